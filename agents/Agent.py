@@ -7,6 +7,7 @@ from collections import deque
 import numpy as np
 
 from utils.viewer import VideoWriter
+from utils.databuffer import databuffer_torch
 import os
 import sys
 
@@ -34,6 +35,7 @@ class Agent:
         self.using_bn = config['using_bn']
 
         self.norm_ob = None
+        self.norm_rw = None
 
         self.learn_step_counter = 0
         self.episode_counter = 0
@@ -51,6 +53,10 @@ class Agent:
         self.a = torch.Tensor(1)
         self.logpac_old = torch.Tensor(1)
         self.other_data = None
+        # minibatches drawn in advance from a databuffer_torch, and the statistics they are normalized with, see
+        # sample_replay_batch().
+        self.replay_batches = deque()
+        self.replay_stats = (None, None, None)
 
     @abc.abstractmethod
     def choose_action(self, s, other_data = None, greedy = False):
@@ -62,19 +68,87 @@ class Agent:
 
     def store_transition(self, transition):
         self.memory.store_transition(transition)
+        # the minibatches drawn in advance do not include the new transitions.
+        self.replay_batches.clear()
 
     def sample_batch(self, batch_size = None):
         return self.memory.sample_batch(batch_size)
 
+    def sample_replay_batch(self):
+        """
+        Set self.s, self.a, self.r, self.done and self.s_ to a minibatch of batch_size transitions of the replay
+        memory, with the observations and rewards normalized by ob_mean, ob_var and rw_var if norm_ob and norm_rw.
+        With a databuffer_torch, the minibatches are drawn 'replay_prefetch' at a time by one gather, and
+        normalized together by tensor operations. They are drawn again after new transitions are stored or the
+        statistics are updated.
+        """
+        if isinstance(self.memory, databuffer_torch):
+            stats = (self.ob_mean if self.norm_ob else None, self.ob_var if self.norm_ob else None,
+                     self.rw_var if self.norm_rw else None)
+            # the running statistics (utils.rms) are replaced by new arrays when they are updated.
+            if any(s is not prev for s, prev in zip(stats, self.replay_stats)):
+                self.replay_batches.clear()
+            if not self.replay_batches:
+                self.replay_batches.extend(self.memory.sample_batches(self.batch_size, self.replay_prefetch, *stats))
+                self.replay_stats = stats
+            batch_memory = self.replay_batches.popleft()
+            self.r, self.done, self.s_, self.a, self.s = [batch_memory[key] for key in
+                                                          ('reward', 'done', 'next_state', 'action', 'state')]
+            return
+        batch_memory = self.sample_batch(self.batch_size)[0]
+        if self.norm_ob:
+            batch_memory['state'] = np.clip(
+                (batch_memory['state'] - self.ob_mean) / np.sqrt(self.ob_var + 1e-8),-10,10)
+            batch_memory['next_state'] = np.clip(
+                (batch_memory['next_state'] - self.ob_mean) / np.sqrt(self.ob_var + 1e-8),-10,10)
+        if self.norm_rw:
+            batch_memory['reward'] = np.clip(batch_memory['reward'] / np.sqrt(self.rw_var + 1e-8), -10, 10)
+        self.r = self.r.resize_(batch_memory['reward'].shape).copy_(torch.Tensor(batch_memory['reward']))
+        self.done = self.done.resize_(batch_memory['done'].shape).copy_(torch.Tensor(batch_memory['done']))
+        self.s_ = self.s_.resize_(batch_memory['next_state'].shape).copy_(torch.Tensor(batch_memory['next_state']))
+        self.a = self.a.resize_(batch_memory['action'].shape).copy_(torch.Tensor(batch_memory['action']))
+        self.s = self.s.resize_(batch_memory['state'].shape).copy_(torch.Tensor(batch_memory['state']))
+
     def soft_update(self, target, eval, tau):
-        for target_param, param in zip(target.parameters(), eval.parameters()):
-            target_param.data.copy_(target_param.data * (1.0 - tau) +
-                                    param.data * tau)
+        """
+        target <- (1 - tau) * target + tau * eval, for the parameters of the modules, in place by one multi-tensor
+        lerp. The multi-tensor ops are private ones of recent torch releases, the public per-tensor lerp_ is used
+        when they are missing.
+        :param target, eval: a module, or a list of modules updated together.
+        """
+        targets, evals = self._update_tensors(target, False), self._update_tensors(eval, False)
+        with torch.no_grad():
+            if hasattr(torch, '_foreach_lerp_'):
+                torch._foreach_lerp_(targets, evals, tau)
+            else:
+                for target_tensor, eval_tensor in zip(targets, evals):
+                    target_tensor.lerp_(eval_tensor, tau)
 
     def hard_update(self, target, eval):
-        target.load_state_dict(eval.state_dict())
+        """
+        Copy the parameters and buffers of eval into target, in place by one multi-tensor copy (torch >= 2.1),
+        or by the public per-tensor copy_ with older torch releases.
+        :param target, eval: a module, or a list of modules updated together.
+        """
+        targets, evals = self._update_tensors(target, True), self._update_tensors(eval, True)
+        with torch.no_grad():
+            if hasattr(torch, '_foreach_copy_'):
+                torch._foreach_copy_(targets, evals)
+            else:
+                for target_tensor, eval_tensor in zip(targets, evals):
+                    target_tensor.copy_(eval_tensor)
         # print('\ntarget_params_replaced\n')
 
+    def _update_tensors(self, modules, with_buffers):
+        if isinstance(modules, torch.nn.Module):
+            modules = [modules]
+        tensors = []
+        for module in modules:
+            tensors += list(module.parameters())
+            if with_buffers:
+                tensors += list(module.buffers())
+        return tensors
+
     def cuda(self):
         self.use_cuda = True
         self.r = self.r.cuda()
@@ -8,11 +8,12 @@ from agents.Agent import Agent
 from .config import DDPG_CONFIG
 import basenets
 import copy
-from utils import databuffer
+from utils import databuffer, databuffer_torch
 import os
 from collections import deque
 from utils.mathutils import explained_variance
 from rlnets.DDPG import FCDDPG_C
+from .multiseed import StackedModules, seed_partitions
 
 class DDPG(Agent):
     def __init__(self,hyperparams):
@@ -40,7 +41,8 @@ class DDPG(Agent):
 
         # initialize zero memory [s, a, r, s_]
         config['memory_size'] = self.memory_size
-        self.memory = databuffer(config)
+        self.replay_prefetch = config['replay_prefetch']
+        self.memory = databuffer_torch(config) if config['torch_memory'] else databuffer(config)
 
         self.hidden_layers_v = config['hidden_layers_v'] \
             if isinstance(config['hidden_layers_v'], list) else config['hidden_layers']
@@ -63,6 +65,18 @@ class DDPG(Agent):
                                     initializer_param={"last_lower": 3e-3, "last_upper": 3e-3}
                                     )
         self.hard_update(self.t_Actor, self.e_Actor)
+
+        self.loss_func = config['loss_func_v']
+        self.loss = config['loss_func_v']()
+        self.optimizer_a_func = config['optimizer']
+        self.optimizer_a = self.optimizer_a_func(self.e_Actor.parameters(), lr = self.lr)
+        self.optimizer_c_func = config['v_optimizer']
+        self.build_critic()
+
+    def build_critic(self):
+        """
+        Build the online and target critics and the critic optimizer.
+        """
         self.e_Critic = FCDDPG_C(self.n_states, self.n_action_dims,
                                      n_hiddens=self.hidden_layers_v,
                                      nonlinear=self.act_func,
@@ -78,12 +92,6 @@ class DDPG(Agent):
                                      initializer_param={"last_lower": 3e-3, "last_upper": 3e-3}
                                 )
         self.hard_update(self.t_Critic, self.e_Critic)
-
-        self.loss_func = config['loss_func_v']
-        self.loss = config['loss_func_v']()
-        self.optimizer_a_func = config['optimizer']
-        self.optimizer_a = self.optimizer_a_func(self.e_Actor.parameters(), lr = self.lr)
-        self.optimizer_c_func = config['v_optimizer']
         self.optimizer_c = self.optimizer_c_func(self.e_Critic.parameters(), lr = self.lrv, weight_decay=1e-2)
 
     def cuda(self):
@@ -92,38 +100,35 @@ class DDPG(Agent):
         self.e_Critic = self.e_Critic.cuda()
         self.t_Actor = self.t_Actor.cuda()
         self.t_Critic = self.t_Critic.cuda()
+        if isinstance(self.memory, databuffer_torch):
+            self.memory.cuda()
 
     def choose_action(self, s):
-        if self.norm_ob:
-            s = torch.clamp(
-                (s - torch.Tensor(self.ob_mean).type_as(s)) / torch.sqrt(torch.Tensor(self.ob_var).type_as(s) + 1e-8),
-                -10,10)
+        s = self.normalize_state(s)
         self.e_Actor.eval()
         s = torch.Tensor(s)
         if self.use_cuda:
             s = s.cuda()
         preda = self.e_Actor(s).detach()
+        self.e_Actor.train()
+        return self.add_action_noise(preda)
+
+    def normalize_state(self, s):
+        if self.norm_ob:
+            s = torch.clamp(
+                (s - torch.Tensor(self.ob_mean).type_as(s)) / torch.sqrt(torch.Tensor(self.ob_var).type_as(s) + 1e-8),
+                -10,10)
+        return s
+
+    def add_action_noise(self, preda):
         anoise = torch.normal(torch.zeros(preda.size()),
                               self.noise * torch.ones(preda.size())).type_as(preda)
-        self.e_Actor.train()
         return preda + anoise
 
     def learn(self):
 
         # sample batch memory from all memory
-        batch_memory = self.sample_batch(self.batch_size)[0]
-        if self.norm_ob:
-            batch_memory['state'] = np.clip(
-                (batch_memory['state'] - self.ob_mean) / np.sqrt(self.ob_var + 1e-8),-10,10)
-            batch_memory['next_state'] = np.clip(
-                (batch_memory['next_state'] - self.ob_mean) / np.sqrt(self.ob_var + 1e-8),-10,10)
-        if self.norm_rw:
-            batch_memory['reward'] = np.clip(batch_memory['reward'] / np.sqrt(self.rw_var + 1e-8), -10, 10)
-        self.r = self.r.resize_(batch_memory['reward'].shape).copy_(torch.Tensor(batch_memory['reward']))
-        self.done = self.done.resize_(batch_memory['done'].shape).copy_(torch.Tensor(batch_memory['done']))
-        self.s_ = self.s_.resize_(batch_memory['next_state'].shape).copy_(torch.Tensor(batch_memory['next_state']))
-        self.a = self.a.resize_(batch_memory['action'].shape).copy_(torch.Tensor(batch_memory['action']))
-        self.s = self.s.resize_(batch_memory['state'].shape).copy_(torch.Tensor(batch_memory['state']))
+        self.sample_replay_batch()
 
         q_target = self.r + (1 - self.done) * self.gamma * self.t_Critic(self.s_, self.t_Actor(self.s_))
         q_target = q_target.detach().squeeze()
@@ -155,8 +160,7 @@ class DDPG(Agent):
                 1 - self.exploration_noise_decrement) if self.noise > self.noise_min else self.noise_min
 
         # check to replace target parameters
-        self.soft_update(self.t_Actor, self.e_Actor, self.replace_tau)
-        self.soft_update(self.t_Critic, self.e_Critic, self.replace_tau)
+        self.soft_update([self.t_Actor, self.t_Critic], [self.e_Actor, self.e_Critic], self.replace_tau)
 
     def save_model(self, save_path):
         super(DDPG, self).save_model(save_path)
@@ -176,6 +180,10 @@ class DDPG(Agent):
         torch.save(save_dict_c, os.path.join(save_path, "critic" + str(self.learn_step_counter) + ".pth"))
 
     def load_model(self, load_path, load_point):
+        self.load_actor(load_path, load_point)
+        self.load_critic(load_path, load_point)
+
+    def load_actor(self, load_path, load_point):
         actor_name = os.path.join(load_path, "actor" + str(load_point) + ".pth")
         print("loading checkpoint %s" % (actor_name))
         checkpoint = torch.load(actor_name)
@@ -186,6 +194,7 @@ class DDPG(Agent):
         self.episode_counter = checkpoint['episode']
         print("loaded checkpoint %s" % (actor_name))
 
+    def load_critic(self, load_path, load_point):
         critic_name = os.path.join(load_path, "critic" + str(load_point) + ".pth")
         print("loading checkpoint %s" % (critic_name))
         checkpoint = torch.load(critic_name)
@@ -199,11 +208,7 @@ def run_ddpg_train(env, agent, max_timesteps, logger, log_interval):
     total_updates = max_timesteps / env.num_envs
     epinfobuf = deque(maxlen=100)
     observations = env.reset()
-    curlen = np.zeros(shape=(observations.shape[0], 1))
-
-    loss_a = 0
-    loss_c = 0
-    explained_var = 0
+    stats = {'explained_var': 0, 'loss_a': 0, 'loss_c': 0}
 
     while (True):
 
@@ -237,24 +242,8 @@ def run_ddpg_train(env, agent, max_timesteps, logger, log_interval):
 
         epinfobuf.extend(epinfos)
 
-        def reshape_data(arr):
-            s = arr.shape
-            return arr.reshape(s[0] * s[1], *s[2:])
-        mb_obs = reshape_data(np.asarray(mb_obs, dtype=np.float32))
-        mb_rs = reshape_data(np.asarray(mb_rs, dtype=np.float32))
-        mb_as = reshape_data(np.asarray(mb_as))
-        mb_dones = reshape_data(np.asarray(mb_dones, dtype=np.uint8))
-        mb_obs_ = reshape_data(np.asarray(mb_obs_, dtype=np.float32))
-
         # store transition
-        transition = {
-            'state': mb_obs if mb_obs.ndim == 2 else np.expand_dims(mb_obs, 1),
-            'action': mb_as if mb_as.ndim == 2 else np.expand_dims(mb_as, 1),
-            'reward': mb_rs if mb_rs.ndim == 2 else np.expand_dims(mb_rs, 1),
-            'next_state': mb_obs_ if mb_obs_.ndim == 2 else np.expand_dims(mb_obs_, 1),
-            'done': mb_dones if mb_dones.ndim == 2 else np.expand_dims(mb_dones, 1),
-        }
-        agent.store_transition(transition)
+        agent.store_transition(ddpg_transition(mb_obs, mb_as, mb_rs, mb_obs_, mb_dones))
 
         # training controller
         timestep_counter += agent.nsteps
@@ -267,41 +256,157 @@ def run_ddpg_train(env, agent, max_timesteps, logger, log_interval):
                 agent.ob_mean, agent.ob_var = env.ob_rms.mean, env.ob_rms.var
             if agent.norm_rw:
                 agent.rw_mean, agent.rw_var = env.ret_rms.mean, env.ret_rms.var
-            for i in range(0, agent.nsteps):
-                agent.learn()
-
-                # adjust learning rate for policy and value function
-                # decay_coef = 1 - agent.learn_step_counter / total_updates
-                # adjust_learning_rate(agent.optimizer_a, original_lr=agent.lr, decay_coef=decay_coef)
-                # adjust_learning_rate(agent.optimizer_c, original_lr=agent.lrv, decay_coef=decay_coef)
-
-                explained_var += explained_variance(agent.Qe, agent.Qt)
-                loss_a += agent.loss_a.item()
-                loss_c += agent.loss_c.item()
-                if agent.learn_step_counter % log_interval == 0:
-                    print("------------------log information------------------")
-                    print("total_timesteps:".ljust(20) + str(timestep_counter))
-                    print("iterations:".ljust(20) + str(agent.learn_step_counter) + " / " + str(int(total_updates)))
-                    print("explained_var:".ljust(20) + str(explained_var / log_interval))
-                    logger.add_scalar("explained_var/train", explained_var / log_interval, timestep_counter)
-                    print("episode_len:".ljust(20) + "{:.1f}".format(np.mean([epinfo['l'] for epinfo in epinfobuf])))
-                    print("episode_rew:".ljust(20) + str(np.mean([epinfo['r'] for epinfo in epinfobuf])))
-                    logger.add_scalar("episode_reward/train", np.mean([epinfo['r'] for epinfo in epinfobuf]),
-                                      timestep_counter)
-                    print("max_episode_rew:".ljust(20) + str(np.max([epinfo['r'] for epinfo in epinfobuf])))
-                    print("min_episode_rew:".ljust(20) + str(np.min([epinfo['r'] for epinfo in epinfobuf])))
-                    print("loss_a:".ljust(20) + str(loss_a / log_interval))
-                    logger.add_scalar("actor_loss/train", loss_a / log_interval, timestep_counter)
-                    print("loss_c:".ljust(20) + str(loss_c / log_interval))
-                    logger.add_scalar("critic_loss/train", loss_c / log_interval, timestep_counter)
-                    print("action_noise_std:".ljust(20) + str(agent.noise))
-
-                    explained_var = 0
-                    loss_a = 0
-                    loss_c = 0
+            run_ddpg_updates(agent, logger, timestep_counter, total_updates, epinfobuf, stats, log_interval)
 
     return agent
 
+def run_ddpg_multiseed_train(env, agents, streams, max_timesteps, loggers, log_interval):
+    """
+    Train N independent DDPG agents of the same config in one process. The agents step their own partition of the
+    env pool together (see seed_partitions), the actions of all of them being computed by one vectorized forward
+    pass of their actors, then each agent stores its transitions in its own replay buffer and learns with its own
+    optimizers and RNG stream. The env pool is not normalized: the observation and reward statistics of the agents
+    are left unchanged.
+
+    :param env: (VecEnv) the pool of environments.
+    :param agents: ([DDPG]) the agents.
+    :param streams: ([RNGStream]) the RNG streams of the agents.
+    :param max_timesteps: (int) number of transitions of each agent.
+    :param loggers: ([SummaryWriter]) the loggers of the agents.
+    :param log_interval: (int) number of updates between two logs.
+    :return: ([DDPG]) the trained agents.
+    """
+    timestep_counter = 0
+    partitions = seed_partitions(env, len(agents))
+    envs_per_seed = env.num_envs // len(agents)
+    nsteps = agents[0].nsteps
+    total_updates = max_timesteps / envs_per_seed
+    epinfobufs = [deque(maxlen=100) for _ in agents]
+    statses = [{'explained_var': 0, 'loss_a': 0, 'loss_c': 0} for _ in agents]
+    actors = StackedModules([agent.e_Actor for agent in agents])
+    device = next(iter(actors.params.values())).device
+    observations = env.reset()
+
+    while (True):
+
+        # collection of training data
+        actors.refresh()
+        mb_obs, mb_as, mb_dones, mb_rs, mb_obs_ = [], [], [], [], []
+        for _ in range(0, nsteps, envs_per_seed):
+            observations = torch.Tensor(observations)
+            if timestep_counter > agents[0].learn_start_step:
+                states = torch.stack([agent.normalize_state(observations[envs])
+                                      for agent, envs in zip(agents, partitions)])
+                predas = actors(states.to(device))
+                actions = []
+                for i, (agent, stream) in enumerate(zip(agents, streams)):
+                    with stream:
+                        actions.append(agent.add_action_noise(predas[i]))
+                actions = torch.cat(actions).cpu().numpy().clip(env.action_space.low, env.action_space.high)
+            else:
+                actions = []
+                for stream in streams:
+                    with stream:
+                        actions.append(np.random.uniform(env.action_space.low, env.action_space.high,
+                                                         size=(envs_per_seed,) + env.action_space.shape))
+                actions = np.concatenate(actions).astype(np.float32)
+
+            observations = observations.cpu().numpy()
+            observations_, rewards, dones, infos = env.step(actions)
+            for e, info in enumerate(infos):
+                maybeepinfo = info.get('episode')
+                if maybeepinfo:
+                    epinfobufs[e // envs_per_seed].append(maybeepinfo)
+
+            mb_obs.append(observations)
+            mb_as.append(actions)
+            mb_rs.append(rewards)
+            mb_obs_.append(observations_)
+            mb_dones.append(dones)
+
+            observations = observations_
+
+        # store transitions
+        mbs = [np.asarray(mb) for mb in (mb_obs, mb_as, mb_rs, mb_obs_, mb_dones)]
+        for agent, envs in zip(agents, partitions):
+            agent.store_transition(ddpg_transition(*[mb[:, envs] for mb in mbs]))
+
+        # training controller
+        timestep_counter += nsteps
+        if timestep_counter >= max_timesteps:
+            break
+
+        if timestep_counter > agents[0].batch_size:
+            for agent, stream, logger, epinfobuf, stats in zip(agents, streams, loggers, epinfobufs, statses):
+                with stream:
+                    run_ddpg_updates(agent, logger, timestep_counter, total_updates, epinfobuf, stats, log_interval,
+                                     seed = stream.seed)
+
+    return agents
+
+def ddpg_transition(mb_obs, mb_as, mb_rs, mb_obs_, mb_dones):
+    """
+    :return: (dict) the transition stored by DDPG from the T x num_envs x dim lists (or arrays) of the collected
+             states, actions, rewards, next states and dones.
+    """
+    def reshape_data(arr):
+        s = arr.shape
+        return arr.reshape(s[0] * s[1], *s[2:])
+    mb_obs = reshape_data(np.asarray(mb_obs, dtype=np.float32))
+    mb_rs = reshape_data(np.asarray(mb_rs, dtype=np.float32))
+    mb_as = reshape_data(np.asarray(mb_as))
+    mb_dones = reshape_data(np.asarray(mb_dones, dtype=np.uint8))
+    mb_obs_ = reshape_data(np.asarray(mb_obs_, dtype=np.float32))
+
+    return {
+        'state': mb_obs if mb_obs.ndim == 2 else np.expand_dims(mb_obs, 1),
+        'action': mb_as if mb_as.ndim == 2 else np.expand_dims(mb_as, 1),
+        'reward': mb_rs if mb_rs.ndim == 2 else np.expand_dims(mb_rs, 1),
+        'next_state': mb_obs_ if mb_obs_.ndim == 2 else np.expand_dims(mb_obs_, 1),
+        'done': mb_dones if mb_dones.ndim == 2 else np.expand_dims(mb_dones, 1),
+    }
+
+def run_ddpg_updates(agent, logger, timestep_counter, total_updates, epinfobuf, stats, log_interval, seed = None):
+    """
+    Run agent.nsteps updates of the agent, logging every log_interval updates.
+
+    :param stats: (dict) the running sums of 'explained_var', 'loss_a' and 'loss_c' since the last log.
+    :param seed: (int) the seed printed in the logs of multi-seed training.
+    """
+    for i in range(0, agent.nsteps):
+        agent.learn()
+
+        # adjust learning rate for policy and value function
+        # decay_coef = 1 - agent.learn_step_counter / total_updates
+        # adjust_learning_rate(agent.optimizer_a, original_lr=agent.lr, decay_coef=decay_coef)
+        # adjust_learning_rate(agent.optimizer_c, original_lr=agent.lrv, decay_coef=decay_coef)
+
+        stats['explained_var'] += explained_variance(agent.Qe, agent.Qt)
+        stats['loss_a'] += agent.loss_a.item()
+        stats['loss_c'] += agent.loss_c.item()
+        if agent.learn_step_counter % log_interval == 0:
+            print("------------------log information------------------")
+            if seed is not None:
+                print("seed:".ljust(20) + str(seed))
+            print("total_timesteps:".ljust(20) + str(timestep_counter))
+            print("iterations:".ljust(20) + str(agent.learn_step_counter) + " / " + str(int(total_updates)))
+            print("explained_var:".ljust(20) + str(stats['explained_var'] / log_interval))
+            logger.add_scalar("explained_var/train", stats['explained_var'] / log_interval, timestep_counter)
+            print("episode_len:".ljust(20) + "{:.1f}".format(np.mean([epinfo['l'] for epinfo in epinfobuf])))
+            print("episode_rew:".ljust(20) + str(np.mean([epinfo['r'] for epinfo in epinfobuf])))
+            logger.add_scalar("episode_reward/train", np.mean([epinfo['r'] for epinfo in epinfobuf]),
+                              timestep_counter)
+            print("max_episode_rew:".ljust(20) + str(np.max([epinfo['r'] for epinfo in epinfobuf])))
+            print("min_episode_rew:".ljust(20) + str(np.min([epinfo['r'] for epinfo in epinfobuf])))
+            print("loss_a:".ljust(20) + str(stats['loss_a'] / log_interval))
+            logger.add_scalar("actor_loss/train", stats['loss_a'] / log_interval, timestep_counter)
+            print("loss_c:".ljust(20) + str(stats['loss_c'] / log_interval))
+            logger.add_scalar("critic_loss/train", stats['loss_c'] / log_interval, timestep_counter)
+            print("action_noise_std:".ljust(20) + str(agent.noise))
+
+            for key in stats.keys():
+                stats[key] = 0
+
 def adjust_learning_rate(optimizer, original_lr=1e-4, decay_coef=0.95):
     for param_group in optimizer.param_groups:
         param_group['lr'] = original_lr * decay_coef
@@ -34,13 +34,7 @@ class DDQN(DQN):
         # check to replace target parameters
         if self.learn_step_counter % self.replace_target_iter == 0:
             self.hard_update(self.t_DQN, self.e_DQN)
-        batch_memory = self.sample_batch(self.batch_size)[0]
-
-        self.r = self.r.resize_(batch_memory['reward'].shape).copy_(torch.Tensor(batch_memory['reward']))
-        self.done = self.done.resize_(batch_memory['done'].shape).copy_(torch.Tensor(batch_memory['done']))
-        self.s_ = self.s_.resize_(batch_memory['next_state'].shape).copy_(torch.Tensor(batch_memory['next_state']))
-        self.a = self.a.resize_(batch_memory['action'].shape).copy_(torch.Tensor(batch_memory['action']))
-        self.s = self.s.resize_(batch_memory['state'].shape).copy_(torch.Tensor(batch_memory['state']))
+        self.sample_replay_batch()
 
         q_target = self.t_DQN(self.s_)
         q_eval_wrt_s_ = self.e_DQN(self.s_)
@@ -5,8 +5,10 @@ from agents.Agent import Agent
 import copy
 from .config import DQN_CONFIG
 from rlnets.DQN import FCDQN
-from utils import databuffer
+from utils import databuffer, databuffer_torch, databuffer_frames
 import os
+import time
+from collections import deque
 
 class DQN(Agent):
     def __init__(self, hyperparams):
@@ -19,8 +21,14 @@ class DQN(Agent):
         self.epsilon = 0 if self.epsilon_increment is not None else self.epsilon_max
         # initialize zero memory [s, a, r, s_]
         config['memory_size'] = self.memory_size
-        self.memory = databuffer(config)
+        self.replay_prefetch = config['replay_prefetch']
+        if config['frame_memory']:
+            self.memory = databuffer_frames(config)
+        else:
+            self.memory = databuffer_torch(config) if config['torch_memory'] else databuffer(config)
         self.batch_size = config['batch_size']
+        self.learn_start_step = config['learn_start_step']
+        self.replay_ratio = config['replay_ratio']
         ## TODO: include other network architectures
         if type(self) == DQN:
             self.e_DQN = FCDQN(self.n_states, self.n_actions,
@@ -41,6 +49,8 @@ class DQN(Agent):
         Agent.cuda(self)
         self.e_DQN = self.e_DQN.cuda()
         self.t_DQN = self.t_DQN.cuda()
+        if isinstance(self.memory, databuffer_torch):
+            self.memory.cuda()
 
     def choose_action(self, observation):
         # to have batch dimension when feed into tf placeholder
@@ -61,17 +71,33 @@ class DQN(Agent):
             action = np.random.randint(0, self.n_actions)
         return action, distri
 
+    def choose_actions(self, observations):
+        """
+        Epsilon-greedy actions of a batch of observations, e.g. of all the envs of a VecEnv, with one forward pass
+        of the Q network: each action is greedy with probability epsilon, random otherwise.
+
+        :param observations: (ndarray) N x n_states observations.
+        :return: (ndarray) the N actions.
+        """
+        observations = torch.as_tensor(np.asarray(observations), dtype=torch.float32)
+        if self.use_cuda:
+            observations = observations.cuda()
+        n = observations.shape[0]
+        greedy = np.random.uniform(size=n) < self.epsilon
+        actions = np.random.randint(0, self.n_actions, size=n)
+        if greedy.any():
+            self.e_DQN.eval()
+            with torch.no_grad():
+                actions_value = self.e_DQN(observations)
+            self.e_DQN.train()
+            actions[greedy] = torch.max(actions_value, 1)[1].cpu().numpy()[greedy]
+        return actions
+
     def learn(self):
         # check to replace target parameters
         if self.learn_step_counter % self.replace_target_iter == 0:
             self.hard_update(self.t_DQN, self.e_DQN)
-        batch_memory = self.sample_batch(self.batch_size)[0]
-
-        self.r = self.r.resize_(batch_memory['reward'].shape).copy_(torch.Tensor(batch_memory['reward']))
-        self.done = self.done.resize_(batch_memory['done'].shape).copy_(torch.Tensor(batch_memory['done']))
-        self.s_ = self.s_.resize_(batch_memory['next_state'].shape).copy_(torch.Tensor(batch_memory['next_state']))
-        self.a = self.a.resize_(batch_memory['action'].shape).copy_(torch.Tensor(batch_memory['action']))
-        self.s = self.s.resize_(batch_memory['state'].shape).copy_(torch.Tensor(batch_memory['state']))
+        self.sample_replay_batch()
 
         q_target = self.r + self.gamma * torch.max(self.t_DQN(self.s_), 1)[0].view(self.batch_size, 1)
         q_eval = self.e_DQN(self.s)
@@ -110,3 +136,87 @@ class DQN(Agent):
         self.episode_counter = checkpoint['episode']
         self.epsilon = checkpoint['epsilon']
         print("loaded checkpoint %s" % (policy_name))
+
+def dqn_transition(observations, actions, rewards, observations_, dones):
+    """
+    :return: (dict) the transition stored by DQN from the N observations, actions, rewards, next observations and
+             dones of one step of a VecEnv. The observations keep their dtype (e.g. uint8 atari frames).
+    """
+    return {
+        'state': np.asarray(observations),
+        'action': np.asarray(actions).reshape(-1, 1),
+        'reward': np.asarray(rewards, dtype=np.float32).reshape(-1, 1),
+        'next_state': np.asarray(observations_),
+        'done': np.asarray(dones, dtype=np.uint8).reshape(-1, 1),
+    }
+
+def run_dqn_train(env, agent, max_timesteps, logger, log_interval):
+    """
+    Train a DQN, DDQN or DuelingDQN agent on the N envs of a VecEnv. At each step, the actions of all the envs are
+    chosen by one forward pass (DQN.choose_actions) and the N transitions are stored together. The next state of
+    an env whose episode ended is its terminal observation, not the observation of the new episode. After
+    'learn_start_step' transitions, the agent learns 'replay_ratio' times per transition collected on average,
+    i.e. replay_ratio * N updates per step (the fractional part is carried to the next steps).
+
+    :param env: (VecEnv) the environments.
+    :param agent: (DQN) the agent.
+    :param max_timesteps: (int) number of transitions collected.
+    :param logger: (SummaryWriter) the logger.
+    :param log_interval: (int) number of steps of the envs between two logs.
+    :return: (DQN) the trained agent.
+    """
+    timestep_counter = 0
+    iteration = 0
+    updates_due = 0.
+    epinfobuf = deque(maxlen=100)
+    losses = []
+    observations = env.reset()
+    b_t = time.time()
+    log_t, log_timestep = b_t, 0
+
+    while (True):
+        actions = agent.choose_actions(observations)
+        observations_, rewards, dones, infos = env.step(actions)
+        next_states = np.array(observations_)
+        for e, info in enumerate(infos):
+            maybeepinfo = info.get('episode')
+            if maybeepinfo: epinfobuf.append(maybeepinfo)
+            if dones[e] and 'terminal_observation' in info:
+                next_states[e] = info['terminal_observation']
+        agent.store_transition(dqn_transition(observations, actions, rewards, next_states, dones))
+        observations = observations_
+
+        # training controller
+        timestep_counter += env.num_envs
+        iteration += 1
+        if timestep_counter >= max_timesteps:
+            break
+
+        if timestep_counter >= max(agent.learn_start_step, agent.batch_size):
+            updates_due += agent.replay_ratio * env.num_envs
+            while updates_due >= 1:
+                agent.learn()
+                losses.append(agent.loss.item())
+                updates_due -= 1
+
+        if iteration % log_interval == 0:
+            fps = (timestep_counter - log_timestep) / (time.time() - log_t)
+            log_t, log_timestep = time.time(), timestep_counter
+            print("------------------log information------------------")
+            print("total_timesteps:".ljust(20) + str(timestep_counter) + " / " + str(int(max_timesteps)))
+            print("iterations:".ljust(20) + str(agent.learn_step_counter))
+            print("frames_per_sec:".ljust(20) + "{:.1f}".format(fps))
+            logger.add_scalar("frames_per_sec/train", fps, timestep_counter)
+            print("epsilon:".ljust(20) + str(agent.epsilon))
+            if losses:
+                print("loss:".ljust(20) + str(np.mean(losses)))
+                logger.add_scalar("loss/train", np.mean(losses), timestep_counter)
+                losses = []
+            if epinfobuf:
+                print("episode_len:".ljust(20) + "{:.1f}".format(np.mean([epinfo['l'] for epinfo in epinfobuf])))
+                print("episode_rew:".ljust(20) + str(np.mean([epinfo['r'] for epinfo in epinfobuf])))
+                logger.add_scalar("episode_reward/train", np.mean([epinfo['r'] for epinfo in epinfobuf]),
+                                  timestep_counter)
+
+    print("frames_per_sec:".ljust(20) + "{:.1f}".format(timestep_counter / (time.time() - b_t)))
+    return agent
@@ -4,11 +4,14 @@ from .PG import PG, PG_Gaussian, PG_Softmax
 from .config import HPG_CONFIG
 import abc
 import numpy as np
-from utils.mathutils import explained_variance
+from utils.mathutils import explained_variance, discount_cumsum
+from .rollout import RolloutCollector, PhaseTimer, pg_policy_fn
 from collections import deque
 import copy
 from utils.vec_envs import space_dim
 from utils.rms import RunningMeanStd
+from utils.goal_grid import GoalGrid, space_bounds
+from basenets.IndexedRows import IndexedRows
 import pickle
 import os
 import random
@@ -31,6 +34,9 @@ class HPG(PG):
         self.obs_space = config['other_data']
         self.using_original_data = config['using_original_data']
         self.n_valid_ep = 0
+        # rounded goals, and the cells of the goal space covered by the achieved goals so far. The goals within
+        # finite bounds of the goal space get packed keys.
+        self.goal_grid = GoalGrid(2, *space_bounds(config['goal_space']))
         self.reward_type = config['reward_type']
         if self.reward_type == 'sparse':
             self.using_her_reward = config['using_her_reward']
@@ -58,25 +64,220 @@ class HPG(PG):
     def generate_subgoals(self):
         # generate subgoals from sampled data
         ags = self.achieved_goal.cpu().numpy()
-        self.subgoals = np.unique(ags.round(decimals=2), axis=0)
         # - np.inf means the invalid achieved goals
-        self.subgoals = self.subgoals[self.subgoals.mean(-1) > -np.inf]
+        self.subgoals, keys = self.goal_grid.unique(ags[ags.mean(-1) > -np.inf])
+        self.goal_grid.add(keys)
         if self.sampled_goal_num is not None:
-            # generate subgoals randomly
-            ind = list(range(self.subgoals.shape[0]))
-            random.shuffle(ind)
+            # generate subgoals randomly, without shuffling all the candidates.
             size = min(self.sampled_goal_num, self.subgoals.shape[0])
-            ind = ind[:size]
-            self.subgoals = self.subgoals[ind]
+            self.subgoals = self.subgoals[random.sample(range(self.subgoals.shape[0]), size)]
 
-    @abc.abstractmethod
     def generate_fake_data(self):
-        raise NotImplementedError("Must be implemented in subclass.")
+        """
+        Relabel every collected episode with every sampled subgoal at once. All the episodes are padded into
+        Ne x Ng x T tensors, so that rewards, hindsight episode lengths, masks, returns and hindsight ratios are
+        computed in a batched way, and the policy is evaluated only once on all valid (episode, subgoal, t) triples.
+        The fake data are appended after the original data in (episode, subgoal, t) order.
+        """
+        self.subgoals = torch.Tensor(self.subgoals).type_as(self.s)
+        # number of subgoals
+        n_g = self.subgoals.shape[0]
+        # number of episodes
+        n_e = self.ep_offsets.size(0) - 1
+
+        # flat data of all episodes, in the same order as they are collected.
+        ep_s = self.ep_data['s']
+        ep_s_ = self.ep_data['s_']
+        ep_a = self.ep_data['a']
+        ep_done = self.ep_data['done']
+        ep_logpac_old = self.ep_data['logpac_old']
+        ep_ag = self.ep_data['achieved_goal']
+
+        # Ne
+        ep_begins = self.ep_offsets[:-1]
+        ep_lens = self.ep_offsets[1:] - ep_begins
+        max_len = int(ep_lens.max().item())
+        # 1 x T
+        steps = torch.arange(max_len).type_as(ep_lens).unsqueeze(0)
+        # Ne x T: whether a padded position is inside the episode, and where it is in the flat data.
+        valid = steps < ep_lens.unsqueeze(1)
+        flat_inds = torch.min(ep_begins.unsqueeze(1) + steps, ep_lens.sum() - 1)
+
+        # Modify episode length and rewards.
+        # Ne x Ng x T
+        r_f = self.reward_fn(ep_ag[flat_inds].unsqueeze(1).repeat(1, n_g, 1, 1).cpu().numpy(),
+                             self.subgoals.reshape(1, n_g, 1, -1).repeat(n_e, 1, max_len, 1).cpu().numpy(), None)
+        if self.reward_type == "dense":
+            goal_dist = - r_f
+            r_f = -(goal_dist > 0.05).astype(np.float32)
+        # padded positions never achieve the goal.
+        r_f[np.broadcast_to(~valid.cpu().numpy()[:, None, :], r_f.shape)] = -1
+
+        # For negative episode, there is no positive reward, all are 0.
+        neg_ep_inds = np.where((r_f == 0).sum(axis=-1) == 0)
+        pos_ep_inds = np.where((r_f == 0).sum(axis=-1) > 0)
+
+        # In reward, there are only 0 and 1. The first 1's position indicates the episode length.
+        l_f = np.argmax(r_f, axis=-1)
+        l_f += 1
+        # For all negative episodes, the length is the original episode length.
+        l_f[neg_ep_inds] = ep_lens.cpu().numpy()[neg_ep_inds[0]]
+        # lengths: Ne x Ng
+        l_f = torch.Tensor(l_f).type_as(self.s).long()
+
+        # Ne x Ng x T
+        mask = steps.unsqueeze(0) < l_f.unsqueeze(2)
+        # filter out the episodes where at beginning, the goal is achieved.
+        mask[l_f == 1] = 0
+
+        if self.reward_type == "sparse":
+            r_f = torch.Tensor(r_f).type_as(self.r)
+            if not self.using_her_reward:
+                r_f += 1
+                # Rewards are 0 and T - t_done + 1
+                # Ne x Ng x T
+                r_f.scatter_(2, (l_f - 1).unsqueeze(2), (self.max_steps - l_f + 1).type_as(self.r).unsqueeze(2))
+                r_f[neg_ep_inds] = 0
+        else:
+            r_f = torch.Tensor(-goal_dist).type_as(self.r)
+
+        # returns of the relabeled episodes, padded positions do not contribute.
+        r_valid = r_f * valid.unsqueeze(1).type_as(r_f)
+        row_ends = torch.zeros_like(r_valid)
+        row_ends[:, :, -1] = 1
+        ret_f = discount_cumsum(r_valid, row_ends, self.gamma).reshape(r_valid.size())
+
+        d_f = ep_done.squeeze(-1)[flat_inds].unsqueeze(1).repeat(1, n_g, 1)
+        pos_e, pos_g = [torch.from_numpy(inds).type_as(l_f) for inds in pos_ep_inds]
+        d_f[pos_e, pos_g, l_f[pos_e, pos_g] - 1] = 1
+
+        # 1-D indices of all the valid (episode, subgoal, t) triples.
+        data_inds = flat_inds.unsqueeze(1).repeat(1, n_g, 1)[mask]
+        goal_inds = torch.arange(n_g).type_as(ep_lens).reshape(1, n_g, 1).repeat(n_e, 1, max_len)[mask]
+
+        expanded_a = ep_a[data_inds]
+        # the unique states and goals are normalized, and the policy applies its input layer to them only.
+        if self.norm_ob:
+            fake_input_s = torch.clamp(
+                (ep_s - torch.Tensor(self.ob_mean).type_as(ep_s)) / torch.sqrt(
+                    torch.clamp(torch.Tensor(self.ob_var), 1e-4).type_as(ep_s)), -5, 5)
+            fake_input_g = torch.clamp(
+                (self.subgoals - torch.Tensor(self.goal_mean).type_as(ep_s)) / torch.sqrt(
+                    torch.clamp(torch.Tensor(self.goal_var), 1e-4).type_as(ep_s)), -5, 5)
+        else:
+            fake_input_s = ep_s
+            fake_input_g = self.subgoals
+
+        # one policy forward for all the fake data.
+        fake_logpac, fake_policy_outputs = self._fake_policy_outputs(IndexedRows(fake_input_s, data_inds),
+                                                                     IndexedRows(fake_input_g, goal_inds), expanded_a)
+        del fake_input_s, fake_input_g
+
+        # generate hindsight ratio
+        # Ne x Ng x T
+        d_logp = torch.zeros(size = mask.size()).type_as(self.s)
+        d_logp[mask] = fake_logpac - ep_logpac_old[data_inds].squeeze(-1)
+        if self.per_decision:
+            h_ratios = torch.exp(d_logp.cumsum(dim=2)) + 1e-10
+        else:
+            # the ratio of the whole hindsight trajectory is shared by all its steps.
+            h_ratios = torch.exp(torch.sum(d_logp, dim=2, keepdim=True)).repeat(1, 1, max_len) + 1e-10
+        h_ratios *= mask.type_as(h_ratios)
+
+        # make all data one batch. States and goals of the fake data are stored once and indexed by the
+        # (state, goal) pairs of the valid triples.
+        self.s = IndexedRows.cat(self.s, ep_s, data_inds)
+        self.s_ = IndexedRows(torch.cat((self.s_, ep_s_), dim=0), self.s.index)
+        self.a = torch.cat((self.a, expanded_a), dim=0)
+        self.goal = IndexedRows.cat(self.goal, self.subgoals, goal_inds)
+        for key, value in fake_policy_outputs.items():
+            setattr(self, key, torch.cat((getattr(self, key), value), dim=0))
+
+        self.r = torch.cat((self.r, r_f[mask].unsqueeze(1)), dim=0)
+        self.ret = torch.cat((self.ret, ret_f[mask].unsqueeze(1)), dim=0)
+        self.done = torch.cat((self.done, d_f[mask].unsqueeze(1)), dim=0)
+        self.logpac_old = torch.cat((self.logpac_old, fake_logpac.unsqueeze(1)), dim=0)
+
+        # Ne x Ng x T
+        gamma_discount = torch.pow(self.gamma, torch.Tensor(np.arange(1, max_len + 1)).type_as(self.r)).repeat(n_e, n_g, 1)
+        self.gamma_discount = torch.cat((self.gamma_discount, gamma_discount[mask]), dim=0)
+
+        self.n_traj += n_e * n_g
+
+        if self.weight_is:
+            h_ratios_sum = torch.sum(h_ratios, dim=0, keepdim = True)
+            h_ratios /= h_ratios_sum
+
+        self.hratio = torch.cat((self.hratio, h_ratios[mask]), dim=0)
 
     @abc.abstractmethod
-    def split_episode(self):
+    def _fake_policy_outputs(self, fake_input_s, fake_input_g, fake_a):
+        """
+        :return: log-likelihoods of fake_a (1-D) and a dict of the detached policy outputs to be appended
+                 to the training data, e.g. {'mu': ..., 'sigma': ...}.
+        """
         raise NotImplementedError("Must be implemented in subclass.")
 
+    def split_episode(self):
+        """
+        Split the batch into its episodes, given by their offsets: episode i is made of the transitions
+        ep_offsets[i]: ep_offsets[i + 1]. The flat data that the fake data are generated from are kept in
+        self.ep_data, since the training data may be reset before generate_fake_data().
+        Returns, hindsight discounts, episode validity and the rewards of the successes are computed on the
+        whole batch at once.
+        :return: (LongTensor) Ne + 1 offsets of the episodes.
+        """
+        self.n_traj = 0
+        assert self.other_data, "Hindsight algorithms need goal infos."
+        self.desired_goal = self.other_data['desired_goal']
+        self.achieved_goal = self.other_data['achieved_goal']
+        self.goal = self.desired_goal
+        # initialize real data's hindsight ratios.
+        self.hratio = torch.ones(self.s.size(0)).type_as(self.s)
+
+        # every episode ends with a done flag, the last one with the final state of the rollout.
+        ends = torch.nonzero(self.done[:, 0] > 0)[:, 0] + 1
+        self.ep_offsets = torch.cat((ends.new_zeros(1), ends))
+        # N: episode of every transition, and its time step in the episode.
+        ep_inds = torch.repeat_interleave(torch.arange(ends.size(0)).type_as(ends), ends - self.ep_offsets[:-1])
+        steps = torch.arange(ep_inds.size(0)).type_as(ends) - self.ep_offsets[ep_inds]
+
+        if self.reward_type == "sparse" and not self.using_her_reward:
+            self.r += 1
+            # Rewards of the successes are T - t
+            suc_poses = self.r[:, 0] == 1
+            self.r[suc_poses, 0] = (self.max_steps - steps[suc_poses]).type_as(self.r)
+
+        # returns of the original episodes
+        self.ret = discount_cumsum(self.r, self.done, self.gamma).unsqueeze(1)
+        self.gamma_discount = torch.pow(self.gamma, steps.type_as(self.s))
+
+        # TODO: For gym envs, the episode will not end when the goal is achieved, deal with that!
+        self.n_valid_ep = int(np.count_nonzero(self._valid_episodes(ep_inds, self.ep_offsets[:-1])))
+        self.ep_data = {'s': self.s, 's_': self.s_, 'a': self.a, 'done': self.done, 'logpac_old': self.logpac_old,
+                        'achieved_goal': self.achieved_goal}
+        self.n_traj += self.ep_offsets.size(0) - 1
+        return self.ep_offsets
+
+    def _valid_episodes(self, ep_inds, ep_begins, mode = "reward"):
+        """
+        An episode is valid if its achieved goals do not all stay at its first achieved goal: in mode "naive", if
+        they are not all in the same cell of the goal grid, in mode "reward", if one of them does not reach the first
+        one according to reward_fn, evaluated once on the whole batch.
+        :param ep_inds: (LongTensor) N, episode of every transition.
+        :param ep_begins: (LongTensor) Ne, first transition of every episode.
+        :return: Ne bool ndarray.
+        """
+        ep_inds = ep_inds.cpu().numpy()
+        ep_begins = ep_begins.cpu().numpy()
+        ags = self.achieved_goal.cpu().numpy()
+        if mode == "naive":
+            keys = self.goal_grid.keys(ags)[1]
+            return np.logical_or.reduceat(keys != keys[ep_begins][ep_inds], ep_begins)
+        elif mode == "reward":
+            rew = np.reshape(self.reward_fn(ags, ags[ep_begins][ep_inds], None), ags.shape[0])
+            return np.minimum.reduceat(rew, ep_begins) < - 0.05
+
     @abc.abstractmethod
     def reset_training_data(self):
         raise NotImplementedError("Must be implemented in subclass.")
@@ -97,18 +298,30 @@ class HPG(PG):
                 self.goal_var = self.ob_rms['desired_goal'].var
         PG.load_model(self, load_path, load_point)
 
+    def sample_batch(self, batch_size = None):
+        # states of the previous hindsight batch are indexed, the new batch is copied into plain tensors.
+        if isinstance(self.s, IndexedRows):
+            self.s = self.s.table
+            self.s_ = self.s_.table
+        return super(HPG, self).sample_batch(batch_size)
+
     def data_preprocess(self):
         if self.norm_ob:
-            self.ob_rms['observation'].update(self.s.cpu().numpy())
-            self.ob_rms['desired_goal'].update(self.goal.cpu().numpy())
-            self.s = torch.clamp((self.s - torch.Tensor(self.ob_mean).type_as(self.s)) / torch.sqrt(
-                torch.clamp(torch.Tensor(self.ob_var), 1e-4).type_as(self.s)), -5, 5)
-            self.goal = torch.clamp(
-                (self.goal - torch.Tensor(self.goal_mean).type_as(self.s)) / torch.sqrt(
-                    torch.clamp(torch.Tensor(self.goal_var), 1e-4).type_as(self.s)), -5, 5)
+            for rms, x in ((self.ob_rms['observation'], self.s), (self.ob_rms['desired_goal'], self.goal)):
+                if isinstance(x, IndexedRows):
+                    rms.update_from_moments(*x.moments())
+                else:
+                    rms.update(x.cpu().numpy())
+            norm_s = lambda s: torch.clamp((s - torch.Tensor(self.ob_mean).type_as(s)) / torch.sqrt(
+                torch.clamp(torch.Tensor(self.ob_var), 1e-4).type_as(s)), -5, 5)
+            norm_g = lambda g: torch.clamp((g - torch.Tensor(self.goal_mean).type_as(g)) / torch.sqrt(
+                torch.clamp(torch.Tensor(self.goal_var), 1e-4).type_as(g)), -5, 5)
+            # indexed rows are normalized once per unique state or goal.
+            self.s = self.s.apply(norm_s) if isinstance(self.s, IndexedRows) else norm_s(self.s)
+            self.goal = self.goal.apply(norm_g) if isinstance(self.goal, IndexedRows) else norm_g(self.goal)
         if self.norm_rw:
             self.ret_rms.update(self.ret.squeeze(1).cpu().numpy())
-            self.r = torch.clamp(self.r / torch.sqrt(torch.clamp(torch.Tensor([self.rw_var, ]), 1e-8)).type_as(self.s),
+            self.r = torch.clamp(self.r / torch.sqrt(torch.clamp(torch.Tensor([self.rw_var, ]), 1e-8)).type_as(self.r),
                                  -10., 10.)
 
     def update_normalizer(self):
@@ -161,30 +374,15 @@ class HPG(PG):
             nn.utils.clip_grad_norm_(self.policy.parameters(), self.max_grad_norm)
         self.optimizer.step()
         self.learn_step_counter += 1
-        self.cur_kl = self.mean_kl_divergence().item()
-        self.policy_ent = self.compute_entropy().item()
+        with torch.no_grad():
+            self.cur_kl = self.mean_kl_divergence().item()
+            self.policy_ent = self.compute_entropy().item()
         self.update_normalizer()
 
     def estimate_value_with_mc(self):
-        returns = torch.zeros(self.r.size(0), 1).type_as(self.s)
-        # For Hindsight ratio used in this function, it should be 2-d with a second redundant dimension.
-        hratio = self.hratio.unsqueeze(1)
         # Reward with hindsight ratio weights.
-        r_h = self.r * hratio
-        e_points = torch.nonzero(self.done.squeeze() == 1).squeeze()
-        b_points = - torch.ones(size=e_points.size()).type_as(e_points)
-        b_points[1:] = e_points[:-1]
-        ep_lens = e_points - b_points
-        assert ep_lens.min().item() > 0, "Some episode lengths are smaller than 0."
-        max_len = torch.max(ep_lens).item()
-        uncomplete_flag = ep_lens > 0
-        returns[e_points] = r_h[e_points]
-        for i in range(1, max_len):
-            uncomplete_flag[ep_lens <= i] = 0
-            inds = (e_points - i)[uncomplete_flag]
-            returns[inds] = r_h[inds] + self.gamma * returns[inds + 1]
-
-        self.R = returns.squeeze().detach()
+        r_h = self.r.squeeze(-1) * self.hratio
+        self.R = discount_cumsum(r_h, self.done, self.gamma).detach()
         # Here self.A is actually not advantages. It works for policy updates, which
         # means that it is used to measure how good a action is.
         self.A = self.R
@@ -321,140 +519,13 @@ class HPG_Gaussian(HPG, PG_Gaussian):
     #         "action_std": action_std
     #     }
 
-    def generate_fake_data(self):
-        self.subgoals = torch.Tensor(self.subgoals).type_as(self.s)
-        # number of subgoals
-        n_g = self.subgoals.shape[0]
-
-        # for weighted importance sampling, Ne x Ng x T
-        h_ratios = torch.zeros(size = (len(self.episodes), n_g, self.max_steps)).type_as(self.s)
-        h_ratios_mask = torch.zeros(size = (len(self.episodes), n_g, self.max_steps)).type_as(self.s)
-        for ep in range(len(self.episodes)):
-            # original episode length
-            ep_len = self.episodes[ep]['length']
-
-            # Modify episode length and rewards.
-            # Ng x T
-            r_f = self.reward_fn(self.episodes[ep]['achieved_goal'].unsqueeze(0).repeat(n_g,1,1).cpu().numpy(),
-                                          self.subgoals.unsqueeze(1).repeat(1,ep_len,1).cpu().numpy(), None)
-            if self.reward_type == "dense":
-                goal_dist = - r_f
-                r_f = -(goal_dist > 0.05).astype(np.float32)
-
-            # For negative episode, there is no positive reward, all are 0.
-            neg_ep_inds = np.where((r_f == 0).sum(axis=-1) == 0)
-            pos_ep_inds = np.where((r_f == 0).sum(axis=-1) > 0)
-
-            # In reward, there are only 0 and 1. The first 1's position indicates the episode length.
-            l_f = np.argmax(r_f, axis=-1)
-            l_f += 1
-            # For all negative episodes, the length is the value of max_steps.
-            l_f[neg_ep_inds] = ep_len
-            # lengths: Ng
-            l_f = torch.Tensor(l_f).type_as(self.s).long()
-
-            # Ng x T
-            mask = torch.Tensor(np.arange(1, ep_len + 1)).type_as(self.s).repeat(n_g, 1)
-            mask[mask > l_f.type_as(self.s).unsqueeze(1)] = 0
-            mask[mask > 0] = 1
-            # filter out the episodes where at beginning, the goal is achieved.
-            mask[l_f == 1] = 0
-
-            if self.reward_type == "sparse":
-                r_f = torch.Tensor(r_f).type_as(self.r)
-                if not self.using_her_reward:
-                    r_f += 1
-                    # Rewards are 0 and T - t_done + 1
-                    # Ng x T
-                    r_f[range(r_f.size(0)), l_f - 1] = (self.max_steps - l_f + 1).type_as(self.r)
-                    r_f[neg_ep_inds] = 0
-            else:
-                r_f = torch.Tensor(-goal_dist).type_as(self.r)
-
-            ret_f = torch.rand(r_f.shape).zero_().type_as(r_f)
-            ret_f[:, r_f.shape[1] - 1] = r_f[:, r_f.shape[1] - 1]
-            for t in range(r_f.shape[1]-2, -1, -1):
-                ret_f[:, t] = self.gamma * ret_f[:, t+1] + r_f[:, t]
-
-            d_f = self.episodes[ep]['done'].squeeze().repeat(n_g, 1)
-            d_f[pos_ep_inds, l_f[pos_ep_inds] - 1] = 1
-
-            h_ratios_mask[ep][:,:ep_len] = mask
-
-            # in this case, the input state is the full state of the envs, which should be a vector.
-            if self.policy_type == 'FC':
-                expanded_s = self.episodes[ep]['s'][:ep_len].repeat(n_g, 1)
-            # in this case, the input state is represented by images
-            elif self.episodes[ep]['s'].dim() == 4:
-                expanded_s = self.episodes[ep]['s'][:ep_len].repeat(n_g, 1, 1, 1)
-
-            expanded_g = self.subgoals.unsqueeze(1).repeat(1, ep_len, 1).reshape(-1, self.d_goal)
-                         # - self.episodes[ep]['achieved_goal'].unsqueeze(0).repeat(n_g,1,1).reshape(-1, self.d_goal)
-            if self.norm_ob:
-                fake_input_s = torch.clamp(
-                    (expanded_s - torch.Tensor(self.ob_mean).type_as(self.s)) / torch.sqrt(
-                        torch.clamp(torch.Tensor(self.ob_var), 1e-4).type_as(self.s)), -5, 5)
-                fake_input_g = torch.clamp(
-                    (expanded_g - torch.Tensor(self.goal_mean).type_as(self.s)) / torch.sqrt(
-                        torch.clamp(torch.Tensor(self.goal_var), 1e-4).type_as(self.s)), -5, 5)
-
-            else:
-                fake_input_s = expanded_s
-                fake_input_g = expanded_g
-
-            fake_mu, fake_logsigma, fake_sigma = self.policy(fake_input_s, other_data = fake_input_g)
-            fake_mu = fake_mu.detach()
-            fake_sigma = fake_sigma.detach()
-            fake_logsigma = fake_logsigma.detach()
-
-            # Ng * T x Da
-            expanded_a = self.episodes[ep]['a'].repeat(n_g, 1)
-
-            # Ng x T
-            fake_logpac = self.compute_logp(fake_mu, fake_logsigma, fake_sigma, expanded_a).reshape(n_g, ep_len)
-            expanded_logpac_old = self.episodes[ep]['logpac_old'].repeat(n_g,1).reshape(n_g, -1)
-            d_logp = fake_logpac - expanded_logpac_old
-
-            # generate hindsight ratio
-            # Ng x T
-            if self.per_decision:
-                h_ratio = torch.exp(d_logp.cumsum(dim=1)) + 1e-10
-                h_ratio *= mask
-                h_ratios[ep][:, :ep_len] = h_ratio
-            else:
-                h_ratio = torch.exp(torch.sum(d_logp, keepdim=True)).repeat(1, ep_len) + 1e-10
-                h_ratio *= mask
-                h_ratios[ep][:, :ep_len] = h_ratio
-
-            # make all data one batch
-            mask = mask.reshape(-1) > 0
-            self.s = torch.cat((self.s, expanded_s[mask]), dim=0)
-            self.s_ = torch.cat((self.s_, self.episodes[ep]['s_'].repeat(n_g, 1)[mask]), dim=0)
-            self.a = torch.cat((self.a, expanded_a[mask]), dim=0)
-            self.goal = torch.cat((self.goal, expanded_g[mask]), dim=0)
-            self.mu = torch.cat((self.mu, fake_mu[mask]), dim=0)
-            self.sigma = torch.cat((self.sigma, fake_sigma[mask]), dim=0)
-
-            self.r = torch.cat((self.r, r_f.reshape(n_g * ep_len, 1)[mask]), dim=0)
-            self.ret = torch.cat((self.r, ret_f.reshape(n_g * ep_len, 1)[mask]), dim=0)
-            self.done = torch.cat((self.done, d_f.reshape(n_g * ep_len, 1)[mask]), dim=0)
-            self.logpac_old = torch.cat((self.logpac_old, fake_logpac.reshape(n_g * ep_len, 1)[mask]), dim=0)
-
-            # Ng x T
-            gamma_discount = torch.pow(self.gamma, torch.Tensor(np.arange(1, ep_len + 1)).type_as(self.s)).repeat(n_g, 1)
-            self.gamma_discount = torch.cat((self.gamma_discount, gamma_discount.reshape(n_g * ep_len)[mask]), dim=0)
-
-            self.n_traj += n_g
-
-        if self.done.numel() == 0:
-            pdb.set_trace()
-
-        if self.weight_is:
-            h_ratios_sum = torch.sum(h_ratios, dim=0, keepdim = True)
-            h_ratios /= h_ratios_sum
-
-        h_ratios_mask = h_ratios_mask.reshape(-1) > 0
-        self.hratio = torch.cat((self.hratio, h_ratios.reshape(-1)[h_ratios_mask]), dim=0)
+    def _fake_policy_outputs(self, fake_input_s, fake_input_g, fake_a):
+        fake_mu, fake_logsigma, fake_sigma = self.policy(fake_input_s, other_data = fake_input_g)
+        fake_mu = fake_mu.detach()
+        fake_sigma = fake_sigma.detach()
+        fake_logsigma = fake_logsigma.detach()
+        fake_logpac = self.compute_logp(fake_mu, fake_logsigma, fake_sigma, fake_a)
+        return fake_logpac, {'mu': fake_mu, 'sigma': fake_sigma}
 
     def reset_training_data(self):
         self.s = torch.Tensor(size = (0,) + self.s.size()[1:]).type_as(self.s)
@@ -473,69 +544,6 @@ class HPG_Gaussian(HPG, PG_Gaussian):
         self.desired_goal = torch.Tensor(size = (0,) + self.desired_goal.size()[1:]).type_as(self.desired_goal)
         self.n_traj = 0
 
-    def _is_valid_ep(self, ep_achieved_goals, mode="reward"):
-        if mode == "naive":
-            return np.unique(np.round(ep_achieved_goals, decimals=2), axis=0).shape[0] > 1
-        elif mode == "reward":
-            virtual_desired = np.tile(np.expand_dims(ep_achieved_goals[0], axis=0), (ep_achieved_goals.shape[0], 1))
-            rew = self.reward_fn(ep_achieved_goals, virtual_desired, None).min()
-            return rew < - 0.05
-
-    def split_episode(self):
-        self.n_traj = 0
-        self.n_valid_ep = 0
-        # Episodes store all the original data and will be used to generate fake
-        # data instead of being used to train model
-        assert self.other_data, "Hindsight algorithms need goal infos."
-        self.desired_goal = self.other_data['desired_goal']
-        self.achieved_goal = self.other_data['achieved_goal']
-        self.goal = self.desired_goal
-        # initialize real data's hindsight ratios.
-        self.hratio = torch.ones(self.s.size(0)).type_as(self.s)
-
-        self.episodes = []
-        endpoints = (0,) + tuple((torch.nonzero(self.done[:, 0] > 0) + 1).squeeze().cpu().numpy().tolist())
-
-        if self.reward_type == "sparse" and not self.using_her_reward:
-            self.r += 1
-            suc_poses = torch.nonzero(self.r==1)[:, 0]
-            for suc_pos in suc_poses:
-                temp = suc_pos - torch.Tensor(endpoints).type_as(self.r) + 1
-                temp = temp[temp > 0]
-                self.r[suc_pos] = self.max_steps - torch.min(temp) + 1
-
-        # TODO: For gym envs, the episode will not end when the goal is achieved, deal with that!
-        for i in range(len(endpoints) - 1):
-            is_valid_ep = self._is_valid_ep(self.achieved_goal[endpoints[i]: endpoints[i + 1]].cpu().numpy())
-            self.n_valid_ep += is_valid_ep
-            # if is_valid_ep:
-            episode = {}
-            episode['s'] = self.s[endpoints[i] : endpoints[i + 1]]
-            episode['a'] = self.a[endpoints[i]: endpoints[i + 1]]
-            episode['r'] = self.r[endpoints[i]: endpoints[i + 1]]
-            episode['ret'] = torch.Tensor(episode['r'].shape).zero_().type_as(episode['r'])
-            episode['ret'][-1, :] = episode['r'][-1, :]
-            for t in range(episode['r'].shape[0] - 2, -1, -1):
-                episode['ret'][t, :] = episode['r'][t, :] + self.gamma * episode['ret'][t + 1, :]
-            episode['done'] = self.done[endpoints[i]: endpoints[i + 1]]
-            episode['s_'] = self.s_[endpoints[i]: endpoints[i + 1]]
-            episode['logpac_old'] = self.logpac_old[endpoints[i]: endpoints[i + 1]]
-            episode['mu'] = self.mu[endpoints[i]: endpoints[i + 1]]
-            episode['sigma'] = self.sigma[endpoints[i]: endpoints[i + 1]]
-            episode['desired_goal'] = self.desired_goal[endpoints[i]: endpoints[i + 1]]
-            episode['achieved_goal'] = self.achieved_goal[endpoints[i]: endpoints[i + 1]]
-
-            episode['length'] = endpoints[i + 1] - endpoints[i]
-            episode['gamma_discount'] = torch.pow(self.gamma, torch.Tensor(np.arange(episode['length'])).type_as(
-                self.s)).unsqueeze(1)
-
-            self.episodes.append(episode)
-
-        self.ret = torch.cat([ep['ret'] for ep in self.episodes], dim = 0)
-        # if len(self.episodes) > 0:
-        self.gamma_discount = torch.cat([ep['gamma_discount'].squeeze(1) for ep in self.episodes], dim=0)
-        self.n_traj += len(self.episodes)
-
 class HPG_Softmax(HPG, PG_Softmax):
     def __init__(self, hyperparams):
         super(HPG_Softmax, self).__init__(hyperparams)
@@ -609,139 +617,11 @@ class HPG_Softmax(HPG, PG_Softmax):
                 torch.clamp(torch.Tensor(self.goal_var), 1e-4).type_as(s)), -5, 5)
         return PG_Softmax.choose_action(self, s, other_data, greedy)
 
-    def generate_fake_data(self):
-        self.subgoals = torch.Tensor(self.subgoals).type_as(self.s)
-        # number of subgoals
-        n_g = self.subgoals.shape[0]
-
-        # for weighted importance sampling, Ne x Ng x T
-        h_ratios = torch.zeros(size = (len(self.episodes), n_g, self.max_steps)).type_as(self.s)
-        h_ratios_mask = torch.zeros(size = (len(self.episodes), n_g, self.max_steps)).type_as(self.s)
-        for ep in range(len(self.episodes)):
-            # original episode length
-            ep_len = self.episodes[ep]['length']
-
-            # Modify episode length and rewards.
-            # Ng x T
-            r_f = self.reward_fn(
-                self.episodes[ep]['achieved_goal'].unsqueeze(0).repeat(n_g, 1, 1).cpu().numpy(),
-                self.subgoals.unsqueeze(1).repeat(1, ep_len, 1).cpu().numpy(), None)
-
-            if self.reward_type == "dense":
-                goal_dist = - r_f
-                r_f = -(goal_dist > 0.05).astype(np.float32)
-
-            # For negative episode, there is no positive reward, all are 0.
-            neg_ep_inds = np.where((r_f == 0).sum(axis=-1) == 0)
-            pos_ep_inds = np.where((r_f == 0).sum(axis=-1) > 0)
-
-            # In reward, there are only 0 and 1. The first 1's position indicates the episode length.
-            l_f = np.argmax(r_f, axis=-1)
-            l_f += 1
-            # For all negative episodes, the length is the value of max_steps.
-            l_f[neg_ep_inds] = ep_len
-            # lengths: Ng
-            l_f = torch.Tensor(l_f).type_as(self.s).long()
-
-            # Ng x T
-            mask = torch.Tensor(np.arange(1, ep_len + 1)).type_as(self.s).repeat(n_g, 1)
-            mask[mask > l_f.type_as(self.s).unsqueeze(1)] = 0
-            mask[mask > 0] = 1
-            # filter out the episodes where at beginning, the goal is achieved.
-            mask[l_f == 1] = 0
-
-            if self.reward_type == "sparse":
-                r_f = torch.Tensor(r_f).type_as(self.r)
-                if not self.using_her_reward:
-                    r_f += 1
-                    # Rewards are 0 and T - t_done + 1
-                    # Ng x T
-                    r_f[range(r_f.size(0)), l_f - 1] = (self.max_steps - l_f + 1).type_as(self.r)
-                    r_f[neg_ep_inds] = 0
-            else:
-                r_f = torch.Tensor(-goal_dist).type_as(self.r)
-
-            ret_f = torch.rand(r_f.shape).zero_().type_as(r_f)
-            ret_f[:, r_f.shape[1] - 1] = r_f[:, r_f.shape[1] - 1]
-            for t in range(r_f.shape[1] - 2, -1, -1):
-                ret_f[:, t] = self.gamma * ret_f[:, t + 1] + r_f[:, t]
-
-            d_f = self.episodes[ep]['done'].squeeze().repeat(n_g, 1)
-            d_f[pos_ep_inds, l_f[pos_ep_inds] - 1] = 1
-
-            h_ratios_mask[ep][:,:ep_len] = mask
-
-            # in this case, the input state is the full state of the envs, which should be a vector.
-            if self.policy_type == 'FC':
-                expanded_s = self.episodes[ep]['s'][:ep_len].repeat(n_g, 1)
-            # in this case, the input state is represented by images
-            elif self.episodes[ep]['s'].dim() == 4:
-                expanded_s = self.episodes[ep]['s'][:ep_len].repeat(n_g, 1, 1, 1)
-
-            expanded_g = self.subgoals.unsqueeze(1).repeat(1, ep_len, 1).reshape(-1, self.d_goal)
-            # - self.episodes[ep]['achieved_goal'].unsqueeze(0).repeat(n_g,1,1).reshape(-1, self.d_goal)
-
-            if self.norm_ob:
-                fake_input_s = torch.clamp(
-                    (expanded_s - torch.Tensor(self.ob_mean).type_as(self.s)) / torch.sqrt(
-                        torch.clamp(torch.Tensor(self.ob_var), 1e-4).type_as(self.s)), -5, 5)
-                fake_input_g = torch.clamp(
-                    (expanded_g - torch.Tensor(self.goal_mean).type_as(self.s)) / torch.sqrt(
-                        torch.clamp(torch.Tensor(self.goal_var), 1e-4).type_as(self.s)), -5, 5)
-            else:
-                fake_input_s = expanded_s
-                fake_input_g = expanded_g
-
-            # Ng * T x Na
-            fake_distri = self.policy(fake_input_s, other_data = fake_input_g).detach()
-
-            # Ng * T x Da
-            expanded_a = self.episodes[ep]['a'].repeat(n_g, 1)
-
-            # Ng x T
-            fake_logpac = self.compute_logp(fake_distri, expanded_a).reshape(n_g, ep_len)
-            expanded_logpac_old = self.episodes[ep]['logpac_old'].repeat(n_g,1).reshape(n_g, -1)
-            d_logp = fake_logpac - expanded_logpac_old
-
-            # generate hindsight ratio
-            # Ng x T
-            if self.per_decision:
-                h_ratio = torch.exp(d_logp.cumsum(dim=1)) + 1e-10
-                h_ratio *= mask
-                h_ratios[ep][:, :ep_len] = h_ratio
-            else:
-                h_ratio = torch.exp(torch.sum(d_logp, keepdim=True)).repeat(1, ep_len) + 1e-10
-                h_ratio *= mask
-                h_ratios[ep][:, :ep_len] = h_ratio
-
-            # make all data one batch
-            mask = mask.reshape(-1) > 0
-            self.s = torch.cat((self.s, expanded_s[mask]), dim=0)
-            if self.policy_type == 'FC':
-                self.s_ = torch.cat((self.s_, self.episodes[ep]['s_'].repeat(n_g, 1)[mask]), dim=0)
-            else:
-                self.s_ = torch.cat((self.s_, self.episodes[ep]['s_'].repeat(n_g, 1, 1, 1)[mask]), dim=0)
-            self.a = torch.cat((self.a, expanded_a[mask]), dim=0)
-            self.goal = torch.cat((self.goal, expanded_g[mask]), dim=0)
-            self.distri = torch.cat((self.distri, fake_distri[mask]), dim=0)
-
-            self.r = torch.cat((self.r, r_f.reshape(n_g * ep_len, 1)[mask]), dim=0)
-            self.ret = torch.cat((self.r, ret_f.reshape(n_g * ep_len, 1)[mask]), dim=0)
-            self.done = torch.cat((self.done, d_f.reshape(n_g * ep_len, 1)[mask]), dim=0)
-            self.logpac_old = torch.cat((self.logpac_old, fake_logpac.reshape(n_g * ep_len, 1)[mask]), dim=0)
-
-            # Ng x T
-            gamma_discount = torch.pow(self.gamma, torch.Tensor(np.arange(1, ep_len + 1)).type_as(self.s)).repeat(n_g, 1)
-            self.gamma_discount = torch.cat((self.gamma_discount, gamma_discount.reshape(n_g * ep_len)[mask]), dim=0)
-
-            self.n_traj += n_g
-
-        if self.weight_is:
-            h_ratios_sum = torch.sum(h_ratios, dim=0, keepdim = True)
-            h_ratios /= h_ratios_sum
-
-        h_ratios_mask = h_ratios_mask.reshape(-1) > 0
-        self.hratio = torch.cat((self.hratio, h_ratios.reshape(-1)[h_ratios_mask]), dim=0)
+    def _fake_policy_outputs(self, fake_input_s, fake_input_g, fake_a):
+        # N x Na
+        fake_distri = self.policy(fake_input_s, other_data = fake_input_g).detach()
+        fake_logpac = self.compute_logp(fake_distri, fake_a)
+        return fake_logpac, {'distri': fake_distri}
 
     def reset_training_data(self):
         self.s = torch.Tensor(size = (0,) + self.s.size()[1:]).type_as(self.s)
@@ -759,60 +639,11 @@ class HPG_Softmax(HPG, PG_Softmax):
         self.desired_goal = torch.Tensor(size = (0,) + self.desired_goal.size()[1:]).type_as(self.desired_goal)
         self.n_traj = 0
 
-    def split_episode(self):
-        self.n_traj = 0
-        self.n_valid_ep = 0
-        # Episodes store all the original data and will be used to generate fake
-        # data instead of being used to train model
-        assert self.other_data, "Hindsight algorithms need goal infos."
-        self.desired_goal = self.other_data['desired_goal']
-        self.achieved_goal = self.other_data['achieved_goal']
-        self.goal = self.desired_goal
-        # initialize real data's hindsight ratios.
-        self.hratio = torch.ones(self.s.size(0)).type_as(self.s)
-
-        self.episodes = []
-        endpoints = (0,) + tuple((torch.nonzero(self.done[:, 0] > 0) + 1).squeeze().cpu().numpy().tolist())
+    def _valid_episodes(self, ep_inds, ep_begins, mode = "naive"):
+        return super(HPG_Softmax, self)._valid_episodes(ep_inds, ep_begins, mode)
 
-        if self.reward_type == "sparse" and not self.using_her_reward:
-            self.r += 1
-            suc_poses = torch.nonzero(self.r==1)[:, 0]
-            for suc_pos in suc_poses:
-                temp = suc_pos - torch.Tensor(endpoints).type_as(self.r) + 1
-                temp = temp[temp > 0]
-                self.r[suc_pos] = self.max_steps - torch.min(temp) + 1
-
-        for i in range(len(endpoints) - 1):
-
-            self.n_valid_ep += \
-                np.unique(np.round(self.achieved_goal[endpoints[i]: endpoints[i + 1]].cpu().numpy(), decimals=2),
-                          axis=0).shape[0] > 1
-
-            episode = {}
-            episode['s'] = self.s[endpoints[i] : endpoints[i + 1]]
-            episode['a'] = self.a[endpoints[i]: endpoints[i + 1]]
-            episode['r'] = self.r[endpoints[i]: endpoints[i + 1]]
-            episode['ret'] = torch.Tensor(episode['r'].shape).zero_().type_as(episode['r'])
-            episode['ret'][-1, :] = episode['r'][-1, :]
-            for t in range(episode['r'].shape[0] - 2, -1, -1):
-                episode['ret'][t, :] = episode['r'][t, :] + self.gamma * episode['ret'][t + 1, :]
-            episode['done'] = self.done[endpoints[i]: endpoints[i + 1]]
-            episode['s_'] = self.s_[endpoints[i]: endpoints[i + 1]]
-            episode['logpac_old'] = self.logpac_old[endpoints[i]: endpoints[i + 1]]
-            episode['distri'] = self.distri[endpoints[i]: endpoints[i + 1]]
-            episode['desired_goal'] = self.desired_goal[endpoints[i]: endpoints[i + 1]]
-            episode['achieved_goal'] = self.achieved_goal[endpoints[i]: endpoints[i + 1]]
-
-            episode['length'] = endpoints[i + 1] - endpoints[i]
-            episode['gamma_discount'] = torch.pow(self.gamma, torch.Tensor(np.arange(episode['length'])).type_as(
-                self.s)).unsqueeze(1)
-            self.episodes.append(episode)
-
-        self.ret = torch.cat([ep['ret'] for ep in self.episodes], dim=0)
-        self.gamma_discount = torch.cat([ep['gamma_discount'].squeeze(1) for ep in self.episodes], dim=0)
-        self.n_traj += len(self.episodes)
-
-def run_hpg_train(env, agent, max_timesteps, logger, eval_interval = None, num_evals = 5, render = False):
+def run_hpg_train(env, agent, max_timesteps, logger, eval_interval = None, num_evals = 5, render = False,
+                  rollout_groups = 1):
     timestep_counter = 0
     total_updates = max_timesteps // agent.nsteps
     epinfobuf = deque(maxlen=100)
@@ -828,154 +659,56 @@ def run_hpg_train(env, agent, max_timesteps, logger, eval_interval = None, num_e
         logger.add_scalar("episode_reward/eval", np.mean(eval_ret), timestep_counter)
         logger.add_scalar("success_rate/eval", np.mean(eval_success), timestep_counter)
 
+    collector = RolloutCollector(env, agent.nsteps, rollout_groups)
+    timer = PhaseTimer()
     while (True):
-        mb_obs, mb_rewards, mb_actions, mb_dones, mb_logpacs, mb_obs_, mb_mus, mb_sigmas \
-            , mb_distris = [], [], [], [], [], [], [], [], []
-        mb_dg, mb_ag = [], []
-        epinfos = []
-        successes = []
-        obs_dict = env.reset()
-        # env.render()
-
-        for i in range(0, agent.nsteps, env.num_envs):
-            for key in obs_dict.keys():
-                obs_dict[key] = torch.Tensor(obs_dict[key])
-
-            if not agent.dicrete_action:
-                actions, mus, logsigmas, sigmas = agent.choose_action(obs_dict["observation"],
-                                                                      other_data=obs_dict["desired_goal"])
-                logp = agent.compute_logp(mus, logsigmas, sigmas, actions)
-                mus = mus.cpu().numpy()
-                sigmas = sigmas.cpu().numpy()
-                mb_mus.append(mus)
-                mb_sigmas.append(sigmas)
-            else:
-                actions, distris = agent.choose_action(obs_dict["observation"],
-                                                       other_data=obs_dict["desired_goal"])
-                logp = agent.compute_logp(distris, actions)
-                distris = distris.cpu().numpy()
-                mb_distris.append(distris)
-            observations = obs_dict['observation'].cpu().numpy()
-            actions = actions.cpu().numpy()
-            logp = logp.cpu().numpy()
-
-            if np.random.rand() < 0.0:
-                actions = np.concatenate([np.expand_dims(env.action_space.sample(), axis=0)
-                                          for i in range(env.num_envs)], axis = 0)
-                obs_dict_, rewards, dones, infos = env.step(actions)
-            else:
-                obs_dict_, rewards, dones, infos = env.step(actions)
-
-            next_obs_dict = copy.deepcopy(obs_dict_)
-
-            for e, info in enumerate(infos):
-                if dones[e]:
-                    epinfos.append(info.get('episode'))
-                    successes.append(info.get('is_success'))
-                    for k in next_obs_dict.keys():
-                        next_obs_dict[k][e] = info.get('terminal_observation')[k]
-                    ep_num += 1
-
-            mb_obs.append(observations)
-            mb_actions.append(actions)
-            mb_logpacs.append(logp)
-            mb_dones.append(dones.astype(np.uint8))
-            mb_rewards.append(rewards)
-            mb_obs_.append(next_obs_dict['observation'].copy())
-            mb_dg.append(next_obs_dict['desired_goal'].copy())
-            mb_ag.append(next_obs_dict['achieved_goal'].copy())
-
-            obs_dict = obs_dict_
-
+        with timer('collect'):
+            _, epinfos, successes = collector.collect(pg_policy_fn(agent))
+            transition = collector.transition()
+            # every trajectory ends with a real done (1) or with the final state of the rollout (2).
+            ep_num += int(np.count_nonzero(transition['done']))
+            agent.store_transition(transition)
         epinfobuf.extend(epinfos)
         success_history.extend(successes)
 
-        # make all final states marked by done, preventing wrong estimating of returns and advantages.
-        # done flag:
-        #      0: undone and not the final state
-        #      1: realdone
-        #      2: undone but the final state
-        ep_num += (mb_dones[-1] == 0).sum()
-        mb_dones[-1][np.where(mb_dones[-1] == 0)] = 2
-
-        def reshape_data(arr):
-            s = arr.shape
-            return arr.swapaxes(0, 1).reshape(s[0] * s[1], *s[2:])
-
-        mb_obs = reshape_data(np.asarray(mb_obs, dtype=np.float32))
-        mb_rewards = reshape_data(np.asarray(mb_rewards, dtype=np.float32))
-        mb_actions = reshape_data(np.asarray(mb_actions))
-        mb_logpacs = reshape_data(np.asarray(mb_logpacs, dtype=np.float32))
-        mb_dones = reshape_data(np.asarray(mb_dones, dtype=np.uint8))
-        mb_obs_ = reshape_data(np.asarray(mb_obs_, dtype=np.float32))
-        mb_ag = reshape_data(np.asarray(mb_ag, dtype=np.float32))
-        mb_dg = reshape_data(np.asarray(mb_dg, dtype=np.float32))
-
-        assert mb_rewards.ndim <= 2 and mb_actions.ndim <= 2 and \
-               mb_logpacs.ndim <= 2 and mb_dones.ndim <= 2, \
-            "databuffer only supports 1-D data's batch."
-
-        if not agent.dicrete_action:
-            mb_mus = reshape_data(np.asarray(mb_mus, dtype=np.float32))
-            mb_sigmas = reshape_data(np.asarray(mb_sigmas, dtype=np.float32))
-            assert mb_mus.ndim <= 2 and mb_sigmas.ndim <= 2, "databuffer only supports 1-D data's batch."
-        else:
-            mb_distris = reshape_data(np.asarray(mb_distris, dtype=np.float32))
-            assert mb_distris.ndim <= 2, "databuffer only supports 1-D data's batch."
-
-        # store transition
-        transition = {
-            'state': mb_obs if mb_obs.ndim == 2 or mb_obs.ndim == 4 else np.expand_dims(mb_obs, 1),
-            'action': mb_actions if mb_actions.ndim == 2 else np.expand_dims(mb_actions, 1),
-            'reward': mb_rewards if mb_rewards.ndim == 2 else np.expand_dims(mb_rewards, 1),
-            'next_state': mb_obs_ if mb_obs_.ndim == 2 or mb_obs_.ndim == 4 else np.expand_dims(mb_obs_, 1),
-            'done': mb_dones if mb_dones.ndim == 2 else np.expand_dims(mb_dones, 1),
-            'logpac': mb_logpacs if mb_logpacs.ndim == 2 else np.expand_dims(mb_logpacs, 1),
-            'other_data': {
-                'desired_goal': mb_dg if mb_dg.ndim == 2 else np.expand_dims(mb_dg, 1),
-                'achieved_goal': mb_ag if mb_ag.ndim == 2 else np.expand_dims(mb_ag, 1),
-            }
-        }
-        if not agent.dicrete_action:
-            transition['mu'] = mb_mus if mb_mus.ndim == 2 else np.expand_dims(mb_mus, 1)
-            transition['sigma'] = mb_sigmas if mb_sigmas.ndim == 2 else np.expand_dims(mb_sigmas, 1)
-        else:
-            transition['distri'] = mb_distris if mb_distris.ndim == 2 else np.expand_dims(mb_distris, 1)
-        agent.store_transition(transition)
-
         # agent learning step
-        agent.learn()
+        with timer('learn'):
+            agent.learn()
 
         # training controller
         timestep_counter += agent.nsteps
         if timestep_counter > max_timesteps:
             break
 
-        print("------------------log information------------------")
-        print("total_timesteps:".ljust(20) + str(timestep_counter))
-        print("valid_ep_ratio:".ljust(20) + "{:.3f}".format(agent.n_valid_ep / ep_num))
-        logger.add_scalar("valid_ep_ratio/train", agent.n_valid_ep / ep_num, timestep_counter)
-        if agent.n_valid_ep > 0:
-            print("iterations:".ljust(20) + str(agent.learn_step_counter) + " / " + str(int(total_updates)))
-            if agent.value_type is not None:
-                explained_var = explained_variance(agent.V.cpu().numpy(), agent.esti_R.cpu().numpy())
-                print("explained_var:".ljust(20) + str(explained_var))
-                logger.add_scalar("explained_var/train", explained_var, timestep_counter)
-            print("episode_len:".ljust(20) + "{:.1f}".format(np.mean([epinfo['l'] for epinfo in epinfobuf])))
-            rew = np.mean([epinfo['r'] for epinfo in epinfobuf]) + agent.max_steps
-            print("episode_rew:".ljust(20) + str(rew))
-            logger.add_scalar("episode_reward/train", rew, timestep_counter)
-            print("success_rate:".ljust(20) + "{:.3f}".format(100 * np.mean(success_history)) + "%")
-            logger.add_scalar("success_rate/train", np.mean(success_history), timestep_counter)
-            print("mean_kl:".ljust(20) + str(agent.cur_kl))
-            logger.add_scalar("mean_kl/train", agent.cur_kl, timestep_counter)
-            print("policy_ent:".ljust(20) + str(agent.policy_ent))
-            logger.add_scalar("policy_ent/train", agent.policy_ent, timestep_counter)
-            print("value_loss:".ljust(20) + str(agent.value_loss))
-            logger.add_scalar("value_loss/train", agent.value_loss, timestep_counter)
-            ep_num = 0
-        else:
-            print("No valid episode was collected. Policy has not been updated.")
+        with timer('log'):
+            print("------------------log information------------------")
+            print("total_timesteps:".ljust(20) + str(timestep_counter))
+            print("valid_ep_ratio:".ljust(20) + "{:.3f}".format(agent.n_valid_ep / ep_num))
+            logger.add_scalar("valid_ep_ratio/train", agent.n_valid_ep / ep_num, timestep_counter)
+            print("goal_cells:".ljust(20) + str(agent.goal_grid.n_cells))
+            logger.add_scalar("goal_cells/train", agent.goal_grid.n_cells, timestep_counter)
+            if agent.n_valid_ep > 0:
+                print("iterations:".ljust(20) + str(agent.learn_step_counter) + " / " + str(int(total_updates)))
+                if agent.value_type is not None:
+                    explained_var = explained_variance(agent.V.cpu().numpy(), agent.esti_R.cpu().numpy())
+                    print("explained_var:".ljust(20) + str(explained_var))
+                    logger.add_scalar("explained_var/train", explained_var, timestep_counter)
+                print("episode_len:".ljust(20) + "{:.1f}".format(np.mean([epinfo['l'] for epinfo in epinfobuf])))
+                rew = np.mean([epinfo['r'] for epinfo in epinfobuf]) + agent.max_steps
+                print("episode_rew:".ljust(20) + str(rew))
+                logger.add_scalar("episode_reward/train", rew, timestep_counter)
+                print("success_rate:".ljust(20) + "{:.3f}".format(100 * np.mean(success_history)) + "%")
+                logger.add_scalar("success_rate/train", np.mean(success_history), timestep_counter)
+                print("mean_kl:".ljust(20) + str(agent.cur_kl))
+                logger.add_scalar("mean_kl/train", agent.cur_kl, timestep_counter)
+                print("policy_ent:".ljust(20) + str(agent.policy_ent))
+                logger.add_scalar("policy_ent/train", agent.policy_ent, timestep_counter)
+                print("value_loss:".ljust(20) + str(agent.value_loss))
+                logger.add_scalar("value_loss/train", agent.value_loss, timestep_counter)
+                ep_num = 0
+            else:
+                print("No valid episode was collected. Policy has not been updated.")
+            timer.dump(logger, timestep_counter)
 
         if eval_interval and timestep_counter % eval_interval == 0:
             agent.save_model("output/models/HTRPO")
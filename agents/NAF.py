@@ -4,7 +4,7 @@ import copy
 from agents.Agent import Agent
 from .config import NAF_CONFIG
 from rlnets.NAF import FCNAF
-from utils import databuffer
+from utils import databuffer, databuffer_torch
 import os
 from collections import deque
 from utils.mathutils import explained_variance
@@ -36,7 +36,8 @@ class NAF(Agent):
         # initialize zero memory [s, a, r, s_]
         if "memory_size" not in config.keys():
             config["memory_size"] = self.memory_size
-        self.memory = databuffer(config)
+        self.replay_prefetch = config['replay_prefetch']
+        self.memory = databuffer_torch(config) if config['torch_memory'] else databuffer(config)
         self.e_NAF = FCNAF(self.n_states, self.n_action_dims,
                            n_hiddens=self.hidden_layers,
                            usebn=self.using_bn,
@@ -56,6 +57,8 @@ class NAF(Agent):
         Agent.cuda(self)
         self.e_NAF = self.e_NAF.cuda()
         self.t_NAF = self.t_NAF.cuda()
+        if isinstance(self.memory, databuffer_torch):
+            self.memory.cuda()
 
     def choose_action(self,s):
         if self.norm_ob:
@@ -77,19 +80,7 @@ class NAF(Agent):
         self.soft_update(self.t_NAF, self.e_NAF, self.replace_tau)
 
         # sample batch memory from all memory
-        batch_memory = self.sample_batch(self.batch_size)[0]
-        if self.norm_ob:
-            batch_memory['state'] = np.clip(
-                (batch_memory['state'] - self.ob_mean) / np.sqrt(self.ob_var + 1e-8),-10,10)
-            batch_memory['next_state'] = np.clip(
-                (batch_memory['next_state'] - self.ob_mean) / np.sqrt(self.ob_var + 1e-8),-10,10)
-        if self.norm_rw:
-            batch_memory['reward'] = np.clip(batch_memory['reward'] / np.sqrt(self.rw_var + 1e-8), -10, 10)
-        self.r = self.r.resize_(batch_memory['reward'].shape).copy_(torch.Tensor(batch_memory['reward']))
-        self.done = self.done.resize_(batch_memory['done'].shape).copy_(torch.Tensor(batch_memory['done']))
-        self.s_ = self.s_.resize_(batch_memory['next_state'].shape).copy_(torch.Tensor(batch_memory['next_state']))
-        self.a = self.a.resize_(batch_memory['action'].shape).copy_(torch.Tensor(batch_memory['action']))
-        self.s = self.s.resize_(batch_memory['state'].shape).copy_(torch.Tensor(batch_memory['state']))
+        self.sample_replay_batch()
 
         V_, _, _ = self.t_NAF(self.s_)
         q_target = self.r + self.gamma * V_
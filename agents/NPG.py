@@ -8,6 +8,7 @@ import copy
 from .config import NPG_CONFIG
 import abc
 from utils.mathutils import explained_variance
+from .rollout import RolloutCollector, PhaseTimer, pg_policy_fn
 from collections import deque
 
 class NPG(PG):
@@ -20,17 +21,24 @@ class NPG(PG):
         self.cg_residual_tol = config['cg_residual_tol']
         self.cg_damping = config['cg_damping']
         self.max_kl = config['max_kl_divergence']
+        self.fvp_method = config['fvp_method']
+        self.fisher_subsample = config['fisher_subsample']
 
-    def conjunction_gradient(self, b):
+    def conjunction_gradient(self, b, fvp = None):
         """
         Demmel p 312, borrowed from https://github.com/ikostrikov/pytorch-trpo
+
+        :param b: (Tensor) right-hand side of Ax = b.
+        :param fvp: (callable) product of A and a vector. Default: self.hessian_vector_product.
         """
+        if fvp is None:
+            fvp = self.hessian_vector_product
         p = b.clone().data
         r = b.clone().data
         x = torch.zeros_like(b).data
         rdotr = torch.sum(r * r)
         for i in range(self.cg_iters):
-            z = self.hessian_vector_product(Variable(p))
+            z = fvp(Variable(p))
             v = rdotr / torch.sum(p * z.data)
             x += v * p
             r -= v * z.data
@@ -53,12 +61,101 @@ class NPG(PG):
             mean_kl_div, self.policy.parameters(), create_graph=True)
         kl_grad_vector = torch.cat([grad.view(-1) for grad in kl_grad])
         grad_vector_product = torch.sum(kl_grad_vector * vector)
+        # the graph of the policy outputs may be shared through policy_outputs().
         grad_grad = torch.autograd.grad(
-            grad_vector_product, self.policy.parameters())
+            grad_vector_product, self.policy.parameters(), retain_graph=True)
         fisher_vector_product = torch.cat(
             [grad.contiguous().view(-1) for grad in grad_grad])
         return fisher_vector_product + (self.cg_damping * vector)
 
+    def fisher_vector_product_fn(self):
+        """
+        Build the Fisher-vector product (with damping) of the current batch once per update, so that it can be reused
+        by all the conjugate gradient iterations and the step size computation. With 'fisher_subsample' < 1, the
+        Fisher information is estimated on a random subset of the batch drawn here, once per update. The method is
+        set by 'fvp_method':
+            'double_backprop': Hessian-vector product of mean_kl_divergence(), whose gradient graph is built once.
+            'analytic': J^T M J v, where J is the Jacobian of the policy outputs given by fisher_outputs() w.r.t. the
+                        parameters and M the Fisher information of the distribution w.r.t. these outputs. It falls
+                        back to 'double_backprop' if fisher_outputs() returns None.
+
+        :return: (callable) maps a 1-D Tensor of the size of the policy parameters to its Fisher-vector product.
+        """
+        inds = self.fisher_subsample_inds()
+        if self.fvp_method == 'analytic':
+            fisher_outputs = self.fisher_outputs(inds = inds)
+            if fisher_outputs is not None:
+                return self._analytic_fvp(*fisher_outputs)
+        elif self.fvp_method != 'double_backprop':
+            raise ValueError("Unknown fvp_method: {}".format(self.fvp_method))
+        if inds is None:
+            mean_kl_div = self.mean_kl_divergence()
+        else:
+            mean_kl_div = self.fisher_scale(inds) * self.mean_kl_divergence(inds = inds)
+        kl_grad = torch.autograd.grad(
+            mean_kl_div, self.policy.parameters(), create_graph=True)
+        kl_grad_vector = torch.cat([grad.view(-1) for grad in kl_grad])
+
+        def fvp(vector):
+            grad_vector_product = torch.sum(kl_grad_vector * vector)
+            grad_grad = torch.autograd.grad(
+                grad_vector_product, self.policy.parameters(), retain_graph=True)
+            fisher_vector_product = torch.cat(
+                [grad.contiguous().view(-1) for grad in grad_grad])
+            return fisher_vector_product + (self.cg_damping * vector)
+        return fvp
+
+    def fisher_subsample_inds(self):
+        """
+        :return: (ndarray) sorted indices of the random subset of the batch used to estimate the Fisher information,
+                 or None to use the whole batch.
+        """
+        if self.fisher_subsample is None or self.fisher_subsample >= 1:
+            return None
+        n = self.s.size(0)
+        n_sub = min(n, max(1, int(np.ceil(self.fisher_subsample * n))))
+        return np.sort(np.random.choice(n, n_sub, replace=False))
+
+    def fisher_scale(self, inds):
+        """
+        :return: (float) factor making mean_kl_divergence(inds) an estimation of the KL divergence of the whole batch.
+                 1 for a KL averaged over the samples, which is the case of NPG and TRPO.
+        """
+        return 1.
+
+    def _analytic_fvp(self, outputs, metric):
+        params = list(self.policy.parameters())
+        # J^T u is linear in the dummy u, so J v is its vector-Jacobian product with v w.r.t. u.
+        u = torch.zeros_like(outputs, requires_grad=True)
+        jtu = torch.autograd.grad(outputs, params, grad_outputs=u, create_graph=True, allow_unused=True)
+        jtu_vector = torch.cat([grad.contiguous().view(-1) for grad in jtu if grad is not None])
+        used = [grad is not None for grad in jtu]
+
+        def fvp(vector):
+            used_vector = torch.cat([v for v, flag in zip(
+                torch.split(vector, [param.numel() for param in params]), used) if flag])
+            jv = torch.autograd.grad(jtu_vector, u, grad_outputs=used_vector, retain_graph=True)[0]
+            grad_grad = torch.autograd.grad(outputs, params, grad_outputs=metric * jv,
+                                            retain_graph=True, allow_unused=True)
+            fisher_vector_product = torch.cat([grad.contiguous().view(-1) if grad is not None
+                                               else torch.zeros_like(param).view(-1)
+                                               for grad, param in zip(grad_grad, params)])
+            return fisher_vector_product + (self.cg_damping * vector)
+        return fvp
+
+    @abc.abstractmethod
+    def fisher_outputs(self, logp_weights = None, inds = None):
+        """
+        :param logp_weights: (Tensor) weights w of a KL estimated by sum(w * 0.5 * (logp_old - logp)^2), one per
+               sample of inds. Default: the KL of the policy distributions, or its estimation with uniform weights if
+               using_KL_estimation.
+        :param inds: (ndarray) samples of the batch to use. Default: the whole batch.
+        :return: (Tensor, Tensor) or None, the N x k outputs of the policy on the batch and the N x k diagonal metric
+                 M such that the Hessian of mean_kl_divergence() at the current parameters is J^T diag(M) J, J being
+                 the Jacobian of the outputs. None if there is no such form.
+        """
+        raise NotImplementedError("Must be implemented in subclass.")
+
     def learn(self):
         self.sample_batch()
         # imp_fac: should be a 1-D Variable or Tensor, size is the same with a.size(0)
@@ -78,132 +175,92 @@ class NPG(PG):
         # loss_grad_vector is a 1-D Variable including all parameters in self.policy
         loss_grad_vector = parameters_to_vector([grad for grad in loss_grad])
         # solve Ax = -g, A is Hessian Matrix of KL divergence
-        trpo_grad_direc = self.conjunction_gradient(- loss_grad_vector)
-        shs = .5 * torch.sum(trpo_grad_direc * self.hessian_vector_product(trpo_grad_direc))
+        fvp = self.fisher_vector_product_fn()
+        trpo_grad_direc = self.conjunction_gradient(- loss_grad_vector, fvp)
+        shs = .5 * torch.sum(trpo_grad_direc * fvp(trpo_grad_direc))
         beta = torch.sqrt(self.max_kl / shs)
         fullstep = trpo_grad_direc * beta
         thetanew = parameters_to_vector(self.policy.parameters()) + fullstep
         vector_to_parameters(thetanew, self.policy.parameters())
         self.learn_step_counter += 1
-        self.cur_kl = self.mean_kl_divergence().item()
-        self.policy_ent = self.compute_entropy().item()
+        with torch.no_grad():
+            self.cur_kl = self.mean_kl_divergence().item()
+            self.policy_ent = self.compute_entropy().item()
 
 class NPG_Gaussian(NPG, PG_Gaussian):
     def __init__(self,hyperparams):
         super(NPG_Gaussian, self).__init__(hyperparams)
 
+    def fisher_outputs(self, logp_weights = None, inds = None):
+        mu, logsigma, sigma = self.policy_outputs(inds)
+        if inds is None:
+            inds = np.arange(self.s.size(0))
+        n = len(inds)
+        if logp_weights is None and self.using_KL_estimation:
+            logp_weights = torch.ones_like(mu[:, 0]) / n
+        if logp_weights is not None:
+            # sum(w * 0.5 * (logp_old - logp)^2) has the weighted empirical Fisher as Hessian.
+            logp = self.compute_logp(mu, logsigma, sigma, self.a[inds]).view(-1, 1)
+            return logp, logp_weights.detach().view(-1, 1)
+        # Fisher information of a diagonal Gaussian: 1 / sigma^2 for the mean and 2 for the log std.
+        outputs = torch.cat((mu, logsigma), dim=1)
+        metric = torch.cat((1. / torch.pow(sigma.detach(), 2), 2. * torch.ones_like(sigma)), dim=1) / n
+        return outputs, metric
+
 class NPG_Softmax(NPG,PG_Softmax):
     def __init__(self,hyperparams):
         super(NPG_Softmax, self).__init__(hyperparams)
 
-def run_npg_train(env, agent, max_timesteps, logger):
+    def fisher_outputs(self, logp_weights = None, inds = None):
+        distri = self.policy_outputs(inds)
+        if inds is None:
+            inds = np.arange(self.s.size(0))
+        n = len(inds)
+        if logp_weights is not None:
+            logp = self.compute_logp(distri, self.a[inds]).view(-1, 1)
+            return logp, logp_weights.detach().view(-1, 1)
+        # Fisher information of a categorical distribution w.r.t. its probabilities: 1 / p.
+        return distri, 1. / (n * torch.clamp(distri.detach(), min = 1e-8))
+
+def run_npg_train(env, agent, max_timesteps, logger, rollout_groups = 1):
     timestep_counter = 0
     total_updates = max_timesteps // agent.nsteps
     epinfobuf = deque(maxlen=100)
+    collector = RolloutCollector(env, agent.nsteps, rollout_groups)
+    timer = PhaseTimer()
     while(True):
-        mb_obs, mb_rewards, mb_actions, mb_dones, mb_logpacs, mb_obs_, mb_mus, mb_sigmas \
-            , mb_distris= [], [], [], [], [], [], [], [], []
-        epinfos = []
-        observations = env.reset()
-        for i in range(0, agent.nsteps, env.num_envs):
-            observations = torch.Tensor(observations)
-            if not agent.dicrete_action:
-                actions, mus, logsigmas, sigmas = agent.choose_action(observations)
-                logp = agent.compute_logp(mus, logsigmas, sigmas, actions)
-                mus = mus.cpu().numpy()
-                sigmas = sigmas.cpu().numpy()
-                mb_mus.append(mus)
-                mb_sigmas.append(sigmas)
-            else:
-                actions, distris = agent.choose_action(observations)
-                logp = agent.compute_logp(distris, actions)
-                distris = distris.cpu().numpy()
-                mb_distris.append(distris)
-            observations = observations.cpu().numpy()
-            actions  = actions.cpu().numpy()
-            logp = logp.cpu().numpy()
-            observations_, rewards, dones, infos = env.step(actions)
-            for info in infos:
-                maybeepinfo = info.get('episode')
-                if maybeepinfo: epinfos.append(maybeepinfo)
-            mb_obs.append(observations)
-            mb_actions.append(actions)
-            mb_logpacs.append(logp)
-            mb_dones.append(dones.astype(np.uint8))
-            mb_rewards.append(rewards)
-            mb_obs_.append(observations_)
-            observations = observations_
-
+        with timer('collect'):
+            _, epinfos, _ = collector.collect(pg_policy_fn(agent))
+            agent.store_transition(collector.transition())
         epinfobuf.extend(epinfos)
-        # make all final states marked by done, preventing wrong estimating of returns and advantages.
-        # done flag:
-        #      0: undone and not the final state
-        #      1: realdone
-        #      2: undone but the final state
-        mb_dones[-1][np.where(mb_dones[-1] == 0)] = 2
-
-        def reshape_data(arr):
-            s = arr.shape
-            return arr.swapaxes(0, 1).reshape(s[0] * s[1], *s[2:])
-        mb_obs = reshape_data(np.asarray(mb_obs, dtype=np.float32))
-        mb_rewards = reshape_data(np.asarray(mb_rewards, dtype=np.float32))
-        mb_actions = reshape_data(np.asarray(mb_actions))
-        mb_logpacs = reshape_data(np.asarray(mb_logpacs, dtype=np.float32))
-        mb_dones = reshape_data(np.asarray(mb_dones, dtype=np.uint8))
-        mb_obs_ = reshape_data(np.asarray(mb_obs_, dtype=np.float32))
-
-        assert mb_obs.ndim <= 2 and mb_rewards.ndim <= 2 and mb_actions.ndim <= 2 and \
-               mb_logpacs.ndim <= 2 and mb_dones.ndim <= 2 and mb_obs_.ndim <= 2, \
-            "databuffer only supports 1-D data's batch."
-
-        if not agent.dicrete_action:
-            mb_mus = reshape_data(np.asarray(mb_mus, dtype=np.float32))
-            mb_sigmas = reshape_data(np.asarray(mb_sigmas, dtype=np.float32))
-            assert mb_mus.ndim <= 2 and mb_sigmas.ndim <= 2, "databuffer only supports 1-D data's batch."
-        else:
-            mb_distris = reshape_data(np.asarray(mb_distris, dtype=np.float32))
-            assert mb_distris.ndim <= 2, "databuffer only supports 1-D data's batch."
-
-        # store transition
-        transition = {
-            'state': mb_obs if mb_obs.ndim == 2 else np.expand_dims(mb_obs, 1),
-            'action': mb_actions if mb_actions.ndim == 2 else np.expand_dims(mb_actions, 1),
-            'reward': mb_rewards if mb_rewards.ndim == 2 else np.expand_dims(mb_rewards, 1),
-            'next_state': mb_obs_ if mb_obs_.ndim == 2 else np.expand_dims(mb_obs_, 1),
-            'done': mb_dones if mb_dones.ndim == 2 else np.expand_dims(mb_dones, 1),
-            'logpac': mb_logpacs if mb_logpacs.ndim == 2 else np.expand_dims(mb_logpacs, 1),
-        }
-        if not agent.dicrete_action:
-            transition['mu'] = mb_mus if mb_mus.ndim == 2 else np.expand_dims(mb_mus, 1)
-            transition['sigma'] = mb_sigmas if mb_sigmas.ndim == 2 else np.expand_dims(mb_sigmas, 1)
-        else:
-            transition['distri'] = mb_distris if mb_distris.ndim == 2 else np.expand_dims(mb_distris, 1)
-        agent.store_transition(transition)
 
         # agent learning step
-        agent.learn()
+        with timer('learn'):
+            agent.learn()
 
         # training controller
         timestep_counter += agent.nsteps
         if timestep_counter >= max_timesteps:
             break
 
-        print("------------------log information------------------")
-        print("total_timesteps:".ljust(20) + str(timestep_counter))
-        print("iterations:".ljust(20) + str(agent.learn_step_counter) + " / " + str(int(total_updates)))
-        if agent.value_type is not None:
-            explained_var = explained_variance(agent.V.cpu().numpy(), agent.esti_R.cpu().numpy())
-            print("explained_var:".ljust(20) + str(explained_var))
-            logger.add_scalar("explained_var/train", explained_var, timestep_counter)
-        print("episode_len:".ljust(20) + "{:.1f}".format(np.mean([epinfo['l'] for epinfo in epinfobuf])))
-        print("episode_rew:".ljust(20) + str(np.mean([epinfo['r'] for epinfo in epinfobuf])))
-        logger.add_scalar("episode_reward/train", np.mean([epinfo['r'] for epinfo in epinfobuf]), timestep_counter)
-        print("mean_kl:".ljust(20) + str(agent.cur_kl))
-        logger.add_scalar("mean_kl/train", agent.cur_kl, timestep_counter)
-        print("policy_ent:".ljust(20) + str(agent.policy_ent))
-        logger.add_scalar("policy_ent/train", agent.policy_ent, timestep_counter)
-        print("value_loss:".ljust(20)+ str(agent.value_loss))
-        logger.add_scalar("value_loss/train", agent.value_loss, timestep_counter)
+        with timer('log'):
+            print("------------------log information------------------")
+            print("total_timesteps:".ljust(20) + str(timestep_counter))
+            print("iterations:".ljust(20) + str(agent.learn_step_counter) + " / " + str(int(total_updates)))
+            if agent.value_type is not None:
+                explained_var = explained_variance(agent.V.cpu().numpy(), agent.esti_R.cpu().numpy())
+                print("explained_var:".ljust(20) + str(explained_var))
+                logger.add_scalar("explained_var/train", explained_var, timestep_counter)
+            print("episode_len:".ljust(20) + "{:.1f}".format(np.mean([epinfo['l'] for epinfo in epinfobuf])))
+            print("episode_rew:".ljust(20) + str(np.mean([epinfo['r'] for epinfo in epinfobuf])))
+            logger.add_scalar("episode_reward/train", np.mean([epinfo['r'] for epinfo in epinfobuf]), timestep_counter)
+            print("mean_kl:".ljust(20) + str(agent.cur_kl))
+            logger.add_scalar("mean_kl/train", agent.cur_kl, timestep_counter)
+            print("policy_ent:".ljust(20) + str(agent.policy_ent))
+            logger.add_scalar("policy_ent/train", agent.policy_ent, timestep_counter)
+            print("value_loss:".ljust(20)+ str(agent.value_loss))
+            logger.add_scalar("value_loss/train", agent.value_loss, timestep_counter)
+            timer.dump(logger, timestep_counter)
     return agent
 
 
@@ -14,7 +14,8 @@ from utils import databuffer, databuffer_PG_gaussian, databuffer_PG_softmax
 import abc
 import os
 from collections import deque
-from utils.mathutils import explained_variance
+from utils.mathutils import explained_variance, discount_cumsum, generalized_advantage_estimation
+from .rollout import RolloutCollector, PhaseTimer, pg_policy_fn
 
 class PG(Agent):
     __metaclass__ = abc.ABCMeta
@@ -29,6 +30,10 @@ class PG(Agent):
         self.value_type = config['value_type']
         self.policy_type = config['policy_type']
         self.using_KL_estimation = config['using_KL_estimation']
+        self.cache_policy_outputs = config['cache_policy_outputs']
+        # the last policy outputs, see policy_outputs(), and the number of forward passes they took.
+        self._policy_output_cache = None
+        self.policy_forwards = 0
         self.policy_ent = 0.
         self.policy_loss = 0.
         self.value_loss = 0.
@@ -91,64 +96,70 @@ class PG(Agent):
     def mean_kl_divergence(self, inds = None, model= None):
         raise NotImplementedError("Must be implemented in subclass.")
 
+    def policy_outputs(self, inds = None, model = None):
+        """
+        Outputs of model on the samples inds of the batch. With 'cache_policy_outputs', the last outputs are kept and
+        returned again as long as they were computed by the same model, on the same index set (the same object, or
+        both None) of the same batch, in the same grad mode, and neither the batch nor the parameters and buffers of
+        the model have changed since: sample_batch(), an optimizer step or vector_to_parameters change their versions
+        or storages, which invalidates the cache. compute_imp_fac(), compute_entropy() and mean_kl_divergence() called one after the
+        other then run one forward pass, and share its graph.
+
+        :param inds: (ndarray) samples of the batch. Default: the whole batch.
+        :param model: the policy, or a callable with the same signature. Default: self.policy.
+        """
+        if model is None:
+            model = self.policy
+        key = (model, inds, self.s, self.other_data, torch.is_grad_enabled())
+        if self.cache_policy_outputs and self._policy_output_cache is not None:
+            cached_key, cached_version, _, outputs = self._policy_output_cache
+            if all(k is c for k, c in zip(key, cached_key)) and self._cache_version(model) == cached_version:
+                return outputs
+        if inds is None:
+            inds = np.arange(self.s.size(0))
+        outputs = model(self.s[inds], other_data = self.other_data[inds] if self.other_data is not None else None)
+        self.policy_forwards += 1
+        if self.cache_policy_outputs:
+            # the tensors of the model are kept, so that their storages cannot be reused by other parameters.
+            tensors = [t.data for t in self._model_tensors(model)]
+            self._policy_output_cache = (key, self._cache_version(model), tensors, outputs)
+        return outputs
+
+    def _model_tensors(self, model):
+        if not isinstance(model, nn.Module):
+            # e.g. a functional call of the policy, a new one for each set of parameters.
+            return []
+        return list(model.parameters()) + list(model.buffers())
+
+    def _cache_version(self, model):
+        # sample_batch() refills self.s and self.other_data in place.
+        tensors = self._model_tensors(model) + [t for t in (self.s, self.other_data) if torch.is_tensor(t)]
+        return [(t.data_ptr(), t._version) for t in tensors]
+
     def estimate_value_with_approximator(self):
         fake_done = torch.nonzero(self.done.squeeze() == 2).squeeze(-1)
-        self.done[self.done == 2] = 1
-        returns = torch.zeros(self.r.size(0), 1).type_as(self.s)
-        values = self.value(self.s, other_data=self.other_data)
-        delta = torch.zeros(self.r.size(0), 1).type_as(self.s)
-        advantages = torch.zeros(self.r.size(0), 1).type_as(self.s)
-
-        # mask is a 1-d vector, therefore, e_points is also a 1-d vector
-        e_points = torch.nonzero(self.done.squeeze() == 1).squeeze()
-        b_points = - torch.ones(size=e_points.size()).type_as(e_points)
-        b_points[1:] = e_points[:-1]
-        ep_lens = e_points - b_points
-
-        assert ep_lens.min().item() > 0, "Some episode lengths are smaller than 0."
-        max_len = torch.max(ep_lens).item()
-        uncomplete_flag = ep_lens > 0
-
-        delta[e_points] = self.r[e_points] - values[e_points]
+        values = self.value(self.s, other_data=self.other_data).detach()
+        # states flagged by 2 are not real terminal states, their returns are bootstrapped with V(s_).
+        bootstrap_values = None
         if fake_done.numel() > 0:
-            delta[fake_done] += self.value(self.s_[fake_done],
-                                           other_data=self.other_data[fake_done]
-                                           if self.other_data is not None else None).resize_as(delta[fake_done])
-        advantages[e_points] = delta[e_points]
-        returns[e_points] = self.r[e_points]
-        for i in range(1, max_len):
-            uncomplete_flag[ep_lens <= i] = 0
-            # TD-error
-            inds = (e_points - i)[uncomplete_flag]
-            delta[inds] = self.r[inds] + self.gamma * values[inds + 1] - values[inds]
-            advantages[inds] = delta[inds] + self.gamma * self.lamb * advantages[inds + 1]
-            returns[inds] = self.r[inds] + self.gamma * returns[inds + 1]
+            bootstrap_values = self.value(self.s_[fake_done],
+                                          other_data=self.other_data[fake_done]
+                                          if self.other_data is not None else None).detach()
+        returns, advantages = generalized_advantage_estimation(self.r, values, self.done, self.gamma, self.lamb,
+                                                               bootstrap_values)
+        self.done[self.done == 2] = 1
 
         # Estimated Return, from OpenAI baseline.
-        esti_return = values + advantages
+        esti_return = values.squeeze(-1) + advantages
         # values returns advantages and estimated returns
-        self.V = values.squeeze().detach()
-        self.R = returns.squeeze().detach()
-        self.A = advantages.squeeze().detach()
-        self.esti_R = esti_return.squeeze().detach()
+        self.V = values.squeeze()
+        self.R = returns
+        self.A = advantages
+        self.esti_R = esti_return
 
     def estimate_value_with_mc(self):
         self.done[self.done == 2] = 1
-        returns = torch.zeros(self.r.size(0), 1).type_as(self.s)
-        e_points = torch.nonzero(self.done.squeeze() == 1).squeeze()
-        b_points = - torch.ones(size=e_points.size()).type_as(e_points)
-        b_points[1:] = e_points[:-1]
-        ep_lens = e_points - b_points
-        assert ep_lens.min().item() > 0, "Some episode lengths are smaller than 0."
-        max_len = torch.max(ep_lens).item()
-        uncomplete_flag = ep_lens > 0
-        returns[e_points] = self.r[e_points]
-        for i in range(1, max_len):
-            uncomplete_flag[ep_lens <= i] = 0
-            inds = (e_points - i)[uncomplete_flag]
-            returns[inds] = self.r[inds] + self.gamma * returns[inds + 1]
-
-        self.R = returns.squeeze().detach()
+        self.R = discount_cumsum(self.r, self.done, self.gamma).detach()
         # Here self.A is actually not advantages. It works for policy updates, which
         # means that it is used to measure how good a action is.
         self.A = self.R
@@ -214,9 +225,10 @@ class PG(Agent):
             nn.utils.clip_grad_norm_(self.policy.parameters(), self.max_grad_norm)
         self.optimizer.step()
         self.learn_step_counter += 1
-        self.cur_kl = self.mean_kl_divergence().item()
         self.policy_loss = self.loss.item()
-        self.policy_ent = self.compute_entropy().item()
+        with torch.no_grad():
+            self.cur_kl = self.mean_kl_divergence().item()
+            self.policy_ent = self.compute_entropy().item()
 
     def save_model(self, save_path):
         super(PG, self).save_model(save_path)
@@ -308,10 +320,15 @@ class PG_Gaussian(PG):
             if other_data is not None:
                 other_data = other_data.cuda()
         mu, logsigma, sigma = self.policy(s, other_data)
-        mu = mu.detach()
-        logsigma = logsigma.detach()
-        sigma = sigma.detach()
         self.policy.train()
+        return self.sample_action((mu, logsigma, sigma), greedy)
+
+    def sample_action(self, outputs, greedy = False):
+        """
+        :param outputs: (tuple) the outputs mu, logsigma and sigma of the policy.
+        :return: (tuple) the sampled (or greedy) actions, with the detached mu, logsigma and sigma.
+        """
+        mu, logsigma, sigma = [output.detach() for output in outputs]
         if not greedy:
             a = torch.normal(mu,sigma)
         else:
@@ -331,13 +348,10 @@ class PG_Gaussian(PG):
             RuntimeError("a must be a 1-D or 2-D Tensor or Variable")
 
     def compute_imp_fac(self, inds = None, model = None):
+        mu_now, logsigma_now, sigma_now = self.policy_outputs(inds, model)
         # default: compute all importance factors.
         if inds is None:
             inds = np.arange(self.s.size(0))
-        if model is None:
-            model = self.policy
-        # theta is the vectorized model parameters
-        mu_now, logsigma_now, sigma_now = model(self.s[inds], other_data = self.other_data[inds] if self.other_data is not None else None)
         # important sampling coefficients
         # imp_fac: should be a 1-D Variable or Tensor, size is the same with a.size(0)
         imp_fac = torch.exp(
@@ -345,21 +359,14 @@ class PG_Gaussian(PG):
         return imp_fac
 
     def compute_entropy(self, inds = None, model = None):
-        # default: compute all importance factors.
-        if inds is None:
-            inds = np.arange(self.s.size(0))
-        if model is None:
-            model = self.policy
-        mu_now, logsigma_now, _ = model(self.s[inds], other_data = self.other_data[inds] if self.other_data is not None else None)
+        mu_now, logsigma_now, _ = self.policy_outputs(inds, model)
         entropy = (0.5 * self.n_action_dims * np.log(2 * np.pi * np.e) + torch.sum(logsigma_now, 1)).mean()
         return entropy
 
     def mean_kl_divergence(self, inds = None, model = None):
+        mu1, logsigma1, sigma1 = self.policy_outputs(inds, model)
         if inds is None:
             inds = np.arange(self.s.size(0))
-        if model is None:
-            model = self.policy
-        mu1, logsigma1, sigma1 = model(self.s[inds], other_data = self.other_data[inds] if self.other_data is not None else None)
         if self.using_KL_estimation:
             logp = self.compute_logp(mu1, logsigma1, sigma1, self.a[inds])
             logp_old = self.logpac_old[inds].squeeze()
@@ -439,8 +446,16 @@ class PG_Softmax(PG):
             s = s.cuda()
             if other_data is not None:
                 other_data = other_data.cuda()
-        distri = self.policy(s, other_data).detach()
+        distri = self.policy(s, other_data)
         self.policy.train()
+        return self.sample_action(distri, greedy)
+
+    def sample_action(self, outputs, greedy = False):
+        """
+        :param outputs: (Tensor) the action distributions output by the policy.
+        :return: (tuple) the sampled (or greedy) actions and the detached distributions.
+        """
+        distri = outputs.detach()
         if not greedy:
             a = torch.multinomial(distri, 1, replacement=True)
         else:
@@ -458,35 +473,26 @@ class PG_Softmax(PG):
             RuntimeError("distri must be a 1-D or 2-D Tensor or Variable")
 
     def compute_imp_fac(self, inds = None, model = None):
+        distri_now = self.policy_outputs(inds, model)
         # default: compute all importance factors.
         if inds is None:
             inds = np.arange(self.s.size(0))
-        if model is None:
-            model = self.policy
-        distri_now = model(self.s[inds], other_data = self.other_data[inds] if self.other_data is not None else None)
         # important sampling coefficients
         # imp_fac: should be a 1-D Variable or Tensor, size is the same with a.size(0)
         imp_fac = torch.exp(self.compute_logp(distri_now, self.a[inds]) - self.logpac_old[inds].squeeze())
         return imp_fac
 
     def compute_entropy(self, inds = None, model = None):
-        # default: compute all importance factors.
-        if inds is None:
-            inds = np.arange(self.s.size(0))
-        if model is None:
-            model = self.policy
-        distri = model(self.s[inds], other_data = self.other_data[inds] if self.other_data is not None else None)
+        distri = self.policy_outputs(inds, model)
         # important sampling coefficients
         # imp_fac: should be a 1-D Variable or Tensor, size is the same with a.size(0)
         entropy = - torch.sum(distri * torch.log(distri), 1).mean()
         return entropy
 
     def mean_kl_divergence(self, inds = None, model = None):
+        distri1 = self.policy_outputs(inds, model)
         if inds is None:
             inds = np.arange(self.s.size(0))
-        if model is None:
-            model = self.policy
-        distri1 = model(self.s[inds], other_data = self.other_data[inds] if self.other_data is not None else None)
         distri2 = self.distri[inds].squeeze()
         logratio = torch.log(distri2 / distri1)
         kl = torch.sum(distri2 * logratio, 1)
@@ -506,93 +512,22 @@ class PG_Softmax(PG):
             for key in self.other_data.keys():
                 self.other_data[key] = torch.Tensor(self.other_data[key]).type_as(self.s)
 
-def run_pg_train(env, agent, max_timesteps, logger):
+def run_pg_train(env, agent, max_timesteps, logger, rollout_groups = 1):
     timestep_counter = 0
     total_updates = max_timesteps // agent.nsteps
     epinfobuf = deque(maxlen=100)
 
+    collector = RolloutCollector(env, agent.nsteps, rollout_groups)
+    timer = PhaseTimer()
     while(True):
-        mb_obs, mb_rewards, mb_actions, mb_dones, mb_logpacs, mb_obs_, mb_mus, mb_sigmas \
-            , mb_distris= [], [], [], [], [], [], [], [], []
-        epinfos = []
-        observations = env.reset()
-        for i in range(0, agent.nsteps, env.num_envs):
-            observations = torch.Tensor(observations)
-            if not agent.dicrete_action:
-                actions, mus, logsigmas, sigmas = agent.choose_action(observations)
-                logp = agent.compute_logp(mus, logsigmas, sigmas, actions)
-                mus = mus.cpu().numpy()
-                sigmas = sigmas.cpu().numpy()
-                mb_mus.append(mus)
-                mb_sigmas.append(sigmas)
-            else:
-                actions, distris = agent.choose_action(observations)
-                logp = agent.compute_logp(distris, actions)
-                distris = distris.cpu().numpy()
-                mb_distris.append(distris)
-            observations = observations.cpu().numpy()
-            actions  = actions.cpu().numpy()
-            logp = logp.cpu().numpy()
-            observations_, rewards, dones, infos = env.step(actions)
-            for info in infos:
-                maybeepinfo = info.get('episode')
-                if maybeepinfo: epinfos.append(maybeepinfo)
-            mb_obs.append(observations)
-            mb_actions.append(actions)
-            mb_logpacs.append(logp)
-            mb_dones.append(dones.astype(np.uint8))
-            mb_rewards.append(rewards)
-            mb_obs_.append(observations_)
-            observations = observations_
-
+        with timer('collect'):
+            _, epinfos, _ = collector.collect(pg_policy_fn(agent))
+            agent.store_transition(collector.transition())
         epinfobuf.extend(epinfos)
-        # make all final states marked by done, preventing wrong estimating of returns and advantages.
-        # done flag:
-        #      0: undone and not the final state
-        #      1: realdone
-        #      2: undone but the final state
-        mb_dones[-1][np.where(mb_dones[-1] == 0)] = 2
-
-        def reshape_data(arr):
-            s = arr.shape
-            return arr.swapaxes(0, 1).reshape(s[0] * s[1], *s[2:])
-        mb_obs = reshape_data(np.asarray(mb_obs, dtype=np.float32))
-        mb_rewards = reshape_data(np.asarray(mb_rewards, dtype=np.float32))
-        mb_actions = reshape_data(np.asarray(mb_actions))
-        mb_logpacs = reshape_data(np.asarray(mb_logpacs, dtype=np.float32))
-        mb_dones = reshape_data(np.asarray(mb_dones, dtype=np.uint8))
-        mb_obs_ = reshape_data(np.asarray(mb_obs_, dtype=np.float32))
-
-        assert mb_obs.ndim <= 2 and mb_rewards.ndim <= 2 and mb_actions.ndim <= 2 and \
-               mb_logpacs.ndim <= 2 and mb_dones.ndim <= 2 and mb_obs_.ndim <= 2, \
-            "databuffer only supports 1-D data's batch."
-
-        if not agent.dicrete_action:
-            mb_mus = reshape_data(np.asarray(mb_mus, dtype=np.float32))
-            mb_sigmas = reshape_data(np.asarray(mb_sigmas, dtype=np.float32))
-            assert mb_mus.ndim <= 2 and mb_sigmas.ndim <= 2, "databuffer only supports 1-D data's batch."
-        else:
-            mb_distris = reshape_data(np.asarray(mb_distris, dtype=np.float32))
-            assert mb_distris.ndim <= 2, "databuffer only supports 1-D data's batch."
-
-        # store transition
-        transition = {
-            'state': mb_obs if mb_obs.ndim == 2 else np.expand_dims(mb_obs, 1),
-            'action': mb_actions if mb_actions.ndim == 2 else np.expand_dims(mb_actions, 1),
-            'reward': mb_rewards if mb_rewards.ndim == 2 else np.expand_dims(mb_rewards, 1),
-            'next_state': mb_obs_ if mb_obs_.ndim == 2 else np.expand_dims(mb_obs_, 1),
-            'done': mb_dones if mb_dones.ndim == 2 else np.expand_dims(mb_dones, 1),
-            'logpac': mb_logpacs if mb_logpacs.ndim == 2 else np.expand_dims(mb_logpacs, 1),
-        }
-        if not agent.dicrete_action:
-            transition['mu'] = mb_mus if mb_mus.ndim == 2 else np.expand_dims(mb_mus, 1)
-            transition['sigma'] = mb_sigmas if mb_sigmas.ndim == 2 else np.expand_dims(mb_sigmas, 1)
-        else:
-            transition['distri'] = mb_distris if mb_distris.ndim == 2 else np.expand_dims(mb_distris, 1)
-        agent.store_transition(transition)
 
         # agent learning step
-        agent.learn()
+        with timer('learn'):
+            agent.learn()
 
         # training controller
         timestep_counter += agent.nsteps
@@ -605,24 +540,26 @@ def run_pg_train(env, agent, max_timesteps, logger):
         if agent.value_type is not None:
             adjust_learning_rate(agent.v_optimizer, original_lr=agent.lr_v, decay_coef=decay_coef)
 
-        print("------------------log information------------------")
-        print("total_timesteps:".ljust(20) + str(timestep_counter))
-        print("iterations:".ljust(20) + str(agent.learn_step_counter) + " / " + str(int(total_updates)))
-        if agent.value_type is not None:
-            explained_var = explained_variance(agent.V.cpu().numpy(), agent.esti_R.cpu().numpy())
-            print("explained_var:".ljust(20) + str(explained_var))
-            logger.add_scalar("explained_var/train", explained_var, timestep_counter)
-        print("episode_len:".ljust(20) + "{:.1f}".format(np.mean([epinfo['l'] for epinfo in epinfobuf])))
-        print("episode_rew:".ljust(20) + str(np.mean([epinfo['r'] for epinfo in epinfobuf])))
-        logger.add_scalar("episode_reward/train", np.mean([epinfo['r'] for epinfo in epinfobuf]), timestep_counter)
-        print("mean_kl:".ljust(20) + str(agent.cur_kl))
-        logger.add_scalar("mean_kl/train", agent.cur_kl, timestep_counter)
-        print("policy_ent:".ljust(20) + str(agent.policy_ent))
-        logger.add_scalar("policy_ent/train", agent.policy_ent, timestep_counter)
-        print("policy_loss:".ljust(20)+ str(agent.policy_loss))
-        logger.add_scalar("policy_loss/train", agent.policy_loss, timestep_counter)
-        print("value_loss:".ljust(20)+ str(agent.value_loss))
-        logger.add_scalar("value_loss/train", agent.value_loss, timestep_counter)
+        with timer('log'):
+            print("------------------log information------------------")
+            print("total_timesteps:".ljust(20) + str(timestep_counter))
+            print("iterations:".ljust(20) + str(agent.learn_step_counter) + " / " + str(int(total_updates)))
+            if agent.value_type is not None:
+                explained_var = explained_variance(agent.V.cpu().numpy(), agent.esti_R.cpu().numpy())
+                print("explained_var:".ljust(20) + str(explained_var))
+                logger.add_scalar("explained_var/train", explained_var, timestep_counter)
+            print("episode_len:".ljust(20) + "{:.1f}".format(np.mean([epinfo['l'] for epinfo in epinfobuf])))
+            print("episode_rew:".ljust(20) + str(np.mean([epinfo['r'] for epinfo in epinfobuf])))
+            logger.add_scalar("episode_reward/train", np.mean([epinfo['r'] for epinfo in epinfobuf]), timestep_counter)
+            print("mean_kl:".ljust(20) + str(agent.cur_kl))
+            logger.add_scalar("mean_kl/train", agent.cur_kl, timestep_counter)
+            print("policy_ent:".ljust(20) + str(agent.policy_ent))
+            logger.add_scalar("policy_ent/train", agent.policy_ent, timestep_counter)
+            print("policy_loss:".ljust(20)+ str(agent.policy_loss))
+            logger.add_scalar("policy_loss/train", agent.policy_loss, timestep_counter)
+            print("value_loss:".ljust(20)+ str(agent.value_loss))
+            logger.add_scalar("value_loss/train", agent.value_loss, timestep_counter)
+            timer.dump(logger, timestep_counter)
     return agent
 
 def adjust_learning_rate(optimizer, original_lr = 1e-4, decay_coef = 0.95):
@@ -9,6 +9,8 @@ from .config import AdaptiveKLPPO_CONFIG,PPO_CONFIG
 import copy
 import abc
 from utils.mathutils import explained_variance
+from .rollout import RolloutCollector, PhaseTimer, pg_policy_fn
+from .multiseed import run_multiseed_pg_train
 from collections import deque
 
 class PPO(NPG):
@@ -59,7 +61,8 @@ class PPO(NPG):
                 nn.utils.clip_grad_norm(list(self.policy.parameters()) + list(self.value.parameters()), self.max_grad_norm)
                 self.optimizer.step()
                 self.v_optimizer.step()
-        self.cur_kl = self.mean_kl_divergence().item()
+        with torch.no_grad():
+            self.cur_kl = self.mean_kl_divergence().item()
         self.clip_frac /= self.nupdates * (self.nsteps // self.batch_size)
         self.policy_ent /= self.nupdates * (self.nsteps // self.batch_size)
         self.policy_loss /= self.nupdates * (self.nsteps // self.batch_size)
@@ -142,7 +145,8 @@ class AdaptiveKLPPO(NPG):
                 self.optimizer.step()
                 self.v_optimizer.step()
         # update panishment of kl divergence
-        self.cur_kl = self.mean_kl_divergence().item()
+        with torch.no_grad():
+            self.cur_kl = self.mean_kl_divergence().item()
         self.update_beta()
         self.policy_ent /= self.nupdates * (self.nsteps // self.batch_size)
         self.policy_loss /= self.nupdates * (self.nsteps // self.batch_size)
@@ -167,130 +171,69 @@ class AdaptiveKLPPO_Softmax(AdaptiveKLPPO, NPG_Softmax):
     def __init__(self,hyperparams):
         super(AdaptiveKLPPO_Softmax,self).__init__(hyperparams)
 
-def run_ppo_train(env, agent, max_timesteps, logger):
+def run_ppo_train(env, agent, max_timesteps, logger, rollout_groups = 1):
     timestep_counter = 0
     total_updates = max_timesteps // agent.nsteps
     epinfobuf = deque(maxlen=100)
 
+    collector = RolloutCollector(env, agent.nsteps, rollout_groups)
+    timer = PhaseTimer()
     while(True):
-        mb_obs, mb_rewards, mb_actions, mb_dones, mb_logpacs, mb_obs_, mb_mus, mb_sigmas \
-            , mb_distris= [], [], [], [], [], [], [], [], []
-        epinfos = []
-        observations = env.reset()
-        for i in range(0, agent.nsteps, env.num_envs):
-            observations = torch.Tensor(observations)
-            if not agent.dicrete_action:
-                actions, mus, logsigmas, sigmas = agent.choose_action(observations)
-                logp = agent.compute_logp(mus, logsigmas, sigmas, actions)
-                mus = mus.cpu().numpy()
-                sigmas = sigmas.cpu().numpy()
-                mb_mus.append(mus)
-                mb_sigmas.append(sigmas)
-            else:
-                actions, distris = agent.choose_action(observations)
-                logp = agent.compute_logp(distris, actions)
-                distris = distris.cpu().numpy()
-                mb_distris.append(distris)
-            observations = observations.cpu().numpy()
-            actions  = actions.cpu().numpy()
-            logp = logp.cpu().numpy()
-            observations_, rewards, dones, infos = env.step(actions)
-
-            mb_obs.append(observations)
-            mb_actions.append(actions)
-            mb_logpacs.append(logp)
-            mb_dones.append(dones.astype(np.uint8))
-            mb_rewards.append(rewards)
-            mb_obs_.append(observations_)
-
-            for e, info in enumerate(infos):
-                if dones[e]:
-                    epinfos.append(info.get('episode'))
-                    observations_[e] = info.get('new_obs')
-
-            observations = observations_
-
+        with timer('collect'):
+            _, epinfos, _ = collector.collect(pg_policy_fn(agent))
+            agent.store_transition(collector.transition())
         epinfobuf.extend(epinfos)
-        # make all final states marked by done, preventing wrong estimating of returns and advantages.
-        # done flag:
-        #      0: undone and not the final state
-        #      1: realdone
-        #      2: undone but the final state
-        mb_dones[-1][np.where(mb_dones[-1] == 0)] = 2
-
-        def reshape_data(arr):
-            s = arr.shape
-            return arr.swapaxes(0, 1).reshape(s[0] * s[1], *s[2:])
-        mb_obs = reshape_data(np.asarray(mb_obs, dtype=np.float32))
-        mb_rewards = reshape_data(np.asarray(mb_rewards, dtype=np.float32))
-        mb_actions = reshape_data(np.asarray(mb_actions))
-        mb_logpacs = reshape_data(np.asarray(mb_logpacs, dtype=np.float32))
-        mb_dones = reshape_data(np.asarray(mb_dones, dtype=np.uint8))
-        mb_obs_ = reshape_data(np.asarray(mb_obs_, dtype=np.float32))
-
-        assert mb_obs.ndim <= 2 and mb_rewards.ndim <= 2 and mb_actions.ndim <= 2 and \
-               mb_logpacs.ndim <= 2 and mb_dones.ndim <= 2 and mb_obs_.ndim <= 2, \
-            "databuffer only supports 1-D data's batch."
-
-        if not agent.dicrete_action:
-            mb_mus = reshape_data(np.asarray(mb_mus, dtype=np.float32))
-            mb_sigmas = reshape_data(np.asarray(mb_sigmas, dtype=np.float32))
-            assert mb_mus.ndim <= 2 and mb_sigmas.ndim <= 2, "databuffer only supports 1-D data's batch."
-        else:
-            mb_distris = reshape_data(np.asarray(mb_distris, dtype=np.float32))
-            assert mb_distris.ndim <= 2, "databuffer only supports 1-D data's batch."
-
-        # store transition
-        transition = {
-            'state': mb_obs if mb_obs.ndim == 2 else np.expand_dims(mb_obs, 1),
-            'action': mb_actions if mb_actions.ndim == 2 else np.expand_dims(mb_actions, 1),
-            'reward': mb_rewards if mb_rewards.ndim == 2 else np.expand_dims(mb_rewards, 1),
-            'next_state': mb_obs_ if mb_obs_.ndim == 2 else np.expand_dims(mb_obs_, 1),
-            'done': mb_dones if mb_dones.ndim == 2 else np.expand_dims(mb_dones, 1),
-            'logpac': mb_logpacs if mb_logpacs.ndim == 2 else np.expand_dims(mb_logpacs, 1),
-        }
-        if not agent.dicrete_action:
-            transition['mu'] = mb_mus if mb_mus.ndim == 2 else np.expand_dims(mb_mus, 1)
-            transition['sigma'] = mb_sigmas if mb_sigmas.ndim == 2 else np.expand_dims(mb_sigmas, 1)
-        else:
-            transition['distri'] = mb_distris if mb_distris.ndim == 2 else np.expand_dims(mb_distris, 1)
-        agent.store_transition(transition)
 
         # agent learning step
-        agent.learn()
+        with timer('learn'):
+            agent.learn()
 
         # training controller
         timestep_counter += agent.nsteps
         if timestep_counter >= max_timesteps:
             break
 
-        # adjust learning rate for policy and value function
-        decay_coef = 1 - agent.learn_step_counter / total_updates
-        adjust_learning_rate(agent.optimizer, original_lr=agent.lr, decay_coef=decay_coef)
-        if agent.value_type is not None:
-            adjust_learning_rate(agent.v_optimizer, original_lr=agent.lr_v, decay_coef=decay_coef)
+        decay_ppo_learning_rate(agent, total_updates)
 
-        print("------------------log information------------------")
-        print("total_timesteps:".ljust(20) + str(timestep_counter))
-        print("iterations:".ljust(20) + str(agent.learn_step_counter) + " / " + str(int(total_updates)))
-        explained_var = explained_variance(agent.V.cpu().numpy(), agent.esti_R.cpu().numpy())
-        print("explained_var:".ljust(20) + str(explained_var))
-        logger.add_scalar("explained_var/train", explained_var, timestep_counter)
-        print("episode_len:".ljust(20) + "{:.1f}".format(np.mean([epinfo['l'] for epinfo in epinfobuf])))
-        print("episode_rew:".ljust(20) + str(np.mean([epinfo['r'] for epinfo in epinfobuf])))
-        logger.add_scalar("episode_reward/train", np.mean([epinfo['r'] for epinfo in epinfobuf]), timestep_counter)
-        print("mean_kl:".ljust(20) + str(agent.cur_kl))
-        logger.add_scalar("mean_kl/train", agent.cur_kl, timestep_counter)
-        print("policy_ent:".ljust(20) + str(agent.policy_ent))
-        logger.add_scalar("policy_ent/train", agent.policy_ent, timestep_counter)
-        print("policy_loss:".ljust(20)+ str(agent.policy_loss))
-        logger.add_scalar("policy_loss/train", agent.policy_loss, timestep_counter)
-        print("value_loss:".ljust(20)+ str(agent.value_loss))
-        logger.add_scalar("value_loss/train", agent.value_loss, timestep_counter)
-        print("clip_frac:".ljust(20) + "{:.4f}".format(agent.clip_frac) + "(only for standard PPO)")
-        print("kl_panishment:".ljust(20) + "{:.4f}".format(agent.beta) + "(only for Adaptive KL PPO)")
+        with timer('log'):
+            print("------------------log information------------------")
+            log_ppo_train(agent, logger, timestep_counter, total_updates, epinfobuf)
+            timer.dump(logger, timestep_counter)
     return agent
 
+def run_ppo_multiseed_train(env, agents, streams, max_timesteps, loggers):
+    """
+    Train the PPO agents of N seeds together, see run_multiseed_pg_train.
+    """
+    return run_multiseed_pg_train(env, agents, streams, max_timesteps, loggers, log_ppo_train, decay_ppo_learning_rate)
+
+def decay_ppo_learning_rate(agent, total_updates):
+    # adjust learning rate for policy and value function
+    decay_coef = 1 - agent.learn_step_counter / total_updates
+    adjust_learning_rate(agent.optimizer, original_lr=agent.lr, decay_coef=decay_coef)
+    if agent.value_type is not None:
+        adjust_learning_rate(agent.v_optimizer, original_lr=agent.lr_v, decay_coef=decay_coef)
+
+def log_ppo_train(agent, logger, timestep_counter, total_updates, epinfobuf):
+    print("total_timesteps:".ljust(20) + str(timestep_counter))
+    print("iterations:".ljust(20) + str(agent.learn_step_counter) + " / " + str(int(total_updates)))
+    explained_var = explained_variance(agent.V.cpu().numpy(), agent.esti_R.cpu().numpy())
+    print("explained_var:".ljust(20) + str(explained_var))
+    logger.add_scalar("explained_var/train", explained_var, timestep_counter)
+    print("episode_len:".ljust(20) + "{:.1f}".format(np.mean([epinfo['l'] for epinfo in epinfobuf])))
+    print("episode_rew:".ljust(20) + str(np.mean([epinfo['r'] for epinfo in epinfobuf])))
+    logger.add_scalar("episode_reward/train", np.mean([epinfo['r'] for epinfo in epinfobuf]), timestep_counter)
+    print("mean_kl:".ljust(20) + str(agent.cur_kl))
+    logger.add_scalar("mean_kl/train", agent.cur_kl, timestep_counter)
+    print("policy_ent:".ljust(20) + str(agent.policy_ent))
+    logger.add_scalar("policy_ent/train", agent.policy_ent, timestep_counter)
+    print("policy_loss:".ljust(20)+ str(agent.policy_loss))
+    logger.add_scalar("policy_loss/train", agent.policy_loss, timestep_counter)
+    print("value_loss:".ljust(20)+ str(agent.value_loss))
+    logger.add_scalar("value_loss/train", agent.value_loss, timestep_counter)
+    print("clip_frac:".ljust(20) + "{:.4f}".format(agent.clip_frac) + "(only for standard PPO)")
+    print("kl_panishment:".ljust(20) + "{:.4f}".format(agent.beta) + "(only for Adaptive KL PPO)")
+
 def adjust_learning_rate(optimizer, original_lr = 1e-4, decay_coef = 0.95):
     for param_group in optimizer.param_groups:
         param_group['lr'] = original_lr * decay_coef
@@ -13,60 +13,45 @@ import os
 from collections import deque
 from utils.mathutils import explained_variance
 from .DDPG import DDPG
-from rlnets.DDPG import FCDDPG_C
+from rlnets.DDPG import FCDDPG_C_Ensemble
 from .config import TD3_CONFIG
 
 class TD3(DDPG):
     def __init__(self,hyperparams):
         config = copy.deepcopy(TD3_CONFIG)
         config.update(hyperparams)
+        self.n_critics = config["n_critics"]
         super(TD3, self).__init__(config)
 
         self.d = config["actor_delayed_steps"]
         self.smooth_noise = config["smooth_noise"]
         self.epsilon = config["smooth_epsilon"]
 
-        self.e_Critic_double = FCDDPG_C(self.n_states, self.n_action_dims,
-                                 n_hiddens=self.hidden_layers_v,
-                                 nonlinear=self.act_func,
-                                 usebn=self.using_bn,
-                                 initializer="uniform",
-                                 initializer_param={"last_lower": 3e-3, "last_upper": 3e-3}
-                                 )
-        self.t_Critic_double = FCDDPG_C(self.n_states, self.n_action_dims,
-                                 n_hiddens=self.hidden_layers_v,
-                                 nonlinear=self.act_func,
-                                 usebn=self.using_bn,
-                                 initializer="uniform",
-                                 initializer_param={"last_lower": 3e-3, "last_upper": 3e-3}
-                                 )
+    def build_critic(self):
+        # the critics of the ensemble are evaluated together, and the clipped double Q learning takes the minimum of
+        # their values.
+        self.e_Critic = FCDDPG_C_Ensemble(self.n_critics, self.n_states, self.n_action_dims,
+                                          n_hiddens=self.hidden_layers_v,
+                                          nonlinear=self.act_func,
+                                          usebn=self.using_bn,
+                                          initializer="uniform",
+                                          initializer_param={"last_lower": 3e-3, "last_upper": 3e-3}
+                                          )
+        self.t_Critic = FCDDPG_C_Ensemble(self.n_critics, self.n_states, self.n_action_dims,
+                                          n_hiddens=self.hidden_layers_v,
+                                          nonlinear=self.act_func,
+                                          usebn=self.using_bn,
+                                          initializer="uniform",
+                                          initializer_param={"last_lower": 3e-3, "last_upper": 3e-3}
+                                          )
         self.hard_update(self.t_Critic, self.e_Critic)
-        self.optimizer_c = self.optimizer_c_func(list(self.e_Critic.parameters()) +
-                                                 list(self.e_Critic_double.parameters()),
-                                                 lr = self.lrv)
-
-    def cuda(self):
-        DDPG.cuda(self)
-        self.e_Critic_double.cuda()
-        self.t_Critic_double.cuda()
+        self.optimizer_c = self.optimizer_c_func(self.e_Critic.parameters(), lr = self.lrv)
 
     def learn(self):
 
         for i in range(self.d):
             # sample batch memory from all memory
-            batch_memory = self.sample_batch(self.batch_size)[0]
-            if self.norm_ob:
-                batch_memory['state'] = np.clip(
-                    (batch_memory['state'] - self.ob_mean) / np.sqrt(self.ob_var + 1e-8), -10, 10)
-                batch_memory['next_state'] = np.clip(
-                    (batch_memory['next_state'] - self.ob_mean) / np.sqrt(self.ob_var + 1e-8), -10, 10)
-            if self.norm_rw:
-                batch_memory['reward'] = np.clip(batch_memory['reward'] / np.sqrt(self.rw_var + 1e-8), -10, 10)
-            self.r = self.r.resize_(batch_memory['reward'].shape).copy_(torch.Tensor(batch_memory['reward']))
-            self.done = self.done.resize_(batch_memory['done'].shape).copy_(torch.Tensor(batch_memory['done']))
-            self.s_ = self.s_.resize_(batch_memory['next_state'].shape).copy_(torch.Tensor(batch_memory['next_state']))
-            self.a = self.a.resize_(batch_memory['action'].shape).copy_(torch.Tensor(batch_memory['action']))
-            self.s = self.s.resize_(batch_memory['state'].shape).copy_(torch.Tensor(batch_memory['state']))
+            self.sample_replay_batch()
 
             # Target Policy Smoothing'
             a_noise = np.clip(np.random.normal(0, self.smooth_noise, size = self.a.size()), -self.epsilon, self.epsilon)
@@ -74,30 +59,25 @@ class TD3(DDPG):
             a_ = torch.clamp(self.t_Actor(self.s_) + a_noise, -self.action_bounds, self.action_bounds)
 
             # Clipping Double Q Learning
-            q_1 = self.t_Critic(self.s_, a_)
-            q_2 = self.t_Critic_double(self.s_, a_)
-            q_target = self.r + (1 - self.done) * self.gamma * torch.min(q_1, q_2)
+            q_target = self.r + (1 - self.done) * self.gamma * torch.min(self.t_Critic(self.s_, a_), 0)[0]
             q_target = q_target.detach().squeeze()
 
-            q_eval_1 = self.e_Critic(self.s, self.a).squeeze()
-            q_eval_2 = self.e_Critic_double(self.s, self.a).squeeze()
+            q_eval = self.e_Critic(self.s, self.a).squeeze(-1)
             self.Qt = q_target.cpu().numpy()
-            self.Qe1 = q_eval_1.detach().cpu().numpy()
-            self.Qe2 = q_eval_2.detach().cpu().numpy()
+            # the values of the first critic, as the one critic of DDPG.
+            self.Qe = q_eval[0].detach().cpu().numpy()
 
             # update critic
-            self.loss_c = self.loss(q_eval_1, q_target) + self.loss(q_eval_2, q_target)
+            self.loss_c = sum(self.loss(q_eval_i, q_target) for q_eval_i in q_eval)
 
             self.e_Critic.zero_grad()
-            self.e_Critic_double.zero_grad()
             self.loss_c.backward()
             if self.max_grad_norm is not None:
-                torch.nn.utils.clip_grad_norm_(self.e_Critic.parameters(), self.max_grad_norm)
-                torch.nn.utils.clip_grad_norm_(self.e_Critic_double.parameters(), self.max_grad_norm)
+                self.e_Critic.clip_grad_norm_(self.max_grad_norm)
             self.optimizer_c.step()
 
         # update actor
-        self.loss_a = -self.e_Critic(self.s, self.e_Actor(self.s)).mean()
+        self.loss_a = -self.e_Critic(self.s, self.e_Actor(self.s), heads=slice(0, 1)).mean()
         self.e_Actor.zero_grad()
         self.loss_a.backward()
         if self.max_grad_norm is not None:
@@ -109,9 +89,21 @@ class TD3(DDPG):
                 1 - self.exploration_noise_decrement) if self.noise > self.noise_min else self.noise_min
 
         # check to replace target parameters
-        self.soft_update(self.t_Actor, self.e_Actor, self.replace_tau)
-        self.soft_update(self.t_Critic, self.e_Critic, self.replace_tau)
-        self.soft_update(self.t_Critic_double, self.e_Critic_double, self.replace_tau)
+        self.soft_update([self.t_Actor, self.t_Critic], [self.e_Actor, self.e_Critic], self.replace_tau)
+
+    def load_critic(self, load_path, load_point):
+        critic_name = os.path.join(load_path, "critic" + str(load_point) + ".pth")
+        checkpoint = torch.load(critic_name)
+        if checkpoint['model']['first_layer.weight'].dim() == 3:
+            DDPG.load_critic(self, load_path, load_point)
+            return
+        # checkpoint of the former TD3, which saved only its first FCDDPG_C critic as 'model'. Its second critic
+        # cannot be recovered.
+        print("loading checkpoint %s" % (critic_name))
+        self.e_Critic.load_critic_state_dict(0, checkpoint['model'])
+        print("only critic 0 is in the checkpoint, critics 1 to {} keep their initialization".format(self.n_critics - 1))
+        print("the optimizer state of the former critic is not loaded")
+        print("loaded checkpoint %s" % (critic_name))
 
 def run_td3_train(env, agent, max_timesteps, logger, log_interval):
 
@@ -194,8 +186,7 @@ def run_td3_train(env, agent, max_timesteps, logger, log_interval):
                 # adjust_learning_rate(agent.optimizer_a, original_lr=agent.lr, decay_coef=decay_coef)
                 # adjust_learning_rate(agent.optimizer_c, original_lr=agent.lrv, decay_coef=decay_coef)
 
-                explained_var += 0.5 * explained_variance(agent.Qe1, agent.Qt)
-                explained_var += 0.5 * explained_variance(agent.Qe2, agent.Qt)
+                explained_var += explained_variance(agent.Qe, agent.Qt)
                 loss_a += agent.loss_a.item()
                 loss_c += agent.loss_c.item()
                 if agent.learn_step_counter % log_interval == 0:
@@ -6,6 +6,8 @@ from .config import TRPO_CONFIG
 import abc
 import numpy as np
 from utils.mathutils import explained_variance
+from .rollout import RolloutCollector, PhaseTimer, pg_policy_fn
+from .multiseed import run_multiseed_pg_train
 from collections import deque
 import time
 
@@ -18,36 +20,86 @@ class TRPO(NPG):
         self.accept_ratio = config['accept_ratio']
         self.max_search_num = config['max_search_num']
         self.step_frac = config['step_frac']
+        self.line_search_batch = max(1, config['line_search_batch'])
+        self._scratch_policy = None
         self.improvement = 0
         self.expected_improvement = 0
 
-    def object_loss(self, theta):
-        model = copy.deepcopy(self.policy)
-        vector_to_parameters(theta, model.parameters())
+    def cuda(self):
+        super(TRPO, self).cuda()
+        self._scratch_policy = None
+
+    def _policy_with(self, theta):
+        """
+        Write theta into the scratch copy of the policy, which is allocated once and reused by all the candidate steps
+        of the line searches, instead of deep copying the policy for each candidate.
+        """
+        if self._scratch_policy is None:
+            self._scratch_policy = copy.deepcopy(self.policy)
+        vector_to_parameters(theta, self._scratch_policy.parameters())
+        return self._scratch_policy
+
+    def object_loss(self, theta, model = None):
+        if model is None:
+            model = self._policy_with(theta)
         imp_fac = self.compute_imp_fac(model=model)
-        loss = - (imp_fac * self.A).mean() - self.entropy_weight * self.compute_entropy()
+        loss = - (imp_fac * self.A).mean() - self.entropy_weight * self.compute_entropy(model=model)
         curkl = self.mean_kl_divergence(model=model)
         return loss, curkl
 
+    def batched_object_loss(self, thetas):
+        """
+        Evaluate the loss and the KL divergence of several parameter vectors with one batched forward, by vmapping a
+        functional call of the policy over the parameter vectors.
+
+        :param thetas: (Tensor) K x n_params parameter vectors.
+        :return: (Tensor, Tensor) the K losses and KL divergences.
+        """
+        # torch.func requires torch >= 2.0, only imported by the batched line search.
+        from torch.func import functional_call, vmap
+        names, params = zip(*self.policy.named_parameters())
+        buffers = dict(self.policy.named_buffers())
+
+        def loss_fn(theta):
+            theta_params = {name: p.view_as(param) for name, p, param in
+                            zip(names, torch.split(theta, [param.numel() for param in params]), params)}
+            model = lambda x, other_data = None: functional_call(
+                self.policy, (theta_params, buffers), (x,), {'other_data': other_data})
+            return self.object_loss(theta, model)
+        return vmap(loss_fn)(thetas)
+
     def linear_search(self,x, fullstep, expected_improve_rate):
         accept_ratio = self.accept_ratio
         max_backtracks = self.max_search_num
-        fval, curkl = self.object_loss(x)
-        print("*****************************************")
-        for (_n_backtracks, stepfrac) in enumerate(list(self.step_frac ** torch.arange(0, max_backtracks).float().type_as(self.s))):
-            xnew = x + stepfrac * fullstep
-            newfval, curkl = self.object_loss(xnew)
-            actual_improve = fval - newfval
-            expected_improve = expected_improve_rate * stepfrac
-            ratio = actual_improve / expected_improve
-            print("Search number {}...".format(_n_backtracks + 1),  "Step Frac:{:.5f}".format(stepfrac),
-                  " Actual improve: {:.5f}".format(actual_improve) , " Expected improve: {:.5f}".format(expected_improve),
-                  " Current KL: {:.8f}".format(curkl))
-            if ratio.item() > accept_ratio and actual_improve.item() > 0 and 0 < curkl < self.max_kl * 1.5:
-                self.improvement = actual_improve.item()
-                self.expected_improvement = expected_improve.item()
-                print("*****************************************")
-                return xnew
+        stepfracs = self.step_frac ** torch.arange(0, max_backtracks).float().type_as(x)
+        with torch.no_grad():
+            if self._scratch_policy is not None:
+                for scratch_buffer, buffer in zip(self._scratch_policy.buffers(), self.policy.buffers()):
+                    scratch_buffer.copy_(buffer)
+            fval, curkl = self.object_loss(x)
+            print("*****************************************")
+            for begin in range(0, max_backtracks, self.line_search_batch):
+                # the candidates of a chunk are evaluated at once, and checked in the order of decreasing steps.
+                chunk = stepfracs[begin: begin + self.line_search_batch]
+                if self.line_search_batch > 1:
+                    newfvals, curkls = self.batched_object_loss(x.unsqueeze(0) + chunk.unsqueeze(1) * fullstep)
+                else:
+                    newfval, curkl = self.object_loss(x + chunk[0] * fullstep)
+                    newfvals, curkls = newfval.unsqueeze(0), curkl.unsqueeze(0)
+                for i, stepfrac in enumerate(chunk):
+                    _n_backtracks = begin + i
+                    newfval, curkl = newfvals[i], curkls[i]
+                    actual_improve = fval - newfval
+                    expected_improve = expected_improve_rate * stepfrac
+                    ratio = actual_improve / expected_improve
+                    print("Search number {}...".format(_n_backtracks + 1),  "Step Frac:{:.5f}".format(stepfrac),
+                          " Actual improve: {:.5f}".format(actual_improve) , " Expected improve: {:.5f}".format(expected_improve),
+                          " Current KL: {:.8f}".format(curkl))
+                    if ratio.item() > accept_ratio and actual_improve.item() > 0 and 0 < curkl < self.max_kl * 1.5:
+                        self.improvement = actual_improve.item()
+                        self.expected_improvement = expected_improve.item()
+                        print("*****************************************")
+                        return x + stepfrac * fullstep
         print("** Failure optimization, rolling back. **")
         print("*****************************************")
         return x
@@ -69,8 +121,9 @@ class TRPO(NPG):
         # loss_grad_vector is a 1-D Variable including all parameters in self.policy
         loss_grad_vector = parameters_to_vector([grad for grad in loss_grad])
         # solve Ax = -g, A is Hessian Matrix of KL divergence
-        trpo_grad_direc = self.conjunction_gradient( - loss_grad_vector)
-        shs = .5 * torch.sum(trpo_grad_direc * self.hessian_vector_product(trpo_grad_direc))
+        fvp = self.fisher_vector_product_fn()
+        trpo_grad_direc = self.conjunction_gradient( - loss_grad_vector, fvp)
+        shs = .5 * torch.sum(trpo_grad_direc * fvp(trpo_grad_direc))
         beta = torch.sqrt(self.max_kl / shs)
         fullstep = trpo_grad_direc * beta
         gdotstepdir = -torch.sum(loss_grad_vector * trpo_grad_direc)
@@ -79,8 +132,9 @@ class TRPO(NPG):
         # update policy
         vector_to_parameters(theta, self.policy.parameters())
         self.learn_step_counter += 1
-        self.cur_kl = self.mean_kl_divergence().item()
-        self.policy_ent = self.compute_entropy().item()
+        with torch.no_grad():
+            self.cur_kl = self.mean_kl_divergence().item()
+            self.policy_ent = self.compute_entropy().item()
 
 class TRPO_Gaussian(TRPO, NPG_Gaussian):
     def __init__(self,hyperparams):
@@ -90,127 +144,59 @@ class TRPO_Softmax(TRPO, NPG_Softmax):
     def __init__(self,hyperparams):
         super(TRPO_Softmax, self).__init__(hyperparams)
 
-def run_trpo_train(env, agent, max_timesteps, logger):
+def run_trpo_train(env, agent, max_timesteps, logger, rollout_groups = 1):
     timestep_counter = 0
     total_updates = max_timesteps // agent.nsteps
 
     epinfobuf = deque(maxlen=100)
 
+    collector = RolloutCollector(env, agent.nsteps, rollout_groups)
+    timer = PhaseTimer()
     while(True):
-        mb_obs, mb_rewards, mb_actions, mb_dones, mb_logpacs, mb_obs_, mb_mus, mb_sigmas \
-            , mb_distris= [], [], [], [], [], [], [], [], []
-        epinfos = []
-        observations = env.reset()
-
-        for i in range(0, agent.nsteps, env.num_envs):
-            observations = torch.Tensor(observations)
-            if not agent.dicrete_action:
-                actions, mus, logsigmas, sigmas = agent.choose_action(observations)
-                logp = agent.compute_logp(mus, logsigmas, sigmas, actions)
-                mus = mus.cpu().numpy()
-                sigmas = sigmas.cpu().numpy()
-                mb_mus.append(mus)
-                mb_sigmas.append(sigmas)
-            else:
-                actions, distris = agent.choose_action(observations)
-                logp = agent.compute_logp(distris, actions)
-                distris = distris.cpu().numpy()
-                mb_distris.append(distris)
-            observations = observations.cpu().numpy()
-            actions  = actions.cpu().numpy()
-            logp = logp.cpu().numpy()
-            observations_, rewards, dones, infos = env.step(actions)
-
-            mb_obs.append(observations)
-            mb_actions.append(actions)
-            mb_logpacs.append(logp)
-            mb_dones.append(dones.astype(np.uint8))
-            mb_rewards.append(rewards)
-            mb_obs_.append(observations_)
-
-            for e, info in enumerate(infos):
-                if dones[e]:
-                    epinfos.append(info.get('episode'))
-                    observations_[e] = info.get('new_obs')
-
-            observations = observations_
-
+        with timer('collect'):
+            _, epinfos, _ = collector.collect(pg_policy_fn(agent))
+            agent.store_transition(collector.transition())
         epinfobuf.extend(epinfos)
 
-        # make all final states marked by done, preventing wrong estimating of returns and advantages.
-        # done flag:
-        #      0: undone and not the final state
-        #      1: realdone
-        #      2: undone but the final state
-        mb_dones[-1][np.where(mb_dones[-1] == 0)] = 2
-
-        def reshape_data(arr):
-            s = arr.shape
-            return arr.swapaxes(0, 1).reshape(s[0] * s[1], *s[2:])
-        mb_obs = reshape_data(np.asarray(mb_obs, dtype=np.float32))
-        mb_rewards = reshape_data(np.asarray(mb_rewards, dtype=np.float32))
-        mb_actions = reshape_data(np.asarray(mb_actions))
-        mb_logpacs = reshape_data(np.asarray(mb_logpacs, dtype=np.float32))
-        mb_dones = reshape_data(np.asarray(mb_dones, dtype=np.uint8))
-        mb_obs_ = reshape_data(np.asarray(mb_obs_, dtype=np.float32))
-
-        assert mb_obs.ndim <= 2 and mb_rewards.ndim <= 2 and mb_actions.ndim <= 2 and \
-               mb_logpacs.ndim <= 2 and mb_dones.ndim <= 2 and mb_obs_.ndim <= 2, \
-            "databuffer only supports 1-D data's batch."
-
-        if not agent.dicrete_action:
-            mb_mus = reshape_data(np.asarray(mb_mus, dtype=np.float32))
-            mb_sigmas = reshape_data(np.asarray(mb_sigmas, dtype=np.float32))
-            assert mb_mus.ndim <= 2 and mb_sigmas.ndim <= 2, "databuffer only supports 1-D data's batch."
-        else:
-            mb_distris = reshape_data(np.asarray(mb_distris, dtype=np.float32))
-            assert mb_distris.ndim <= 2, "databuffer only supports 1-D data's batch."
-
-        # store transition
-        transition = {
-            'state': mb_obs if mb_obs.ndim == 2 else np.expand_dims(mb_obs, 1),
-            'action': mb_actions if mb_actions.ndim == 2 else np.expand_dims(mb_actions, 1),
-            'reward': mb_rewards if mb_rewards.ndim == 2 else np.expand_dims(mb_rewards, 1),
-            'next_state': mb_obs_ if mb_obs_.ndim == 2 else np.expand_dims(mb_obs_, 1),
-            'done': mb_dones if mb_dones.ndim == 2 else np.expand_dims(mb_dones, 1),
-            'logpac': mb_logpacs if mb_logpacs.ndim == 2 else np.expand_dims(mb_logpacs, 1),
-        }
-        if not agent.dicrete_action:
-            transition['mu'] = mb_mus if mb_mus.ndim == 2 else np.expand_dims(mb_mus, 1)
-            transition['sigma'] = mb_sigmas if mb_sigmas.ndim == 2 else np.expand_dims(mb_sigmas, 1)
-        else:
-            transition['distri'] = mb_distris if mb_distris.ndim == 2 else np.expand_dims(mb_distris, 1)
-        agent.store_transition(transition)
-
         # agent learning step
-        agent.learn()
+        with timer('learn'):
+            agent.learn()
 
         # training controller
         timestep_counter += agent.nsteps
         if timestep_counter >= max_timesteps:
             break
 
-        print("------------------log information------------------")
-        print("total_timesteps:".ljust(20) + str(timestep_counter))
-        print("iterations:".ljust(20) + str(agent.learn_step_counter) + " / " + str(int(total_updates)))
-        if agent.value_type is not None:
-            explained_var = explained_variance(agent.V.cpu().numpy(), agent.esti_R.cpu().numpy())
-            print("explained_var:".ljust(20) + str(explained_var))
-            logger.add_scalar("explained_var/train", explained_var, timestep_counter)
-        print("episode_len:".ljust(20) + "{:.1f}".format(np.mean([epinfo['l'] for epinfo in epinfobuf])))
-        print("episode_rew:".ljust(20) + str(np.mean([epinfo['r'] for epinfo in epinfobuf])))
-        logger.add_scalar("episode_reward/train", np.mean([epinfo['r'] for epinfo in epinfobuf]), timestep_counter)
-        print("mean_kl:".ljust(20) + str(agent.cur_kl))
-        logger.add_scalar("mean_kl/train", agent.cur_kl, timestep_counter)
-        print("policy_ent:".ljust(20) + str(agent.policy_ent))
-        logger.add_scalar("policy_ent/train", agent.policy_ent, timestep_counter)
-        print("value_loss:".ljust(20)+ str(agent.value_loss))
-        logger.add_scalar("value_loss/train", agent.value_loss, timestep_counter)
-        print("actual_imprv:".ljust(20) + "{:.3f}".format(agent.improvement))
-        logger.add_scalar("actual_imprv/train", agent.improvement, timestep_counter)
-        print("exp_imprv:".ljust(20) + "{:.3f}".format(agent.expected_improvement))
-        logger.add_scalar("exp_imprv/train", agent.expected_improvement, timestep_counter)
+        with timer('log'):
+            print("------------------log information------------------")
+            log_trpo_train(agent, logger, timestep_counter, total_updates, epinfobuf)
+            timer.dump(logger, timestep_counter)
 
     return agent
 
-
+def run_trpo_multiseed_train(env, agents, streams, max_timesteps, loggers):
+    """
+    Train the TRPO agents of N seeds together, see run_multiseed_pg_train.
+    """
+    return run_multiseed_pg_train(env, agents, streams, max_timesteps, loggers, log_trpo_train)
+
+def log_trpo_train(agent, logger, timestep_counter, total_updates, epinfobuf):
+    print("total_timesteps:".ljust(20) + str(timestep_counter))
+    print("iterations:".ljust(20) + str(agent.learn_step_counter) + " / " + str(int(total_updates)))
+    if agent.value_type is not None:
+        explained_var = explained_variance(agent.V.cpu().numpy(), agent.esti_R.cpu().numpy())
+        print("explained_var:".ljust(20) + str(explained_var))
+        logger.add_scalar("explained_var/train", explained_var, timestep_counter)
+    print("episode_len:".ljust(20) + "{:.1f}".format(np.mean([epinfo['l'] for epinfo in epinfobuf])))
+    print("episode_rew:".ljust(20) + str(np.mean([epinfo['r'] for epinfo in epinfobuf])))
+    logger.add_scalar("episode_reward/train", np.mean([epinfo['r'] for epinfo in epinfobuf]), timestep_counter)
+    print("mean_kl:".ljust(20) + str(agent.cur_kl))
+    logger.add_scalar("mean_kl/train", agent.cur_kl, timestep_counter)
+    print("policy_ent:".ljust(20) + str(agent.policy_ent))
+    logger.add_scalar("policy_ent/train", agent.policy_ent, timestep_counter)
+    print("value_loss:".ljust(20)+ str(agent.value_loss))
+    logger.add_scalar("value_loss/train", agent.value_loss, timestep_counter)
+    print("actual_imprv:".ljust(20) + "{:.3f}".format(agent.improvement))
+    logger.add_scalar("actual_imprv/train", agent.improvement, timestep_counter)
+    print("exp_imprv:".ljust(20) + "{:.3f}".format(agent.expected_improvement))
+    logger.add_scalar("exp_imprv/train", agent.expected_improvement, timestep_counter)
@@ -11,3 +11,5 @@ from .PPO import *
 from .TD3 import *
 from .HTRPO import *
 from .HPG import *
+from .rollout import *
+from .multiseed import *
@@ -24,6 +24,20 @@ DQN_CONFIG = {
     'optimizer': optim.RMSprop,
     'loss' : MSELoss,
     'batch_size': 32,
+    # the configs of the DQN family do not set them, the Q networks are built with the defaults of FCDQN.
+    'act_func': F.tanh,
+    'use_batch_norm': False,
+    # keep the replay memory as torch tensors (utils.databuffer_torch), sampled with index tensors.
+    'torch_memory': True,
+    # number of minibatches drawn at once from the torch replay memory, by one gather.
+    'replay_prefetch': 1,
+    # keep the stacked image observations (e.g. atari) once per uint8 frame in the replay memory
+    # (utils.databuffer_frames) instead of two float copies of each stack.
+    'frame_memory': False,
+    # number of transitions collected before the first update, see run_dqn_train.
+    'learn_start_step': 1000,
+    # learner updates per transition collected (i.e. per env step of each env), see run_dqn_train.
+    'replay_ratio': 0.25,
 }
 
 DDPG_CONFIG = {
@@ -46,12 +60,18 @@ DDPG_CONFIG = {
     'out_act_func': F.tanh,
     'action_bounds':1,
     'max_grad_norm': None,
+    # keep the replay memory as torch tensors (utils.databuffer_torch), sampled with index tensors.
+    'torch_memory': True,
+    # number of minibatches drawn at once from the torch replay memory, by one gather.
+    'replay_prefetch': 50,
 }
 
 TD3_CONFIG = {
     'actor_delayed_steps': 2,
     'smooth_epsilon': 0.5,
     'smooth_noise': 0.2,
+    # number of critics of the ensemble (rlnets.DDPG.FCDDPG_C_Ensemble), the targets are the minimum of their values.
+    'n_critics': 2,
 }
 
 NAF_CONFIG = {
@@ -70,6 +90,10 @@ NAF_CONFIG = {
     'max_grad_norm': 1.,
     'act_func': F.tanh,
     'using_bn': True,
+    # keep the replay memory as torch tensors (utils.databuffer_torch), sampled with index tensors.
+    'torch_memory': True,
+    # number of minibatches drawn at once from the torch replay memory, by one gather.
+    'replay_prefetch': 50,
 }
 
 PG_CONFIG = {
@@ -89,6 +113,9 @@ PG_CONFIG = {
     'iters_v': 3,
     'using_KL_estimation' : False,
     'policy_type': 'FC',
+    # the importance factors, entropy and KL divergence computed on the same samples with the same parameters
+    # share one forward pass of the policy.
+    'cache_policy_outputs': True,
 }
 PG_CONFIG['memory_size'] = PG_CONFIG['steps_per_iter']
 
@@ -97,6 +124,10 @@ NPG_CONFIG = {
     'cg_residual_tol' : 1e-10,
     'cg_damping': 1e-3,
     'max_kl_divergence':0.01,
+    # how the Fisher-vector products of the conjugate gradient are computed: 'double_backprop' | 'analytic'
+    'fvp_method': 'double_backprop',
+    # fraction of the batch, drawn once per update, on which the Fisher-vector products are estimated.
+    'fisher_subsample': 1.,
 }
 
 PPO_CONFIG = {
@@ -120,11 +151,14 @@ AdaptiveKLPPO_CONFIG['lr_v'] = AdaptiveKLPPO_CONFIG['lr']
 TRPO_CONFIG = {
     'max_search_num' : 10,
     'accept_ratio' : .1,
-    'step_frac': .5
+    'step_frac': .5,
+    # number of step fractions of the line search evaluated by one batched forward of the policy.
+    'line_search_batch': 1,
 }
 
 HPG_CONFIG = {
     'sampled_goal_num': 10,
+    # gym space of the goals, its finite bounds are those of the goal grid. None: the achieved_goal space of the env.
     'goal_space': None,
     'per_decision': True,
     'weighted_is': True,
@@ -135,5 +169,14 @@ HPG_CONFIG = {
 HTRPO_CONFIG = {
     'KL_esti_method_for_TRPO' : 'kl2',
     'using_curiosity': False,
+    # density estimator of the curiosity goals: 'kde' (sklearn KDE refitted every iteration), 'streaming'
+    # (incrementally refitted float32 KDE) or 'grid' (histogram, for low-dimensional goals).
+    'curiosity_density': 'kde',
+    # number of samples scored to update the curiosity mixture and to estimate the entropies. None: the default of
+    # the estimator, all the KDE samples for 'kde' and 1000 otherwise.
+    'curiosity_score_samples': None,
     'using_hgf_goals' : True,
+    # the farthest point sampling of the hgf subgoals updates the distances through a KD-tree when there are at
+    # least this many candidate subgoals. None: never.
+    'fps_kdtree_min_size': 10000,
 }
\ No newline at end of file
@@ -0,0 +1,188 @@
+import copy
+import random
+from collections import deque
+import numpy as np
+import torch
+
+from .rollout import RolloutCollector, PhaseTimer, pg_step_outputs
+
+class RNGStream(object):
+    """
+    The random number generator states of one seed (torch, numpy and random), swapped into the global generators
+    while the code of this seed runs. Several agents trained in one process then draw from independent streams,
+    as they would in separate processes started with their own seeds.
+
+        stream = RNGStream(seed)
+        with stream:
+            agent = PPO_Gaussian(config)
+
+    :param seed: (int) the seed of the stream.
+    """
+    def __init__(self, seed):
+        self.seed = seed
+        outer = self._get_states()
+        torch.manual_seed(seed)
+        np.random.seed(seed)
+        random.seed(seed)
+        self.states = self._get_states()
+        self._set_states(outer)
+        self._outer = None
+
+    @staticmethod
+    def _get_states():
+        cuda_states = torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None
+        return torch.get_rng_state(), cuda_states, np.random.get_state(), random.getstate()
+
+    @staticmethod
+    def _set_states(states):
+        torch_state, cuda_states, np_state, random_state = states
+        torch.set_rng_state(torch_state)
+        if cuda_states is not None:
+            torch.cuda.set_rng_state_all(cuda_states)
+        np.random.set_state(np_state)
+        random.setstate(random_state)
+
+    def __enter__(self):
+        self._outer = self._get_states()
+        self._set_states(self.states)
+        return self
+
+    def __exit__(self, *exc):
+        self.states = self._get_states()
+        self._set_states(self._outer)
+        return False
+
+class StackedModules(object):
+    """
+    Forward passes of N modules of the same architecture (e.g. the policies of N seeds) as one vectorized call: their
+    parameters and buffers are stacked along a first dimension of size N, and the forward of the architecture is
+    mapped over it with torch.func.vmap. The stacked tensors are copies, refresh() updates them after the modules
+    have been trained.
+
+    :param modules: ([nn.Module]) the modules.
+    """
+    def __init__(self, modules):
+        # torch.func requires torch >= 2.0, only imported by the multi-seed training.
+        from torch.func import stack_module_state
+        self.modules = modules
+        self.params, self.buffers = stack_module_state(modules)
+        for tensor in list(self.params.values()) + list(self.buffers.values()):
+            tensor.requires_grad_(False)
+        self.base = copy.deepcopy(modules[0])
+        self.base.eval()
+
+    def refresh(self):
+        with torch.no_grad():
+            for stacked, named_tensors in ((self.params, [dict(m.named_parameters()) for m in self.modules]),
+                                           (self.buffers, [dict(m.named_buffers()) for m in self.modules])):
+                for key, tensor in stacked.items():
+                    torch.stack([tensors[key] for tensors in named_tensors], out=tensor)
+
+    def __call__(self, *inputs):
+        """
+        :param inputs: (Tensor or None) N x ... batches of inputs, the i-th one given to the i-th module. None
+               inputs are passed as they are to all the modules.
+        :return: the N stacked outputs.
+        """
+        from torch.func import functional_call, vmap
+        def forward(params, buffers, *inputs):
+            return functional_call(self.base, (params, buffers), inputs)
+        in_dims = (0, 0) + tuple(None if x is None else 0 for x in inputs)
+        with torch.no_grad():
+            return vmap(forward, in_dims=in_dims)(self.params, self.buffers, *inputs)
+
+def multiseed_pg_policy_fn(agents, policies, streams):
+    """
+    Build the policy function of RolloutCollector.collect for N policy gradient agents (PG, NPG, TRPO, PPO) acting
+    on a pool of environments split into N consecutive partitions of equal size, the i-th one for the i-th agent.
+    The policy outputs of all the agents are computed by one vectorized forward pass and the actions of each agent
+    are sampled from its own RNG stream.
+
+    :param agents: ([PG]) the agents.
+    :param policies: (StackedModules) the stacked policies of the agents, refreshed here.
+    :param streams: ([RNGStream]) the RNG streams of the agents.
+    :return: (callable) see pg_policy_fn.
+    """
+    policies.refresh()
+    device = next(iter(policies.params.values())).device
+    def policy_fn(obs):
+        if isinstance(obs, dict):
+            s = torch.Tensor(obs['observation'])
+            other_data = torch.Tensor(obs['desired_goal'])
+            other_data = other_data.to(device).view((len(agents), -1) + other_data.shape[1:])
+        else:
+            s = torch.Tensor(obs)
+            other_data = None
+        outputs = policies(s.to(device).view((len(agents), -1) + s.shape[1:]), other_data)
+        steps = []
+        for i, (agent, stream) in enumerate(zip(agents, streams)):
+            with stream:
+                choice = agent.sample_action(tuple(output[i] for output in outputs)
+                                             if isinstance(outputs, tuple) else outputs[i])
+            steps.append(pg_step_outputs(agent, choice))
+        return {key: np.concatenate([step[key] for step in steps]) for key in steps[0].keys()}
+    return policy_fn
+
+def seed_partitions(env, n_seeds):
+    """
+    :param env: (VecEnv) the pool of environments shared by the seeds.
+    :param n_seeds: (int) number of seeds.
+    :return: ([slice]) the consecutive envs of each seed.
+    """
+    assert env.num_envs % n_seeds == 0, "the env pool must hold the same number of envs for each seed."
+    envs_per_seed = env.num_envs // n_seeds
+    return [slice(i * envs_per_seed, (i + 1) * envs_per_seed) for i in range(n_seeds)]
+
+def run_multiseed_pg_train(env, agents, streams, max_timesteps, loggers, log_fn, schedule_fn = None):
+    """
+    Train N independent policy gradient agents of the same algorithm and config in one process, see
+    run_ppo_multiseed_train and run_trpo_multiseed_train. Each iteration, the agents roll out their own partition of
+    the env pool together, with one vectorized forward pass of their policies per step, then each agent learns from
+    its own batch with its own optimizer and RNG stream and logs to its own logger.
+
+    :param env: (VecEnv) the pool of environments, see seed_partitions.
+    :param agents: ([PG]) the agents.
+    :param streams: ([RNGStream]) the RNG streams of the agents.
+    :param max_timesteps: (int) number of transitions of each agent.
+    :param loggers: ([SummaryWriter]) the loggers of the agents.
+    :param log_fn: (callable) log_fn(agent, logger, timestep_counter, total_updates, epinfobuf) logs an iteration.
+    :param schedule_fn: (callable) schedule_fn(agent, total_updates) adjusts the agent after learning, e.g. its
+           learning rate.
+    :return: ([PG]) the trained agents.
+    """
+    timestep_counter = 0
+    nsteps = agents[0].nsteps
+    total_updates = max_timesteps // nsteps
+    partitions = seed_partitions(env, len(agents))
+    epinfobufs = [deque(maxlen=100) for _ in agents]
+
+    collector = RolloutCollector(env, nsteps * len(agents))
+    policies = StackedModules([agent.policy for agent in agents])
+    timer = PhaseTimer()
+    while(True):
+        with timer('collect'):
+            collector.collect(multiseed_pg_policy_fn(agents, policies, streams))
+        for epinfobuf, envs in zip(epinfobufs, partitions):
+            epinfobuf.extend(collector.episode_infos(envs))
+
+        # agent learning steps
+        with timer('learn'):
+            for agent, stream, envs in zip(agents, streams, partitions):
+                with stream:
+                    agent.store_transition(collector.transition(envs))
+                    agent.learn()
+
+        # training controller
+        timestep_counter += nsteps
+        if timestep_counter >= max_timesteps:
+            break
+
+        with timer('log'):
+            for agent, stream, logger, epinfobuf in zip(agents, streams, loggers, epinfobufs):
+                if schedule_fn is not None:
+                    schedule_fn(agent, total_updates)
+                print("------------------log information------------------")
+                print("seed:".ljust(20) + str(stream.seed))
+                log_fn(agent, logger, timestep_counter, total_updates, epinfobuf)
+            timer.dump(loggers, timestep_counter)
+    return agents
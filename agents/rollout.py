@@ -0,0 +1,253 @@
+import time
+from collections import OrderedDict
+import gym
+import numpy as np
+import torch
+
+from utils.vec_envs import BatchedSubprocVecEnv
+
+def pg_policy_fn(agent):
+    """
+    Build the policy function of collect_rollout for the policy gradient agents (PG, NPG, TRPO, PPO, HPG, HTRPO).
+
+    :param agent: a Gaussian or Softmax policy gradient agent.
+    :return: (callable) maps a batch of observations (or of goal dicts) to the actions, their log-likelihoods
+             and the outputs of the policy.
+    """
+    def policy_fn(obs):
+        if isinstance(obs, dict):
+            s = torch.Tensor(obs['observation'])
+            other_data = torch.Tensor(obs['desired_goal'])
+        else:
+            s = torch.Tensor(obs)
+            other_data = None
+        return pg_step_outputs(agent, agent.choose_action(s, other_data=other_data))
+    return policy_fn
+
+def pg_step_outputs(agent, choice):
+    """
+    :param agent: a Gaussian or Softmax policy gradient agent.
+    :param choice: (tuple) the actions and policy outputs returned by agent.choose_action or agent.sample_action.
+    :return: (dict) the numpy actions, their log-likelihoods and the outputs of the policy, see pg_policy_fn.
+    """
+    if not agent.dicrete_action:
+        actions, mus, logsigmas, sigmas = choice
+        logp = agent.compute_logp(mus, logsigmas, sigmas, actions)
+        outputs = {'mu': mus.cpu().numpy(), 'sigma': sigmas.cpu().numpy()}
+    else:
+        actions, distris = choice
+        logp = agent.compute_logp(distris, actions)
+        outputs = {'distri': distris.cpu().numpy()}
+    outputs['action'] = actions.cpu().numpy()
+    outputs['logpac'] = logp.cpu().numpy()
+    return outputs
+
+def split_env_groups(env, n_groups):
+    """
+    Split the environments of a vectorized env into groups that can be stepped concurrently. With a
+    BatchedSubprocVecEnv, the envs of each worker are split, so that a worker simulates a group while the actions
+    of the other groups are computed. Otherwise, the envs are split into contiguous groups.
+
+    :param env: (VecEnv) the vectorized environment.
+    :param n_groups: (int) number of groups. It is reduced if there are not enough envs (per worker).
+    :return: ([ndarray]) increasing env indices of each group.
+    """
+    unwrapped = env.unwrapped
+    envs_per_worker = unwrapped.envs_per_worker if isinstance(unwrapped, BatchedSubprocVecEnv) else env.num_envs
+    n_groups = min(max(1, n_groups), envs_per_worker)
+    groups = [[] for _ in range(n_groups)]
+    for begin in range(0, env.num_envs, envs_per_worker):
+        worker_envs = np.arange(begin, min(begin + envs_per_worker, env.num_envs))
+        for g, inds in enumerate(np.array_split(worker_envs, n_groups)):
+            groups[g].append(inds)
+    groups = [np.concatenate(inds) for inds in groups]
+    return [inds for inds in groups if inds.size > 0]
+
+def _take(obs, inds):
+    if isinstance(obs, dict):
+        return {key: value[inds] for key, value in obs.items()}
+    return obs[inds]
+
+class RolloutCollector(object):
+    """
+    Collect on-policy rollouts of a vectorized environment into preallocated buffers, which are reused across
+    iterations. The buffers are stored env-major, i.e. num_envs x T x dim with T = ceil(nsteps / num_envs), so that
+    the trajectory of each env is contiguous and the flat batch given to the agent is a view of the buffers instead
+    of a copy.
+
+    With n_groups > 1, the environments are split into groups stepped in a double-buffered way: while a group
+    steps in the worker processes (step_async), the policy computes the actions of the next group, which hides the
+    inference time behind the simulation time. With n_groups = 1, this is the usual synchronous rollout.
+
+    :param env: (VecEnv) the vectorized environment.
+    :param nsteps: (int) number of transitions collected per rollout, rounded up to a multiple of env.num_envs.
+    :param n_groups: (int) number of groups of environments.
+    """
+    def __init__(self, env, nsteps, n_groups=1):
+        self.env = env
+        self.num_envs = env.num_envs
+        self.T = int(np.ceil(nsteps / env.num_envs))
+        self.nsteps = self.T * self.num_envs
+        self.groups = split_env_groups(env, n_groups)
+        self.goal_env = isinstance(env.observation_space, gym.spaces.Dict)
+        self.buffers = {}
+        self.epinfos = []
+        self.successes = []
+        # the env index of each finished episode.
+        self.episode_envs = []
+
+    def _buffer(self, key, value):
+        """
+        Get the buffer of key, which is allocated the first time with the shape and dtype of value. Per-env scalars
+        get a trailing dimension of size 1 and floats are stored in float32.
+        """
+        if key not in self.buffers:
+            shape = value.shape[1:] if value.ndim > 1 else (1,)
+            dtype = np.float32 if value.dtype.kind == 'f' else value.dtype
+            self.buffers[key] = np.zeros((self.num_envs, self.T) + shape, dtype=dtype)
+        return self.buffers[key]
+
+    def _record(self, key, t, inds, value):
+        value = np.asarray(value)
+        buf = self._buffer(key, value)
+        buf[inds, t] = value.reshape((len(inds),) + buf.shape[2:])
+
+    def _act(self, policy_fn, t, inds, obs):
+        outputs = policy_fn(obs)
+        self._record('state', t, inds, obs['observation'] if self.goal_env else obs)
+        for key, value in outputs.items():
+            self._record(key, t, inds, value)
+        self.env.step_async(outputs['action'], inds)
+
+    def collect(self, policy_fn, step_callback=None):
+        """
+        Reset the environment and roll out the policy.
+
+        :param policy_fn: (callable) maps a batch of observations to a dict with the numpy 'action' and any other
+               per-step output to be recorded (e.g. 'logpac', 'mu', 'sigma', 'distri').
+        :param step_callback: (callable) called without argument each time all the environments have stepped, e.g.
+               to render them. It should only use the env if there is a single group.
+        :return: (dict, list, list) the rollout, with T x num_envs x dim views of the buffers for 'state',
+                 'next_state', 'reward', 'done', the outputs of policy_fn and, for goal-conditioned envs,
+                 'desired_goal' and 'achieved_goal' of the next states; the infos of the finished episodes; and
+                 their success flags. For finished episodes, 'next_state' holds the terminal observation.
+        """
+        self.epinfos = []
+        self.successes = []
+        self.episode_envs = []
+        obs = self.env.reset()
+        for inds in self.groups:
+            self._act(policy_fn, 0, inds, _take(obs, inds))
+
+        for t in range(self.T):
+            for inds in self.groups:
+                obs_, rewards, dones, infos = self.env.step_wait(inds)
+                self._record('reward', t, inds, rewards)
+                self._record('done', t, inds, dones.astype(np.uint8))
+                if self.goal_env:
+                    for key, buf_key in (('observation', 'next_state'), ('desired_goal', 'desired_goal'),
+                                         ('achieved_goal', 'achieved_goal')):
+                        self._record(buf_key, t, inds, obs_[key])
+                else:
+                    self._record('next_state', t, inds, obs_)
+                for e, info in enumerate(infos):
+                    if dones[e]:
+                        self.epinfos.append(info.get('episode'))
+                        self.successes.append(info.get('is_success'))
+                        self.episode_envs.append(inds[e])
+                        terminal_obs = info.get('terminal_observation')
+                        if self.goal_env:
+                            self.buffers['next_state'][inds[e], t] = terminal_obs['observation']
+                            self.buffers['desired_goal'][inds[e], t] = terminal_obs['desired_goal']
+                            self.buffers['achieved_goal'][inds[e], t] = terminal_obs['achieved_goal']
+                        else:
+                            self.buffers['next_state'][inds[e], t] = terminal_obs
+                if step_callback is not None and inds is self.groups[-1]:
+                    step_callback()
+                # the next actions of this group are computed while the other groups are stepping.
+                if t + 1 < self.T:
+                    self._act(policy_fn, t + 1, inds, obs_)
+
+        rollout = {key: buf.swapaxes(0, 1) for key, buf in self.buffers.items()}
+        return rollout, self.epinfos, self.successes
+
+    def flat(self, key, envs = slice(None)):
+        """
+        :param envs: (slice) contiguous envs whose trajectories are taken, all of them by default.
+        :return: (ndarray) the buffer of key as a (n_envs * T) x dim view, trajectory by trajectory.
+        """
+        buf = self.buffers[key][envs]
+        return buf.reshape((buf.shape[0] * self.T,) + buf.shape[2:])
+
+    def transition(self, envs = slice(None)):
+        """
+        Build the batch stored by the policy gradient agents from the last rollout, with flat views of the buffers.
+        The last transition of the unfinished trajectories is flagged as done, preventing wrong estimating of
+        returns and advantages. Done flags:
+             0: undone and not the final state
+             1: realdone
+             2: undone but the final state
+
+        :param envs: (slice) contiguous envs whose trajectories make the batch, all of them by default.
+        :return: (dict) the transition, with 'other_data' holding the goals for goal-conditioned envs.
+        """
+        final_dones = self.buffers['done'][envs, -1]
+        final_dones[final_dones == 0] = 2
+        transition = {key: self.flat(key, envs) for key in self.buffers.keys()
+                      if key not in ('desired_goal', 'achieved_goal')}
+        if self.goal_env:
+            transition['other_data'] = {
+                'desired_goal': self.flat('desired_goal', envs),
+                'achieved_goal': self.flat('achieved_goal', envs),
+            }
+        return transition
+
+    def episode_infos(self, envs = slice(None)):
+        """
+        :param envs: (slice) contiguous envs.
+        :return: (list) the infos of the episodes of these envs finished during the last rollout.
+        """
+        begin, end, _ = envs.indices(self.num_envs)
+        return [epinfo for epinfo, e in zip(self.epinfos, self.episode_envs) if begin <= e < end]
+
+def collect_rollout(env, policy_fn, nsteps, n_groups=1, step_callback=None):
+    """
+    Roll out the policy for nsteps transitions in total with a one-off RolloutCollector, see RolloutCollector.collect.
+    """
+    return RolloutCollector(env, nsteps, n_groups).collect(policy_fn, step_callback)
+
+class PhaseTimer(object):
+    """
+    Wall-clock time of the phases of a training iteration (e.g. collect, learn and log).
+
+        timer = PhaseTimer()
+        with timer('collect'):
+            ...
+    """
+    def __init__(self):
+        self.times = OrderedDict()
+        self._phase = None
+        self._b_t = None
+
+    def __call__(self, phase):
+        self._phase = phase
+        return self
+
+    def __enter__(self):
+        self._b_t = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.times[self._phase] = time.time() - self._b_t
+        return False
+
+    def dump(self, logger, timestep_counter):
+        """
+        Print the time of the last run of each phase and add it to the tensorboard logger (or to each logger of a
+        list). When called inside the 'log' phase, the reported log time is the one of the previous iteration.
+        """
+        loggers = logger if isinstance(logger, (list, tuple)) else [logger]
+        for phase, cost in self.times.items():
+            print((phase + "_time:").ljust(20) + "{:.3f} s".format(cost))
+            for logger in loggers:
+                logger.add_scalar("time/" + phase, cost, timestep_counter)
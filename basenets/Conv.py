@@ -3,6 +3,7 @@ from torch import nn
 from torch.autograd import Variable
 import torch.nn.functional as F
 import numpy as np
+from .IndexedRows import IndexedRows
 
 class Conv(nn.Module):
     def __init__(self,
@@ -111,10 +112,14 @@ class Conv(nn.Module):
             self.fc_layers.append(linear_layer)
 
     def forward(self,x, other_data = None):
-        assert other_data is None or isinstance(other_data, torch.Tensor)
+        assert other_data is None or isinstance(other_data, (torch.Tensor, IndexedRows))
         assert (other_data is not None and self.g_c) or not self.g_c
         if self.g_c:
-            g = other_data
+            g = other_data.dense() if isinstance(other_data, IndexedRows) else other_data
+        # the convolutional features of IndexedRows are computed once per unique image, then gathered.
+        index = None
+        if isinstance(x, IndexedRows):
+            x, index = x.table, x.index
         input_dim = x.dim()
         if input_dim == 3:
             x = x.unsqueeze(0)
@@ -124,6 +129,8 @@ class Conv(nn.Module):
             x = self.nonlinear(layer(x))
 
         x = x.reshape(x.size(0), -1)
+        if index is not None:
+            x = x[index]
         if self.g_c:
             x = torch.cat((x, g), dim = 1)
         for layernum, layer in enumerate(self.fc_layers):
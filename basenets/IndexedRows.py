@@ -0,0 +1,60 @@
+import torch
+
+class IndexedRows(object):
+    """
+    Rows of a batch stored as a table of unique rows and, for every row of the batch, the index of its row in the
+    table. In a hindsight batch, every state is repeated once per sampled subgoal and every subgoal once per state:
+    the states and the goals are stored once, and the rows are only gathered when they are needed. Indexing returns
+    the IndexedRows of the selected rows; the networks (MLP, Conv) take IndexedRows as inputs and apply their first
+    layers to the unique rows only.
+
+    :param table: (Tensor) unique rows.
+    :param index: (LongTensor) 1-D, row of the table of every row of the batch.
+    """
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @classmethod
+    def cat(cls, rows, table, index):
+        """
+        :param rows: (Tensor) dense rows, stored as they are at the beginning of the table.
+        :return: (IndexedRows) rows followed by the rows table[index].
+        """
+        n = rows.size(0)
+        return cls(torch.cat((rows, table), dim=0), torch.cat((torch.arange(n).type_as(index), index + n), dim=0))
+
+    def __getitem__(self, inds):
+        return IndexedRows(self.table, self.index[inds])
+
+    def __len__(self):
+        return self.index.size(0)
+
+    def size(self, dim = None):
+        size = self.index.size()[:1] + self.table.size()[1:]
+        return size if dim is None else size[dim]
+
+    def dense(self):
+        """
+        :return: (Tensor) the gathered rows.
+        """
+        return self.table[self.index]
+
+    def apply(self, fn):
+        """
+        Apply a row-wise function, e.g. the normalization of the observations, to the unique rows only.
+        """
+        return IndexedRows(fn(self.table), self.index)
+
+    def moments(self):
+        """
+        :return: mean, variance and number of the rows of the batch, computed from the unique rows weighted by their
+                 number of occurrences, to update a RunningMeanStd without gathering the batch.
+        """
+        counts = torch.bincount(self.index, minlength=self.table.size(0)).double()
+        table = self.table.double().reshape(self.table.size(0), -1)
+        n = counts.sum()
+        mean = torch.mv(table.t(), counts) / n
+        var = torch.mv(torch.pow(table - mean, 2).t(), counts) / n
+        shape = self.table.size()[1:]
+        return mean.reshape(shape).cpu().numpy(), var.reshape(shape).cpu().numpy(), int(n.item())
@@ -3,6 +3,7 @@ from torch import nn
 from torch.autograd import Variable
 import torch.nn.functional as F
 import numpy as np
+from .IndexedRows import IndexedRows
 
 class MLP(nn.Module):
     def __init__(self,
@@ -78,15 +79,47 @@ class MLP(nn.Module):
                 assert 0, "please specify one initializer."
             self.layers.append(linear_layer)
 
+    def indexed_input_layer(self, x, other_data = None):
+        """
+        Input layer of inputs given as IndexedRows, e.g. the states and goals of a hindsight batch. The weight is split
+        into the blocks of x and other_data, W [x, g] + b = W_x x + W_g g + b, and each block is applied to the unique
+        rows only, then gathered. The parameters are the ones of the input layer, so that any checkpoint is loaded.
+        """
+        layer = self.layers[0]
+        n_x = x.size(-1)
+        out, bias = None, layer.bias
+        for rows, weight in ((x, layer.weight[:, :n_x]), (other_data, layer.weight[:, n_x:])):
+            if rows is None:
+                continue
+            if isinstance(rows, IndexedRows):
+                # gathered by embedding, whose double backward (e.g. of the Fisher-vector products) keeps no
+                # N x n_hidden tensor, unlike index_select.
+                term = F.embedding(rows.index, F.linear(rows.table, weight, bias))
+            else:
+                term = F.linear(rows, weight, bias)
+            # the gathered term is not needed by the backward, it is summed in place.
+            out, bias = term if out is None else term.add_(out), None
+        return out
+
     def forward(self,x,other_data = None):
-        assert other_data is None or isinstance(other_data, torch.Tensor)
+        assert other_data is None or isinstance(other_data, (torch.Tensor, IndexedRows))
+        first_layer = 0
+        if isinstance(x, IndexedRows) or isinstance(other_data, IndexedRows):
+            if isinstance(self.layers[0], nn.Linear):
+                x = self.indexed_input_layer(x, other_data)
+                other_data = None
+                first_layer = 1
+            else:
+                # batch normalization needs the statistics of the gathered batch.
+                x, other_data = [rows.dense() if isinstance(rows, IndexedRows) else rows for rows in (x, other_data)]
         if other_data is not None:
             x = torch.cat((x, other_data), dim=-1)
         input_dim = x.dim()
         if input_dim == 1:
             x = x.unsqueeze(0)
         for layernum, layer in enumerate(self.layers):
-            x = layer(x)
+            if layernum >= first_layer:
+                x = layer(x)
             # the last layer
             if layernum == len(self.layers) -1 :
                 if self.outactive is not None:
@@ -0,0 +1,115 @@
+"""
+Benchmark of the double-buffered rollout of agents.rollout.RolloutCollector: the envs are split into
+--groups groups, and the policy computes the actions of a group while the other groups step in
+their worker processes. The envs of each worker (--envs_per_worker) are split among the groups, so
+that a worker simulates a group while the actions of the other one are computed.
+
+A synthetic continuous control env sleeps --step_cost seconds per step to emulate a simulator
+running on its own core. The rollouts of all group counts are first checked to be identical, with
+a deterministic policy; then a PG_Gaussian agent is timed.
+
+usage: python -m benchmarks.async_rollout [--num_envs 16] [--envs_per_worker 4] [--step_cost 0.002] [--groups 1 2]
+"""
+import argparse
+import time
+import numpy as np
+import gym
+from gym import spaces
+
+from agents import PG_Gaussian, RolloutCollector, collect_rollout, pg_policy_fn
+from utils.vec_envs import SubprocVecEnv, BatchedSubprocVecEnv
+
+class SyntheticControlEnv(gym.Env):
+    def __init__(self, n_s, n_a, step_cost, max_steps):
+        self.observation_space = spaces.Box(-np.inf, np.inf, (n_s,), np.float32)
+        self.action_space = spaces.Box(-1., 1., (n_a,), np.float32)
+        self.step_cost = step_cost
+        self.max_steps = max_steps
+        self.rng = np.random.RandomState()
+        self.proj = np.ones((n_a, n_s), dtype=np.float32) / n_a
+        self.t = 0
+        self.s = None
+
+    def seed(self, seed=None):
+        self.rng = np.random.RandomState(seed)
+        return [seed]
+
+    def reset(self):
+        self.t = 0
+        self.s = self.rng.randn(*self.observation_space.shape).astype(np.float32)
+        return self.s.copy()
+
+    def step(self, action):
+        time.sleep(self.step_cost)
+        self.t += 1
+        self.s = 0.9 * self.s + np.clip(action, -1., 1.).dot(self.proj) + \
+                 0.1 * self.rng.randn(*self.observation_space.shape).astype(np.float32)
+        reward = - float(np.square(self.s).sum())
+        return self.s.copy(), reward, self.t >= self.max_steps, {}
+
+def make_vec_env(args, step_cost):
+    def make_thunk(rank):
+        def _thunk():
+            env = SyntheticControlEnv(args.n_s, args.n_a, step_cost, args.max_steps)
+            env.seed(args.seed + rank)
+            return env
+        return _thunk
+    env_fns = [make_thunk(i) for i in range(args.num_envs)]
+    if args.envs_per_worker > 1:
+        return BatchedSubprocVecEnv(env_fns, args.envs_per_worker)
+    return SubprocVecEnv(env_fns)
+
+def check_identical(args):
+    w = np.random.RandomState(args.seed).randn(args.n_s, args.n_a).astype(np.float32)
+    def policy_fn(obs):
+        actions = np.tanh(obs.dot(w))
+        return {'action': actions, 'logpac': - np.square(actions).sum(axis=1, keepdims=True)}
+    rollouts = {}
+    for n_groups in args.groups:
+        env = make_vec_env(args, 0.)
+        rollouts[n_groups], _, _ = collect_rollout(env, policy_fn, args.nsteps, n_groups)
+        env.close()
+    ref = rollouts[args.groups[0]]
+    for n_groups, rollout in rollouts.items():
+        assert sorted(ref.keys()) == sorted(rollout.keys()), n_groups
+        for key in ref.keys():
+            assert ref[key].shape == rollout[key].shape and ref[key].dtype == rollout[key].dtype, key
+            assert np.array_equal(ref[key], rollout[key]), "{}: rollout of {} groups differs".format(key, n_groups)
+    print("rollouts identical for groups {}, keys: {}".format(args.groups, sorted(ref.keys())))
+
+def run(args):
+    check_identical(args)
+    agent = PG_Gaussian({
+        'n_states': args.n_s,
+        'n_action_dims': args.n_a,
+        'dicrete_action': False,
+        'hidden_layers': args.hidden_layers,
+        'norm_ob': False,
+        'norm_rw': False,
+    })
+    print("groups".ljust(10) + "rollout time".ljust(15) + "env-steps/sec")
+    for n_groups in args.groups:
+        env = make_vec_env(args, args.step_cost)
+        collector = RolloutCollector(env, args.nsteps, n_groups)
+        collector.collect(pg_policy_fn(agent))
+        b_t = time.time()
+        for _ in range(args.repeats):
+            collector.collect(pg_policy_fn(agent))
+        cost = (time.time() - b_t) / args.repeats
+        env.close()
+        print(str(n_groups).ljust(10) + "{:.3f} s".format(cost).ljust(15) + "{:.0f}".format(args.nsteps / cost))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='double-buffered rollout benchmark')
+    parser.add_argument('--num_envs', type=int, default=16)
+    parser.add_argument('--envs_per_worker', type=int, default=4)
+    parser.add_argument('--nsteps', type=int, default=2048)
+    parser.add_argument('--n_s', type=int, default=64)
+    parser.add_argument('--n_a', type=int, default=8)
+    parser.add_argument('--hidden_layers', type=int, nargs='+', default=[512, 512])
+    parser.add_argument('--step_cost', type=float, default=0.002, help='simulation time per env step, in seconds')
+    parser.add_argument('--max_steps', type=int, default=100)
+    parser.add_argument('--groups', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    run(parser.parse_args())
@@ -0,0 +1,84 @@
+"""
+Cost of the target updates and critics of DDPG and TD3, with the sizes of configs/DDPG_Hopperv2.py (Hopper: 11
+states, 3 actions, 400 x 300 networks, minibatches of 128):
+    soft update:  the former loop over the parameters (copy_(target * (1 - tau) + param * tau)) and the fused
+                  multi-tensor lerp of Agent.soft_update, on the actor and the critics of TD3
+    critics:      forward and backward of --n_critics separate FCDDPG_C and of one FCDDPG_C_Ensemble, whose values
+                  are first checked to match
+    TD3:          updates per second of TD3.learn() with the ensembles of --n_critics critics
+
+usage: python -m benchmarks.critic_ensemble [--n_critics 2 5 10] [--updates 100]
+"""
+import argparse
+import copy
+import time
+import numpy as np
+import torch
+
+from agents import Agent, TD3
+from rlnets.DDPG import FCDDPG_C, FCDDPG_C_Ensemble
+from configs.DDPG_Hopperv2 import DDPGconfig
+from benchmarks.databuffer_insert import make_batch
+
+def previous_soft_update(target, eval, tau):
+    for target_param, param in zip(target.parameters(), eval.parameters()):
+        target_param.data.copy_(target_param.data * (1.0 - tau) + param.data * tau)
+
+def timed(fn, n):
+    fn()
+    b_t = time.time()
+    for _ in range(n):
+        fn()
+    return (time.time() - b_t) / n
+
+def make_agent(n_critics, args):
+    config = copy.deepcopy(DDPGconfig)
+    config.update({'n_states': 11, 'n_action_dims': 3, 'dicrete_action': False, 'norm_ob': False, 'norm_rw': False,
+                   'memory_size': args.fill, 'n_critics': n_critics})
+    agent = TD3(config)
+    agent.store_transition(make_batch(args.fill, 11, 3))
+    return agent
+
+def run(args):
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    x, a = torch.randn(args.batch_size, 11), torch.rand(args.batch_size, 3) * 2 - 1
+    print("critics".ljust(9) + "soft update: loop".ljust(20) + "fused".ljust(12) + "critics: separate".ljust(20) +
+          "ensemble".ljust(12) + "TD3 updates / s")
+    for n_critics in args.n_critics:
+        agent = make_agent(n_critics, args)
+        targets, evals = [agent.t_Actor, agent.t_Critic], [agent.e_Actor, agent.e_Critic]
+        loop = timed(lambda: [previous_soft_update(t, e, agent.replace_tau) for t, e in zip(targets, evals)],
+                     args.repeats)
+        fused = timed(lambda: agent.soft_update(targets, evals, agent.replace_tau), args.repeats)
+
+        critics = [FCDDPG_C(11, 3, DDPGconfig['hidden_layers_v']) for _ in range(n_critics)]
+        ensemble = FCDDPG_C_Ensemble(n_critics, 11, 3, DDPGconfig['hidden_layers_v'])
+        for i, critic in enumerate(critics):
+            ensemble.load_critic_state_dict(i, critic.state_dict())
+        assert torch.allclose(ensemble(x, a), torch.stack([critic(x, a) for critic in critics]), atol=1e-5), \
+            "the values of the ensemble differ"
+        def separate_step():
+            for critic in critics:
+                critic.zero_grad()
+            sum(critic(x, a).mean() for critic in critics).backward()
+        def ensemble_step():
+            ensemble.zero_grad()
+            ensemble(x, a).mean(-1).mean(-1).sum().backward()
+        separate = timed(separate_step, args.repeats)
+        batched = timed(ensemble_step, args.repeats)
+
+        updates = timed(agent.learn, args.updates)
+        print(str(n_critics).ljust(9) + "{:.3f} ms".format(loop * 1e3).ljust(20) + "{:.3f} ms".format(fused * 1e3).ljust(12) +
+              "{:.3f} ms".format(separate * 1e3).ljust(20) + "{:.3f} ms".format(batched * 1e3).ljust(12) +
+              "{:.1f}".format(1. / updates))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='target update and critic ensemble benchmark')
+    parser.add_argument('--n_critics', type=int, nargs='+', default=[2, 5, 10])
+    parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument('--fill', type=int, default=10000)
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--updates', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    run(parser.parse_args())
@@ -0,0 +1,72 @@
+"""
+Per-iteration overhead of the curiosity of HTRPO (HTRPO.update_curiosity: storing the achieved and desired goals of
+the batch, fitting both density estimators and updating the curiosity mixture), with the density estimators of
+'curiosity_density':
+    kde:        sklearn KernelDensity refitted on 10000 samples every iteration, all of them scored for the mixture
+    streaming:  float32 KDE refitted incrementally, with a kept KD-tree and --score_samples scored samples
+    grid:       histogram of the goals on a grid of 0.1 cells
+on synthetic 3-D goals of FetchPush (random walks of the object drifting over the iterations, desired goals on the
+table), --steps goals per iteration. The memory of the goal buffers and the log-density of the desired goals under
+both estimators are also reported. For the grid, the achieved goals of the last batch are first checked to get the
+same keys and scores alone and among far away goals, i.e. in a query batch of another scale than the stored goals.
+
+usage: python -m benchmarks.curiosity_density [--iterations 10] [--steps 3200] [--densities kde streaming grid]
+"""
+import argparse
+import time
+from types import SimpleNamespace
+import numpy as np
+import torch
+
+from agents.HTRPO import HTRPO
+
+class NullLogger(object):
+    def add_scalar(self, *args, **kwargs):
+        pass
+
+def goals_batch(rng, it, steps, T = 50):
+    n_e = steps // T
+    start = np.array([1.3, 0.75, 0.42]) + 0.01 * it
+    ag = start + np.cumsum(0.005 * rng.randn(n_e, T, 3), axis=1)
+    dg = np.repeat(start + np.concatenate((0.15 * rng.rand(n_e, 1, 2) - 0.075, np.zeros((n_e, 1, 1))), axis=-1),
+                   T, axis=1)
+    return torch.Tensor(ag.reshape(-1, 3)), torch.Tensor(dg.reshape(-1, 3))
+
+def run(args):
+    print("density".ljust(12) + "iteration".ljust(14) + "max".ljust(12) + "buffers".ljust(12) + "mean log p_dg(dg)".ljust(20) +
+          "mean log p_ag(dg)".ljust(20) + "alpha")
+    for density in args.densities:
+        rng = np.random.RandomState(args.seed)
+        np.random.seed(args.seed)
+        agent = SimpleNamespace()
+        HTRPO._init_density_estimators(agent, NullLogger(), density, args.score_samples)
+        costs = []
+        for it in range(args.iterations):
+            agent.achieved_goal, agent.desired_goal = goals_batch(rng, it, args.steps)
+            b_t = time.time()
+            HTRPO.update_curiosity(agent)
+            costs.append(time.time() - b_t)
+        if density == 'grid':
+            ag = agent.achieved_goal.numpy()[::10]
+            mixed = np.concatenate((ag, 1e6 * np.ones((1, 3), dtype=ag.dtype)))
+            grid = agent.ag_kde.grid
+            assert np.array_equal(grid.keys(ag)[1], grid.keys(mixed)[1][:-1]), "grid: the keys of the goals differ"
+            assert np.array_equal(agent.ag_kde.evaluate_log_density(ag),
+                                  agent.ag_kde.evaluate_log_density(mixed)[:-1]), "grid: the scores of the goals differ"
+        memory = sum(kde.buffer.nbytes for kde in (agent.ag_kde, agent.dg_kde)) / 2 ** 20
+        dg = agent.desired_goal.numpy()[::10]
+        print(density.ljust(12) + "{:.4f} s".format(np.mean(costs)).ljust(14) + "{:.4f} s".format(np.max(costs)).ljust(12) +
+              "{:.1f} MB".format(memory).ljust(12) +
+              "{:.3f}".format(np.mean(agent.dg_kde.evaluate_log_density(dg))).ljust(20) +
+              "{:.3f}".format(np.mean(agent.ag_kde.evaluate_log_density(dg))).ljust(20) +
+              "{:.3f}".format(agent.curiosity_alpha.alpha))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='curiosity density estimation benchmark')
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--steps', type=int, default=3200)
+    parser.add_argument('--densities', nargs='+', default=['kde', 'streaming', 'grid'])
+    parser.add_argument('--score_samples', type=int, default=None,
+                        help="'curiosity_score_samples', None: the default of the estimators")
+    parser.add_argument('--seed', type=int, default=1)
+    run(parser.parse_args())
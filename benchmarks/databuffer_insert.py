@@ -0,0 +1,51 @@
+"""
+Micro-benchmark of utils.databuffer insertion cost at different fill levels.
+
+The buffer is configured like the DDPG/TD3/NAF replay memory (1e6 transitions) and receives
+batches of steps_per_iter = 50 transitions. With the circular storage the cost per insert
+should stay flat from an almost empty buffer to a full, wrapping one.
+
+usage: python -m benchmarks.databuffer_insert [--n_states 17] [--n_action_dims 6]
+"""
+import argparse
+import time
+import numpy as np
+
+from utils.databuffer import databuffer
+
+def make_batch(n, n_states, n_action_dims):
+    return {
+        'state': np.random.randn(n, n_states).astype(np.float32),
+        'action': np.random.randn(n, n_action_dims).astype(np.float32),
+        'reward': np.random.randn(n, 1).astype(np.float32),
+        'next_state': np.random.randn(n, n_states).astype(np.float32),
+        'done': np.zeros((n, 1), dtype=np.uint8),
+    }
+
+def run(args):
+    memory = databuffer({
+        'memory_size': args.memory_size,
+        'n_states': args.n_states,
+        'n_action_dims': args.n_action_dims,
+        'dicrete_action': False,
+    })
+    batch = make_batch(args.batch_size, args.n_states, args.n_action_dims)
+    print("fill level".ljust(15) + "us / insert")
+    for fill in (0.01, 0.1, 0.5, 0.99, 1.5):
+        # fill the buffer up to the target level (beyond 1.0 the cursor has wrapped around).
+        while memory.mem_c < fill * args.memory_size:
+            memory.store_transition(batch)
+        b_t = time.time()
+        for _ in range(args.repeats):
+            memory.store_transition(batch)
+        cost = (time.time() - b_t) / args.repeats * 1e6
+        print("{:.2f}".format(fill).ljust(15) + "{:.2f}".format(cost))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='databuffer insertion benchmark')
+    parser.add_argument('--memory_size', type=int, default=int(1e6))
+    parser.add_argument('--batch_size', type=int, default=50)
+    parser.add_argument('--n_states', type=int, default=17)
+    parser.add_argument('--n_action_dims', type=int, default=6)
+    parser.add_argument('--repeats', type=int, default=1000)
+    run(parser.parse_args())
@@ -0,0 +1,119 @@
+"""
+Correctness check and benchmark of utils.mathutils.discount_cumsum / generalized_advantage_estimation
+against the backward loops formerly used in PG.estimate_value_with_approximator and
+PG.estimate_value_with_mc.
+
+Batches are built like the on-policy rollouts: num_envs interleaved streams of episodes with
+random lengths, the last step of every stream flagged by 2 if its episode is not finished.
+
+usage: python -m benchmarks.discounted_scan [--sizes 2000 20000 200000] [--max_ep_len 1000]
+"""
+import argparse
+import time
+import numpy as np
+import torch
+
+from utils.mathutils import discount_cumsum, generalized_advantage_estimation
+
+def make_batch(n, num_envs, max_ep_len):
+    dones = []
+    for _ in range(num_envs):
+        d = np.zeros(n // num_envs, dtype=np.float32)
+        t = np.random.randint(1, max_ep_len + 1)
+        while t <= d.shape[0]:
+            d[t - 1] = 1
+            t += np.random.randint(1, max_ep_len + 1)
+        if d[-1] == 0:
+            d[-1] = 2
+        dones.append(d)
+    dones = torch.Tensor(np.concatenate(dones)).unsqueeze(1)
+    rewards = torch.randn(dones.size(0), 1)
+    values = torch.randn(dones.size(0), 1)
+    bootstrap_values = torch.randn(int((dones == 2).sum().item()), 1)
+    return rewards, values, dones, bootstrap_values
+
+def loop_gae(r, values, done, bootstrap_values, gamma, lamb):
+    # loop of PG.estimate_value_with_approximator, with the bootstrapped values discounted by gamma.
+    done = done.clone()
+    fake_done = torch.nonzero(done.squeeze() == 2).squeeze(-1)
+    done[done == 2] = 1
+    returns = torch.zeros(r.size(0), 1).type_as(r)
+    delta = torch.zeros(r.size(0), 1).type_as(r)
+    advantages = torch.zeros(r.size(0), 1).type_as(r)
+    e_points = torch.nonzero(done.squeeze() == 1).squeeze()
+    b_points = - torch.ones(size=e_points.size()).type_as(e_points)
+    b_points[1:] = e_points[:-1]
+    ep_lens = e_points - b_points
+    max_len = torch.max(ep_lens).item()
+    uncomplete_flag = ep_lens > 0
+    delta[e_points] = r[e_points] - values[e_points]
+    if fake_done.numel() > 0:
+        delta[fake_done] += gamma * bootstrap_values
+    advantages[e_points] = delta[e_points]
+    returns[e_points] = r[e_points]
+    for i in range(1, max_len):
+        uncomplete_flag[ep_lens <= i] = 0
+        inds = (e_points - i)[uncomplete_flag]
+        delta[inds] = r[inds] + gamma * values[inds + 1] - values[inds]
+        advantages[inds] = delta[inds] + gamma * lamb * advantages[inds + 1]
+        returns[inds] = r[inds] + gamma * returns[inds + 1]
+    return returns.squeeze(), advantages.squeeze()
+
+def loop_mc(r, done, gamma):
+    # loop of PG.estimate_value_with_mc
+    returns = torch.zeros(r.size(0), 1).type_as(r)
+    e_points = torch.nonzero(done.squeeze() != 0).squeeze()
+    b_points = - torch.ones(size=e_points.size()).type_as(e_points)
+    b_points[1:] = e_points[:-1]
+    ep_lens = e_points - b_points
+    max_len = torch.max(ep_lens).item()
+    uncomplete_flag = ep_lens > 0
+    returns[e_points] = r[e_points]
+    for i in range(1, max_len):
+        uncomplete_flag[ep_lens <= i] = 0
+        inds = (e_points - i)[uncomplete_flag]
+        returns[inds] = r[inds] + gamma * returns[inds + 1]
+    return returns.squeeze()
+
+def timeit(fn, repeats):
+    fn()
+    b_t = time.time()
+    for _ in range(repeats):
+        out = fn()
+    return (time.time() - b_t) / repeats * 1e3, out
+
+def max_rel_err(ref, new):
+    return ((ref - new).abs() / (1. + ref.abs())).max().item()
+
+def run(args):
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    print("steps".ljust(10) + "loop gae".ljust(12) + "scan gae".ljust(12) +
+          "loop mc".ljust(12) + "scan mc".ljust(12) + "max rel err")
+    for n in args.sizes:
+        r, v, d, bv = make_batch(n, args.num_envs, args.max_ep_len)
+        t_loop_gae, (ret_loop, adv_loop) = timeit(
+            lambda: loop_gae(r, v, d, bv, args.gamma, args.lamb), args.repeats)
+        t_scan_gae, (ret_scan, adv_scan) = timeit(
+            lambda: generalized_advantage_estimation(r, v, d, args.gamma, args.lamb, bv), args.repeats)
+        t_loop_mc, mc_loop = timeit(lambda: loop_mc(r, d, args.gamma), args.repeats)
+        t_scan_mc, mc_scan = timeit(lambda: discount_cumsum(r, d, args.gamma), args.repeats)
+        # the float32 loops accumulate rounding errors along long episodes, check against them in float64.
+        ret_ref, adv_ref = loop_gae(r.double(), v.double(), d, bv.double(), args.gamma, args.lamb)
+        mc_ref = loop_mc(r.double(), d, args.gamma)
+        err = max(max_rel_err(ret_ref, ret_scan), max_rel_err(adv_ref, adv_scan), max_rel_err(mc_ref, mc_scan))
+        print(str(n).ljust(10) + "".join(["{:.2f} ms".format(t).ljust(12) for t in
+                                           (t_loop_gae, t_scan_gae, t_loop_mc, t_scan_mc)]) + "{:.3g}".format(err))
+        assert err < args.tol, "discounted scan does not match the loop."
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='discounted scan / GAE benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2000, 20000, 200000])
+    parser.add_argument('--num_envs', type=int, default=8)
+    parser.add_argument('--max_ep_len', type=int, default=1000)
+    parser.add_argument('--gamma', type=float, default=0.99)
+    parser.add_argument('--lamb', type=float, default=0.95)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tol', type=float, default=1e-5)
+    run(parser.parse_args())
@@ -0,0 +1,76 @@
+"""
+Throughput of DQN, DDQN and DuelingDQN with the configs of configs/*_CartPolev1.py on --num_envs CartPole envs:
+    actions:   time to choose the actions of all the envs, with one DQN.choose_action per env (a forward pass of one
+               observation and an epsilon draw each) and with one DQN.choose_actions (one forward pass, a vectorized
+               epsilon mask)
+    training:  frames (transitions collected) per second of run_dqn_train, 'replay_ratio' updates per frame
+               after 'learn_start_step' frames
+
+usage: python -m benchmarks.dqn_throughput [--num_envs 1 4 8] [--steps 8000] [--algos DQN DDQN DuelingDQN]
+"""
+import argparse
+import contextlib
+import copy
+import io
+import time
+import numpy as np
+import torch
+
+from utils.envbuilder import make_vec_env
+from agents import DQN, DDQN, DuelingDQN, run_dqn_train
+from configs.DQN_CartPolev1 import DQNconfig
+from configs.DDQN_CartPolev1 import DDQNconfig
+from configs.DuelingDQN_CartPolev1 import DuelingDQNconfig
+
+ALGOS = {'DQN': (DQN, DQNconfig), 'DDQN': (DDQN, DDQNconfig), 'DuelingDQN': (DuelingDQN, DuelingDQNconfig)}
+
+class NullLogger(object):
+    def add_scalar(self, *args, **kwargs):
+        pass
+
+def make_agent(algo, args):
+    cls, env_config = ALGOS[algo]
+    config = copy.deepcopy(env_config)
+    config.update({'norm_ob': False, 'norm_rw': False, 'replay_ratio': args.replay_ratio,
+                   'learn_start_step': args.learn_start_step})
+    with contextlib.redirect_stdout(io.StringIO()):
+        return cls(config)
+
+def timed(fn, n):
+    fn()
+    b_t = time.time()
+    for _ in range(n):
+        fn()
+    return (time.time() - b_t) / n
+
+def run(args):
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    print("algo".ljust(12) + "envs".ljust(6) + "actions: per env".ljust(20) + "batched".ljust(12) + "frames / s")
+    for algo in args.algos:
+        for num_envs in args.num_envs:
+            agent = make_agent(algo, args)
+            obs = np.random.randn(num_envs, agent.n_states).astype(np.float32)
+            per_env = timed(lambda: [agent.choose_action(o) for o in obs], args.repeats)
+            batched = timed(lambda: agent.choose_actions(obs), args.repeats)
+
+            env = make_vec_env(args.env, 'classic_control', num_envs, args.seed, envs_per_worker=num_envs)
+            b_t = time.time()
+            with contextlib.redirect_stdout(io.StringIO()):
+                run_dqn_train(env, agent, args.steps, NullLogger(), 10 ** 9)
+            cost = time.time() - b_t
+            env.close()
+            print(algo.ljust(12) + str(num_envs).ljust(6) + "{:.1f} us".format(per_env * 1e6).ljust(20) +
+                  "{:.1f} us".format(batched * 1e6).ljust(12) + "{:.0f}".format(args.steps / cost))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='vectorized DQN training throughput benchmark')
+    parser.add_argument('--num_envs', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--steps', type=int, default=8000)
+    parser.add_argument('--algos', nargs='+', default=['DQN', 'DDQN', 'DuelingDQN'])
+    parser.add_argument('--env', default='CartPole-v1')
+    parser.add_argument('--replay_ratio', type=float, default=0.25)
+    parser.add_argument('--learn_start_step', type=int, default=1000)
+    parser.add_argument('--repeats', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    run(parser.parse_args())
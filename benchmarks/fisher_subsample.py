@@ -0,0 +1,101 @@
+"""
+Subsampled Fisher estimation of the TRPO-family updates ('fisher_subsample' of NPG_CONFIG): time of the natural
+gradient step (Fisher-vector product built on the subset, conjugate gradient and step size), cosine between the step
+and the step of the whole batch, and the KL divergence reached by the full step on the whole batch, compared to
+max_kl_divergence.
+
+The HTRPO policies have the sizes of configs/HTRPO_FetchPushv1.py (Gaussian, 25 states, 3-D goals, 4 actions) and
+configs/HTRPO_FlipBit8.py (softmax, 8 bits), on a synthetic hindsight batch sampled from the current policy, with
+the kl2 estimation of the KL divergence.
+
+usage: python -m benchmarks.fisher_subsample [--fractions 1 0.5 0.2 0.1 0.05] [--fetch_batch 16000]
+"""
+import argparse
+import copy
+import time
+from collections import OrderedDict
+import numpy as np
+import torch
+from torch.nn.utils.convert_parameters import parameters_to_vector
+
+from agents import HTRPO_Softmax
+from configs.HTRPO_FlipBit8 import HTRPOconfig as FlipBitconfig
+from benchmarks.fisher_vector_product import make_fetch_agent, fill_batch
+
+def make_flipbit_agent(n_bits):
+    config = copy.deepcopy(FlipBitconfig)
+    obs_space = OrderedDict([('observation', np.zeros((1, n_bits))), ('desired_goal', np.zeros((1, n_bits))),
+                             ('achieved_goal', np.zeros((1, n_bits)))])
+    config.update({'n_states': {'n_s': n_bits, 'n_g': n_bits}, 'n_action_dims': 1, 'n_actions': n_bits,
+                   'dicrete_action': True, 'norm_ob': False, 'norm_rw': False, 'other_data': obs_space,
+                   'reward_fn': None, 'max_episode_steps': n_bits, 'reward_type': 'sparse'})
+    return HTRPO_Softmax(config)
+
+def fill_discrete_batch(agent, n, n_bits):
+    agent.s = torch.randint(0, 2, (n, n_bits)).float()
+    agent.other_data = agent.goal = torch.randint(0, 2, (n, n_bits)).float()
+    with torch.no_grad():
+        distri = agent.policy(agent.s, other_data = agent.other_data)
+    agent.a = torch.multinomial(distri, 1).float()
+    agent.distri = distri
+    agent.logpac_old = agent.compute_logp(distri, agent.a).view(-1, 1)
+    agent.hratio = torch.rand(n)
+    agent.gamma_discount = agent.gamma ** torch.randint(0, n_bits, (n,)).float()
+    agent.n_traj = n // n_bits
+
+def surrogate_gradient(agent):
+    imp_fac = agent.compute_imp_fac()
+    loss = - (imp_fac * agent.gamma_discount * agent.hratio * agent.A).mean()
+    return parameters_to_vector(torch.autograd.grad(loss, agent.policy.parameters()))
+
+def natural_step(agent, g):
+    fvp = agent.fisher_vector_product_fn()
+    direc = agent.conjunction_gradient(- g, fvp)
+    shs = .5 * torch.sum(direc * fvp(direc))
+    return direc * torch.sqrt(agent.max_kl / shs)
+
+def run(args):
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    fetch = make_fetch_agent(args)
+    fill_batch(fetch, args.fetch_batch, 25, n_g = 3)
+    flipbit = make_flipbit_agent(8)
+    fill_discrete_batch(flipbit, args.flipbit_batch, 8)
+
+    print("agent".ljust(20) + "batch".ljust(8) + "fraction".ljust(10) + "step time".ljust(12) + "speedup".ljust(10) +
+          "cos".ljust(10) + "KL / max_kl")
+    for name, agent in (("HTRPO FetchPush", fetch), ("HTRPO FlipBit8", flipbit)):
+        agent.using_kl2 = True
+        agent.fvp_method = args.fvp_method
+        agent.A = torch.randn(agent.s.size(0))
+        g = surrogate_gradient(agent)
+        x = parameters_to_vector(agent.policy.parameters()).detach()
+        ref_step, ref_cost = None, None
+        for fraction in args.fractions:
+            agent.fisher_subsample = fraction
+            natural_step(agent, g)
+            steps = []
+            b_t = time.time()
+            for _ in range(args.repeats):
+                steps.append(natural_step(agent, g).detach())
+            cost = (time.time() - b_t) / args.repeats
+            if ref_step is None:
+                ref_step, ref_cost = steps[0], cost
+            cos = np.mean([(torch.dot(step, ref_step) / (torch.norm(step) * torch.norm(ref_step))).item()
+                           for step in steps])
+            with torch.no_grad():
+                kl = np.mean([agent.mean_kl_divergence(model=agent._policy_with(x + step)).item() for step in steps])
+            print(name.ljust(20) + str(agent.s.size(0)).ljust(8) + str(fraction).ljust(10) +
+                  "{:.4f} s".format(cost).ljust(12) + "{:.2f}x".format(ref_cost / cost).ljust(10) +
+                  "{:.3f}".format(cos).ljust(10) + "{:.3f}".format(kl / agent.max_kl))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='subsampled Fisher estimation benchmark')
+    parser.add_argument('--fractions', type=float, nargs='+', default=[1., 0.5, 0.2, 0.1, 0.05],
+                        help='values of fisher_subsample, the first one is the reference')
+    parser.add_argument('--fvp_method', default='double_backprop', help='double_backprop | analytic')
+    parser.add_argument('--fetch_batch', type=int, default=16000)
+    parser.add_argument('--flipbit_batch', type=int, default=16000)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    run(parser.parse_args())
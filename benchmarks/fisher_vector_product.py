@@ -0,0 +1,147 @@
+"""
+Time of the natural gradient step of NPG, TRPO and HTRPO (conjugate gradient + step size), with the Fisher-vector
+products computed:
+    rebuild:          by NPG.hessian_vector_product, which rebuilds the KL and its gradient graph at each product
+    double_backprop:  by the Hessian-vector product of the KL gradient graph built once per update
+    analytic:         by J^T M J v through the policy outputs
+
+The policies have the sizes of configs/TRPO_Hopperv2.py (Hopper: 11 states, 3 actions) and
+configs/HTRPO_FetchPushv1.py (FetchPush: 25 states, 3-D goals, 4 actions), on a synthetic batch sampled from the
+current policy, so that the Hessian of the KL is the Fisher information. The products of the three methods are
+first checked to match; then the whole learn() of NPG and TRPO is timed with each method.
+
+usage: python -m benchmarks.fisher_vector_product [--repeats 5] [--htrpo_batch 16000]
+"""
+import argparse
+import copy
+import time
+from collections import OrderedDict
+import numpy as np
+import torch
+from torch.nn.utils.convert_parameters import parameters_to_vector
+
+from agents import NPG_Gaussian, TRPO_Gaussian, HTRPO_Gaussian
+from configs.TRPO_Hopperv2 import TRPOconfig
+from configs.HTRPO_FetchPushv1 import HTRPOconfig
+
+METHODS = ('rebuild', 'double_backprop', 'analytic')
+
+def make_hopper_agent(cls, args):
+    config = copy.deepcopy(TRPOconfig)
+    config.update({'n_states': 11, 'n_action_dims': 3, 'dicrete_action': False, 'norm_ob': False,
+                   'norm_rw': False, 'iters_v': 1})
+    return cls(config)
+
+def make_fetch_agent(args):
+    config = copy.deepcopy(HTRPOconfig)
+    obs_space = OrderedDict([('observation', np.zeros((1, 25))), ('desired_goal', np.zeros((1, 3))),
+                             ('achieved_goal', np.zeros((1, 3)))])
+    config.update({'n_states': {'n_s': 25, 'n_g': 3}, 'n_action_dims': 4, 'dicrete_action': False,
+                   'norm_ob': False, 'norm_rw': False, 'other_data': obs_space, 'reward_fn': None,
+                   'max_episode_steps': 50, 'reward_type': 'sparse'})
+    return HTRPO_Gaussian(config)
+
+def fill_batch(agent, n, n_s, n_g = None):
+    """
+    Set a synthetic batch of n transitions sampled from the current policy.
+    """
+    agent.s = torch.randn(n, n_s)
+    agent.other_data = torch.randn(n, n_g) if n_g else None
+    with torch.no_grad():
+        mu, logsigma, sigma = agent.policy(agent.s, other_data = agent.other_data)
+    agent.a = torch.normal(mu, sigma)
+    agent.mu, agent.sigma = mu, sigma
+    agent.logpac_old = agent.compute_logp(mu, logsigma, sigma, agent.a).view(-1, 1)
+    if n_g:
+        agent.goal = agent.other_data
+        agent.hratio = torch.rand(n)
+        agent.gamma_discount = agent.gamma ** torch.randint(0, 50, (n,)).float()
+        agent.n_traj = n // 50
+
+def policy_gradient(agent):
+    mu, logsigma, sigma = agent.policy(agent.s, other_data = agent.other_data)
+    logp = agent.compute_logp(mu, logsigma, sigma, agent.a)
+    loss = - (torch.exp(logp - agent.logpac_old.squeeze()) * torch.randn_like(logp)).mean()
+    return parameters_to_vector(torch.autograd.grad(loss, agent.policy.parameters()))
+
+def make_fvp(agent, method):
+    if method == 'rebuild':
+        return agent.hessian_vector_product
+    agent.fvp_method = method
+    return agent.fisher_vector_product_fn()
+
+def natural_gradient_step(agent, method, g):
+    fvp = make_fvp(agent, method)
+    direc = agent.conjunction_gradient(- g, fvp)
+    shs = .5 * torch.sum(direc * fvp(direc))
+    return direc * torch.sqrt(agent.max_kl / shs)
+
+def check_products(name, agent):
+    v = torch.randn(parameters_to_vector(agent.policy.parameters()).numel())
+    products = {method: make_fvp(agent, method)(v).detach() for method in METHODS}
+    ref = products['rebuild']
+    for method, product in products.items():
+        err = (torch.norm(product - ref) / torch.norm(ref)).item()
+        assert err < 1e-3, "{}: {} product differs by {:.2e}".format(name, method, err)
+    print("{}: Fisher-vector products match".format(name))
+
+def time_step(agent, method, g, repeats):
+    natural_gradient_step(agent, method, g)
+    b_t = time.time()
+    for _ in range(repeats):
+        natural_gradient_step(agent, method, g)
+    return (time.time() - b_t) / repeats
+
+def time_learn(agent, method, batch, repeats):
+    if method == 'rebuild':
+        agent.fisher_vector_product_fn = lambda: agent.hessian_vector_product
+    else:
+        agent.fisher_vector_product_fn = lambda: type(agent).fisher_vector_product_fn(agent)
+        agent.fvp_method = method
+    costs = []
+    for _ in range(repeats):
+        agent.store_transition(batch)
+        b_t = time.time()
+        agent.learn()
+        costs.append(time.time() - b_t)
+    return np.mean(costs)
+
+def run(args):
+    torch.manual_seed(args.seed)
+    setups = []
+    for cls in (NPG_Gaussian, TRPO_Gaussian):
+        agent = make_hopper_agent(cls, args)
+        fill_batch(agent, agent.nsteps, 11)
+        setups.append(("{} Hopper".format(cls.__name__.split('_')[0]), agent))
+    agent = make_fetch_agent(args)
+    agent.using_kl2 = True
+    fill_batch(agent, args.htrpo_batch, 25, n_g = 3)
+    setups.append(("HTRPO FetchPush", agent))
+
+    print("natural gradient step (CG + step size)")
+    print("agent".ljust(20) + "batch".ljust(8) + "".join(method.ljust(18) for method in METHODS))
+    for name, agent in setups:
+        check_products(name, agent)
+        g = policy_gradient(agent)
+        costs = [time_step(agent, method, g, args.repeats) for method in METHODS]
+        print(name.ljust(20) + str(agent.s.size(0)).ljust(8) + "".join("{:.4f} s".format(c).ljust(18) for c in costs))
+
+    print("learn()")
+    print("agent".ljust(20) + "batch".ljust(8) + "".join(method.ljust(18) for method in METHODS))
+    for cls in (NPG_Gaussian, TRPO_Gaussian):
+        agent = make_hopper_agent(cls, args)
+        n = agent.nsteps
+        batch = {'state': np.random.randn(n, 11), 'action': np.random.randn(n, 3), 'reward': np.random.randn(n, 1),
+                 'next_state': np.random.randn(n, 11), 'done': (np.random.rand(n, 1) < 0.01).astype(np.uint8),
+                 'logpac': np.zeros((n, 1)), 'mu': np.zeros((n, 3)), 'sigma': np.ones((n, 3))}
+        costs = [time_learn(agent, method, batch, args.repeats) for method in METHODS]
+        print(cls.__name__.split('_')[0].ljust(20) + str(n).ljust(8) +
+              "".join("{:.4f} s".format(c).ljust(18) for c in costs))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fisher-vector product benchmark')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--htrpo_batch', type=int, default=16000,
+                        help='number of (hindsight) transitions in an HTRPO update')
+    parser.add_argument('--seed', type=int, default=1)
+    run(parser.parse_args())
@@ -0,0 +1,88 @@
+"""
+Memory and cost of the replay memory of DQN for atari observations (84 x 84 x 4 stacks of grayscale frames, as built
+by wrap_deepmind(frame_stack=True)), with the float storage of the stacked states and next states
+(utils.databuffer_torch, 'frame_memory' False) and with utils.databuffer_frames ('frame_memory' True), which keeps
+each uint8 frame once. The transitions are synthetic episodes of --num_envs envs stepped together, of random
+lengths up to --max_episode_len, starting with a stack of the repeated reset frame as FrameStack does. The stacks
+sampled from databuffer_frames are checked to be the stored ones. The memory of a buffer of 1M transitions is
+extrapolated from the bytes per transition.
+
+usage: python -m benchmarks.frame_replay [--fill 4000] [--num_envs 4] [--batch_size 32]
+"""
+import argparse
+import time
+import numpy as np
+import torch
+
+from utils import databuffer_torch, databuffer_frames
+
+def make_steps(rng, args, k = 4):
+    """
+    :return: ([dict]) the batches of transitions of the envs at each step.
+    """
+    def reset():
+        frame = rng.randint(0, 256, (84, 84, 1), dtype=np.uint8)
+        return np.concatenate([frame] * k, axis=-1), rng.randint(1, args.max_episode_len + 1)
+    envs = [reset() for _ in range(args.num_envs)]
+    steps = []
+    for _ in range(int(np.ceil(args.fill / args.num_envs))):
+        states, next_states, dones = [], [], []
+        for e, (state, steps_left) in enumerate(envs):
+            next_state = np.concatenate((state[..., 1:], rng.randint(0, 256, (84, 84, 1), dtype=np.uint8)), axis=-1)
+            states.append(state)
+            next_states.append(next_state)
+            dones.append(steps_left == 1)
+            envs[e] = reset() if steps_left == 1 else (next_state, steps_left - 1)
+        n = args.num_envs
+        steps.append({'state': np.stack(states), 'next_state': np.stack(next_states),
+                      'action': rng.randint(0, 6, (n, 1)), 'reward': rng.randn(n, 1).astype(np.float32),
+                      'done': np.array(dones, dtype=np.uint8).reshape(n, 1)})
+    return steps
+
+def nbytes(buffer):
+    tensors = [buffer.S, buffer.S_, buffer.A, buffer.R, buffer.done]
+    if isinstance(buffer, databuffer_frames):
+        tensors.append(buffer.frames)
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+def run(args):
+    rng = np.random.RandomState(args.seed)
+    torch.manual_seed(args.seed)
+    steps = make_steps(rng, args)
+    config = {'n_states': (84, 84, 4), 'n_action_dims': 1, 'n_actions': 6, 'dicrete_action': True,
+              'memory_size': args.fill, 'n_envs': args.num_envs}
+    print("memory".ljust(10) + "MB / 1k transitions".ljust(22) + "GB / 1M transitions".ljust(22) +
+          "insert us / transition".ljust(25) + "sample ms / batch")
+    for name, cls in (('float', databuffer_torch), ('frames', databuffer_frames)):
+        buffer = cls(config)
+        b_t = time.time()
+        for step in steps:
+            buffer.store_transition(step)
+        insert = (time.time() - b_t) / (len(steps) * args.num_envs)
+        b_t = time.time()
+        for _ in range(args.batches):
+            batch, index = buffer.sample_batch(args.batch_size)
+        sample = (time.time() - b_t) / args.batches
+        per_transition = nbytes(buffer) / buffer.max_size
+        print(name.ljust(10) + "{:.1f}".format(per_transition * 1e3 / 2 ** 20).ljust(22) +
+              "{:.1f}".format(per_transition * 1e6 / 2 ** 30).ljust(22) + "{:.1f}".format(insert * 1e6).ljust(25) +
+              "{:.2f}".format(sample * 1e3))
+        if cls is databuffer_frames:
+            # the transitions are stored in order, transition t of the flattened steps in slot t.
+            index = torch.arange(buffer.mem_c)
+            batch = buffer._gather(index)
+            for key in ('state', 'next_state'):
+                stored = np.concatenate([step[key] for step in steps])
+                assert np.array_equal(batch[key].numpy(), stored.astype(np.float32)), \
+                    "the rebuilt stacks differ from the stored ones"
+        del buffer
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='frame replay memory benchmark')
+    parser.add_argument('--fill', type=int, default=4000)
+    parser.add_argument('--num_envs', type=int, default=4)
+    parser.add_argument('--max_episode_len', type=int, default=200)
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--batches', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    run(parser.parse_args())
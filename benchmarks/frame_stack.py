@@ -0,0 +1,132 @@
+"""
+Cost of stacking the atari frames of --num_envs envs (84 x 84 x 1 frames, --n_stack of them, as VecFrameStack does
+on top of wrap_deepmind), per step of all the envs: the former wrapper (np.roll of the whole stacked observations,
+then a copy of the new frames) and utils.vec_envs.VecFrameStack (one frame written per env, the stacks gathered
+from the frame store), returning arrays or StackedObs (lazy, not materialised). The envs are synthetic: their
+frames are random and their episodes end at random. The observations, terminal observations and partial resets of
+both wrappers are first checked to match.
+
+usage: python -m benchmarks.frame_stack [--num_envs 8] [--n_stack 4] [--steps 2000]
+"""
+import argparse
+import time
+import numpy as np
+from gym import spaces
+
+from utils.vec_envs import VecFrameStack
+from utils.vec_envs.vec_env import VecEnv, VecEnvWrapper
+
+class SyntheticVecEnv(VecEnv):
+    def __init__(self, num_envs, max_episode_len, seed):
+        VecEnv.__init__(self, num_envs, spaces.Box(0, 255, (84, 84, 1), np.uint8), spaces.Discrete(4))
+        self.rng = np.random.RandomState(seed)
+        self.max_episode_len = max_episode_len
+        self.pool = self.rng.randint(0, 256, (64, 84, 84, 1), dtype=np.uint8)
+        self.obs = self.pool[self.rng.randint(0, 64, num_envs)]
+
+    def step_async(self, actions, indices=None):
+        pass
+
+    def step_wait(self, indices=None):
+        indices = list(self._get_indices(indices))
+        dones = self.rng.rand(len(indices)) < 1. / self.max_episode_len
+        infos = [{'terminal_observation': self.pool[self.rng.randint(0, 64)]} if done else {} for done in dones]
+        self.obs[indices] = self.pool[self.rng.randint(0, 64, len(indices))]
+        return self.obs[indices].copy(), np.zeros(len(indices)), dones, infos
+
+    def reset(self, i=None):
+        indices = list(self._get_indices(i))
+        self.obs[indices] = self.pool[self.rng.randint(0, 64, len(indices))]
+        return self.obs.copy()
+
+    def close(self):
+        pass
+
+    def get_attr(self, attr_name, indices=None):
+        pass
+
+    def set_attr(self, attr_name, value, indices=None):
+        pass
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        pass
+
+    def seed(self, seed=None):
+        pass
+
+class PreviousVecFrameStack(VecEnvWrapper):
+    def __init__(self, venv, n_stack):
+        self.venv = venv
+        self.n_stack = n_stack
+        low = np.repeat(venv.observation_space.low, self.n_stack, axis=-1)
+        self.stackedobs = np.zeros((venv.num_envs,) + low.shape, low.dtype)
+        VecEnvWrapper.__init__(self, venv)
+
+    def step_wait(self, indices=None):
+        observations, rewards, dones, infos = self.venv.step_wait(indices)
+        last_ax_size = observations.shape[-1]
+        indices = list(self._get_indices(indices))
+        stackedobs = np.roll(self.stackedobs[indices], shift=-last_ax_size, axis=-1)
+        for i, done in enumerate(dones):
+            if done:
+                infos[i]['terminal_observation'] = np.concatenate(
+                    (stackedobs[i, ..., :-last_ax_size], infos[i]['terminal_observation']), axis=-1)
+                stackedobs[i] = 0
+        stackedobs[..., -observations.shape[-1]:] = observations
+        self.stackedobs[indices] = stackedobs
+        return stackedobs, rewards, dones, infos
+
+    def reset(self, i=None):
+        obs = self.venv.reset()
+        self.stackedobs[...] = 0
+        self.stackedobs[..., -obs.shape[-1]:] = obs
+        return self.stackedobs
+
+def check(args):
+    previous = PreviousVecFrameStack(SyntheticVecEnv(args.num_envs, args.max_episode_len, args.seed), args.n_stack)
+    wrapper = VecFrameStack(SyntheticVecEnv(args.num_envs, args.max_episode_len, args.seed), args.n_stack, lazy=True)
+    assert np.array_equal(previous.reset(), np.asarray(wrapper.reset())), "the reset observations differ"
+    half = list(range(0, args.num_envs, 2))
+    for t in range(args.max_episode_len * 4):
+        indices = half if t % 3 == 0 else None
+        obs_p, _, dones, infos_p = previous.step_wait(indices)
+        obs, _, _, infos = wrapper.step_wait(indices)
+        assert np.array_equal(obs_p, np.asarray(obs)), "the stacked observations differ"
+        assert np.array_equal(obs.frames[obs.index], np.moveaxis(obs_p.reshape(obs_p.shape[:-1] + (args.n_stack, 1)), -2, 1))
+        for i in np.flatnonzero(dones):
+            assert np.array_equal(infos_p[i]['terminal_observation'], infos[i]['terminal_observation']), \
+                "the terminal observations differ"
+    # partial reset: only the histories of the reset envs are cleared.
+    before = wrapper.stackedobs
+    obs = np.asarray(wrapper.reset(half))
+    rest = [e for e in range(args.num_envs) if e not in half]
+    assert np.array_equal(obs[rest], before[rest]) and not obs[half][..., :-1].any(), "partial reset failed"
+
+def timed(wrapper, args, consume):
+    wrapper.reset()
+    b_t = time.time()
+    for _ in range(args.steps):
+        wrapper.step_async(None)
+        consume(wrapper.step_wait()[0])
+    return (time.time() - b_t) / args.steps
+
+def run(args):
+    check(args)
+    setups = [('np.roll', lambda: PreviousVecFrameStack, lambda obs: obs),
+              ('frame store', lambda: VecFrameStack, lambda obs: obs),
+              ('lazy, (frames, index)', lambda: lambda venv, n: VecFrameStack(venv, n, lazy=True), lambda obs: obs),
+              ('lazy, materialised', lambda: lambda venv, n: VecFrameStack(venv, n, lazy=True), np.asarray)]
+    base = timed(SyntheticVecEnv(args.num_envs, args.max_episode_len, args.seed), args, lambda obs: obs)
+    print("wrapper".ljust(24) + "us / step of the envs (wrapper only)")
+    for name, cls, consume in setups:
+        wrapper = cls()(SyntheticVecEnv(args.num_envs, args.max_episode_len, args.seed), args.n_stack)
+        print(name.ljust(24) + "{:.1f}".format((timed(wrapper, args, consume) - base) * 1e6))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='vectorized frame stacking benchmark')
+    parser.add_argument('--num_envs', type=int, default=8)
+    parser.add_argument('--n_stack', type=int, default=4)
+    parser.add_argument('--steps', type=int, default=2000)
+    parser.add_argument('--max_episode_len', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    run(parser.parse_args())
@@ -0,0 +1,178 @@
+"""
+Memory held by the states and goals of the training batch, and peak memory (RSS) of an HTRPO update (learn()),
+with the hindsight batch stored:
+    dense:    the states, next states and goals of every (episode, subgoal, t) triple gathered into plain tensors, one
+              copy of every state per sampled subgoal, as the batch was stored before
+    indexed:  the unique states and goals stored once, with the (state, goal) index pairs (basenets.IndexedRows),
+              the input layers of the networks being applied to the unique states and goals only
+
+The agents have the configs of configs/HTRPO_FlipBit48v0.py (softmax, 48 bits) and configs/HTRPO_FetchPushv1.py
+(Gaussian, 25 states, 3-D goals), with normalized observations and returns as in main.py, on one synthetic rollout of
+steps_per_iter transitions (--fetch_steps instead of 3200 for FetchPush), and --sampled_goal_num subgoals (FlipBit48
+uses all the achieved goals, i.e. ~640 here). The sizes are reduced so that an update fits in a few GB with either
+representation, most of the peak being the graphs of the TRPO update. Every update runs in its own process,
+and the policies learned with both representations are checked to match.
+
+usage: python -m benchmarks.hindsight_memory [--setups flipbit48 fetchpush] [--sampled_goal_num 100] [--fetch_steps 1000]
+"""
+import argparse
+import copy
+import json
+import random
+import resource
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+import numpy as np
+import torch
+from torch.nn.utils.convert_parameters import parameters_to_vector
+
+from agents import HTRPO_Gaussian, HTRPO_Softmax
+from basenets.IndexedRows import IndexedRows
+from configs.HTRPO_FlipBit48v0 import HTRPOconfig as FlipBitconfig
+from configs.HTRPO_FetchPushv1 import HTRPOconfig as FetchPushconfig
+
+MODES = ('dense', 'indexed')
+
+def flipbit_reward(achieved_goal, desired_goal, info):
+    return - (np.abs(achieved_goal - desired_goal).sum(axis=-1) > 0).astype(np.float32)
+
+def fetch_reward(achieved_goal, desired_goal, info):
+    return - (np.linalg.norm(achieved_goal - desired_goal, axis=-1) > 0.05).astype(np.float32)
+
+def obs_space(n_s, n_g):
+    return OrderedDict([('observation', np.zeros((1, n_s))), ('desired_goal', np.zeros((1, n_g))),
+                        ('achieved_goal', np.zeros((1, n_g)))])
+
+def flipbit_setup(rng, args):
+    n_bits, config = 48, copy.deepcopy(FlipBitconfig)
+    config.update({'n_states': {'n_s': n_bits, 'n_g': n_bits}, 'n_action_dims': 1, 'n_actions': n_bits,
+                   'dicrete_action': True, 'norm_ob': True, 'norm_rw': True, 'other_data': obs_space(n_bits, n_bits),
+                   'reward_fn': flipbit_reward, 'max_episode_steps': n_bits, 'reward_type': 'sparse',
+                   'sampled_goal_num': args.sampled_goal_num})
+    agent = HTRPO_Softmax(config)
+    n, n_e = agent.nsteps, agent.nsteps // n_bits + 1
+    # every step flips a random bit.
+    actions = rng.randint(n_bits, size=(n_e, n_bits))
+    flips = np.zeros((n_e, n_bits, n_bits))
+    flips[np.arange(n_e)[:, None], np.arange(n_bits)[None], actions] = 1
+    init = rng.randint(2, size=(n_e, 1, n_bits))
+    bits = np.abs(init - np.cumsum(flips, axis=1) % 2)
+    s = np.concatenate((init, bits[:, :-1]), axis=1)
+    batch = {'state': s, 'next_state': bits, 'action': actions[..., None],
+             'distri': np.ones((n_e, n_bits, n_bits)) / n_bits, 'logpac': np.log(1. / n_bits) * np.ones((n_e, n_bits, 1))}
+    return agent, episodes_batch(rng, batch, n, n_bits, s, bits, flipbit_reward)
+
+def fetch_setup(rng, args):
+    n_s, n_g, n_a, T = 25, 3, 4, 50
+    config = copy.deepcopy(FetchPushconfig)
+    config.update({'n_states': {'n_s': n_s, 'n_g': n_g}, 'n_action_dims': n_a, 'dicrete_action': False,
+                   'norm_ob': True, 'norm_rw': True, 'other_data': obs_space(n_s, n_g), 'reward_fn': fetch_reward,
+                   'max_episode_steps': T, 'reward_type': 'sparse',
+                   'sampled_goal_num': args.sampled_goal_num, 'steps_per_iter': args.fetch_steps,
+                   'memory_size': args.fetch_steps})
+    agent = HTRPO_Gaussian(config)
+    n, n_e = agent.nsteps, agent.nsteps // T + 1
+    # the states and the object position move smoothly.
+    states = np.cumsum(0.05 * rng.randn(n_e, T + 1, n_s), axis=1)
+    goals = np.cumsum(0.02 * rng.randn(n_e, T + 1, n_g), axis=1)
+    actions = rng.randn(n_e, T, n_a)
+    batch = {'state': states[:, :-1], 'next_state': states[:, 1:], 'action': actions,
+             'mu': np.zeros((n_e, T, n_a)), 'sigma': np.ones((n_e, T, n_a)),
+             'logpac': - 0.5 * np.sum(np.square(actions) + np.log(2 * np.pi), axis=-1, keepdims=True)}
+    return agent, episodes_batch(rng, batch, n, T, goals[:, :-1], goals[:, 1:], fetch_reward)
+
+def episodes_batch(rng, batch, n, T, ag, ag_, reward_fn):
+    """
+    Flatten n_e x T episodes into the n first transitions of a rollout. The desired goal of an episode is the final
+    achieved goal of another one.
+    """
+    n_e = ag.shape[0]
+    dg = np.repeat(ag_[rng.permutation(n_e), -1:], T, axis=1)
+    batch['reward'] = reward_fn(ag_, dg, None)[..., None]
+    done = np.zeros((n_e, T, 1))
+    done[:, -1] = 1
+    batch['done'] = done
+    batch['other_data'] = {'desired_goal': dg, 'achieved_goal': ag}
+    flat = lambda x: x.reshape((n_e * T,) + x.shape[2:])[:n].astype(np.float32)
+    batch = {key: ({k: flat(v) for k, v in value.items()} if isinstance(value, dict) else flat(value))
+             for key, value in batch.items()}
+    batch['done'][-1] = 2
+    return batch
+
+SETUPS = {'flipbit48': flipbit_setup, 'fetchpush': fetch_setup}
+
+def current_rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+
+def batch_storage(agent):
+    """
+    :return: (float) MB held by the states, next states and goals of the training batch.
+    """
+    tensors = {}
+    for key in ('s', 's_', 'goal'):
+        rows = getattr(agent, key)
+        for t in ((rows.table, rows.index) if isinstance(rows, IndexedRows) else (rows,)):
+            tensors[t.data_ptr()] = t.nelement() * t.element_size()
+    return sum(tensors.values()) / 2 ** 20
+
+def densify(agent):
+    generate_fake_data = agent.generate_fake_data
+    def generate_dense_fake_data():
+        generate_fake_data()
+        for key in ('s', 's_', 'goal'):
+            rows = getattr(agent, key)
+            setattr(agent, key, rows.dense())
+    agent.generate_fake_data = generate_dense_fake_data
+
+def run_update(setup, mode, args):
+    rng = np.random.RandomState(args.seed)
+    torch.manual_seed(args.seed)
+    agent, batch = SETUPS[setup](rng, args)
+    if mode == 'dense':
+        densify(agent)
+    agent.store_transition(batch)
+    rss = current_rss()
+    np.random.seed(args.seed)
+    random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    b_t = time.time()
+    agent.learn()
+    cost = time.time() - b_t
+    return {'rows': agent.s.size(0), 'storage': batch_storage(agent), 'rss': rss, 'peak': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10,
+            'time': cost, 'indexed': isinstance(agent.s, IndexedRows),
+            'policy': parameters_to_vector(agent.policy.parameters()).tolist()}
+
+def run(args):
+    print("agent".ljust(12) + "mode".ljust(10) + "batch".ljust(10) + "s, s_, goal".ljust(14) + "RSS before".ljust(14) +
+          "peak RSS".ljust(14) + "learn time")
+    for setup in args.setups:
+        results = {}
+        for mode in MODES:
+            out = subprocess.run([sys.executable, '-m', 'benchmarks.hindsight_memory', '--child', setup, mode,
+                                  '--seed', str(args.seed),
+                                  '--sampled_goal_num', str(args.sampled_goal_num),
+                                  '--fetch_steps', str(args.fetch_steps)], check=True, stdout=subprocess.PIPE).stdout
+            results[mode] = res = json.loads(out.decode().strip().splitlines()[-1])
+            print(setup.ljust(12) + mode.ljust(10) + str(res['rows']).ljust(10) +
+                  "{:.1f} MB".format(res['storage']).ljust(14) + "{:.0f} MB".format(res['rss']).ljust(14) +
+                  "{:.0f} MB".format(res['peak']).ljust(14) + "{:.2f} s".format(res['time']))
+        dense, indexed = [torch.Tensor(results[mode]['policy']) for mode in MODES]
+        assert results['indexed']['indexed'] and not results['dense']['indexed']
+        assert torch.allclose(dense, indexed, atol=1e-5), "{}: the learned policies differ".format(setup)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='hindsight batch memory benchmark')
+    parser.add_argument('--setups', nargs='+', default=list(SETUPS.keys()))
+    parser.add_argument('--child', nargs=2, default=None, help='run one update: setup mode', metavar=('SETUP', 'MODE'))
+    parser.add_argument('--sampled_goal_num', type=int, default=100)
+    parser.add_argument('--fetch_steps', type=int, default=1000, help='steps_per_iter of FetchPush')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    if args.child:
+        result = run_update(args.child[0], args.child[1], args)
+        print(json.dumps(result))
+    else:
+        run(args)
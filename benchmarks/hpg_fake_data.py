@@ -0,0 +1,204 @@
+"""
+Benchmark of the hindsight data generation in HPG / HTRPO.
+
+A synthetic goal-conditioned batch (random walks on an integer grid, so that subgoals are
+achieved exactly) is fed through sample_batch / split_episode / generate_subgoals, and then
+the batched HPG.generate_fake_data is compared with the former per-episode implementation,
+which is kept here as the reference. All generated training data must match it up to float rounding.
+
+usage: python -m benchmarks.hpg_fake_data [--steps 3200] [--sampled_goal_num 100] [--discrete]
+"""
+import argparse
+import random
+import time
+import numpy as np
+import torch
+
+from agents import HPG_Gaussian, HPG_Softmax
+from basenets.IndexedRows import IndexedRows
+
+def reward_fn(achieved_goal, desired_goal, info):
+    return -(np.linalg.norm(achieved_goal - desired_goal, axis=-1) > 0.05).astype(np.float32)
+
+def make_transition(args, n_s, d_goal, n_action_dims):
+    ep_lens = []
+    while sum(ep_lens) < args.steps:
+        ep_lens.append(np.random.randint(1, args.max_steps + 1))
+    ep_lens[-1] -= sum(ep_lens) - args.steps
+    ag, done = [], []
+    for l in ep_lens:
+        ag.append(np.cumsum(np.random.randint(-1, 2, size=(l, d_goal)), axis=0))
+        d = np.zeros((l, 1), dtype=np.uint8)
+        d[-1] = np.random.randint(1, 3)
+        done.append(d)
+    ag = np.concatenate(ag).astype(np.float32)
+    transition = {
+        'state': np.random.randn(args.steps, n_s).astype(np.float32),
+        'next_state': np.random.randn(args.steps, n_s).astype(np.float32),
+        'reward': reward_fn(ag, np.zeros_like(ag), None)[:, None],
+        'done': np.concatenate(done),
+        'logpac': np.random.randn(args.steps, 1).astype(np.float32) - 2,
+        'other_data': {
+            'desired_goal': np.zeros_like(ag),
+            'achieved_goal': ag,
+        }
+    }
+    if args.discrete:
+        transition['action'] = np.random.randint(args.n_actions, size=(args.steps, 1))
+        distri = np.random.rand(args.steps, args.n_actions).astype(np.float32)
+        transition['distri'] = distri / distri.sum(axis=1, keepdims=True)
+    else:
+        transition['action'] = np.random.randn(args.steps, n_action_dims).astype(np.float32)
+        transition['mu'] = np.random.randn(args.steps, n_action_dims).astype(np.float32)
+        transition['sigma'] = np.ones((args.steps, n_action_dims), dtype=np.float32)
+    return transition
+
+def split_episodes(agent):
+    # per-episode dicts of the flat episode data, as split_episode built them before it returned offsets.
+    offsets = agent.ep_offsets.tolist()
+    return [dict({key: value[b: e] for key, value in agent.ep_data.items()}, length=e - b)
+            for b, e in zip(offsets[:-1], offsets[1:])]
+
+def reference_generate_fake_data(self):
+    # per-episode implementation, used before the batched one.
+    self.episodes = split_episodes(self)
+    self.subgoals = torch.Tensor(self.subgoals).type_as(self.s)
+    n_g = self.subgoals.shape[0]
+    h_ratios = torch.zeros(size = (len(self.episodes), n_g, self.max_steps)).type_as(self.s)
+    h_ratios_mask = torch.zeros(size = (len(self.episodes), n_g, self.max_steps)).type_as(self.s)
+    for ep in range(len(self.episodes)):
+        ep_len = self.episodes[ep]['length']
+        r_f = self.reward_fn(self.episodes[ep]['achieved_goal'].unsqueeze(0).repeat(n_g,1,1).cpu().numpy(),
+                             self.subgoals.unsqueeze(1).repeat(1,ep_len,1).cpu().numpy(), None)
+        if self.reward_type == "dense":
+            goal_dist = - r_f
+            r_f = -(goal_dist > 0.05).astype(np.float32)
+        neg_ep_inds = np.where((r_f == 0).sum(axis=-1) == 0)
+        pos_ep_inds = np.where((r_f == 0).sum(axis=-1) > 0)
+        l_f = np.argmax(r_f, axis=-1)
+        l_f += 1
+        l_f[neg_ep_inds] = ep_len
+        l_f = torch.Tensor(l_f).type_as(self.s).long()
+        mask = torch.Tensor(np.arange(1, ep_len + 1)).type_as(self.s).repeat(n_g, 1)
+        mask[mask > l_f.type_as(self.s).unsqueeze(1)] = 0
+        mask[mask > 0] = 1
+        mask[l_f == 1] = 0
+        if self.reward_type == "sparse":
+            r_f = torch.Tensor(r_f).type_as(self.r)
+            if not self.using_her_reward:
+                r_f += 1
+                r_f[range(r_f.size(0)), l_f - 1] = (self.max_steps - l_f + 1).type_as(self.r)
+                r_f[neg_ep_inds] = 0
+        else:
+            r_f = torch.Tensor(-goal_dist).type_as(self.r)
+        ret_f = torch.rand(r_f.shape).zero_().type_as(r_f)
+        ret_f[:, r_f.shape[1] - 1] = r_f[:, r_f.shape[1] - 1]
+        for t in range(r_f.shape[1]-2, -1, -1):
+            ret_f[:, t] = self.gamma * ret_f[:, t+1] + r_f[:, t]
+        d_f = self.episodes[ep]['done'].squeeze(-1).repeat(n_g, 1)
+        d_f[pos_ep_inds, l_f[pos_ep_inds] - 1] = 1
+        h_ratios_mask[ep][:,:ep_len] = mask
+        expanded_s = self.episodes[ep]['s'][:ep_len].repeat(n_g, 1)
+        expanded_g = self.subgoals.unsqueeze(1).repeat(1, ep_len, 1).reshape(-1, self.d_goal)
+        expanded_a = self.episodes[ep]['a'].repeat(n_g, 1)
+        fake_logpac, fake_outputs = self._fake_policy_outputs(expanded_s, expanded_g, expanded_a)
+        fake_logpac = fake_logpac.reshape(n_g, ep_len)
+        d_logp = fake_logpac - self.episodes[ep]['logpac_old'].repeat(n_g,1).reshape(n_g, -1)
+        h_ratio = torch.exp(d_logp.cumsum(dim=1)) + 1e-10
+        h_ratio *= mask
+        h_ratios[ep][:, :ep_len] = h_ratio
+        mask = mask.reshape(-1) > 0
+        self.s = torch.cat((self.s, expanded_s[mask]), dim=0)
+        self.s_ = torch.cat((self.s_, self.episodes[ep]['s_'].repeat(n_g, 1)[mask]), dim=0)
+        self.a = torch.cat((self.a, expanded_a[mask]), dim=0)
+        self.goal = torch.cat((self.goal, expanded_g[mask]), dim=0)
+        for key, value in fake_outputs.items():
+            setattr(self, key, torch.cat((getattr(self, key), value[mask]), dim=0))
+        self.r = torch.cat((self.r, r_f.reshape(n_g * ep_len, 1)[mask]), dim=0)
+        self.ret = torch.cat((self.ret, ret_f.reshape(n_g * ep_len, 1)[mask]), dim=0)
+        self.done = torch.cat((self.done, d_f.reshape(n_g * ep_len, 1)[mask]), dim=0)
+        self.logpac_old = torch.cat((self.logpac_old, fake_logpac.reshape(n_g * ep_len, 1)[mask]), dim=0)
+        gamma_discount = torch.pow(self.gamma, torch.Tensor(np.arange(1, ep_len + 1)).type_as(self.s)).repeat(n_g, 1)
+        self.gamma_discount = torch.cat((self.gamma_discount, gamma_discount.reshape(n_g * ep_len)[mask]), dim=0)
+        self.n_traj += n_g
+    if self.weight_is:
+        h_ratios_sum = torch.sum(h_ratios, dim=0, keepdim = True)
+        h_ratios /= h_ratios_sum
+    h_ratios_mask = h_ratios_mask.reshape(-1) > 0
+    self.hratio = torch.cat((self.hratio, h_ratios.reshape(-1)[h_ratios_mask]), dim=0)
+
+def prepare(agent, seed):
+    agent.sample_batch()
+    agent.split_episode()
+    random.seed(seed)
+    agent.generate_subgoals()
+    agent.reset_training_data()
+
+def collect(agent, keys):
+    # the states and goals of the batched data are IndexedRows.
+    return {key: (value.dense() if isinstance(value, IndexedRows) else value).clone()
+            for key, value in ((key, getattr(agent, key)) for key in keys)}
+
+def run(args):
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    n_s, d_goal, n_action_dims = 10, 2, 1 if args.discrete else 4
+    config = {
+        'n_states': {'n_s': n_s, 'n_g': d_goal},
+        'n_action_dims': n_action_dims,
+        'dicrete_action': args.discrete,
+        'n_actions': args.n_actions,
+        'reward_type': 'sparse',
+        'reward_fn': reward_fn,
+        'max_episode_steps': args.max_steps,
+        'other_data': {
+            'observation': np.zeros((1, n_s), dtype=np.float32),
+            'desired_goal': np.zeros((1, d_goal), dtype=np.float32),
+            'achieved_goal': np.zeros((1, d_goal), dtype=np.float32),
+        },
+        'norm_ob': False,
+        'norm_rw': False,
+        'steps_per_iter': args.steps,
+        'memory_size': args.steps,
+        'sampled_goal_num': args.sampled_goal_num,
+        'hidden_layers': [256, 256, 256],
+    }
+    agent = HPG_Softmax(config) if args.discrete else HPG_Gaussian(config)
+    agent.store_transition(make_transition(args, n_s, d_goal, n_action_dims))
+
+    keys = ['s', 's_', 'a', 'goal', 'r', 'ret', 'done', 'logpac_old', 'gamma_discount', 'hratio']
+    keys += ['distri'] if args.discrete else ['mu', 'sigma']
+    results = {}
+    for name, fn in (('per-episode', reference_generate_fake_data), ('batched', type(agent).generate_fake_data)):
+        cost = 0.
+        for _ in range(args.repeats):
+            prepare(agent, args.seed)
+            b_t = time.time()
+            with torch.no_grad():
+                fn(agent)
+            cost += time.time() - b_t
+        results[name] = collect(agent, keys)
+        print(name.ljust(15) + "{:.1f} ms".format(cost / args.repeats * 1e3))
+
+    print("episodes: {:d}, subgoals: {:d}, fake samples: {:d}".format(
+        agent.ep_offsets.size(0) - 1, agent.subgoals.shape[0], results['batched']['s'].size(0)))
+    for key in keys:
+        ref, new = results['per-episode'][key], results['batched'][key]
+        assert ref.size() == new.size(), "{}: {} vs {}".format(key, ref.size(), new.size())
+        valid = ~torch.isnan(ref)
+        assert torch.equal(valid, ~torch.isnan(new)), key
+        err = ((ref[valid] - new[valid]).abs() / (1. + ref[valid].abs())).max().item() if valid.any() else 0.
+        print(key.ljust(15) + "max rel err: {:.3g}".format(err))
+        assert err <= args.tol, key
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='HPG fake data generation benchmark')
+    parser.add_argument('--steps', type=int, default=3200)
+    parser.add_argument('--max_steps', type=int, default=50)
+    parser.add_argument('--sampled_goal_num', type=int, default=100)
+    parser.add_argument('--discrete', action='store_true', default=False)
+    parser.add_argument('--n_actions', type=int, default=5)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tol', type=float, default=1e-6)
+    run(parser.parse_args())
@@ -0,0 +1,80 @@
+"""
+Time of the TRPO line search (all the --max_search_num candidate steps, i.e. a rejected step) with:
+    deepcopy:   the previous object_loss, which deep copies the policy for every candidate
+    scratch:    the candidates written into a single scratch copy of the policy (line_search_batch = 1)
+    batched K:  K candidates evaluated by one vmapped forward (line_search_batch = K)
+
+The policies have the sizes of configs/TRPO_Hopperv2.py and configs/HTRPO_FetchPushv1.py, on a synthetic batch
+sampled from the current policy. The accepted steps of all the modes are first checked to be the same.
+
+usage: python -m benchmarks.line_search [--batches 1 5 10] [--repeats 5] [--htrpo_batch 16000]
+"""
+import argparse
+import contextlib
+import copy
+import io
+import time
+import torch
+from torch.nn.utils.convert_parameters import parameters_to_vector, vector_to_parameters
+
+from agents import TRPO_Gaussian
+from benchmarks.fisher_vector_product import make_hopper_agent, make_fetch_agent, fill_batch
+
+def deepcopy_object_loss(agent):
+    def object_loss(theta, model = None):
+        model = copy.deepcopy(agent.policy)
+        vector_to_parameters(theta, model.parameters())
+        imp_fac = agent.compute_imp_fac(model=model)
+        loss = - (imp_fac * agent.A).mean() - agent.entropy_weight * agent.compute_entropy(model=model)
+        curkl = agent.mean_kl_divergence(model=model)
+        return loss, curkl
+    return object_loss
+
+def search(agent, mode, x, fullstep, expected_improve_rate):
+    if mode == 'deepcopy':
+        agent.object_loss = deepcopy_object_loss(agent)
+        agent.line_search_batch = 1
+    else:
+        agent.object_loss = type(agent).object_loss.__get__(agent)
+        agent.line_search_batch = mode
+    # the progress of the line search is not printed.
+    with contextlib.redirect_stdout(io.StringIO()):
+        return agent.linear_search(x, fullstep, expected_improve_rate)
+
+def time_search(agent, mode, x, fullstep, repeats):
+    # an expected improvement that cannot be reached: all the candidates are evaluated.
+    search(agent, mode, x, fullstep, torch.tensor(1e3))
+    b_t = time.time()
+    for _ in range(repeats):
+        search(agent, mode, x, fullstep, torch.tensor(1e3))
+    return (time.time() - b_t) / repeats
+
+def run(args):
+    torch.manual_seed(args.seed)
+    hopper = make_hopper_agent(TRPO_Gaussian, args)
+    fill_batch(hopper, hopper.nsteps, 11)
+    fetch = make_fetch_agent(args)
+    fill_batch(fetch, args.htrpo_batch, 25, n_g = 3)
+    modes = ['deepcopy'] + args.batches
+    print("agent".ljust(20) + "batch".ljust(8) + "".join(
+        (mode if mode == 'deepcopy' else ('scratch' if mode == 1 else 'batched {}'.format(mode))).ljust(15)
+        for mode in modes))
+    for name, agent in (("TRPO Hopper", hopper), ("HTRPO FetchPush", fetch)):
+        agent.max_search_num = args.max_search_num
+        agent.A = torch.randn(agent.s.size(0))
+        x = parameters_to_vector(agent.policy.parameters()).detach()
+        fullstep = 1e-3 * torch.randn_like(x)
+        steps = [search(agent, mode, x, fullstep, torch.tensor(.5)) for mode in modes]
+        assert all(torch.allclose(step, steps[0]) for step in steps), "{}: line searches differ".format(name)
+        costs = [time_search(agent, mode, x, fullstep, args.repeats) for mode in modes]
+        print(name.ljust(20) + str(agent.s.size(0)).ljust(8) + "".join("{:.4f} s".format(c).ljust(15) for c in costs))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='TRPO line search benchmark')
+    parser.add_argument('--batches', type=int, nargs='+', default=[1, 5, 10],
+                        help='values of line_search_batch to time')
+    parser.add_argument('--max_search_num', type=int, default=10)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--htrpo_batch', type=int, default=16000)
+    parser.add_argument('--seed', type=int, default=1)
+    run(parser.parse_args())
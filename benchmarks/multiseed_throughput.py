@@ -0,0 +1,136 @@
+"""
+Aggregate throughput of training --num_seeds seeds of PPO, TRPO and DDPG on Pendulum (the configs of
+configs/*_Pendulumv0.py, --num_envs envs per seed), as N separate processes started together (as runexp.sh does)
+and as one process with the seeds trained together (main.py --num_seeds N): one env pool partitioned by seed and
+one vectorized forward pass of the stacked policies (or actors) per step, the seeds keeping their own optimizers,
+buffers and RNG streams. The wall-clock time includes the start of the processes (imports, env and agent
+construction). Before that, the first rollout of the seeds trained together is checked to match the rollouts of
+separate runs, up to float rounding (amplified along the trajectories by the dynamics).
+
+usage: python -m benchmarks.multiseed_throughput [--num_seeds 4] [--steps 4000] [--algos PPO TRPO DDPG]
+"""
+import argparse
+import contextlib
+import copy
+import io
+import subprocess
+import sys
+import time
+import numpy as np
+
+from utils.envbuilder import make_vec_env
+from agents import *
+from agents.multiseed import multiseed_pg_policy_fn, StackedModules
+from configs.PPO_Pendulumv0 import PPOconfig
+from configs.TRPO_Pendulumv0 import TRPOconfig
+from configs.DDPG_Pendulumv0 import DDPGconfig
+
+ALGOS = {'PPO': (PPO_Gaussian, PPOconfig), 'TRPO': (TRPO_Gaussian, TRPOconfig), 'DDPG': (DDPG, DDPGconfig)}
+
+class NullLogger(object):
+    def add_scalar(self, *args, **kwargs):
+        pass
+
+def make_config(algo, args):
+    config = copy.deepcopy(ALGOS[algo][1])
+    config.update({'n_states': 3, 'n_action_dims': 1, 'dicrete_action': False, 'norm_ob': False, 'norm_rw': False})
+    if algo == 'DDPG':
+        config.update({'steps_per_iter': 200 * args.num_envs, 'learn_start_step': 200 * args.num_envs})
+    else:
+        config.update({'steps_per_iter': 1000, 'memory_size': 1000})
+    return config
+
+def make_pool(args, seeds):
+    return make_vec_env(args.env, 'classic_control', args.num_envs * len(seeds), seeds[0],
+                        envs_per_worker=args.num_envs * len(seeds),
+                        partition_seeds=seeds if len(seeds) > 1 else None)
+
+def train(args):
+    """
+    The worker: train the seeds args.seed, ..., args.seed + args.num_seeds - 1 of args.algos[0] in this process.
+    """
+    algo = args.algos[0]
+    seeds = [args.seed + i for i in range(args.num_seeds)]
+    env = make_pool(args, seeds)
+    with contextlib.redirect_stdout(io.StringIO()):
+        if len(seeds) == 1:
+            agent = ALGOS[algo][0](make_config(algo, args))
+            if algo == 'DDPG':
+                run_ddpg_train(env, agent, args.steps, NullLogger(), 10 ** 9)
+            else:
+                {'PPO': run_ppo_train, 'TRPO': run_trpo_train}[algo](env, agent, args.steps, NullLogger())
+        else:
+            streams = [RNGStream(seed) for seed in seeds]
+            agents = []
+            for stream in streams:
+                with stream:
+                    agents.append(ALGOS[algo][0](make_config(algo, args)))
+            loggers = [NullLogger()] * len(seeds)
+            if algo == 'DDPG':
+                run_ddpg_multiseed_train(env, agents, streams, args.steps, loggers, 10 ** 9)
+            else:
+                {'PPO': run_ppo_multiseed_train, 'TRPO': run_trpo_multiseed_train}[algo](
+                    env, agents, streams, args.steps, loggers)
+    env.close()
+
+def check_rollouts(args):
+    seeds = [args.seed + i for i in range(args.num_seeds)]
+    config = make_config('PPO', args)
+    env = make_pool(args, seeds)
+    streams = [RNGStream(seed) for seed in seeds]
+    agents = []
+    for stream in streams:
+        with stream:
+            agents.append(PPO_Gaussian(config))
+    collector = RolloutCollector(env, agents[0].nsteps * len(seeds))
+    rollout, _, _ = collector.collect(multiseed_pg_policy_fn(agents, StackedModules([a.policy for a in agents]), streams))
+    env.close()
+    err = 0.
+    for i, seed in enumerate(seeds):
+        env = make_pool(args, [seed])
+        agent = PPO_Gaussian(config)
+        single, _, _ = RolloutCollector(env, agent.nsteps).collect(pg_policy_fn(agent))
+        env.close()
+        for key in ('state', 'action', 'logpac'):
+            err = max(err, np.abs(rollout[key][:, i * args.num_envs:(i + 1) * args.num_envs] - single[key]).max())
+    print("max rollout diff: {:.3g}".format(err))
+    assert err <= args.tol, "the rollouts of the seeds trained together differ by {:.3g}".format(err)
+
+def launch(args, algo, seed, num_seeds):
+    command = [sys.executable, '-m', 'benchmarks.multiseed_throughput', '--worker', '--algos', algo,
+               '--seed', str(seed), '--num_seeds', str(num_seeds), '--num_envs', str(args.num_envs),
+               '--steps', str(args.steps), '--env', args.env]
+    return subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def run(args):
+    check_rollouts(args)
+    print("algo".ljust(8) + "mode".ljust(24) + "wall time".ljust(12) + "aggregate steps / s")
+    for algo in args.algos:
+        for mode in ('separate processes', 'one process'):
+            b_t = time.time()
+            if mode == 'separate processes':
+                procs = [launch(args, algo, args.seed + i, 1) for i in range(args.num_seeds)]
+            else:
+                procs = [launch(args, algo, args.seed, args.num_seeds)]
+            for proc in procs:
+                assert proc.wait() == 0, "a training process failed"
+            cost = time.time() - b_t
+            print(algo.ljust(8) + mode.ljust(24) + "{:.1f} s".format(cost).ljust(12) +
+                  "{:.0f}".format(args.num_seeds * args.steps / cost))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='multi-seed training throughput benchmark')
+    parser.add_argument('--num_seeds', type=int, default=4)
+    parser.add_argument('--num_envs', type=int, default=2)
+    parser.add_argument('--steps', type=int, default=4000)
+    parser.add_argument('--algos', nargs='+', default=['PPO', 'TRPO', 'DDPG'])
+    parser.add_argument('--env', default='Pendulum-v1')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tol', type=float, default=1e-3)
+    parser.add_argument('--worker', action='store_true', default=False,
+                        help='train the seeds in this process, used by the benchmark itself')
+    args = parser.parse_args()
+    if args.worker:
+        train(args)
+    else:
+        run(args)
@@ -0,0 +1,81 @@
+"""
+Forward passes of the policy and time of one learn() of PG, NPG, TRPO and PPO (Hopper sizes: 11 states, 3 actions)
+and HTRPO (FetchPush sizes, the synthetic batch of benchmarks.hindsight_memory), without and with
+'cache_policy_outputs': the importance factors, entropy and KL divergence computed one after the other from the
+same parameters then share one forward pass of the policy (PG.policy_outputs). The hopper batch is a synthetic
+rollout of --steps transitions. The policies learned with and without the cache are checked to match, up to float
+rounding: the gradients flow through one shared graph instead of separate ones.
+
+usage: python -m benchmarks.policy_output_cache [--steps 2048] [--algos PG NPG TRPO PPO HTRPO]
+"""
+import argparse
+import copy
+import random
+import time
+import numpy as np
+import torch
+from torch.nn.utils.convert_parameters import parameters_to_vector
+
+from agents import PG_Gaussian, NPG_Gaussian, TRPO_Gaussian, PPO_Gaussian
+from configs.PG_Hopperv2 import PGconfig
+from configs.NPG_Hopperv2 import NPGconfig
+from configs.TRPO_Hopperv2 import TRPOconfig
+from configs.PPO_Hopperv2 import PPOconfig
+from benchmarks.hindsight_memory import fetch_setup
+
+HOPPER = {'PG': (PG_Gaussian, PGconfig), 'NPG': (NPG_Gaussian, NPGconfig), 'TRPO': (TRPO_Gaussian, TRPOconfig),
+          'PPO': (PPO_Gaussian, PPOconfig)}
+
+def hopper_setup(rng, algo, args, T = 200):
+    cls, hopper_config = HOPPER[algo]
+    n_s, n_a = 11, 3
+    config = copy.deepcopy(hopper_config)
+    config.update({'n_states': n_s, 'n_action_dims': n_a, 'dicrete_action': False, 'norm_ob': False,
+                   'norm_rw': False, 'steps_per_iter': args.steps, 'memory_size': args.steps})
+    agent = cls(config)
+    n = args.steps
+    states = np.cumsum(0.05 * rng.randn(n + 1, n_s), axis=0)
+    actions = rng.randn(n, n_a)
+    done = np.zeros((n, 1))
+    done[T - 1::T] = 1
+    done[-1] = 2
+    batch = {'state': states[:-1], 'next_state': states[1:], 'action': actions, 'reward': rng.randn(n, 1),
+             'done': done, 'mu': np.zeros((n, n_a)), 'sigma': np.ones((n, n_a)),
+             'logpac': - 0.5 * np.sum(np.square(actions) + np.log(2 * np.pi), axis=-1, keepdims=True)}
+    return agent, {key: value.astype(np.float32) for key, value in batch.items()}
+
+def run_learn(algo, cache, args):
+    rng = np.random.RandomState(args.seed)
+    torch.manual_seed(args.seed)
+    if algo == 'HTRPO':
+        args.sampled_goal_num, args.fetch_steps = 20, args.steps
+        agent, batch = fetch_setup(rng, args)
+    else:
+        agent, batch = hopper_setup(rng, algo, args)
+    agent.cache_policy_outputs = cache
+    agent.store_transition(batch)
+    np.random.seed(args.seed)
+    random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    b_t = time.time()
+    agent.learn()
+    return agent.policy_forwards, time.time() - b_t, parameters_to_vector(agent.policy.parameters()).detach()
+
+def run(args):
+    print("algo".ljust(8) + "cache".ljust(8) + "forwards".ljust(10) + "learn time".ljust(12) + "max param diff")
+    for algo in args.algos:
+        results = {}
+        for cache in (False, True):
+            forwards, cost, results[cache] = run_learn(algo, cache, args)
+            err = (results[False] - results[cache]).abs().max().item()
+            print(algo.ljust(8) + ("on" if cache else "off").ljust(8) + str(forwards).ljust(10) +
+                  "{:.3f} s".format(cost).ljust(12) + ("{:.3g}".format(err) if cache else ""))
+        assert err <= args.tol, "{}: the learned policies differ by {:.3g}".format(algo, err)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='policy output cache benchmark')
+    parser.add_argument('--steps', type=int, default=2048)
+    parser.add_argument('--algos', nargs='+', default=['PG', 'NPG', 'TRPO', 'PPO', 'HTRPO'])
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tol', type=float, default=1e-5)
+    run(parser.parse_args())
@@ -0,0 +1,81 @@
+"""
+Step throughput of the ravens Environment (ravens.environments.environment) with the two observation modes:
+    rgbd:   the color and depth images of the 3 agent cameras at each step (the default)
+    state:  the ground truth state of the robot and the objects (Environment.get_state), no camera rendered
+The episodes of --tasks are played by the oracle of the task, with the same seed in both modes, and only the env
+resets and steps are timed (the oracle renders its own camera to choose the actions). The rewards of both modes are
+checked to match, rendering having no effect on the simulation.
+Also timed: render('rgb_array') (color only, no segmentation mask, cached camera matrices) against the color image
+of a full render_camera of the same camera.
+
+usage: python -m benchmarks.ravens_obs_mode [--tasks block-insertion place-red-in-green] [--episodes 3]
+"""
+import argparse
+import time
+import numpy as np
+import pybullet as p
+
+from ravens import tasks
+from ravens.environments.environment import Environment
+
+def play(name, obs_mode, args):
+    np.random.seed(args.seed)
+    env = Environment(args.assets_root, disp=False, hz=args.hz, obs_mode=obs_mode)
+    task = tasks.names[name]()
+    task.mode = 'train'
+    env.set_task(task)
+    env.seed(args.seed)
+    agent = task.oracle(env)
+    rewards, cost, steps = [], 0., 0
+    for _ in range(args.episodes):
+        b_t = time.time()
+        obs = env.reset()
+        cost += time.time() - b_t
+        info = None
+        for _ in range(task.max_steps):
+            act = agent.act(obs, info)
+            b_t = time.time()
+            obs, reward, done, info = env.step(act)
+            cost += time.time() - b_t
+            steps += 1
+            rewards.append(reward)
+            if obs_mode == 'state':
+                assert env.observation_space.contains(obs), "the state is out of the observation space"
+            if done:
+                break
+    return env, rewards, steps / cost
+
+def timed(fn, n):
+    fn()
+    b_t = time.time()
+    for _ in range(n):
+        fn()
+    return (time.time() - b_t) / n
+
+def run(args):
+    print("task".ljust(24) + "obs_mode".ljust(10) + "env steps / s")
+    for name in args.tasks:
+        results = {}
+        for obs_mode in ('rgbd', 'state'):
+            env, rewards, steps = play(name, obs_mode, args)
+            results[obs_mode] = rewards
+            print(name.ljust(24) + obs_mode.ljust(10) + "{:.2f}".format(steps))
+        assert np.allclose(results['rgbd'], results['state']), "the rewards of both modes differ"
+
+    config = env.agent_cams[0]
+    color = env.render()
+    assert np.array_equal(color, env.render_camera(config)[0]), "render differs from render_camera"
+    full = timed(lambda: env.render_camera(config)[0], args.renders)
+    color_only = timed(env.render, args.renders)
+    print("render_camera color: {:.1f} ms, render: {:.1f} ms".format(full * 1e3, color_only * 1e3))
+    p.disconnect()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='ravens environment observation mode benchmark')
+    parser.add_argument('--tasks', nargs='+', default=['block-insertion', 'place-red-in-green'])
+    parser.add_argument('--episodes', type=int, default=3)
+    parser.add_argument('--renders', type=int, default=20)
+    parser.add_argument('--assets_root', default='ravensenvs/ravens/environments/assets')
+    parser.add_argument('--hz', type=int, default=240)
+    parser.add_argument('--seed', type=int, default=1)
+    run(parser.parse_args())
@@ -0,0 +1,66 @@
+"""
+Reset and step throughput of the ravens goal environments (myenvs.ravens: SweepPile and DragRope), with the reset
+that rebuilds the whole simulation (fast_reset False) and with the static scene built once and restored from a
+pybullet saveState (fast_reset True, see myenvs.ravens.scene_cache.SceneCacheMixin):
+    resets / s:  --resets resets in a row
+    steps / s:   env steps of random actions, in episodes of --episode_len steps (the max_episode_steps of the
+                 registered envs) each followed by a reset
+Before timing, each fast reset is checked to leave the arm at its home configuration and the same number of bodies
+in the simulation as a full reset.
+
+usage: python -m benchmarks.ravens_reset [--envs SweepPile DragRope] [--resets 50] [--steps 500]
+"""
+import argparse
+import time
+import numpy as np
+import pybullet as p
+
+from myenvs.ravens import SweepPileEnv, DragRopeEnv
+
+ENVS = {'SweepPile': SweepPileEnv, 'DragRope': DragRopeEnv}
+
+def check(env, args):
+    n_bodies = None
+    for _ in range(args.check_resets):
+        env.reset()
+        if n_bodies is None:
+            n_bodies = p.getNumBodies()
+        assert p.getNumBodies() == n_bodies, "the bodies of the previous episodes are left in the simulation"
+    if isinstance(env, SweepPileEnv):
+        joints = np.array([p.getJointState(env.ur5, i)[0] for i in env.joints])
+        assert np.abs(joints - env.homej).max() < 1e-2, "the arm is not at its home configuration after a reset"
+
+def run(args):
+    print("env".ljust(12) + "reset".ljust(10) + "resets / s".ljust(14) + "steps / s")
+    for name in args.envs:
+        for fast_reset in (False, True):
+            np.random.seed(args.seed)
+            env = ENVS[name](fast_reset=fast_reset)
+            env.seed(args.seed)
+            if fast_reset:
+                check(env, args)
+            b_t = time.time()
+            for _ in range(args.resets):
+                env.reset()
+            resets = args.resets / (time.time() - b_t)
+
+            env.reset()
+            b_t = time.time()
+            for t in range(1, args.steps + 1):
+                _, _, done, _ = env.step(env.action_space.sample())
+                if done or t % args.episode_len == 0:
+                    env.reset()
+            steps = args.steps / (time.time() - b_t)
+            print(name.ljust(12) + ("fast" if fast_reset else "full").ljust(10) + "{:.2f}".format(resets).ljust(14) +
+                  "{:.2f}".format(steps))
+            p.disconnect()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='ravens environment reset benchmark')
+    parser.add_argument('--envs', nargs='+', default=['SweepPile', 'DragRope'])
+    parser.add_argument('--resets', type=int, default=50)
+    parser.add_argument('--steps', type=int, default=500)
+    parser.add_argument('--episode_len', type=int, default=50)
+    parser.add_argument('--check_resets', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    run(parser.parse_args())
@@ -0,0 +1,68 @@
+"""
+Updates per second of DDPG with the replay memory of configs/DDPG_Hopperv2.py (Hopper: 11 states, 3 actions) and
+configs/DDPG_Pendulumv0.py (Pendulum: 3 states, 1 action), with the numpy databuffer ('torch_memory' False: one
+numpy sample, clip and copy into the agent tensors per update) and with utils.databuffer_torch ('torch_memory'
+True: 'replay_prefetch' minibatches drawn by one gather, normalized by tensor operations). The observations and
+rewards are normalized, as with 'norm_ob' and 'norm_rw'. The time of sampling alone (sample_replay_batch) is also
+reported. The replay memory holds --fill random transitions (at most its size).
+
+usage: python -m benchmarks.replay_sampling [--fill 100000] [--updates 500] [--cuda]
+"""
+import argparse
+import copy
+import time
+import numpy as np
+import torch
+
+from agents import DDPG
+from configs.DDPG_Hopperv2 import DDPGconfig as Hopperconfig
+from configs.DDPG_Pendulumv0 import DDPGconfig as Pendulumconfig
+from benchmarks.databuffer_insert import make_batch
+
+SETUPS = {'hopper': (Hopperconfig, 11, 3), 'pendulum': (Pendulumconfig, 3, 1)}
+
+def make_agent(setup, torch_memory, args):
+    env_config, n_states, n_action_dims = SETUPS[setup]
+    config = copy.deepcopy(env_config)
+    config.update({'n_states': n_states, 'n_action_dims': n_action_dims, 'dicrete_action': False,
+                   'norm_ob': True, 'norm_rw': True, 'torch_memory': torch_memory})
+    agent = DDPG(config)
+    if args.cuda:
+        agent.cuda()
+    agent.ob_mean, agent.ob_var = np.random.randn(n_states), np.random.rand(n_states) + 0.5
+    agent.rw_mean, agent.rw_var = 0., 2.
+    batch = make_batch(min(args.fill, int(agent.memory.max_size)), n_states, n_action_dims)
+    agent.store_transition(batch)
+    return agent
+
+def timed(fn, n, cuda):
+    fn()
+    if cuda:
+        torch.cuda.synchronize()
+    b_t = time.time()
+    for _ in range(n):
+        fn()
+    if cuda:
+        torch.cuda.synchronize()
+    return time.time() - b_t
+
+def run(args):
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    print("config".ljust(12) + "memory".ljust(10) + "updates / s".ljust(14) + "sampling us / batch")
+    for setup in args.setups:
+        for torch_memory in (False, True):
+            agent = make_agent(setup, torch_memory, args)
+            cost = timed(agent.learn, args.updates, args.cuda)
+            sample_cost = timed(agent.sample_replay_batch, args.updates, args.cuda)
+            print(setup.ljust(12) + ("torch" if torch_memory else "numpy").ljust(10) +
+                  "{:.1f}".format(args.updates / cost).ljust(14) + "{:.1f}".format(sample_cost / args.updates * 1e6))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='replay memory sampling benchmark')
+    parser.add_argument('--setups', nargs='+', default=['hopper', 'pendulum'])
+    parser.add_argument('--fill', type=int, default=100000)
+    parser.add_argument('--updates', type=int, default=500)
+    parser.add_argument('--cuda', action='store_true', default=False)
+    parser.add_argument('--seed', type=int, default=1)
+    run(parser.parse_args())
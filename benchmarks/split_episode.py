@@ -0,0 +1,116 @@
+"""
+Time of HPG.split_episode on a synthetic goal-conditioned batch (benchmarks.hpg_fake_data), compared with the former
+implementation, kept here as the reference: a list of per-episode dicts of slices, one validity test per episode
+(one reward_fn call on a tiled first achieved goal for HPG_Gaussian, np.unique of the rounded achieved goals for
+HPG_Softmax) and one tensor subtraction per success to rewrite the sparse rewards. The rewards, returns, hindsight
+discounts and numbers of valid episodes must match it, up to float rounding.
+
+usage: python -m benchmarks.split_episode [--steps 32000] [--max_steps 50] [--discrete]
+"""
+import argparse
+import time
+import numpy as np
+import torch
+
+from agents import HPG_Gaussian, HPG_Softmax
+from utils.mathutils import discount_cumsum
+from benchmarks.hpg_fake_data import reward_fn, make_transition
+
+def reference_split_episode(self):
+    self.n_traj = 0
+    self.n_valid_ep = 0
+    self.desired_goal = self.other_data['desired_goal']
+    self.achieved_goal = self.other_data['achieved_goal']
+    self.goal = self.desired_goal
+    self.hratio = torch.ones(self.s.size(0)).type_as(self.s)
+
+    self.episodes = []
+    endpoints = (0,) + tuple((torch.nonzero(self.done[:, 0] > 0) + 1).squeeze().cpu().numpy().tolist())
+
+    if self.reward_type == "sparse" and not self.using_her_reward:
+        self.r += 1
+        suc_poses = torch.nonzero(self.r==1)[:, 0]
+        for suc_pos in suc_poses:
+            temp = suc_pos - torch.Tensor(endpoints).type_as(self.r) + 1
+            temp = temp[temp > 0]
+            self.r[suc_pos] = self.max_steps - torch.min(temp) + 1
+
+    ret = discount_cumsum(self.r, self.done, self.gamma).unsqueeze(1)
+    policy_keys = ('distri',) if isinstance(self, HPG_Softmax) else ('mu', 'sigma')
+    for i in range(len(endpoints) - 1):
+        ep_ag = self.achieved_goal[endpoints[i]: endpoints[i + 1]].cpu().numpy()
+        if isinstance(self, HPG_Softmax):
+            self.n_valid_ep += np.unique(np.round(ep_ag, decimals=2), axis=0).shape[0] > 1
+        else:
+            virtual_desired = np.tile(np.expand_dims(ep_ag[0], axis=0), (ep_ag.shape[0], 1))
+            self.n_valid_ep += self.reward_fn(ep_ag, virtual_desired, None).min() < - 0.05
+        episode = {}
+        for key in ('s', 'a', 'r', 'done', 's_', 'logpac_old', 'desired_goal', 'achieved_goal') + policy_keys:
+            episode[key] = getattr(self, key)[endpoints[i]: endpoints[i + 1]]
+        episode['ret'] = ret[endpoints[i]: endpoints[i + 1]]
+        episode['length'] = endpoints[i + 1] - endpoints[i]
+        episode['gamma_discount'] = torch.pow(self.gamma, torch.Tensor(np.arange(episode['length'])).type_as(
+            self.s)).unsqueeze(1)
+        self.episodes.append(episode)
+
+    self.ret = torch.cat([ep['ret'] for ep in self.episodes], dim=0)
+    self.gamma_discount = torch.cat([ep['gamma_discount'].squeeze(1) for ep in self.episodes], dim=0)
+    self.n_traj += len(self.episodes)
+
+def run(args):
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    n_s, d_goal, n_action_dims = 10, 2, 1 if args.discrete else 4
+    config = {
+        'n_states': {'n_s': n_s, 'n_g': d_goal},
+        'n_action_dims': n_action_dims,
+        'dicrete_action': args.discrete,
+        'n_actions': args.n_actions,
+        'reward_type': 'sparse',
+        'reward_fn': reward_fn,
+        'max_episode_steps': args.max_steps,
+        'other_data': {
+            'observation': np.zeros((1, n_s), dtype=np.float32),
+            'desired_goal': np.zeros((1, d_goal), dtype=np.float32),
+            'achieved_goal': np.zeros((1, d_goal), dtype=np.float32),
+        },
+        'norm_ob': False,
+        'norm_rw': False,
+        'steps_per_iter': args.steps,
+        'memory_size': args.steps,
+    }
+    agent = HPG_Softmax(config) if args.discrete else HPG_Gaussian(config)
+    agent.store_transition(make_transition(args, n_s, d_goal, n_action_dims))
+
+    results = {}
+    for name, fn in (('per-episode', reference_split_episode), ('segmented', type(agent).split_episode)):
+        cost = 0.
+        for _ in range(args.repeats):
+            agent.sample_batch()
+            b_t = time.time()
+            fn(agent)
+            cost += time.time() - b_t
+        results[name] = {'r': agent.r, 'ret': agent.ret, 'gamma_discount': agent.gamma_discount,
+                         'n_valid_ep': agent.n_valid_ep, 'n_traj': agent.n_traj}
+        print(name.ljust(15) + "{:.1f} ms".format(cost / args.repeats * 1e3))
+
+    ref, new = results['per-episode'], results['segmented']
+    print("episodes: {:d}, valid: {:d}".format(new['n_traj'], new['n_valid_ep']))
+    for key in ('n_valid_ep', 'n_traj'):
+        assert ref[key] == new[key], "{}: {} vs {}".format(key, ref[key], new[key])
+    assert torch.equal(ref['r'], new['r']), 'r'
+    for key in ('ret', 'gamma_discount'):
+        err = ((ref[key] - new[key]).abs() / (1. + ref[key].abs())).max().item()
+        print(key.ljust(15) + "max rel err: {:.3g}".format(err))
+        assert err <= args.tol, key
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='HPG episode splitting benchmark')
+    parser.add_argument('--steps', type=int, default=32000)
+    parser.add_argument('--max_steps', type=int, default=50)
+    parser.add_argument('--discrete', action='store_true', default=False)
+    parser.add_argument('--n_actions', type=int, default=5)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tol', type=float, default=1e-6)
+    run(parser.parse_args())
@@ -0,0 +1,103 @@
+"""
+Time of the deduplication of --n_candidates rounded achieved goals (3-D as in FetchPush, and the 48 bits of
+FlipBit48) with np.unique(axis=0) and with the integer keys of utils.goal_grid.GoalGrid, the unique goals being
+first checked to be the same, and the cells counted by the grid over several batches to be the unique goals.
+Time of the subgoal selection of HTRPO among --n_candidates candidate achieved goals (3-D, as in FetchPush), for
+--sampled_goal_num subgoals:
+    farthest point sampling of the hgf heuristic:
+        previous:  np.delete of the candidates and of the growing distance matrix at every selection
+        exact:     utils.mathutils.farthest_point_sampling, running minimum distances
+        kdtree:    the same, with the distances updated in the balls queried from a KD-tree
+    HTRPO.generate_subgoals, with the hgf heuristic and with random subgoals.
+The subgoals selected by the three farthest point samplings are first checked to be the same.
+
+usage: python -m benchmarks.subgoal_sampling [--n_candidates 100000] [--sampled_goal_num 100]
+"""
+import argparse
+import random
+import time
+import numpy as np
+import torch
+
+from utils.mathutils import farthest_point_sampling
+from utils.goal_grid import GoalGrid
+from benchmarks.fisher_vector_product import make_fetch_agent
+
+def previous_farthest_point_sampling(subgoals, size, init_ind):
+    selected_subgoals = subgoals[init_ind:init_ind + 1]
+    subgoals = np.delete(subgoals, init_ind, axis=0)
+    dists = np.linalg.norm(np.expand_dims(selected_subgoals, axis=0) - np.expand_dims(subgoals, axis=1), axis=-1)
+    for g in range(size - 1):
+        selected_ind = np.argmax(np.min(dists, axis=1))
+        selected_subgoal = subgoals[selected_ind:selected_ind + 1]
+        selected_subgoals = np.concatenate((selected_subgoals, selected_subgoal), axis=0)
+        subgoals = np.delete(subgoals, selected_ind, axis=0)
+        dists = np.delete(dists, selected_ind, axis=0)
+        new_dist = np.linalg.norm(
+            np.expand_dims(selected_subgoal, axis=0) - np.expand_dims(subgoals, axis=1), axis=-1)
+        dists = np.concatenate((dists, new_dist), axis=1)
+    return selected_subgoals
+
+def timed(fn, repeats):
+    b_t = time.time()
+    for _ in range(repeats):
+        result = fn()
+    return result, (time.time() - b_t) / repeats
+
+def sorted_rows(x):
+    return x[np.lexsort(x.T[::-1])]
+
+def run(args):
+    np.random.seed(args.seed)
+    random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    k = args.sampled_goal_num
+    n = args.n_candidates
+
+    print("deduplication: {} goals".format(n))
+    # packed keys between the bounds of the 3-D goals, hashed keys for FlipBit48.
+    for name, goals, bounds in (('fetchpush', np.random.rand(n, 3).astype(np.float32), (0., 1.)),
+                                ('flipbit48', np.random.randint(2, size=(n, 48)).astype(np.float32), (None, None))):
+        ref, ref_cost = timed(lambda: np.unique(goals.round(decimals=2), axis=0), args.repeats)
+        (unique, keys), cost = timed(lambda: GoalGrid(2, *bounds).unique(goals), args.repeats)
+        assert np.array_equal(sorted_rows(unique), ref), "{}: the unique goals differ".format(name)
+        grid = GoalGrid(2, *bounds)
+        for batch in np.array_split(goals, 4):
+            grid.add(grid.unique(batch)[1])
+        assert grid.n_cells == unique.shape[0], "{}: the cells are counted several times".format(name)
+        print(name.ljust(20) + "np.unique {:.4f} s".format(ref_cost).ljust(22) + "grid {:.4f} s".format(cost).ljust(17) +
+              "{:.1f}x".format(ref_cost / cost).ljust(8) + "{} unique goals".format(unique.shape[0]))
+
+    # distinct candidates, as the unique rounded achieved goals of generate_subgoals.
+    candidates = np.unique(np.random.rand(args.n_candidates, 3).round(decimals=3), axis=0)
+    init_ind = np.random.randint(candidates.shape[0])
+
+    print("farthest point sampling: {} candidates, {} subgoals".format(candidates.shape[0], k))
+    results = {}
+    results['previous'], cost = timed(lambda: previous_farthest_point_sampling(candidates, k, init_ind), 1)
+    print("previous".ljust(20) + "{:.4f} s".format(cost))
+    ref_cost = cost
+    for name, using_kdtree in (('exact', False), ('kdtree', True)):
+        inds, cost = timed(lambda: farthest_point_sampling(candidates, k, init_ind, using_kdtree), args.repeats)
+        results[name] = candidates[inds]
+        print(name.ljust(20) + "{:.4f} s".format(cost).ljust(12) + "{:.1f}x".format(ref_cost / cost))
+    for name, subgoals in results.items():
+        assert np.array_equal(subgoals, results['previous']), "{}: the selected subgoals differ".format(name)
+
+    agent = make_fetch_agent(args)
+    agent.sampled_goal_num = k
+    agent.achieved_goal = torch.Tensor(np.random.rand(n, 3))
+    agent.desired_goal = torch.Tensor(np.random.rand(n, 3))
+    print("HTRPO.generate_subgoals: {} achieved goals".format(n))
+    for name, using_hgf_goals in (('hgf', True), ('random', False)):
+        agent.using_hgf_goals = using_hgf_goals
+        _, cost = timed(agent.generate_subgoals, args.repeats)
+        print(name.ljust(20) + "{:.4f} s".format(cost).ljust(12) + "{} subgoals".format(agent.subgoals.shape[0]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='subgoal sampling benchmark')
+    parser.add_argument('--n_candidates', type=int, default=100000)
+    parser.add_argument('--sampled_goal_num', type=int, default=100)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    run(parser.parse_args())
@@ -0,0 +1,123 @@
+"""
+Throughput of the vectorized environments: env-steps/sec of DummyVecEnv, of SubprocVecEnv with
+observations sent through the pipes or through shared memory, and of BatchedSubprocVecEnv with
+--envs_per_worker environments in each worker process.
+
+A synthetic environment returns Atari-like uint8 frames (or a goal dict with --dict_obs), with a
+configurable busy-wait per step to emulate the simulation cost. Before timing, the shared memory
+transport and the batched workers are checked to return exactly the same observations, rewards,
+dones and infos as the one-process-per-env pipes.
+
+usage: python -m benchmarks.vec_env_step [--num_envs 8] [--obs_shape 84 84 4] [--dict_obs] [--envs_per_worker 4]
+"""
+import argparse
+import time
+from collections import OrderedDict
+import numpy as np
+import gym
+from gym import spaces
+
+from utils.vec_envs import DummyVecEnv, SubprocVecEnv, BatchedSubprocVecEnv
+
+class SyntheticEnv(gym.Env):
+    def __init__(self, obs_shape, dict_obs, step_cost, max_steps):
+        if dict_obs:
+            self.observation_space = spaces.Dict(OrderedDict([
+                ('observation', spaces.Box(-np.inf, np.inf, tuple(obs_shape), np.float32)),
+                ('desired_goal', spaces.Box(-np.inf, np.inf, (3,), np.float32)),
+                ('achieved_goal', spaces.Box(-np.inf, np.inf, (3,), np.float32)),
+            ]))
+        else:
+            self.observation_space = spaces.Box(0, 255, tuple(obs_shape), np.uint8)
+        self.action_space = spaces.Discrete(4)
+        self.dict_obs = dict_obs
+        self.step_cost = step_cost
+        self.max_steps = max_steps
+        self.rng = np.random.RandomState()
+        self.t = 0
+
+    def seed(self, seed=None):
+        self.rng = np.random.RandomState(seed)
+        return [seed]
+
+    def _obs(self):
+        if self.dict_obs:
+            return OrderedDict([(key, self.rng.randn(*space.shape).astype(np.float32))
+                                for key, space in self.observation_space.spaces.items()])
+        return self.rng.randint(0, 256, size=self.observation_space.shape, dtype=np.uint8)
+
+    def reset(self):
+        self.t = 0
+        return self._obs()
+
+    def step(self, action):
+        b_t = time.time()
+        while time.time() - b_t < self.step_cost:
+            pass
+        self.t += 1
+        return self._obs(), self.rng.randn(), self.t >= self.max_steps, {'t': self.t}
+
+def make_env_fns(args):
+    def make_thunk(rank):
+        def _thunk():
+            env = SyntheticEnv(args.obs_shape, args.dict_obs, args.step_cost, args.max_steps)
+            env.seed(args.seed + rank)
+            return env
+        return _thunk
+    return [make_thunk(i) for i in range(args.num_envs)]
+
+def check_transport(args, make_vec_env, n_steps=50):
+    pipe = SubprocVecEnv(make_env_fns(args))
+    other = make_vec_env()
+    pipe.reset(), other.reset()
+    actions = np.zeros(args.num_envs, dtype=np.int64)
+    for _ in range(n_steps):
+        obs_p, rew_p, done_p, info_p = pipe.step(actions)
+        obs_o, rew_o, done_o, info_o = other.step(actions)
+        if args.dict_obs:
+            assert all(np.array_equal(obs_p[key], obs_o[key]) for key in obs_p.keys())
+        else:
+            assert obs_p.dtype == obs_o.dtype and np.array_equal(obs_p, obs_o)
+        assert np.allclose(rew_p, rew_o) and np.array_equal(done_p, done_o)
+        assert [info['t'] for info in info_p] == [info['t'] for info in info_o]
+    assert pipe.get_attr('t') == other.get_attr('t')
+    pipe.close()
+    other.close()
+
+def steps_per_sec(env, n_steps):
+    actions = np.zeros(env.num_envs, dtype=np.int64)
+    env.reset()
+    env.step(actions)
+    b_t = time.time()
+    for _ in range(n_steps):
+        env.step(actions)
+    cost = time.time() - b_t
+    env.close()
+    return n_steps * env.num_envs / cost
+
+def run(args):
+    k = args.envs_per_worker
+    backends = (
+        ('DummyVecEnv', lambda: DummyVecEnv(make_env_fns(args))),
+        ('Subproc (pipe)', lambda: SubprocVecEnv(make_env_fns(args))),
+        ('Subproc (shm)', lambda: SubprocVecEnv(make_env_fns(args), shared_memory=True)),
+        ('Batched K={} (pipe)'.format(k), lambda: BatchedSubprocVecEnv(make_env_fns(args), k)),
+        ('Batched K={} (shm)'.format(k), lambda: BatchedSubprocVecEnv(make_env_fns(args), k, shared_memory=True)),
+    )
+    for _, make_vec_env in backends[2:]:
+        check_transport(args, make_vec_env)
+    print("backend".ljust(25) + "env-steps/sec")
+    for name, make_vec_env in backends:
+        print(name.ljust(25) + "{:.0f}".format(steps_per_sec(make_vec_env(), args.steps)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='vectorized environment throughput benchmark')
+    parser.add_argument('--num_envs', type=int, default=8)
+    parser.add_argument('--obs_shape', type=int, nargs='+', default=[84, 84, 4])
+    parser.add_argument('--dict_obs', action='store_true', default=False)
+    parser.add_argument('--envs_per_worker', type=int, default=4)
+    parser.add_argument('--step_cost', type=float, default=0., help='busy-wait per env step, in seconds')
+    parser.add_argument('--max_steps', type=int, default=100)
+    parser.add_argument('--steps', type=int, default=500, help='number of vectorized steps to time')
+    parser.add_argument('--seed', type=int, default=1)
+    run(parser.parse_args())
@@ -1,4 +1,5 @@
 import argparse
+import copy
 import os
 import torch
 import numpy as np
@@ -37,6 +38,16 @@ def arg_parser():
     # TODO: add '--num_steps' '--num_episodes' '--updates_per_step' '--snapshot_episode' '--render' into config file.
     parser.add_argument('--num_envs', type=int, default=1, metavar='N',
                         help='env numbers (default: 1)')
+    parser.add_argument('--num_seeds', type=int, default=1, metavar='N',
+                        help='number of seeds (--seed, --seed + 1, ...) trained together in this process, each one with '
+                             'its own --num_envs envs, networks, optimizers, buffers, RNG streams, logs and checkpoints. '
+                             'Only PPO, TRPO and DDPG on unnormalized envs are supported (default: 1)')
+    parser.add_argument('--rollout_groups', type=int, default=1, metavar='N',
+                        help='number of env groups stepped asynchronously during on-policy rollouts, the policy '
+                             'computes the actions of a group while the others are stepping (default: 1)')
+    parser.add_argument('--shared_memory', action='store_true', default=False,
+                        help='pass the observations of the env workers through shared memory instead of the pipes. '
+                             'Always used for atari, ravens and goal-conditioned envs (default: False)')
     parser.add_argument('--num_steps', type=int, default=1e6, metavar='N',
                         help='max episode length (default: 1e6)')
     parser.add_argument('--network', default=None,
@@ -93,6 +104,55 @@ def imitation_pretrain():
 
     pass
 
+def init_agent(args, configs, output_dir, DICRETE_ACTION_SPACE):
+    if args.alg in ("PG", "NPG", "TRPO", "PPO", "AdaptiveKLPPO", "HTRPO", "HPG"):
+        if DICRETE_ACTION_SPACE:
+            RL_brain = eval(args.alg + "_Softmax(configs)")
+        else:
+            RL_brain = eval(args.alg + "_Gaussian(configs)")
+    else:
+        RL_brain = eval(args.alg + "(configs)")
+
+    if not args.cpu:
+        RL_brain.cuda()
+
+    # resume networks
+    if args.resume:
+        RL_brain.load_model(load_path=output_dir, load_point=args.checkpoint)
+    return RL_brain
+
+def run_multiseed(args, env, configs, output_dir, DICRETE_ACTION_SPACE):
+    """
+    Train args.num_seeds agents together on the env pool built by build_env, the i-th one with the seed
+    args.seed + i. Each one has its own RNG stream, logger and output directory.
+    """
+    assert args.alg in ("PPO", "TRPO", "DDPG"), "Multi-seed training only supports PPO, TRPO and DDPG."
+    # the env pool is not normalized, see build_env.
+    configs['norm_ob'] = configs['norm_rw'] = False
+    seeds = [args.seed + i for i in range(args.num_seeds)]
+    streams = [RNGStream(seed) for seed in seeds]
+    loggers = [SummaryWriter(comment = "-"+args.alg + "-" + args.env + "-"+str(seed)) for seed in seeds]
+    agents = []
+    for seed, stream, logger in zip(seeds, streams, loggers):
+        seed_dir = os.path.join(output_dir, "seed" + str(seed))
+        if not os.path.exists(seed_dir):
+            os.makedirs(seed_dir)
+        seed_configs = copy.copy(configs)
+        seed_configs["logger"] = logger
+        with stream:
+            agents.append(init_agent(args, seed_configs, seed_dir, DICRETE_ACTION_SPACE))
+
+    if args.alg == "PPO":
+        trained_brains = run_ppo_multiseed_train(env, agents, streams, args.num_steps, loggers)
+    elif args.alg == "TRPO":
+        trained_brains = run_trpo_multiseed_train(env, agents, streams, args.num_steps, loggers)
+    else:
+        trained_brains = run_ddpg_multiseed_train(env, agents, streams, args.num_steps, loggers, args.display)
+
+    for logger in loggers:
+        logger.close()
+    return trained_brains
+
 if __name__ == "__main__":
     args = arg_parser()
 
@@ -131,8 +191,6 @@ if __name__ == "__main__":
     #     print("The chosen env dose not support input normalization. No normalization is applied.")
     #     configs['norm_ob'] = False
 
-    logger = SummaryWriter(comment = "-"+args.alg + "-" + args.env + "-"+str(args.seed))
-    configs["logger"] = logger
     output_dir = os.path.join("output", "models", args.alg, env_id)
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
@@ -146,6 +204,11 @@ if __name__ == "__main__":
     if n_actions:
         configs['n_actions'] = n_actions
     configs['reward_type'] = args.reward
+    if env_type == 'atari' and args.alg in ("DQN", "DDQN", "DuelingDQN"):
+        # keep each frame of the stacked observations once in the replay memory, the transitions of each step
+        # being stored env by env.
+        configs['frame_memory'] = True
+        configs['n_envs'] = env.num_envs
 
     # for hindsight algorithms, init goal space of the environment.
     if args.alg in {"HTRPO", "HPG"}:
@@ -153,23 +216,19 @@ if __name__ == "__main__":
         assert isinstance(configs['other_data'], dict), \
             "Please check the environment settings, hindsight algorithms only support goal conditioned tasks."
         configs['reward_fn'] = env.compute_reward
+        if configs.get('goal_space') is None:
+            configs['goal_space'] = env_obs_space.spaces['achieved_goal']
         configs['max_episode_steps'] = env.max_episode_steps
 
-    # init agent
-    if args.alg in ("PG", "NPG", "TRPO", "PPO", "AdaptiveKLPPO", "HTRPO", "HPG"):
-        if DICRETE_ACTION_SPACE:
-            RL_brain = eval(args.alg + "_Softmax(configs)")
-        else:
-            RL_brain = eval(args.alg + "_Gaussian(configs)")
-    else:
-        RL_brain = eval(args.alg + "(configs)")
+    if args.num_seeds > 1:
+        run_multiseed(args, env, configs, output_dir, DICRETE_ACTION_SPACE)
+        sys.exit()
 
-    if not args.cpu:
-        RL_brain.cuda()
+    logger = SummaryWriter(comment = "-"+args.alg + "-" + args.env + "-"+str(args.seed))
+    configs["logger"] = logger
 
-    # resume networks
-    if args.resume:
-        RL_brain.load_model(load_path=output_dir, load_point=args.checkpoint)
+    # init agent
+    RL_brain = init_agent(args, configs, output_dir, DICRETE_ACTION_SPACE)
 
     if args.usedemo:
         # TODO: imitation learning now is not supported yet.
@@ -177,27 +236,31 @@ if __name__ == "__main__":
 
     # training
     if args.alg == "PPO" or args.alg == "AdaptiveKLPPO":
-        trained_brain = run_ppo_train(env, RL_brain, args.num_steps, logger)
+        trained_brain = run_ppo_train(env, RL_brain, args.num_steps, logger, args.rollout_groups)
     elif args.alg == "PG":
-        trained_brain = run_pg_train(env, RL_brain, args.num_steps, logger)
+        trained_brain = run_pg_train(env, RL_brain, args.num_steps, logger, args.rollout_groups)
     elif args.alg == "NPG":
-        trained_brain = run_npg_train(env, RL_brain, args.num_steps, logger)
+        trained_brain = run_npg_train(env, RL_brain, args.num_steps, logger, args.rollout_groups)
     elif args.alg == "TRPO":
-        trained_brain = run_trpo_train(env, RL_brain, args.num_steps, logger)
+        trained_brain = run_trpo_train(env, RL_brain, args.num_steps, logger, args.rollout_groups)
     elif args.alg == "NAF":
         trained_brain = run_naf_train(env, RL_brain, args.num_steps, logger, args.display)
     elif args.alg == "DDPG":
         trained_brain = run_ddpg_train(env, RL_brain, args.num_steps, logger, args.display)
+    elif args.alg in ("DQN", "DDQN", "DuelingDQN"):
+        trained_brain = run_dqn_train(env, RL_brain, args.num_steps, logger, args.display)
     elif args.alg == "TD3":
         trained_brain = run_td3_train(env, RL_brain, args.num_steps, logger, args.display)
     elif args.alg == 'HTRPO':
         trained_brain = run_htrpo_train(env, RL_brain, args.num_steps, logger,
                                         eval_interval = args.eval_interval if args.eval_interval > 0 else None,
-                                        num_evals = args.num_evals, render=args.render)
+                                        num_evals = args.num_evals, render=args.render,
+                                        rollout_groups = args.rollout_groups)
     elif args.alg == 'HPG':
         trained_brain = run_hpg_train(env, RL_brain, args.num_steps, logger,
                                         eval_interval = args.eval_interval if args.eval_interval > 0 else None,
-                                        num_evals = args.num_evals, render=args.render)
+                                        num_evals = args.num_evals, render=args.render,
+                                        rollout_groups = args.rollout_groups)
     else:
         raise RuntimeError("Not an invalid algorithm.")
 
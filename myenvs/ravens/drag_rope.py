@@ -7,6 +7,7 @@ from gym import spaces
 from ravens.environments.environment import *
 from ravens.tasks.task import Task
 from ravens.utils import pybullet_utils, utils
+from .scene_cache import SceneCacheMixin
 
 class ManipulatingRope(Task):
     def __init__(self):
@@ -76,11 +77,15 @@ class ManipulatingRope(Task):
             p.stepSimulation()
 
 
-class DragRopeEnv(Environment):
-
-    def __init__(self, reward_type="sparse"):
+class DragRopeEnv(SceneCacheMixin, Environment):
+    """
+    :param fast_reset: (bool) build the static scene once and restore it at each reset, see SceneCacheMixin.
+    :param full_reset_interval: (int) number of resets between two builds of the scene with fast_reset.
+    """
+    def __init__(self, reward_type="sparse", fast_reset=False, full_reset_interval=100):
         super(DragRopeEnv, self).__init__(assets_root="ravensenvs/ravens/environments/assets", disp=False,
                                              shared_memory=False, hz=480)
+        self._init_scene_cache(fast_reset, full_reset_interval)
         task = ManipulatingRope()
         self.set_task(task)
 
@@ -182,36 +187,11 @@ class DragRopeEnv(Environment):
             if not self.task:
                 raise ValueError('environment task must be set. Call set_task or pass '
                                  'the task arg in the environment constructor.')
-            self.obj_ids = {'fixed': [], 'rigid': [], 'deformable': []}
-            p.resetSimulation(p.RESET_USE_DEFORMABLE_WORLD)
-            p.setGravity(0, 0, -9.8)
-
             # Temporarily disable rendering to load scene faster.
             p.configureDebugVisualizer(p.COV_ENABLE_RENDERING, 0)
 
-            pybullet_utils.load_urdf(p, os.path.join(self.assets_root, PLANE_URDF_PATH),
-                                     [0, 0, -0.001])
-            pybullet_utils.load_urdf(
-                p, os.path.join(self.assets_root, UR5_WORKSPACE_URDF_PATH), [0.5, 0, 0])
-
-            # Load UR5 robot arm equipped with suction end effector.
-            # TODO(andyzeng): add back parallel-jaw grippers.
-            self.ur5 = pybullet_utils.load_urdf(
-                p, os.path.join(self.assets_root, UR5_URDF_PATH))
-            self.ee = self.task.ee(self.assets_root, self.ur5, 9, self.obj_ids)
-            self.ee_tip = 10  # Link ID of suction cup.
-
-            # Get revolute joint indices of robot (skip fixed joints).
-            n_joints = p.getNumJoints(self.ur5)
-            joints = [p.getJointInfo(self.ur5, i) for i in range(n_joints)]
-            self.joints = [j[0] for j in joints if j[2] == p.JOINT_REVOLUTE]
-
-            # Move robot to home joint configuration.
-            for i in range(len(self.joints)):
-                p.resetJointState(self.ur5, self.joints[i], self.homej[i])
-
-            # Reset end effector.
-            self.ee.release()
+            # Reset the plane, workspace, robot and end effector.
+            self.reset_scene()
 
             # Reset task.
             self.task.reset(self)
@@ -229,7 +209,7 @@ class DragRopeEnv(Environment):
             picked = self.init_pick(pick_pose)
             if not picked:
                 print("Object not successfully picked. Trying to reset again...")
-                break
+                continue
 
             observation = self._get_obs()
             achieved_goal = self._get_achieved_goal()
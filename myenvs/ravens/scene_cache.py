@@ -0,0 +1,119 @@
+import os
+import numpy as np
+import pybullet as p
+
+from ravens.environments.environment import PLANE_URDF_PATH, UR5_WORKSPACE_URDF_PATH, UR5_URDF_PATH
+from ravens.utils import pybullet_utils
+
+
+class SceneCacheMixin(object):
+    """
+    Reset of the static scene of a ravens Environment: the plane, the workspace, the UR5 arm at its home joint
+    configuration and the end effector of the task.
+
+    By default, the simulation is reset and the scene is loaded again at each reset, as Environment.reset does.
+    With fast_reset, the scene is built once and saved with pybullet saveState. The next resets remove the bodies
+    and constraints added by the task, release the end effector and restore the saved state, the arm being held at
+    its home configuration by position control. The task then adds its randomized objects and goals as before. The
+    scene is built again every full_reset_interval resets, which frees the collision and visual shapes created by
+    the tasks (pybullet only frees them when the simulation is reset).
+
+    The camera images of the static scene are cached as well: the tasks place their first object with
+    Task.get_random_pose, which renders the oracle camera before any object of the task is added, and this render
+    is most of the cost of a reset. With fast_reset, the noiseless images rendered while the simulation holds only
+    the bodies of the scene are rendered once per build of the scene.
+
+    :param fast_reset: (bool) restore the saved scene instead of building it at each reset.
+    :param full_reset_interval: (int) number of resets between two builds of the scene with fast_reset.
+    """
+    def _init_scene_cache(self, fast_reset = False, full_reset_interval = 100):
+        self.fast_reset = fast_reset
+        self.full_reset_interval = full_reset_interval
+        self._scene_state = None
+        self._scene_bodies = set()
+        self._scene_constraints = set()
+        self._scene_resets = 0
+        self._scene_images = {}
+
+    def _build_scene(self):
+        self.obj_ids = {'fixed': [], 'rigid': [], 'deformable': []}
+        p.resetSimulation(p.RESET_USE_DEFORMABLE_WORLD)
+        p.setGravity(0, 0, -9.8)
+
+        pybullet_utils.load_urdf(p, os.path.join(self.assets_root, PLANE_URDF_PATH),
+                                 [0, 0, -0.001])
+        pybullet_utils.load_urdf(
+            p, os.path.join(self.assets_root, UR5_WORKSPACE_URDF_PATH), [0.5, 0, 0])
+
+        # Load UR5 robot arm equipped with the end effector of the task.
+        self.ur5 = pybullet_utils.load_urdf(
+            p, os.path.join(self.assets_root, UR5_URDF_PATH))
+        self.ee = self.task.ee(self.assets_root, self.ur5, 9, self.obj_ids)
+        self.ee_tip = 10  # Link ID of suction cup.
+
+        # Get revolute joint indices of robot (skip fixed joints).
+        n_joints = p.getNumJoints(self.ur5)
+        joints = [p.getJointInfo(self.ur5, i) for i in range(n_joints)]
+        self.joints = [j[0] for j in joints if j[2] == p.JOINT_REVOLUTE]
+
+        # Move robot to home joint configuration.
+        for i in range(len(self.joints)):
+            p.resetJointState(self.ur5, self.joints[i], self.homej[i])
+
+        # Reset end effector.
+        self.ee.release()
+
+    @staticmethod
+    def _body_ids():
+        return set(p.getBodyUniqueId(i) for i in range(p.getNumBodies()))
+
+    @staticmethod
+    def _constraint_ids():
+        return set(p.getConstraintUniqueId(i) for i in range(p.getNumConstraints()))
+
+    def _restore_scene(self):
+        # the gripper holds its own constraint on the grasped object.
+        self.ee.release()
+        for constraint_id in self._constraint_ids() - self._scene_constraints:
+            p.removeConstraint(constraint_id)
+        for body_id in self._body_ids() - self._scene_bodies:
+            p.removeBody(body_id)
+        p.restoreState(stateId=self._scene_state)
+        # the motors keep the targets of the last episode, hold the arm at home instead.
+        p.setJointMotorControlArray(
+            bodyIndex=self.ur5,
+            jointIndices=self.joints,
+            controlMode=p.POSITION_CONTROL,
+            targetPositions=self.homej,
+            positionGains=np.ones(len(self.joints)))
+        # the end effector keeps a reference to obj_ids, it is emptied in place.
+        for ids in self.obj_ids.values():
+            del ids[:]
+
+    def reset_scene(self):
+        """
+        Reset the static scene, without the objects of the task.
+        """
+        if not self.fast_reset:
+            self._build_scene()
+            return
+        if self._scene_state is None or self._scene_resets >= self.full_reset_interval:
+            self._build_scene()
+            self._scene_state = p.saveState()
+            self._scene_bodies = self._body_ids()
+            self._scene_constraints = self._constraint_ids()
+            self._scene_resets = 0
+            self._scene_images = {}
+        else:
+            self._restore_scene()
+        self._scene_resets += 1
+
+    def render_camera(self, config):
+        # the robot only moves once the task has added its objects, the static scene is then left unchanged.
+        cacheable = self._scene_state is not None and not config['noise'] and \
+                    p.getNumBodies() == len(self._scene_bodies)
+        if not cacheable:
+            return super(SceneCacheMixin, self).render_camera(config)
+        if id(config) not in self._scene_images:
+            self._scene_images[id(config)] = super(SceneCacheMixin, self).render_camera(config)
+        return tuple(image.copy() for image in self._scene_images[id(config)])
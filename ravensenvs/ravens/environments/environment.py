@@ -42,7 +42,8 @@ class Environment(gym.Env):
                task=None,
                disp=False,
                shared_memory=False,
-               hz=240):
+               hz=240,
+               obs_mode='rgbd'):
     """Creates OpenAI Gym-style environment with PyBullet.
 
     Args:
@@ -52,10 +53,18 @@ class Environment(gym.Env):
       disp: show environment with PyBullet's built-in display viewer.
       shared_memory: run with shared memory.
       hz: PyBullet physics simulation step speed. Set to 480 for deformables.
+      obs_mode: 'rgbd' to observe the color and depth images of the agent
+        cameras, or 'state' to observe the ground truth state of the robot
+        and the objects (see get_state) without rendering any camera. Images
+        are still rendered on demand by render and render_camera.
 
     Raises:
+      ValueError: if obs_mode is not 'rgbd' or 'state'.
       RuntimeError: if pybullet cannot load fileIOPlugin.
     """
+    if obs_mode not in ('rgbd', 'state'):
+      raise ValueError(f'unknown obs_mode: {obs_mode}')
+    self.obs_mode = obs_mode
     self.pix_size = 0.003125
     self.obj_ids = {'fixed': [], 'rigid': [], 'deformable': []}
     self.homej = np.array([-1, -0.5, 0.5, -0.5, -0.5, 0]) * np.pi
@@ -63,6 +72,9 @@ class Environment(gym.Env):
 
     self.assets_root = assets_root
 
+    # View and projection matrices of each camera configuration.
+    self._camera_matrices = {}
+
     color_tuple = [
         gym.spaces.Box(0, 255, config['image_size'] + (3,), dtype=np.uint8)
         for config in self.agent_cams
@@ -75,6 +87,8 @@ class Environment(gym.Env):
         'color': gym.spaces.Tuple(color_tuple),
         'depth': gym.spaces.Tuple(depth_tuple),
     })
+    if self.obs_mode == 'state':
+      self.observation_space = self._state_space(0)
     # TODO(ayzaan): Delete below and uncomment vector box bounds.
     position_bounds = gym.spaces.Box(
         low=-1.0, high=1.0, shape=(3,), dtype=np.float32)
@@ -198,6 +212,11 @@ class Environment(gym.Env):
     # Re-enable rendering.
     p.configureDebugVisualizer(p.COV_ENABLE_RENDERING, 1)
 
+    # The number of objects depends on the task and its random instance.
+    if self.obs_mode == 'state':
+      self.observation_space = self._state_space(
+          sum(len(ids) for ids in self.obj_ids.values()))
+
     obs, _, _, _ = self.step()
     return obs
 
@@ -216,12 +235,7 @@ class Environment(gym.Env):
       # Exit early if action times out. We still return an observation
       # so that we don't break the Gym API contract.
       if timeout:
-        obs = {'color': (), 'depth': ()}
-        for config in self.agent_cams:
-          color, depth, _ = self.render_camera(config)
-          obs['color'] += (color,)
-          obs['depth'] += (depth,)
-        return obs, 0.0, True, self.info
+        return self.get_observation(), 0.0, True, self.info
 
     # Step simulator asynchronously until objects settle.
     while not self.is_static:
@@ -234,25 +248,86 @@ class Environment(gym.Env):
     # Add ground truth robot state into info.
     info.update(self.info)
 
+    return self.get_observation(), reward, done, info
+
+  def render(self, mode='rgb_array'):
+    # Render only the color image from the first camera.
+    # Only support rgb_array for now.
+    if mode != 'rgb_array':
+      raise NotImplementedError('Only rgb_array implemented')
+    color, _, _ = self._camera_image(self.agent_cams[0], segmentation=False)
+    return self._color_image(self.agent_cams[0], color)
+
+  def get_observation(self):
+    """Observation of the current step, according to obs_mode."""
+    if self.obs_mode == 'state':
+      return self.get_state()
+
     # Get RGB-D camera image observations.
     obs = {'color': (), 'depth': ()}
     for config in self.agent_cams:
       color, depth, _ = self.render_camera(config)
       obs['color'] += (color,)
       obs['depth'] += (depth,)
+    return obs
 
-    return obs, reward, done, info
+  def get_state(self):
+    """Ground truth state of the robot and the objects, without rendering.
 
-  def render(self, mode='rgb_array'):
-    # Render only the color image from the first camera.
-    # Only support rgb_array for now.
-    if mode != 'rgb_array':
-      raise NotImplementedError('Only rgb_array implemented')
-    color, _, _ = self.render_camera(self.agent_cams[0])
-    return color
+    Returns:
+      dict with 'joints': the (6,) joint positions of the UR5, 'ee_pose': the
+        (7,) position and quaternion of the end effector tip, and 'objects':
+        the (n, 7) positions and quaternions of the objects of the task, in
+        the order of info.
+    """
+    joints = [p.getJointState(self.ur5, i)[0] for i in self.joints]
+    ee_position, ee_rotation = p.getLinkState(self.ur5, self.ee_tip)[:2]
+    objects = []
+    for obj_ids in self.obj_ids.values():
+      for obj_id in obj_ids:
+        pos, rot = p.getBasePositionAndOrientation(obj_id)
+        objects.append(pos + rot)
+    return {
+        'joints': np.float32(joints),
+        'ee_pose': np.float32(ee_position + ee_rotation),
+        'objects': np.float32(objects).reshape(-1, 7),
+    }
+
+  def _state_space(self, n_objects):
+    """Observation space of get_state with n_objects objects."""
+    return gym.spaces.Dict({
+        'joints': gym.spaces.Box(-np.inf, np.inf, (6,), dtype=np.float32),
+        'ee_pose': gym.spaces.Box(-np.inf, np.inf, (7,), dtype=np.float32),
+        'objects': gym.spaces.Box(
+            -np.inf, np.inf, (n_objects, 7), dtype=np.float32),
+    })
 
   def render_camera(self, config):
     """Render RGB-D image with specified camera configuration."""
+    color, depth, segm = self._camera_image(config, segmentation=True)
+    color = self._color_image(config, color)
+
+    # Get depth image.
+    znear, zfar = config['zrange']
+    depth_image_size = (config['image_size'][0], config['image_size'][1])
+    zbuffer = np.array(depth).reshape(depth_image_size)
+    depth = (zfar + znear - (2. * zbuffer - 1.) * (zfar - znear))
+    depth = (2. * znear * zfar) / depth
+    if config['noise']:
+      depth += self._random.normal(0, 0.003, depth_image_size)
+
+    # Get segmentation image.
+    segm = np.uint8(segm).reshape(depth_image_size)
+
+    return color, depth, segm
+
+  def _camera_matrices_of(self, config):
+    """View and projection matrices of a camera configuration, cached."""
+    key = (tuple(config['image_size']), tuple(config['intrinsics']),
+           tuple(config['position']), tuple(config['rotation']),
+           tuple(config['zrange']))
+    if key in self._camera_matrices:
+      return self._camera_matrices[key]
 
     # OpenGL camera settings.
     lookdir = np.float32([0, 0, 1]).reshape(3, 1)
@@ -271,18 +346,38 @@ class Environment(gym.Env):
     # Notes: 1) FOV is vertical FOV 2) aspect must be float
     aspect_ratio = config['image_size'][1] / config['image_size'][0]
     projm = p.computeProjectionMatrixFOV(fovh, aspect_ratio, znear, zfar)
+    self._camera_matrices[key] = (viewm, projm)
+    return viewm, projm
+
+  def _camera_image(self, config, segmentation):
+    """Raw color, depth and segmentation buffers of pybullet.
+
+    Args:
+      config: camera configuration.
+      segmentation: compute the segmentation mask. Without it, the returned
+        mask is not meaningful.
+
+    Returns:
+      (color, depth, segm) as returned by p.getCameraImage.
+    """
+    viewm, projm = self._camera_matrices_of(config)
 
     # Render with OpenGL camera settings.
+    flags = p.ER_SEGMENTATION_MASK_OBJECT_AND_LINKINDEX
+    if not segmentation:
+      flags = p.ER_NO_SEGMENTATION_MASK
     _, _, color, depth, segm = p.getCameraImage(
         width=config['image_size'][1],
         height=config['image_size'][0],
         viewMatrix=viewm,
         projectionMatrix=projm,
         shadow=1,
-        flags=p.ER_SEGMENTATION_MASK_OBJECT_AND_LINKINDEX,
+        flags=flags,
         renderer=p.ER_BULLET_HARDWARE_OPENGL)
+    return color, depth, segm
 
-    # Get color image.
+  def _color_image(self, config, color):
+    """RGB image of a raw color buffer, with noise if the camera has any."""
     color_image_size = (config['image_size'][0], config['image_size'][1], 4)
     color = np.array(color, dtype=np.uint8).reshape(color_image_size)
     color = color[:, :, :3]  # remove alpha channel
@@ -290,19 +385,7 @@ class Environment(gym.Env):
       color = np.int32(color)
       color += np.int32(self._random.normal(0, 3, config['image_size']))
       color = np.uint8(np.clip(color, 0, 255))
-
-    # Get depth image.
-    depth_image_size = (config['image_size'][0], config['image_size'][1])
-    zbuffer = np.array(depth).reshape(depth_image_size)
-    depth = (zfar + znear - (2. * zbuffer - 1.) * (zfar - znear))
-    depth = (2. * znear * zfar) / depth
-    if config['noise']:
-      depth += self._random.normal(0, 0.003, depth_image_size)
-
-    # Get segmentation image.
-    segm = np.uint8(segm).reshape(depth_image_size)
-
-    return color, depth, segm
+    return color
 
   @property
   def info(self):
@@ -41,6 +41,21 @@ class EnvironmentTest(absltest.TestCase):
       if done:
         break
 
+  def test_environment_state_obs(self):
+    env = environment.Environment(ASSETS_PATH, obs_mode='state')
+    task = tasks.BlockInsertion()
+    env.set_task(task)
+    env.seed(0)
+    agent = task.oracle(env)
+    obs = env.reset()
+    info = None
+    for _ in range(2):
+      self.assertTrue(env.observation_space.contains(obs))
+      act = agent.act(obs, info)
+      obs, _, done, info = env.step(act)
+      if done:
+        break
+
 
 if __name__ == '__main__':
   absltest.main()
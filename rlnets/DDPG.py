@@ -4,6 +4,7 @@ from torch.autograd import Variable
 from torch import nn
 import torch.nn.functional as F
 import numpy as np
+from collections import OrderedDict
 
 class FCDDPG_C(nn.Module):
     def __init__(self,
@@ -42,4 +43,135 @@ class FCDDPG_C(nn.Module):
         x = self.net.forward(torch.cat((x, a), dim=-1))
         return x
 
+class EnsembleLinear(nn.Module):
+    """
+    N linear layers of the same shape, applied to N x B x in inputs by one batched matmul. The weights are stacked
+    along a first dimension of size N and stored transposed, N x in x out, so that neither the forward nor the
+    backward transposes them. The layers of a slice 'heads' only can be applied, heads = None applies all of them
+    without slicing the parameters, whose backward would allocate and fill whole gradients.
+    """
+    def __init__(self, n_heads, n_inunits, n_outunits):
+        super(EnsembleLinear, self).__init__()
+        self.weight = nn.Parameter(torch.zeros(n_heads, n_inunits, n_outunits))
+        self.bias = nn.Parameter(torch.zeros(n_heads, n_outunits))
 
+    def forward(self, x, heads = None):
+        weight, bias = (self.weight, self.bias) if heads is None else (self.weight[heads], self.bias[heads])
+        return torch.baddbmm(bias.unsqueeze(1), x, weight)
+
+class FCDDPG_C_Ensemble(nn.Module):
+    """
+    N critics of the architecture of FCDDPG_C, evaluated together by batched matmuls in one forward: the layers of
+    the N critics are stacked into EnsembleLinear layers, and the batch normalization layers of the N critics into
+    one nn.BatchNorm1d of N x n_features channels. The critics are initialized as FCDDPG_C, and the state dict of
+    every critic can be read and written in the format of FCDDPG_C, see critic_state_dict() and
+    load_critic_state_dict().
+    """
+    def __init__(self,
+                 n_critics,   # number of critics
+                 n_inputfeats,    # input dim
+                 n_actions,   # action dim
+                 n_hiddens = [64, 64],  # hidden unit number list
+                 nonlinear = F.relu,
+                 usebn = False,
+                 initializer="uniform",
+                 initializer_param={"last_upper":3e-3, "last_lower":3e-3}
+                 ):
+        super(FCDDPG_C_Ensemble, self).__init__()
+        self.n_critics = n_critics
+        self.n_actions = n_actions
+        self.nonlinear = nonlinear
+        critics = [FCDDPG_C(n_inputfeats, n_actions, n_hiddens, nonlinear, usebn, initializer, initializer_param)
+                   for _ in range(n_critics)]
+        self.first_layer = EnsembleLinear(n_critics, n_inputfeats, n_hiddens[0])
+        # the layers of FCDDPG_C.net, in the same order.
+        self.layers = nn.ModuleList()
+        for layer in critics[0].net.layers:
+            if isinstance(layer, nn.BatchNorm1d):
+                self.layers.append(nn.BatchNorm1d(n_critics * layer.num_features))
+            else:
+                self.layers.append(EnsembleLinear(n_critics, layer.in_features, layer.out_features))
+        for i, critic in enumerate(critics):
+            self.load_critic_state_dict(i, critic.state_dict())
+
+    def cuda(self, device=None):
+        return self._apply(lambda t: t.cuda(device))
+
+    def _critic_tensors(self, i):
+        """
+        :return: pairs of (FCDDPG_C key, tensor of critic i), views of the tensors of the ensemble.
+        """
+        pairs = [('first_layer.weight', self.first_layer.weight[i].t()), ('first_layer.bias', self.first_layer.bias[i])]
+        for k, layer in enumerate(self.layers):
+            prefix = 'net.layers.' + str(k) + '.'
+            if isinstance(layer, nn.BatchNorm1d):
+                n = layer.num_features // self.n_critics
+                for key in ('weight', 'bias', 'running_mean', 'running_var'):
+                    pairs.append((prefix + key, getattr(layer, key)[i * n: (i + 1) * n]))
+                pairs.append((prefix + 'num_batches_tracked', layer.num_batches_tracked))
+            else:
+                pairs += [(prefix + 'weight', layer.weight[i].t()), (prefix + 'bias', layer.bias[i])]
+        return pairs
+
+    def critic_state_dict(self, i):
+        """
+        :return: state dict of critic i, as the one of a FCDDPG_C.
+        """
+        return OrderedDict((key, tensor.detach().clone(memory_format=torch.contiguous_format))
+                           for key, tensor in self._critic_tensors(i))
+
+    def load_critic_state_dict(self, i, state_dict):
+        """
+        Load the state dict of a FCDDPG_C, e.g. of an older checkpoint, into critic i.
+        """
+        tensors = self._critic_tensors(i)
+        missing = set(key for key, _ in tensors) - set(state_dict.keys())
+        assert not missing, "Missing keys in the state dict of the critic: " + str(sorted(missing))
+        with torch.no_grad():
+            for key, tensor in tensors:
+                tensor.copy_(state_dict[key])
+
+    def clip_grad_norm_(self, max_norm):
+        """
+        Clip the gradient norm of every critic to max_norm, as torch.nn.utils.clip_grad_norm_ on each of them.
+        :return: the gradient norms of the critics.
+        """
+        grads = [p.grad.view(self.n_critics, -1) for p in self.parameters() if p.grad is not None]
+        norms = torch.stack([g.pow(2).sum(1) for g in grads]).sum(0).sqrt()
+        coefs = torch.clamp(max_norm / (norms + 1e-6), max=1.).unsqueeze(1)
+        for g in grads:
+            g.mul_(coefs)
+        return norms
+
+    def _batch_norm(self, layer, x, heads):
+        n_heads, batch_size, n = x.shape
+        channels = slice(None) if heads is None else slice(heads.start * n, heads.stop * n)
+        x = F.batch_norm(x.transpose(0, 1).reshape(batch_size, n_heads * n),
+                         layer.running_mean[channels], layer.running_var[channels],
+                         layer.weight[channels], layer.bias[channels],
+                         self.training, layer.momentum, layer.eps)
+        if self.training:
+            layer.num_batches_tracked.add_(1)
+        return x.view(batch_size, n_heads, n).transpose(0, 1)
+
+    def forward(self, x, a, heads = None):
+        """
+        :param x: B x n_inputfeats states.
+        :param a: B x n_actions actions.
+        :param heads: (slice) the critics to evaluate. Default: all of them.
+        :return: n_heads x B x 1 values.
+        """
+        n_heads = self.n_critics
+        if heads is not None:
+            start, stop, _ = heads.indices(self.n_critics)
+            heads, n_heads = slice(start, stop), stop - start
+        x = self.nonlinear(self.first_layer(x.unsqueeze(0).expand(n_heads, -1, -1), heads))
+        x = torch.cat((x, a.unsqueeze(0).expand(n_heads, -1, -1)), dim=-1)
+        for layernum, layer in enumerate(self.layers):
+            if isinstance(layer, nn.BatchNorm1d):
+                x = self._batch_norm(layer, x, heads)
+            else:
+                x = layer(x, heads)
+            if layernum < len(self.layers) - 1:
+                x = self.nonlinear(x)
+        return x
@@ -1 +1,11 @@
-DATABUFFER_CONFIG={}
\ No newline at end of file
+DATABUFFER_CONFIG={
+    # device of the storage of databuffer_torch: 'cpu' (pinned memory when CUDA is available) or 'cuda'.
+    'memory_device': 'cpu',
+    # number of stacked frames of the image observations of databuffer_frames.
+    'frame_stack': 4,
+    # number of frames kept by databuffer_frames. None: memory_size + memory_size // 16, i.e. the frames of the
+    # transitions and one reset every 16 transitions.
+    'frame_memory_size': None,
+    # number of envs whose transitions are interleaved in the stored batches, row i coming from env i % n_envs.
+    'n_envs': 1,
+}
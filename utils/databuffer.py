@@ -1,13 +1,19 @@
 import abc
 import copy
 import numpy as np
+import torch
 from .config import DATABUFFER_CONFIG
 
 class databuffer(object):
+    """
+    Fixed-capacity replay storage. All arrays are preallocated with memory_size rows and used
+    as a circular buffer: a write cursor moves forward with each stored batch and wraps around
+    when the buffer is full, so that inserting a batch costs O(batch) regardless of fill level.
+    """
     def __init__(self, hyperparams):
         config = copy.deepcopy(DATABUFFER_CONFIG)
         config.update(hyperparams)
-        self.max_size = config['memory_size']
+        self.max_size = int(config['memory_size'])
         self.state_dims = config['n_states']
         if isinstance(self.state_dims, dict):
             self.state_dims = self.state_dims['n_s']
@@ -17,11 +23,10 @@ class databuffer(object):
         self.dicrete_action = config['dicrete_action']
         if isinstance(self.state_dims, (int, np.int64)):
             self.state_dims = (self.state_dims, )
-        self.S = np.zeros((0,) + self.state_dims, dtype = np.float32)
-        self.A = np.zeros([0, self.actions_dims], dtype = np.uint8 if self.dicrete_action else np.float32)
-        self.R = np.zeros([0, 1], dtype = np.float32)
-        self.S_ = np.zeros((0,) + self.state_dims, dtype = np.float32)
-        self.done = np.zeros([0, 1], dtype = np.uint8)
+        self._init_state_storage(config)
+        self.A = self._new_storage((self.actions_dims, ), np.uint8 if self.dicrete_action else np.float32)
+        self.R = self._new_storage((1, ), np.float32)
+        self.done = self._new_storage((1, ), np.uint8)
 
         # other data in transitions. For example, goals, episode infos, etc.
         self.other_data = None
@@ -29,43 +34,73 @@ class databuffer(object):
             self.other_data = {}
             for key, box in config['other_data'].items():
                 if key != 'observation':
-                    self.other_data[key] = np.zeros((0,) + box.shape[1:], dtype=box.dtype)
+                    self.other_data[key] = self._new_storage(box.shape[1:], box.dtype)
 
         # memory counter: How many transitions are recorded in total
         self.mem_c = 0
+        # write cursor: where the next transition will be stored
+        self.pointer = 0
 
-    def store_transition(self, transitions):
-        self.S = np.concatenate((self.S, transitions['state']), axis=0)
-        self.A = np.concatenate((self.A, transitions['action']), axis=0)
-        self.R = np.concatenate((self.R, transitions['reward']), axis=0)
-        self.done = np.concatenate((self.done, transitions['done']), axis=0)
-        self.S_ = np.concatenate((self.S_, transitions['next_state']), axis=0)
+    def _init_state_storage(self, config):
+        self.S = self._new_storage(self.state_dims, np.float32)
+        self.S_ = self._new_storage(self.state_dims, np.float32)
+
+    def _new_storage(self, dims, dtype):
+        return np.zeros((self.max_size,) + tuple(dims), dtype=dtype)
+
+    def _write_slices(self, n):
+        """
+        :param n: number of transitions to be stored.
+        :return: at most two (storage slice, batch slice) pairs. If the batch is larger than the
+                 buffer, only its last max_size transitions are kept.
+        """
+        m = min(n, self.max_size)
+        begin = (self.pointer + n - m) % self.max_size
+        first = min(m, self.max_size - begin)
+        slices = [(slice(begin, begin + first), slice(n - m, n - m + first))]
+        if first < m:
+            slices.append((slice(0, m - first), slice(n - m + first, n)))
+        return slices
+
+    def _write(self, storage, data, slices):
+        for dst, src in slices:
+            storage[dst] = data[src]
+
+    def _store(self, transitions, slices):
+        self._write(self.S, transitions['state'], slices)
+        self._write(self.S_, transitions['next_state'], slices)
+        self._store_common(transitions, slices)
+
+    def _store_common(self, transitions, slices):
+        self._write(self.A, transitions['action'], slices)
+        self._write(self.R, transitions['reward'], slices)
+        self._write(self.done, transitions['done'], slices)
         if self.other_data:
             for key in self.other_data.keys():
                 assert 'other_data' in transitions, \
                     "Other data types should be included in transitions except S, A, R, Done, and S_."
-                self.other_data[key] = np.concatenate((self.other_data[key], transitions['other_data'][key]), axis=0)
-        self.mem_c += transitions['state'].shape[0]
-        if self.mem_c >self.max_size:
-            self.S = self.S[-self.max_size:]
-            self.A = self.A[-self.max_size:]
-            self.R = self.R[-self.max_size:]
-            self.done = self.done[-self.max_size:]
-            self.S_ = self.S_[-self.max_size:]
-            if self.other_data:
-                for key in self.other_data.keys():
-                    self.other_data[key] = self.other_data[key][-self.max_size:]
+                self._write(self.other_data[key], transitions['other_data'][key], slices)
+
+    def store_transition(self, transitions):
+        n = transitions['state'].shape[0]
+        self._store(transitions, self._write_slices(n))
+        self.pointer = (self.pointer + n) % self.max_size
+        self.mem_c += n
 
     def sample_batch(self, batch_size = None):
+        size = min(self.max_size, self.mem_c)
         if batch_size is not None:
-            if batch_size > self.mem_c or batch_size > self.max_size:
+            if batch_size > size:
                 raise RuntimeError("Batch size is bigger than buffer size")
             # sample without putting back
-            # sample_index = np.random.choice(min(self.max_size, self.mem_c), size=batch_size)
+            # sample_index = np.random.choice(size, size=batch_size)
             # sample with putting back
-            sample_index = np.random.randint(0, self.mem_c, size=batch_size)
+            sample_index = np.random.randint(0, size, size=batch_size)
+        elif size < self.max_size:
+            sample_index = np.arange(size)
         else:
-            sample_index = np.arange(min(self.max_size, self.mem_c))
+            # keep the chronological order, on-policy algorithms rely on contiguous episodes.
+            sample_index = (self.pointer + np.arange(size)) % self.max_size
         batch = {}
         batch['state'] = self.S[sample_index]
         batch['action'] = self.A[sample_index]
@@ -80,32 +115,22 @@ class databuffer(object):
         return batch, sample_index
 
     def reset_buffer(self):
-        self.S = np.zeros((0,) + self.state_dims, dtype=np.float32)
-        self.A = np.zeros([0, self.actions_dims], dtype = np.uint8 if self.dicrete_action else np.float32)
-        self.R = np.zeros([0, 1], dtype = np.float32)
-        self.S_ = np.zeros((0,) + self.state_dims, dtype=np.float32)
-        self.done = np.zeros([0, 1], dtype = np.bool)
-        if self.other_data:
-            for key in self.other_data.keys():
-                self.other_data[key] = np.zeros((0,) + self.other_data[key].shape[1:], dtype=self.other_data[key].dtype)
+        # storage is reused, only the counters are rewound.
         self.mem_c = 0
+        self.pointer = 0
 
 class databuffer_PG_gaussian(databuffer):
     def __init__(self, hyperparams):
         super(databuffer_PG_gaussian, self).__init__(hyperparams)
-        self.mu = np.zeros([0, self.actions_dims])
-        self.sigma = np.zeros([0, self.actions_dims])
-        self.logpac = np.zeros([0, 1], dtype=np.float32)
+        self.mu = self._new_storage((self.actions_dims, ), np.float32)
+        self.sigma = self._new_storage((self.actions_dims, ), np.float32)
+        self.logpac = self._new_storage((1, ), np.float32)
 
-    def store_transition(self, transitions):
-        databuffer.store_transition(self, transitions)
-        self.mu = np.concatenate((self.mu, transitions['mu']), axis=0)
-        self.sigma = np.concatenate((self.sigma, transitions['sigma']), axis=0)
-        self.logpac = np.concatenate((self.logpac, transitions['logpac']), axis=0)
-        if self.mem_c >self.max_size:
-            self.mu = self.mu[-self.max_size:]
-            self.sigma = self.sigma[-self.max_size:]
-            self.logpac = self.logpac[-self.max_size:]
+    def _store(self, transitions, slices):
+        databuffer._store(self, transitions, slices)
+        self._write(self.mu, transitions['mu'], slices)
+        self._write(self.sigma, transitions['sigma'], slices)
+        self._write(self.logpac, transitions['logpac'], slices)
 
     def sample_batch(self, batch_size= None):
         batch, sample_index = databuffer.sample_batch(self, batch_size)
@@ -114,25 +139,16 @@ class databuffer_PG_gaussian(databuffer):
         batch['logpac'] = self.logpac[sample_index]
         return batch, sample_index
 
-    def reset_buffer(self):
-        databuffer.reset_buffer(self)
-        self.mu = np.zeros([0, self.actions_dims])
-        self.sigma = np.zeros([0, self.actions_dims])
-        self.logpac = np.zeros([0, 1], dtype=np.float32)
-
 class databuffer_PG_softmax(databuffer):
     def __init__(self, hyperparams):
         super(databuffer_PG_softmax, self).__init__(hyperparams)
-        self.distri = np.zeros([0, self.n_actions])
-        self.logpac = np.zeros([0, 1], dtype=np.float32)
+        self.distri = self._new_storage((self.n_actions, ), np.float32)
+        self.logpac = self._new_storage((1, ), np.float32)
 
-    def store_transition(self, transitions):
-        databuffer.store_transition(self, transitions)
-        self.distri = np.concatenate((self.distri, transitions['distri']), axis=0)
-        self.logpac = np.concatenate((self.logpac, transitions['logpac']), axis=0)
-        if self.mem_c >self.max_size:
-            self.distri = self.distri[-self.max_size:]
-            self.logpac = self.logpac[-self.max_size:]
+    def _store(self, transitions, slices):
+        databuffer._store(self, transitions, slices)
+        self._write(self.distri, transitions['distri'], slices)
+        self._write(self.logpac, transitions['logpac'], slices)
 
     def sample_batch(self, batch_size= None):
         batch, sample_index = databuffer.sample_batch(self, batch_size)
@@ -140,7 +156,219 @@ class databuffer_PG_softmax(databuffer):
         batch['logpac'] = self.logpac[sample_index]
         return batch, sample_index
 
+class databuffer_torch(databuffer):
+    """
+    Replay storage of torch tensors, in the same circular layout as databuffer. The storage is on 'memory_device':
+    on the CPU it is in pinned memory when CUDA is available, so that the minibatches are copied to the GPU
+    asynchronously after cuda(). Minibatches are sampled with torch.randint index tensors, and sample_batches()
+    draws K of them by one gather. The states, actions, rewards and dones of the minibatches are float tensors.
+    """
+    def __init__(self, hyperparams):
+        config = copy.deepcopy(DATABUFFER_CONFIG)
+        config.update(hyperparams)
+        self.device = torch.device(config['memory_device'])
+        self.pin_memory = self.device.type == 'cpu' and torch.cuda.is_available()
+        # device of the sampled minibatches.
+        self.batch_device = self.device
+        super(databuffer_torch, self).__init__(config)
+
+    def _new_storage(self, dims, dtype):
+        storage = torch.zeros((self.max_size,) + tuple(dims), dtype=torch.from_numpy(np.zeros(0, dtype)).dtype,
+                              device=self.device)
+        return storage.pin_memory() if self.pin_memory else storage
+
+    def _write(self, storage, data, slices):
+        data = torch.as_tensor(data)
+        for dst, src in slices:
+            storage[dst].copy_(data[src])
+
+    def cuda(self):
+        """
+        Sample the minibatches on the GPU. The storage stays on 'memory_device'.
+        """
+        self.batch_device = torch.device('cuda')
+
+    def _sample_index(self, size, shape):
+        return torch.randint(0, size, shape, device=self.device)
+
+    def _gather_rows(self, storage, index):
+        rows = storage.index_select(0, index.view(-1)).view(index.shape + storage.shape[1:])
+        return rows.to(self.batch_device, non_blocking=True)
+
+    def _gather_states(self, index):
+        return self._gather_rows(self.S, index).float(), self._gather_rows(self.S_, index).float()
+
+    def _gather(self, index):
+        batch = {}
+        batch['state'], batch['next_state'] = self._gather_states(index)
+        for key, storage in (('action', self.A), ('reward', self.R), ('done', self.done)):
+            batch[key] = self._gather_rows(storage, index).float()
+        batch['other_data'] = None
+        if self.other_data:
+            batch['other_data'] = {key: self._gather_rows(storage, index) for key, storage in self.other_data.items()}
+        return batch
+
+    def sample_batch(self, batch_size = None):
+        size = min(self.max_size, self.mem_c)
+        if batch_size is not None:
+            if batch_size > size:
+                raise RuntimeError("Batch size is bigger than buffer size")
+            sample_index = self._sample_index(size, (batch_size,))
+        elif size < self.max_size:
+            sample_index = torch.arange(size, device=self.device)
+        else:
+            sample_index = (self.pointer + torch.arange(size, device=self.device)) % self.max_size
+        return self._gather(sample_index), sample_index
+
+    def sample_batches(self, batch_size, n_batches, ob_mean = None, ob_var = None, rw_var = None):
+        """
+        :param batch_size: (int) size of the minibatches, sampled with replacement.
+        :param n_batches: (int) number of minibatches.
+        :param ob_mean, ob_var, rw_var: statistics of normalize().
+        :return: list of n_batches minibatches, views of one gather of n_batches x batch_size transitions,
+                 normalized at once.
+        """
+        size = min(self.max_size, self.mem_c)
+        if batch_size > size:
+            raise RuntimeError("Batch size is bigger than buffer size")
+        batches = self._gather(self._sample_index(size, (n_batches, batch_size)))
+        batches = self.normalize(batches, ob_mean, ob_var, rw_var)
+        other_data = batches.pop('other_data')
+        unbind = lambda tensors: [dict(zip(tensors.keys(), values))
+                                  for values in zip(*[v.unbind(0) for v in tensors.values()])]
+        minibatches = unbind(batches)
+        other_data = unbind(other_data) if other_data else [None] * n_batches
+        for minibatch, other in zip(minibatches, other_data):
+            minibatch['other_data'] = other
+        return minibatches
+
+    def normalize(self, batch, ob_mean = None, ob_var = None, rw_var = None):
+        """
+        Normalize the states and rewards of batch in place, as the runners normalize the observations and rewards
+        of the environments: clip((x - mean) / sqrt(var + 1e-8), -10, 10).
+        :param ob_mean, ob_var: running mean and variance of the observations. Default: not normalized.
+        :param rw_var: running variance of the returns. Default: not normalized.
+        """
+        if ob_mean is not None:
+            ob_mean = torch.as_tensor(ob_mean, dtype=torch.float32).to(self.batch_device)
+            ob_std = torch.sqrt(torch.as_tensor(ob_var, dtype=torch.float32).to(self.batch_device) + 1e-8)
+            for key in ('state', 'next_state'):
+                batch[key] = torch.clamp((batch[key] - ob_mean) / ob_std, -10, 10)
+        if rw_var is not None:
+            batch['reward'] = torch.clamp(batch['reward'] / float(np.sqrt(rw_var + 1e-8)), -10, 10)
+        return batch
+
+class databuffer_frames(databuffer_torch):
+    """
+    Replay storage of stacked image observations (H x W x (k * c) stacks of the last k frames of c channels, e.g.
+    wrap_deepmind(frame_stack=True) with k = 'frame_stack'), which keeps each uint8 frame once. Consecutive
+    stacks of an episode share k - 1 frames, so the frames are written in a circular frame store of
+    'frame_memory_size' frames, and each transition records the indices of the k frames of its state and next
+    state. The stacks are rebuilt by one gather of frames when sampled, then converted to float on the batch
+    device.
+
+    The transitions of each stored batch come from 'n_envs' envs, row i from env i % n_envs. A state equal to the
+    last next state of its env reuses its frames; otherwise (e.g. after a reset), its frames are written, the
+    repeated frames of a reset once. Transitions whose frames have been overwritten in the frame store are not
+    sampled.
+    """
+    def _init_state_storage(self, config):
+        self.k = config['frame_stack']
+        self.n_envs = config['n_envs']
+        H, W, C = self.state_dims
+        assert C % self.k == 0, "the channels of the observations must be 'frame_stack' stacked frames."
+        self.c = C // self.k
+        self.n_frames = int(config['frame_memory_size'] or self.max_size + self.max_size // 16)
+        assert self.n_frames >= 2 * self.k, "the frame store must hold at least two stacks."
+        self.frames = torch.zeros((self.n_frames, H, W, self.c), dtype=torch.uint8, device=self.device)
+        if self.pin_memory:
+            self.frames = self.frames.pin_memory()
+        # absolute indices of the frames of the stacks (the frame store index is taken modulo n_frames).
+        self.S = self._new_storage((self.k, ), np.int64)
+        self.S_ = self._new_storage((self.k, ), np.int64)
+        # frames written in total.
+        self.frame_c = 0
+        # the last next state of each env and the indices of its frames.
+        self.last_next_state = [None] * self.n_envs
+        self.last_next_index = [None] * self.n_envs
+
+    def _write_frame(self, frame):
+        self.frames[self.frame_c % self.n_frames].copy_(torch.as_tensor(frame))
+        self.frame_c += 1
+        return self.frame_c - 1
+
+    def _write_stack(self, stack):
+        """
+        :param stack: (ndarray) k x H x W x c frames.
+        :return: (list) the indices of the k frames of stack, the frames equal to the previous one not written.
+        """
+        index = []
+        for m in range(self.k):
+            if m > 0 and np.array_equal(stack[m], stack[m - 1]):
+                index.append(index[-1])
+            else:
+                index.append(self._write_frame(stack[m]))
+        return index
+
+    def _frame_major(self, stacks):
+        # n x H x W x (k * c) -> n x k x H x W x c, so that the frames compared and written are contiguous.
+        n, H, W, _ = stacks.shape
+        return np.ascontiguousarray(np.moveaxis(stacks.reshape(n, H, W, self.k, self.c), 3, 1), dtype=np.uint8)
+
+    def _frame_indices(self, states, next_states):
+        n = states.shape[0]
+        states, next_states = self._frame_major(states), self._frame_major(next_states)
+        state_index = np.zeros((n, self.k), dtype=np.int64)
+        next_index = np.zeros((n, self.k), dtype=np.int64)
+        for i in range(n):
+            e = i % self.n_envs
+            s, s_ = states[i], next_states[i]
+            if self.last_next_state[e] is not None and np.array_equal(s, self.last_next_state[e]):
+                state_index[i] = self.last_next_index[e]
+            else:
+                state_index[i] = self._write_stack(s)
+            if np.array_equal(s_[:-1], s[1:]):
+                next_index[i, :-1] = state_index[i, 1:]
+                next_index[i, -1] = self._write_frame(s_[-1])
+            else:
+                next_index[i] = self._write_stack(s_)
+            self.last_next_state[e] = s_.copy()
+            self.last_next_index[e] = next_index[i].copy()
+        return state_index, next_index
+
+    def _store(self, transitions, slices):
+        state_index, next_index = self._frame_indices(np.asarray(transitions['state']),
+                                                      np.asarray(transitions['next_state']))
+        self._write(self.S, state_index, slices)
+        self._write(self.S_, next_index, slices)
+        self._store_common(transitions, slices)
+
+    def _valid(self, index):
+        """
+        :return: (Tensor) whether the frames of the transitions of index are still in the frame store.
+        """
+        oldest = self.frame_c - self.n_frames
+        return (self.S[index].min(-1)[0] >= oldest) & (self.S_[index].min(-1)[0] >= oldest)
+
+    def _sample_index(self, size, shape):
+        index = torch.randint(0, size, shape, device=self.device)
+        invalid = ~self._valid(index)
+        while invalid.any():
+            index[invalid] = torch.randint(0, size, (int(invalid.sum()), ), device=self.device)
+            invalid = ~self._valid(index)
+        return index
+
+    def _gather_stacks(self, frame_index):
+        frames = self._gather_rows(self.frames, frame_index % self.n_frames)
+        # ... x k x H x W x c -> ... x H x W x (k * c), the oldest frame first.
+        frames = frames.movedim(-4, -2)
+        return frames.reshape(frames.shape[:-2] + (self.k * self.c, )).float()
+
+    def _gather_states(self, index):
+        return self._gather_stacks(self.S[index]), self._gather_stacks(self.S_[index])
+
     def reset_buffer(self):
-        databuffer.reset_buffer(self)
-        self.distri = np.zeros([0, self.n_actions])
-        self.logpac = np.zeros([0, 1], dtype=np.float32)
\ No newline at end of file
+        databuffer_torch.reset_buffer(self)
+        self.frame_c = 0
+        self.last_next_state = [None] * self.n_envs
+        self.last_next_index = [None] * self.n_envs
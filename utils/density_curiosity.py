@@ -1,5 +1,5 @@
 import numpy as np
-from sklearn.neighbors import KernelDensity
+from sklearn.neighbors import KernelDensity, KDTree
 import torch
 import torch.nn.functional as F
 import os
@@ -7,8 +7,19 @@ from scipy.special import entr
 import pickle
 from collections import deque
 
+from utils.goal_grid import GoalGrid
+
 class KernalDensityEstimator(object):
-    def __init__(self, name, logger, samples=10000, kernel='gaussian', bandwidth=0.2, normalize=True):
+    """
+    Kernel density estimator of the goals collected so far: the goals are stored in a ring buffer of at most
+    buffer_size goals, and every fit() refits a sklearn KernelDensity on samples drawn from it.
+
+    :param buffer_size: (int) maximum number of stored goals, the buffer grows up to it.
+    :param dtype: storage type of the buffer.
+    :param n_score_samples: (int) number of the KDE samples scored by CuriosityAlphaMixture.update, None: all.
+    """
+    def __init__(self, name, logger, samples=10000, kernel='gaussian', bandwidth=0.2, normalize=True,
+                 buffer_size=1000000, dtype=np.float64, n_score_samples=None):
 
         self.kde = KernelDensity(kernel=kernel, bandwidth=bandwidth)
         self.kernel = kernel
@@ -25,6 +36,9 @@ class KernalDensityEstimator(object):
         self.time_steps = 0
         self.n_kde_samples = samples
         self.kde_samples = None
+        self.buffer_size = buffer_size
+        self.dtype = dtype
+        self.n_score_samples = n_score_samples
 
     def fit(self, n_kde_samples=10000):
         self.kde_samples = self._sample(n_kde_samples)
@@ -38,23 +52,39 @@ class KernalDensityEstimator(object):
         # Scoring samples is a bit expensive, so just use 1000 points
         num_samples = 1000
         s = self.fitted_kde.sample(num_samples)
-        entropy = - self.fitted_kde.score(s) / num_samples + np.log(self.kde_sample_std).sum()
-        self.logger.add_scalar('{}_entropy'.format(self.module_name), entropy, self.time_steps)
+        entropy = - self.fitted_kde.score(s) / num_samples + np.log(self.std).sum()
+        self.logger.add_scalar('{}_entropy'.format(self.name), entropy, self.time_steps)
 
     def normalize_samples(self, samples):
         assert self.normalize
         return (samples - self.mean) / self.std
 
-    def evaluate_log_density(self, samples):
+    def score_samples(self, samples):
+        """
+        :param samples: normalized samples.
+        :return: log-densities of the samples.
+        """
         assert self.fitted_kde is not None
+        return self.fitted_kde.score_samples(samples)
+
+    def scoring_samples(self):
+        """
+        :return: n_score_samples (all if None) of the last KDE samples, unnormalized.
+        """
+        samples = self.kde_samples
+        if self.n_score_samples is not None and self.n_score_samples < samples.shape[0]:
+            samples = samples[np.random.choice(samples.shape[0], self.n_score_samples, replace=False)]
+        return samples * self.std + self.mean if self.normalize else samples
+
+    def evaluate_log_density(self, samples):
         if self.normalize:
             samples = self.normalize_samples(samples)
-        return self.fitted_kde.score_samples(samples)
+        return self.score_samples(samples)
 
     def evaluate_elementwise_entropy(self, samples, beta=0.):
         if self.normalize:
             samples = self.normalize_samples(samples)
-        log_px = self.fitted_kde.score_samples(samples)
+        log_px = self.score_samples(samples)
         px = np.exp(log_px)
         elem_entropy = entr(px + beta)
         return elem_entropy
@@ -77,6 +107,13 @@ class KernalDensityEstimator(object):
             buffer_size = self.buffer.shape[0]
             data_dim = self.buffer.shape[1]
             assert data.shape[-1] == data_dim
+            if self.w_controller + batch_size > buffer_size and buffer_size < self.buffer_size:
+                # the buffer is not full yet, grow it instead of overwriting.
+                buffer = np.zeros((min(max(2 * buffer_size, self.w_controller + batch_size), self.buffer_size),
+                                   data_dim), dtype=self.dtype)
+                buffer[:self.w_controller] = self.buffer[:self.w_controller]
+                self.buffer = buffer
+                buffer_size = buffer.shape[0]
             if self.w_controller + batch_size > buffer_size:
                 # reset data number
                 self.w_controller = batch_size + self.w_controller - buffer_size
@@ -89,13 +126,160 @@ class KernalDensityEstimator(object):
             self.time_steps += batch_size
         else:
             # initialize buffer according to the data shape
-            self.buffer = np.zeros((1000000, data.shape[1]))
+            self.buffer = np.zeros((min(data.shape[0], self.buffer_size), data.shape[1]), dtype=self.dtype)
             self.extend(data)
 
     def _sample(self, batch_size):
         idx = np.random.randint(self.n_data, size=batch_size)
         return self.buffer[idx]
 
+    def _oldest_inds(self, n):
+        """
+        :return: buffer indices of the n oldest stored goals.
+        """
+        return (self.w_controller - self.n_data + np.arange(n)) % self.buffer.shape[0]
+
+    def _newest_inds(self, n):
+        """
+        :return: buffer indices of the n newest stored goals.
+        """
+        return (self.w_controller - n + np.arange(n)) % self.buffer.shape[0]
+
+
+class StreamingDensityEstimator(KernalDensityEstimator):
+    """
+    Kernel density estimator with a bounded cost per iteration, in float32.
+    The KDE samples are refitted incrementally: every fit() replaces the share of the samples that the goals
+    stored since the last fit() make up in the buffer, by some of these goals, so that the samples stay a uniform
+    sample of the buffer. The KD-tree of the samples is kept until more than refit_fraction of them are replaced:
+    in between, the densities are those of the tree corrected by the kernel sums of the replaced (subtracted) and
+    replacing (added) samples, computed with two small trees. The normalization of the goals is updated with the
+    tree.
+    The entropy is estimated on n_score_samples of the KDE samples instead of sampling from the KDE, and only
+    n_score_samples of them are scored by CuriosityAlphaMixture.update.
+
+    :param refit_fraction: (float) fraction of replaced samples from which the KD-tree is rebuilt.
+    :param rtol: (float) relative tolerance of the kernel sums of the trees.
+    """
+    def __init__(self, name, logger, samples=10000, kernel='gaussian', bandwidth=0.2, normalize=True,
+                 buffer_size=1000000, dtype=np.float32, n_score_samples=1000, refit_fraction=0.25, rtol=1e-3):
+        super(StreamingDensityEstimator, self).__init__(name, logger, samples, kernel, bandwidth, normalize,
+                                                        buffer_size, dtype, n_score_samples)
+        self.refit_fraction = refit_fraction
+        self.rtol = rtol
+        self.fitted_steps = 0
+        # KD-tree of the samples when it was built, and the samples replaced since then.
+        self.tree = None
+        self.tree_samples = None
+        self.replaced = None
+        self.added_tree = None
+        self.removed_tree = None
+
+    def fit(self, n_kde_samples=10000):
+        new_steps = min(self.time_steps - self.fitted_steps, self.n_data)
+        self.fitted_steps = self.time_steps
+        if self.kde_samples is None or self.kde_samples.shape[0] != n_kde_samples:
+            self.kde_samples = self._sample(n_kde_samples).astype(np.float32)
+            self._build_tree()
+        elif new_steps > 0:
+            n_replaced = np.random.binomial(n_kde_samples, float(new_steps) / self.n_data)
+            inds = np.random.choice(n_kde_samples, n_replaced, replace=False)
+            new_samples = self.buffer[self._newest_inds(new_steps)[np.random.randint(new_steps, size=n_replaced)]]
+            self.kde_samples[inds] = self.normalize_samples(new_samples) if self.normalize else new_samples
+            self.replaced[inds] = True
+            if np.count_nonzero(self.replaced) > self.refit_fraction * n_kde_samples:
+                self._build_tree()
+            else:
+                self.added_tree = KDTree(self.kde_samples[self.replaced])
+                self.removed_tree = KDTree(self.tree_samples[self.replaced])
+
+        # resubstitution estimate of the entropy.
+        scored = self.kde_samples[np.random.choice(n_kde_samples, min(self.n_score_samples, n_kde_samples),
+                                                   replace=False)]
+        entropy = - np.mean(self.score_samples(scored)) + np.log(self.std).sum()
+        self.logger.add_scalar('{}_entropy'.format(self.name), entropy, self.time_steps)
+
+    def _build_tree(self):
+        if self.normalize:
+            samples = self.kde_samples * self.std + self.mean if self.tree is not None else self.kde_samples
+            self.mean = np.mean(samples, axis=0, keepdims=True)
+            self.std = np.std(samples, axis=0, keepdims=True) + 1e-4
+            self.kde_samples = ((samples - self.mean) / self.std).astype(np.float32)
+        self.tree = KDTree(self.kde_samples)
+        self.tree_samples = self.kde_samples.copy()
+        self.replaced = np.zeros(self.kde_samples.shape[0], dtype=bool)
+        self.added_tree = self.removed_tree = None
+
+    def _kernel_sum(self, tree, samples):
+        return tree.kernel_density(samples, h=self.bandwidth, kernel=self.kernel, rtol=self.rtol, breadth_first=True)
+
+    def score_samples(self, samples):
+        assert self.tree is not None
+        samples = np.asarray(samples, dtype=np.float32)
+        density = self._kernel_sum(self.tree, samples)
+        if self.added_tree is not None:
+            density += self._kernel_sum(self.added_tree, samples) - self._kernel_sum(self.removed_tree, samples)
+        return np.log(np.maximum(density, 1e-300)) - np.log(self.kde_samples.shape[0])
+
+
+class GridDensityEstimator(KernalDensityEstimator):
+    """
+    Histogram density of the goals on a grid of cells of size 10 ** -decimals (utils.goal_grid.GoalGrid), for
+    low-dimensional goal spaces. The counts of the cells are updated with the stored and overwritten goals, so
+    that fit() has nothing to refit, and scoring a goal is a search of its cell. Every cell has a prior count.
+    The goals are not normalized.
+    """
+    def __init__(self, name, logger, samples=10000, decimals=1, prior=1., buffer_size=1000000, dtype=np.float32,
+                 n_score_samples=1000):
+        super(GridDensityEstimator, self).__init__(name, logger, samples, normalize=False, buffer_size=buffer_size,
+                                                   dtype=dtype, n_score_samples=n_score_samples)
+        self.grid = GoalGrid(decimals=decimals)
+        self.prior = prior
+        # sorted keys of the non-empty cells and their counts.
+        self.cell_keys = np.zeros(0, dtype=np.int64)
+        self.cell_counts = np.zeros(0, dtype=np.int64)
+
+    def extend(self, data):
+        data = np.asarray(data)
+        if self.buffer is None:
+            # the buffer is allocated and then extended through this method.
+            return super(GridDensityEstimator, self).extend(data)
+        n_overwritten = self.n_data + data.shape[0] - self.buffer_size
+        if n_overwritten > 0:
+            self._count(self.buffer[self._oldest_inds(n_overwritten)], -1)
+        super(GridDensityEstimator, self).extend(data)
+        self._count(data, 1)
+
+    def _count(self, goals, sign):
+        keys, counts = np.unique(self.grid.keys(goals)[1], return_counts=True)
+        pos = np.searchsorted(self.cell_keys, keys)
+        found = pos < self.cell_keys.shape[0]
+        found[found] = self.cell_keys[pos[found]] == keys[found]
+        self.cell_counts[pos[found]] += sign * counts[found]
+        if sign > 0:
+            self.cell_keys = np.insert(self.cell_keys, pos[~found], keys[~found])
+            self.cell_counts = np.insert(self.cell_counts, pos[~found], counts[~found])
+        else:
+            non_empty = self.cell_counts > 0
+            self.cell_keys, self.cell_counts = self.cell_keys[non_empty], self.cell_counts[non_empty]
+
+    def fit(self, n_kde_samples=10000):
+        self.kde_samples = self._sample(min(n_kde_samples, self.n_score_samples))
+        # entropy of the histogram.
+        p = (self.cell_counts + self.prior) / (self.n_data + self.prior * self.cell_counts.shape[0])
+        entropy = - np.sum(p * np.log(p)) + self.buffer.shape[1] * np.log(10. ** - self.grid.decimals)
+        self.logger.add_scalar('{}_entropy'.format(self.name), entropy, self.time_steps)
+
+    def score_samples(self, samples):
+        keys = self.grid.keys(np.asarray(samples))[1]
+        pos = np.searchsorted(self.cell_keys, keys)
+        found = pos < self.cell_keys.shape[0]
+        found[found] = self.cell_keys[pos[found]] == keys[found]
+        counts = np.zeros(keys.shape[0])
+        counts[found] = self.cell_counts[pos[found]]
+        log_volume = samples.shape[1] * np.log(10. ** - self.grid.decimals)
+        return np.log(counts + self.prior) - np.log(self.n_data + self.prior * self.cell_keys.shape[0]) - log_volume
+
 
 class CuriosityAlphaMixture(object):
     def __init__(self, ag_kde, dg_kde, logger):
@@ -114,8 +298,9 @@ class CuriosityAlphaMixture(object):
         return self.dg_kde.time_steps
 
     def update(self):
-        kde_samples = self.dg_kde.kde_samples
-        log_p_dg = self.dg_kde.fitted_kde.score_samples(kde_samples)
-        log_p_ag = self.ag_kde.fitted_kde.score_samples(kde_samples)
+        # both estimators score the same unnormalized samples.
+        samples = self.dg_kde.scoring_samples()
+        log_p_dg = self.dg_kde.evaluate_log_density(samples)
+        log_p_ag = self.ag_kde.evaluate_log_density(samples)
         self._alpha = 1. / max((self._beta + np.mean(log_p_dg) - np.mean(log_p_ag)), 1.)
         self.logger.add_scalar('curiosity_alpha', self._alpha, self.time_steps)
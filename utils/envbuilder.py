@@ -18,7 +18,7 @@ except Exception as e:
     "Could not find package robosuite. All relevant environments cannot be used."
 
 # import env wrappers
-from utils.vec_envs import DummyVecEnv, SubprocVecEnv, VecNormalize, VecFrameStack
+from utils.vec_envs import DummyVecEnv, SubprocVecEnv, BatchedSubprocVecEnv, VecNormalize, VecFrameStack
 from utils.monitor import Monitor
 from utils.atariwrapper import make_atari, wrap_deepmind
 from utils.wrapper import ActionNormalizer
@@ -70,20 +70,30 @@ def build_env(args):
     env_type, env_id = get_env_type(args)
 
     if env_type in {'atari'}:
-        if alg == 'DQN' or alg == 'DDQN' or alg == 'DuelingDQN' :
-            env = make_env(env_id, env_type, seed=seed, wrapper_kwargs={'frame_stack': True})
-        elif alg == 'TRPO':
+        if getattr(args, 'num_seeds', 1) > 1:
+            raise NotImplementedError("multi-seed training does not support atari envs.")
+        if alg == 'TRPO':
             env = make_env(env_id, env_type, seed=seed)
         else:
             frame_stack_size = 4
-            env = make_vec_env(env_id, env_type, nenv, seed)
+            # image observations are passed through shared memory instead of being pickled at each step.
+            env = make_vec_env(env_id, env_type, nenv, seed, shared_memory=True)
             env = VecFrameStack(env, frame_stack_size)
     else:
         flatten_dict_observations = alg not in {'HTRPO', 'HPG'}
-        env = make_vec_env(env_id, env_type, args.num_envs or 1, seed,
-                           flatten_dict_observations=flatten_dict_observations)
+        # with several seeds, the envs of each seed are a partition of one pool, seeded as in its own process.
+        num_seeds = getattr(args, 'num_seeds', 1)
+        # the dict observations of the goal envs and the images of the ravens envs are passed through shared
+        # memory, as well as any observations with --shared_memory.
+        shared_memory = getattr(args, 'shared_memory', False) or not flatten_dict_observations or env_type == 'ravens'
+        env = make_vec_env(env_id, env_type, (args.num_envs or 1) * num_seeds, seed,
+                           flatten_dict_observations=flatten_dict_observations, shared_memory=shared_memory,
+                           partition_seeds=[seed + i for i in range(num_seeds)] if num_seeds > 1 else None)
 
         if env_type in {'mujoco', 'robotics', 'robotsuite'} and alg not in {'HTRPO', 'HPG'}:
+           if num_seeds > 1:
+               raise NotImplementedError("VecNormalize would share its statistics between the seeds of the pool, "
+                                         "multi-seed training does not support normalized envs.")
            env = VecNormalize(env, norm_obs=not args.unnormobs, norm_reward=not args.unnormret)
 
     return env, env_type, env_id
@@ -92,28 +102,53 @@ def make_vec_env(env_id, env_type, num_env, seed,
                  wrapper_kwargs=None,
                  start_index=0,
                  flatten_dict_observations=True,
-                 render = False, reward = "sparse"):
+                 render = False, reward = "sparse",
+                 shared_memory=False,
+                 envs_per_worker=None,
+                 partition_seeds=None):
     """
     Create a wrapped, monitored SubprocVecEnv for Atari and MuJoCo.
+
+    :param shared_memory: (bool) transport observations, rewards and dones of the SubprocVecEnv workers through
+        shared memory instead of the pipes.
+    :param envs_per_worker: (int) number of environments stepped by each worker process. By default, the
+        environments are spread over all the cores, i.e. ceil(num_env / cpu_count) per worker.
+    :param partition_seeds: ([int]) seeds of consecutive partitions of num_env / len(partition_seeds) environments
+        (e.g. the seeds of multi-seed training). Each env is seeded with the seed of its partition plus its index in
+        it, instead of seed plus its index in the whole vectorized env.
     """
     wrapper_kwargs = wrapper_kwargs or {}
     mpi_rank = MPI.COMM_WORLD.Get_rank() if MPI else 0
     seed = seed + 10000 * mpi_rank if seed is not None else None
+    if partition_seeds is not None:
+        assert num_env % len(partition_seeds) == 0, "num_env must be a multiple of the number of partitions."
+        envs_per_partition = num_env // len(partition_seeds)
+        partition_seeds = [s + 10000 * mpi_rank for s in partition_seeds]
 
     def make_thunk(rank):
+        if partition_seeds is not None:
+            env_seed, rank = partition_seeds[rank // envs_per_partition], rank % envs_per_partition
+        else:
+            env_seed = seed
         return lambda: make_env(
             env_id=env_id,
             env_type=env_type,
             subrank=rank,
-            seed=seed,
+            seed=env_seed,
             wrapper_kwargs=wrapper_kwargs,
             flatten_dict_observations=flatten_dict_observations,
         )
 
     set_global_seeds(seed)
 
-    if num_env > 1:
-        return SubprocVecEnv([make_thunk(i + start_index) for i in range(num_env)])
+    if envs_per_worker is None:
+        envs_per_worker = int(np.ceil(num_env / multiprocessing.cpu_count()))
+
+    if num_env > 1 and envs_per_worker > 1:
+        return BatchedSubprocVecEnv([make_thunk(i + start_index) for i in range(num_env)],
+                                    envs_per_worker=envs_per_worker, shared_memory=shared_memory)
+    elif num_env > 1:
+        return SubprocVecEnv([make_thunk(i + start_index) for i in range(num_env)], shared_memory=shared_memory)
     else:
         return DummyVecEnv([make_thunk(start_index)])
 
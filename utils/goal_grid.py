@@ -0,0 +1,116 @@
+import numpy as np
+from gym import spaces
+
+def space_bounds(space):
+    """
+    :param space: gym space of the goals, or None.
+    :return: lower and upper bounds of the goals (d ndarrays), or None, None if they are unknown.
+    """
+    if isinstance(space, spaces.Box):
+        return space.low, space.high
+    if isinstance(space, spaces.MultiBinary):
+        return np.zeros(space.n), np.ones(space.n)
+    if isinstance(space, spaces.MultiDiscrete):
+        return np.zeros(space.nvec.shape), space.nvec - 1.
+    return None, None
+
+class GoalGrid(object):
+    """
+    Hash grid over the goal space. The goals are rounded to 'decimals' decimals, as by np.round, and every cell of
+    the grid, i.e. every rounded goal, gets one int64 key. A cell always gets the same key: when finite bounds of the
+    goals are declared and the d rounded coordinates fit in 63 // d bits each between them (e.g. the 2-D mazes, or
+    FetchPush goals in a box of side < 10485 with 2 decimals), the coordinates of the goals within the bounds are
+    packed into the key, and the key is a 64-bit hash of the coordinates otherwise (e.g. no bounds, goals out of
+    the bounds, or the 48 bits of FlipBit48).
+    Deduplicating goals then only sorts 1-D integer keys, instead of the lexicographic sort of the float rows of
+    np.unique(axis=0). Packed keys are >= 0 and hashed keys < 0, so that they never collide with each other.
+    Colliding hashed keys in a batch are detected, the batch is then deduplicated by np.unique.
+
+    The grid keeps the set of the keys of all the cells seen across iterations, to report the coverage of the goal
+    space.
+
+    :param decimals: (int) number of decimals of the rounded goals, 10 ** -decimals is the size of the cells.
+    :param low: (float or d ndarray) lower bounds of the goals, or None.
+    :param high: (float or d ndarray) upper bounds of the goals, or None.
+    """
+    def __init__(self, decimals = 2, low = None, high = None):
+        self.decimals = decimals
+        self.scale = 10. ** decimals
+        self.seen_keys = set()
+        self.low, self.high = low, high
+        # whether the coordinates within the bounds are packed into the keys, set on the first goals.
+        self.packed = None
+        # odd multipliers of the hash of the coordinates, one per goal dimension.
+        self._hash_coefs = None
+
+    def _init_packing(self, d):
+        self.packed = False
+        if self.low is None or self.high is None or not (np.all(np.isfinite(self.low)) and
+                                                         np.all(np.isfinite(self.high))):
+            return
+        # rounded coordinates of the bounds, one per goal dimension.
+        self._low = np.broadcast_to(np.rint(np.round(self.low, self.decimals) * self.scale).astype(np.int64), (d,))
+        self._high = np.broadcast_to(np.rint(np.round(self.high, self.decimals) * self.scale).astype(np.int64), (d,))
+        self._bits = 63 // d
+        self.packed = self._bits > 0 and d * self._bits <= 63 and \
+                      bool(np.all(self._high - self._low < (1 << self._bits)))
+
+    @property
+    def n_cells(self):
+        """
+        :return: (int) number of cells seen since the creation of the grid.
+        """
+        return len(self.seen_keys)
+
+    def keys(self, goals):
+        """
+        :param goals: N x d ndarray.
+        :return: rounded goals (N x d ndarray, same dtype as goals) and their keys (N int64 ndarray).
+        """
+        rounded = goals.round(decimals=self.decimals)
+        coords = np.rint(rounded * self.scale).astype(np.int64)
+        if self.packed is None:
+            self._init_packing(coords.shape[1])
+        if not self.packed:
+            return rounded, self._hash(coords)
+        inside = np.all((coords >= self._low) & (coords <= self._high), axis=1)
+        shifts = np.arange(coords.shape[1], dtype=np.int64) * self._bits
+        keys = np.bitwise_or.reduce((coords - self._low) << shifts, axis=1)
+        if not np.all(inside):
+            keys[~inside] = self._hash(coords[~inside])
+        return rounded, keys
+
+    def _hash(self, coords):
+        if self._hash_coefs is None or self._hash_coefs.shape[0] != coords.shape[1]:
+            rng = np.random.RandomState(coords.shape[1])
+            self._hash_coefs = rng.randint(0, 2 ** 62, size=coords.shape[1], dtype=np.uint64) * 2 + 1
+        # uint64 products and sums wrap around, followed by the finalizer of MurmurHash3.
+        h = (coords.view(np.uint64) * self._hash_coefs).sum(axis=1, dtype=np.uint64)
+        h ^= h >> np.uint64(33)
+        h *= np.uint64(0xff51afd7ed558ccd)
+        h ^= h >> np.uint64(33)
+        return ((h >> np.uint64(1)) | np.uint64(1 << 63)).view(np.int64)
+
+    def unique(self, goals):
+        """
+        :param goals: N x d ndarray.
+        :return: the distinct rounded goals, ordered by key, and their keys.
+        """
+        rounded, keys = self.keys(goals)
+        keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        rounded_unique = rounded[first]
+        if keys.shape[0] > 0 and keys[0] < 0 and not np.array_equal(rounded_unique[inverse.reshape(-1)], rounded):
+            # two cells with the same hashed key.
+            rounded_unique = np.unique(rounded, axis=0)
+            keys = self.keys(rounded_unique)[1]
+        return rounded_unique, keys
+
+    def add(self, keys):
+        """
+        Add the cells of keys to the seen cells.
+        :param keys: int64 ndarray, e.g. returned by unique().
+        :return: (int) number of new cells.
+        """
+        n_cells = len(self.seen_keys)
+        self.seen_keys.update(keys.tolist())
+        return len(self.seen_keys) - n_cells
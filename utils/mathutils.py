@@ -1,4 +1,6 @@
 import numpy as np
+import torch
+from scipy.spatial import cKDTree
 
 def explained_variance(ypred,y):
     """
@@ -35,4 +37,107 @@ def half_uniform_to_uniform(uniform_range, weight, axis = 0):
     :return: a transformer
     """
 
-    pass
\ No newline at end of file
+    pass
+
+def backward_linear_scan(x, coef, block_size = 8):
+    """
+    Solves y[t] = x[t] + coef[t] * y[t + 1] backwards (y[N] = 0) without a loop over all the steps. The sequence
+    is split into blocks which are scanned in parallel, then the values at the block heads, which satisfy the
+    same kind of recursion, are computed recursively and propagated back into the blocks.
+    :param x: N Tensor.
+    :param coef: N Tensor.
+    :param block_size: number of steps in each block.
+    :return: N Tensor.
+    """
+    n = x.numel()
+    b = max(2, block_size)
+    if n <= b:
+        y = x.clone()
+        for t in range(n - 2, -1, -1):
+            y[t] += coef[t] * y[t + 1]
+        return y
+    n_b = (n + b - 1) // b
+    pad = n_b * b - n
+    # n_b x b
+    y = torch.cat((x, x.new_zeros(pad))).reshape(n_b, b)
+    coef = torch.cat((coef, coef.new_zeros(pad))).reshape(n_b, b)
+    # prod[:, t] = coef[:, t] * ... * coef[:, b - 1]: how the head of the next block contributes to step t.
+    prod = coef.clone()
+    for t in range(b - 2, -1, -1):
+        y[:, t] += coef[:, t] * y[:, t + 1]
+        prod[:, t] *= prod[:, t + 1]
+    heads = backward_linear_scan(y[:, 0].clone(), prod[:, 0].clone(), block_size)
+    next_heads = torch.cat((heads[1:], heads.new_zeros(1)))
+    y += prod * next_heads.unsqueeze(1)
+    return y.reshape(-1)[:n]
+
+def discount_cumsum(x, dones, discount):
+    """
+    Segment-aware discounted cumulative sum: y[t] = x[t] + discount * y[t + 1], where the recursion is cut
+    after every step whose done flag is not 0.
+    :param x: N (or N x 1) Tensor.
+    :param dones: N (or N x 1) Tensor of done flags. 0: undone, 1: real done, 2: undone but the final state.
+    :param discount: a scalar.
+    :return: N Tensor.
+    """
+    x = x.reshape(-1)
+    # accumulate in double precision, long episodes are summed up in many levels.
+    coef = discount * (dones.reshape(-1) == 0).double()
+    return backward_linear_scan(x.double(), coef).type_as(x)
+
+def generalized_advantage_estimation(rewards, values, dones, gamma, lamb, bootstrap_values = None):
+    """
+    Returns and GAE advantages of a flat batch of episodes. HIGH-DIMENSIONAL CONTINUOUS CONTROL USING
+    GENERALIZED ADVANTAGE ESTIMATION. 2016 ICLR
+    :param rewards: N (or N x 1) Tensor.
+    :param values: N (or N x 1) Tensor, value estimations of the states.
+    :param dones: N (or N x 1) Tensor of done flags. 0: undone, 1: real done, 2: undone but the final state.
+    :param gamma: discount factor.
+    :param lamb: GAE lambda.
+    :param bootstrap_values: values of the next states of all the steps flagged by 2, in order. If None,
+                             these steps are not bootstrapped.
+    :return: returns (not bootstrapped) and advantages, both are N Tensors.
+    """
+    rewards = rewards.reshape(-1)
+    values = values.reshape(-1)
+    dones = dones.reshape(-1)
+    returns = discount_cumsum(rewards, dones, gamma)
+    next_values = torch.cat((values[1:], values.new_zeros(1)))
+    next_values[dones != 0] = 0
+    if bootstrap_values is not None:
+        next_values[dones == 2] = bootstrap_values.reshape(-1).type_as(values)
+    delta = rewards + gamma * next_values - values
+    advantages = discount_cumsum(delta, dones, gamma * lamb)
+    return returns, advantages
+
+def farthest_point_sampling(points, k, first = 0, using_kdtree = False):
+    """
+    Greedy farthest point sampling: starting from points[first], the point farthest from all the selected points
+    is selected, k - 1 times. Only the distance of every point to its nearest selected point is kept, and lowered
+    with each new selection: O(N * k) time and O(N) memory.
+    With using_kdtree, a point p can only get closer to the new selected point c if |p - c| < min_dist(p), and
+    min_dist(p) <= min_dist(c) because c is the farthest point, so only the points in the ball of radius
+    min_dist(c) around c, queried from a KD-tree of the points, are updated. The balls shrink as the selected points
+    cover the candidates, which pays off for large N.
+    :param points: N x d ndarray of distinct points.
+    :param k: number of points to select, at most N.
+    :param first: index of the first selected point.
+    :param using_kdtree: update the distances only in the balls queried from a KD-tree.
+    :return: k ndarray, indices of the selected points in the order of selection.
+    """
+    k = min(k, points.shape[0])
+    selected = np.zeros(k, dtype=np.int64)
+    selected[0] = first
+    min_dists = np.linalg.norm(points - points[first], axis=-1)
+    tree = cKDTree(points) if using_kdtree else None
+    for i in range(1, k):
+        # the selected points are at distance 0, they are not selected again.
+        ind = int(np.argmax(min_dists))
+        selected[i] = ind
+        if tree is None:
+            np.minimum(min_dists, np.linalg.norm(points - points[ind], axis=-1), out=min_dists)
+        else:
+            # the radius is slightly enlarged, the distances of the tree and of numpy may differ by rounding.
+            ball = np.array(tree.query_ball_point(points[ind], min_dists[ind] * (1 + 1e-6)), dtype=np.int64)
+            min_dists[ball] = np.minimum(min_dists[ball], np.linalg.norm(points[ball] - points[ind], axis=-1))
+    return selected
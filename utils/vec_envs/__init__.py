@@ -1,6 +1,7 @@
 from .dummy_vec_env import DummyVecEnv
 from .subproc_vec_env import SubprocVecEnv
+from .batched_subproc_vec_env import BatchedSubprocVecEnv
 from .vec_normalize import VecNormalize
-from .vec_frame_stack import VecFrameStack
+from .vec_frame_stack import VecFrameStack, StackedObs
 # from .vec_env_old import *
 from .utils import *
\ No newline at end of file
@@ -0,0 +1,223 @@
+import multiprocessing
+from collections import OrderedDict
+
+import gym
+import numpy as np
+
+from .vec_env import VecEnv, CloudpickleWrapper
+from .dummy_vec_env import DummyVecEnv
+from .subproc_vec_env import SubprocVecEnv, _attach_shm, _write_obs
+
+def _batched_worker(remote, parent_remote, env_fns_wrapper):
+    parent_remote.close()
+    # the envs of the worker are stepped sequentially, exactly as in a DummyVecEnv.
+    envs = DummyVecEnv(env_fns_wrapper.var)
+    # shared memory buffers, only used if the main process attaches them.
+    shm_blocks, keys, buf_obs, buf_rew, buf_done = [], None, None, None, None
+    while True:
+        try:
+            cmd, data = remote.recv()
+            if cmd == 'step':
+                actions, local_indices = data
+                envs.step_async(actions, local_indices)
+                observation, reward, done, info = envs.step_wait(local_indices)
+                if keys is None:
+                    remote.send((observation, reward, done, info))
+                else:
+                    _write_obs(buf_obs, keys, observation, local_indices)
+                    buf_rew[local_indices] = reward
+                    buf_done[local_indices] = done
+                    remote.send(info)
+            elif cmd == 'seed':
+                remote.send(envs.seed(data))
+            elif cmd == 'reset':
+                # the observations of all the envs of the worker are returned, including the ones not reset.
+                observation = envs.reset(data)
+                if keys is None:
+                    remote.send(observation)
+                else:
+                    _write_obs(buf_obs, keys, observation)
+                    remote.send(None)
+            elif cmd == 'attach_shm':
+                rows, keys, shm_specs = data
+                shm_blocks, buf_obs = _attach_shm(shm_specs, rows)
+                buf_rew, buf_done = buf_obs.pop(-2), buf_obs.pop(-1)
+                remote.send(None)
+            elif cmd == 'render':
+                remote.send(envs.get_images())
+            elif cmd == 'close':
+                envs.close()
+                buf_obs = buf_rew = buf_done = None
+                for block in shm_blocks:
+                    block.close()
+                remote.close()
+                break
+            elif cmd == 'get_spaces':
+                remote.send((envs.observation_space, envs.action_space))
+            elif cmd == 'env_method':
+                method_name, method_args, method_kwargs, indices = data
+                remote.send(envs.env_method(method_name, *method_args, indices=indices, **method_kwargs))
+            elif cmd == 'get_attr':
+                remote.send(envs.get_attr(data[0], data[1]))
+            elif cmd == 'set_attr':
+                remote.send(envs.set_attr(data[0], data[1], data[2]))
+            else:
+                raise NotImplementedError("`{}` is not implemented in the worker".format(cmd))
+        except EOFError:
+            break
+
+
+class BatchedSubprocVecEnv(SubprocVecEnv):
+    """
+    Multiprocess vectorized wrapper that packs several environments into each worker process. The environments of
+    a worker are stepped sequentially, like in a DummyVecEnv, and each worker answers with a single batched message.
+    This is useful when there are more environments than cores, or when the environments are so cheap to step
+    (e.g. FlipBit, mazes, Fetch) that one process per environment is dominated by the IPC cost.
+
+    :param env_fns: ([callable]) A list of functions that will create the environments
+        (each callable returns a `Gym.Env` instance when called).
+    :param envs_per_worker: (int) number of environments stepped by each worker. The last worker gets the
+        remaining environments.
+    :param start_method: (str) method used to start the subprocesses, see SubprocVecEnv.
+    :param shared_memory: (bool) transport observations, rewards and dones through shared memory, see SubprocVecEnv.
+    """
+
+    def __init__(self, env_fns, envs_per_worker=1, start_method=None, shared_memory=False):
+        self.waiting = False
+        # workers with a pending step, once per step request.
+        self.stepping = []
+        self.closed = False
+        n_envs = len(env_fns)
+        self.envs_per_worker = max(1, int(envs_per_worker))
+        # rows [begin, end) of the vectorized environment are stepped by each worker.
+        bounds = list(range(0, n_envs, self.envs_per_worker)) + [n_envs]
+        self.worker_slices = [slice(b, e) for b, e in zip(bounds[:-1], bounds[1:])]
+
+        if start_method is None:
+            forkserver_available = 'forkserver' in multiprocessing.get_all_start_methods()
+            start_method = 'forkserver' if forkserver_available else 'spawn'
+        ctx = multiprocessing.get_context(start_method)
+
+        n_workers = len(self.worker_slices)
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe(duplex=True) for _ in range(n_workers)])
+        self.processes = []
+        for work_remote, remote, rows in zip(self.work_remotes, self.remotes, self.worker_slices):
+            args = (work_remote, remote, CloudpickleWrapper(env_fns[rows]))
+            # daemon=True: if the main process crashes, we should not cause things to hang
+            process = ctx.Process(target=_batched_worker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        self.remotes[0].send(('get_spaces', None))
+        observation_space, action_space = self.remotes[0].recv()
+        VecEnv.__init__(self, n_envs, observation_space, action_space)
+
+        self.shared_memory = shared_memory
+        if self.shared_memory:
+            self._init_shared_memory()
+
+    def _remote_rows(self):
+        return self.worker_slices
+
+    def _group_indices(self, indices):
+        """
+        Group environment indices by worker.
+
+        :param indices: (None,int,Iterable) refers to indices of envs.
+        :return: (OrderedDict<int, [int]>) local indices of the targeted envs, keyed by worker.
+        """
+        groups = OrderedDict()
+        for idx in self._get_indices(indices):
+            worker = idx // self.envs_per_worker
+            groups.setdefault(worker, []).append(idx - self.worker_slices[worker].start)
+        return groups
+
+    def _call_workers(self, cmd, indices, payload=()):
+        groups = self._group_indices(indices)
+        for worker, local_indices in groups.items():
+            self.remotes[worker].send((cmd, tuple(payload) + (local_indices,)))
+        results = {}
+        for worker, local_indices in groups.items():
+            for local_idx, result in zip(local_indices, self.remotes[worker].recv()):
+                results[self.worker_slices[worker].start + local_idx] = result
+        # results are returned in the order of the requested indices.
+        return [results[idx] for idx in self._get_indices(indices)]
+
+    def step_async(self, actions, indices=None):
+        """
+        Step the envs refered to by indices, which are expected in increasing order. Several disjoint groups of
+        envs of the same worker can be pending: the worker steps them one after the other, so step_wait must be
+        called for the groups in the order of the step_async calls.
+        """
+        groups = self._group_indices(indices)
+        begin = 0
+        for worker, local_indices in groups.items():
+            self.remotes[worker].send(('step', (actions[begin: begin + len(local_indices)], local_indices)))
+            begin += len(local_indices)
+        self.stepping.extend(groups.keys())
+        self.waiting = True
+
+    def step_wait(self, indices=None):
+        groups = self._group_indices(indices)
+        results = [self.remotes[worker].recv() for worker in groups.keys()]
+        for worker in groups.keys():
+            self.stepping.remove(worker)
+        self.waiting = len(self.stepping) > 0
+        if self.shared_memory:
+            rows = list(self._get_indices(indices))
+            infos = [info for worker_infos in results for info in worker_infos]
+            return self._obs_from_buf(rows), self.buf_rews[rows], self.buf_dones[rows], infos
+        obs, rews, dones, infos = zip(*results)
+        return (_concat_obs(obs, self.observation_space), np.concatenate(rews), np.concatenate(dones),
+                [info for worker_infos in infos for info in worker_infos])
+
+    def seed(self, seed=None):
+        for remote, rows in zip(self.remotes, self.worker_slices):
+            remote.send(('seed', seed + rows.start))
+        return [s for remote in self.remotes for s in remote.recv()]
+
+    def reset(self, i=None):
+        groups = self._group_indices(i)
+        for worker, remote in enumerate(self.remotes):
+            remote.send(('reset', groups.get(worker, [])))
+        obs = [remote.recv() for remote in self.remotes]
+        if self.shared_memory:
+            return self._obs_from_buf()
+        return _concat_obs(obs, self.observation_space)
+
+    def get_images(self):
+        for remote in self.remotes:
+            remote.send(('render', None))
+        return [img for remote in self.remotes for img in remote.recv()]
+
+    def get_attr(self, attr_name, indices=None):
+        """Return attribute from vectorized environment (see base class)."""
+        return self._call_workers('get_attr', indices, (attr_name,))
+
+    def set_attr(self, attr_name, value, indices=None):
+        """Set attribute inside vectorized environments (see base class)."""
+        groups = self._group_indices(indices)
+        for worker, local_indices in groups.items():
+            self.remotes[worker].send(('set_attr', (attr_name, value, local_indices)))
+        for worker in groups.keys():
+            self.remotes[worker].recv()
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        """Call instance methods of vectorized environments."""
+        return self._call_workers('env_method', indices, (method_name, method_args, method_kwargs))
+
+
+def _concat_obs(obs, space):
+    """
+    Concatenate the batched observations of the workers, depending on the observation space.
+
+    :param obs: (list<X> where X is dict<ndarray>, tuple<ndarray> or ndarray) observations, one batch per worker.
+    :return (OrderedDict<ndarray>, tuple<ndarray> or ndarray) observations with the environment index as first axis.
+    """
+    if isinstance(space, gym.spaces.Dict):
+        return OrderedDict([(k, np.concatenate([o[k] for o in obs])) for k in space.spaces.keys()])
+    elif isinstance(space, gym.spaces.Tuple):
+        return tuple((np.concatenate([o[i] for o in obs]) for i in range(len(space.spaces))))
+    else:
+        return np.concatenate(obs)
@@ -32,17 +32,19 @@ class DummyVecEnv(VecEnv):
         self.buf_dones = np.zeros((self.num_envs,), dtype=np.bool)
         self.buf_rews = np.zeros((self.num_envs,), dtype=np.float32)
         self.buf_infos = [{} for _ in range(self.num_envs)]
-        self.actions = None
+        # pending action of each env, set by step_async.
+        self.actions = [None] * self.num_envs
         self.metadata = env.metadata
 
     def __getattr__(self, name):
         return self.get_attr(name)[0]
 
-    def step_async(self, actions):
-        self.actions = actions
+    def step_async(self, actions, indices=None):
+        for action, env_idx in zip(actions, self._get_indices(indices)):
+            self.actions[env_idx] = action
 
-    def step_wait(self):
-        for env_idx in range(self.num_envs):
+    def step_wait(self, indices=None):
+        for env_idx in self._get_indices(indices):
             obs, self.buf_rews[env_idx], self.buf_dones[env_idx], self.buf_infos[env_idx] =\
                 self.envs[env_idx].step(self.actions[env_idx])
             if self.buf_dones[env_idx]:
@@ -50,8 +52,12 @@ class DummyVecEnv(VecEnv):
                 self.buf_infos[env_idx]['terminal_observation'] = obs
                 obs = self.envs[env_idx].reset()
             self._save_obs(env_idx, obs)
-        return (self._obs_from_buf(), np.copy(self.buf_rews), np.copy(self.buf_dones),
-                deepcopy(self.buf_infos))
+        if indices is None:
+            return (self._obs_from_buf(), np.copy(self.buf_rews), np.copy(self.buf_dones),
+                    deepcopy(self.buf_infos))
+        indices = list(self._get_indices(indices))
+        return (self._obs_from_buf(indices), self.buf_rews[indices], self.buf_dones[indices],
+                deepcopy([self.buf_infos[i] for i in indices]))
 
     def seed(self, seed=None):
         seeds = list()
@@ -96,8 +102,10 @@ class DummyVecEnv(VecEnv):
             else:
                 self.buf_obs[key][env_idx] = obs[key]
 
-    def _obs_from_buf(self):
-        return dict_to_obs(self.observation_space, copy_obs_dict(self.buf_obs))
+    def _obs_from_buf(self, indices=None):
+        if indices is None:
+            return dict_to_obs(self.observation_space, copy_obs_dict(self.buf_obs))
+        return dict_to_obs(self.observation_space, OrderedDict([(k, v[indices]) for k, v in self.buf_obs.items()]))
 
     def get_attr(self, attr_name, indices=None):
         """Return attribute from vectorized environment (see base class)."""
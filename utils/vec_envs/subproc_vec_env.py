@@ -6,10 +6,32 @@ import gym
 import numpy as np
 
 from .vec_env import *
+from .utils import copy_obs_dict, dict_to_obs, obs_space_info
+
+def _attach_shm(shm_specs, index):
+    """
+    Open the shared memory buffers created by the main process.
+
+    :param shm_specs: ([(str, tuple, np.dtype)]) name, shape and dtype of each buffer. The first axis of each
+        buffer is the environment index.
+    :param index: (int or slice) index of the environment(s) stepped by the worker.
+    :return: ([SharedMemory], [ndarray]) opened shared memory blocks and the views of the environments' rows.
+    """
+    from multiprocessing.shared_memory import SharedMemory
+    blocks = [SharedMemory(name=name) for name, _, _ in shm_specs]
+    views = [np.ndarray(shape, dtype=dtype, buffer=block.buf)[index, ...]
+             for block, (_, shape, dtype) in zip(blocks, shm_specs)]
+    return blocks, views
+
+def _write_obs(buf_obs, keys, observation, rows=Ellipsis):
+    for key, buf in zip(keys, buf_obs):
+        buf[rows] = observation if key is None else observation[key]
 
 def _worker(remote, parent_remote, env_fn_wrapper):
     parent_remote.close()
     env = env_fn_wrapper.var()
+    # shared memory buffers, only used if the main process attaches them.
+    shm_blocks, keys, buf_obs, buf_rew, buf_done = [], None, None, None, None
     while True:
         try:
             cmd, data = remote.recv()
@@ -19,16 +41,36 @@ def _worker(remote, parent_remote, env_fn_wrapper):
                     # save final observation where user can get it, then reset
                     info['terminal_observation'] = observation
                     observation = env.reset()
-                remote.send((observation, reward, done, info))
+                if keys is None:
+                    remote.send((observation, reward, done, info))
+                else:
+                    # only the info dict goes through the pipe.
+                    _write_obs(buf_obs, keys, observation)
+                    buf_rew[...] = reward
+                    buf_done[...] = done
+                    remote.send(info)
             elif cmd == 'seed':
                 remote.send(env.seed(data))
             elif cmd == 'reset':
                 observation = env.reset()
-                remote.send(observation)
+                if keys is None:
+                    remote.send(observation)
+                else:
+                    _write_obs(buf_obs, keys, observation)
+                    remote.send(None)
+            elif cmd == 'attach_shm':
+                index, keys, shm_specs = data
+                shm_blocks, buf_obs = _attach_shm(shm_specs, index)
+                buf_rew, buf_done = buf_obs.pop(-2), buf_obs.pop(-1)
+                remote.send(None)
             elif cmd == 'render':
                 remote.send(env.render(data))
             elif cmd == 'close':
                 env.close()
+                # views must be released before the shared memory is closed.
+                buf_obs = buf_rew = buf_done = None
+                for block in shm_blocks:
+                    block.close()
                 remote.close()
                 break
             elif cmd == 'get_spaces':
@@ -69,10 +111,15 @@ class SubprocVecEnv(VecEnv):
     :param start_method: (str) method used to start the subprocesses.
            Must be one of the methods returned by multiprocessing.get_all_start_methods().
            Defaults to 'forkserver' on available platforms, and 'spawn' otherwise.
+    :param shared_memory: (bool) if True, workers write observations, rewards and dones into shared memory
+           buffers laid out by `obs_space_info`, and only the info dicts are sent through the pipes. This avoids
+           pickling large (e.g. image) observations on each step.
     """
 
-    def __init__(self, env_fns, start_method=None):
+    def __init__(self, env_fns, start_method=None, shared_memory=False):
         self.waiting = False
+        # remotes with a pending step.
+        self.stepping = []
         self.closed = False
         n_envs = len(env_fns)
 
@@ -98,19 +145,62 @@ class SubprocVecEnv(VecEnv):
         observation_space, action_space = self.remotes[0].recv()
         VecEnv.__init__(self, len(env_fns), observation_space, action_space)
 
+        self.shared_memory = shared_memory
+        if self.shared_memory:
+            self._init_shared_memory()
+        else:
+            # last observation of each env, the envs that are not reset by a partial reset keep theirs.
+            self.keys, shapes, dtypes = obs_space_info(self.observation_space)
+            self.buf_obs = OrderedDict([(k, np.zeros((self.num_envs,) + tuple(shapes[k]), dtype=dtypes[k]))
+                                        for k in self.keys])
+
+    def _init_shared_memory(self):
+        # multiprocessing.shared_memory requires python >= 3.8, only imported when the shared memory is used.
+        from multiprocessing.shared_memory import SharedMemory
+        self.keys, shapes, dtypes = obs_space_info(self.observation_space)
+        # one buffer for each observation key, plus rewards and dones. The first axis is the env index.
+        layouts = [((self.num_envs,) + tuple(shapes[k]), np.dtype(dtypes[k])) for k in self.keys]
+        layouts += [((self.num_envs,), np.dtype(np.float32)), ((self.num_envs,), np.dtype(np.bool_))]
+        self.shm_blocks = [SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+                           for shape, dtype in layouts]
+        views = [np.ndarray(shape, dtype=dtype, buffer=block.buf) for block, (shape, dtype) in zip(self.shm_blocks, layouts)]
+        self.buf_obs = OrderedDict(zip(self.keys, views[:-2]))
+        self.buf_rews, self.buf_dones = views[-2], views[-1]
+        shm_specs = [(block.name, shape, dtype) for block, (shape, dtype) in zip(self.shm_blocks, layouts)]
+        for remote, rows in zip(self.remotes, self._remote_rows()):
+            remote.send(('attach_shm', (rows, self.keys, shm_specs)))
+        for remote in self.remotes:
+            remote.recv()
+
+    def _remote_rows(self):
+        """
+        :return: ([int or slice]) rows of the shared memory buffers written by each worker.
+        """
+        return list(range(self.num_envs))
+
     def __getattr__(self, name):
         return self.get_attr(name)[0]
 
-    def step_async(self, actions):
-        for remote, action in zip(self.remotes, actions):
-            remote.send(('step', action))
+    def step_async(self, actions, indices=None):
+        indices = self._get_indices(indices)
+        for idx, action in zip(indices, actions):
+            self.remotes[idx].send(('step', action))
+        self.stepping.extend(indices)
         self.waiting = True
 
 
-    def step_wait(self):
-        results = [remote.recv() for remote in self.remotes]
-        self.waiting = False
+    def step_wait(self, indices=None):
+        indices = self._get_indices(indices)
+        results = [self.remotes[idx].recv() for idx in indices]
+        for idx in indices:
+            self.stepping.remove(idx)
+        self.waiting = len(self.stepping) > 0
+        if self.shared_memory:
+            rows = list(indices)
+            return (self._obs_from_buf(rows), self.buf_rews[rows], self.buf_dones[rows], tuple(results))
         obs, rews, dones, infos = zip(*results)
+        for idx, observation in zip(indices, obs):
+            _write_obs(self.buf_obs.values(), self.keys, observation, idx)
         return _flatten_obs(obs, self.observation_space), np.stack(rews), np.stack(dones), infos
 
 
@@ -121,22 +211,37 @@ class SubprocVecEnv(VecEnv):
 
 
     def reset(self, i=None):
-        for idx in self._get_indices(i):
+        indices = self._get_indices(i)
+        for idx in indices:
             self.remotes[idx].send(('reset', None))
-        obs = [remote.recv() for remote in self.remotes]
-        return _flatten_obs(obs, self.observation_space)
+        for idx in indices:
+            observation = self.remotes[idx].recv()
+            if not self.shared_memory:
+                _write_obs(self.buf_obs.values(), self.keys, observation, idx)
+        return self._obs_from_buf()
+
+    def _obs_from_buf(self, rows=None):
+        if rows is None:
+            return dict_to_obs(self.observation_space, copy_obs_dict(self.buf_obs))
+        return dict_to_obs(self.observation_space, OrderedDict([(k, v[rows]) for k, v in self.buf_obs.items()]))
 
 
     def close(self):
         if self.closed:
             return
         if self.waiting:
-            for remote in self.remotes:
-                remote.recv()
+            for idx in self.stepping:
+                self.remotes[idx].recv()
         for remote in self.remotes:
             remote.send(('close', None))
         for process in self.processes:
             process.join()
+        if self.shared_memory:
+            # views must be released before the shared memory is closed.
+            self.buf_obs = self.buf_rews = self.buf_dones = None
+            for block in self.shm_blocks:
+                block.close()
+                block.unlink()
         self.closed = True
 
 
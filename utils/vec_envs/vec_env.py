@@ -82,24 +82,30 @@ class VecEnv(ABC):
 
 
     @abstractmethod
-    def step_async(self, actions):
+    def step_async(self, actions, indices=None):
         """
         Tell all the environments to start taking a step
         with the given actions.
         Call step_wait() to get the results of the step.
 
         You should not call this if a step_async run is
-        already pending.
+        already pending for the same environments. Disjoint groups of
+        environments can be stepped concurrently by passing indices.
+
+        :param actions: actions of the environments refered to by indices.
+        :param indices: (None,int,Iterable) refers to indices of envs, all envs by default.
         """
         pass
 
 
     @abstractmethod
-    def step_wait(self):
+    def step_wait(self, indices=None):
         """
         Wait for the step taken with step_async().
 
+        :param indices: (None,int,Iterable) the indices passed to step_async().
         :return: ([int] or [float], [float], [bool], dict) observation, reward, done, information
+            of the environments refered to by indices.
         """
         pass
 
@@ -254,15 +260,15 @@ class VecEnvWrapper(VecEnv):
                         action_space=action_space or venv.action_space)
         self.class_attributes = dict(inspect.getmembers(self.__class__))
 
-    def step_async(self, actions):
-        self.venv.step_async(actions)
+    def step_async(self, actions, indices=None):
+        self.venv.step_async(actions, indices)
 
     @abstractmethod
     def reset(self, i = None):
         pass
 
     @abstractmethod
-    def step_wait(self):
+    def step_wait(self, indices=None):
         pass
 
     def seed(self, seed=None):
@@ -6,50 +6,127 @@ from gym import spaces
 from .vec_env import VecEnvWrapper
 
 
+class StackedObs(object):
+    """
+    Stacked observations of a VecFrameStack, not materialised: the rows of the frame store of the wrapper and,
+    for each environment, the indices of its n_stack frames, the oldest first. Consumers able to gather the frames
+    themselves (e.g. a replay memory of frames) use frames and index as they are; np.asarray(obs) builds the
+    stacks. The frame store is written by the next steps, so the frames must be consumed before the wrapper is
+    stepped again.
+
+    :param frames: (ndarray) the frame store of the wrapper, n_rows x obs_shape.
+    :param index: (ndarray) num_envs x n_stack indices of the rows of frames.
+    """
+    def __init__(self, frames, index):
+        self.frames = frames
+        self.index = index
+
+    @property
+    def shape(self):
+        return (self.index.shape[0], ) + self.frames.shape[1:-1] + (self.frames.shape[-1] * self.index.shape[1], )
+
+    @property
+    def dtype(self):
+        return self.frames.dtype
+
+    def __len__(self):
+        return self.index.shape[0]
+
+    def __getitem__(self, item):
+        return stack_frames(self.frames, self.index[item])
+
+    def __array__(self, dtype=None, copy=None):
+        stacks = stack_frames(self.frames, self.index)
+        return stacks if dtype is None else stacks.astype(dtype, copy=False)
+
+
+def stack_frames(frames, index):
+    """
+    :param frames: (ndarray) n_rows x ... x C frames.
+    :param index: (ndarray) ... x n_stack indices of rows of frames.
+    :return: (ndarray) ... x ... x (n_stack * C) stacks of the frames along the last axis, the first index first.
+    """
+    stacks = np.moveaxis(frames[index], index.ndim - 1, -2)
+    return stacks.reshape(stacks.shape[:-2] + (-1, ))
+
+
 class VecFrameStack(VecEnvWrapper):
     """
     Frame stacking wrapper for vectorized environment
 
+    The frames are kept in a frame store, n_stack rows per environment used as a ring, and each environment has the
+    indices of its last n_stack frames: a step writes only the new frame of each environment and shifts its indices.
+    The frames before the start of an episode point to a shared zero frame (row 0), so a reset only rewrites the
+    indices of the reset environments. The stacks are built by one gather of frames when the observations are
+    returned, or, with lazy, when the consumer materialises the StackedObs returned instead.
+
     :param venv: (VecEnv) the vectorized environment to wrap
     :param n_stack: (int) Number of frames to stack
+    :param lazy: (bool) return the observations as StackedObs instead of arrays
     """
 
-    def __init__(self, venv, n_stack):
+    def __init__(self, venv, n_stack, lazy=False):
         self.venv = venv
         self.n_stack = n_stack
+        self.lazy = lazy
         wrapped_obs_space = venv.observation_space
         low = np.repeat(wrapped_obs_space.low, self.n_stack, axis=-1)
         high = np.repeat(wrapped_obs_space.high, self.n_stack, axis=-1)
-        self.stackedobs = np.zeros((venv.num_envs,) + low.shape, low.dtype)
+        # row 0 is the zero frame, then n_stack rows for each env.
+        self.frames = np.zeros((1 + venv.num_envs * n_stack,) + wrapped_obs_space.shape, low.dtype)
+        self.frame_index = np.zeros((venv.num_envs, n_stack), dtype=np.int64)
+        # ring position of the newest frame of each env.
+        self.newest = np.zeros(venv.num_envs, dtype=np.int64)
         observation_space = spaces.Box(low=low, high=high, dtype=venv.observation_space.dtype)
         VecEnvWrapper.__init__(self, venv, observation_space=observation_space)
 
-    def step_wait(self):
-        observations, rewards, dones, infos = self.venv.step_wait()
-        last_ax_size = observations.shape[-1]
-        self.stackedobs = np.roll(self.stackedobs, shift=-last_ax_size, axis=-1)
-        for i, done in enumerate(dones):
-            if done:
-                if 'terminal_observation' in infos[i]:
-                    old_terminal = infos[i]['terminal_observation']
-                    new_terminal = np.concatenate(
-                        (self.stackedobs[i, ..., :-last_ax_size], old_terminal), axis=-1)
-                    infos[i]['terminal_observation'] = new_terminal
-                else:
-                    warnings.warn(
-                        "VecFrameStack wrapping a VecEnv without terminal_observation info")
-                self.stackedobs[i] = 0
-        self.stackedobs[..., -observations.shape[-1]:] = observations
-        return self.stackedobs, rewards, dones, infos
-
-    def reset(self):
+    @property
+    def stackedobs(self):
+        return stack_frames(self.frames, self.frame_index)
+
+    def _push(self, indices, observations):
+        self.newest[indices] = (self.newest[indices] + 1) % self.n_stack
+        rows = 1 + indices * self.n_stack + self.newest[indices]
+        self.frames[rows] = observations
+        self.frame_index[indices, :-1] = self.frame_index[indices, 1:]
+        self.frame_index[indices, -1] = rows
+
+    def _clear(self, indices):
+        self.frame_index[indices] = 0
+
+    def _stacks(self, indices):
+        if self.lazy:
+            return StackedObs(self.frames, self.frame_index[indices])
+        return stack_frames(self.frames, self.frame_index[indices])
+
+    def step_wait(self, indices=None):
+        observations, rewards, dones, infos = self.venv.step_wait(indices)
+        indices = np.asarray(list(self._get_indices(indices)), dtype=np.int64)
+        done_envs = np.flatnonzero(dones)
+        for i in done_envs:
+            if 'terminal_observation' in infos[i]:
+                old_terminal = infos[i]['terminal_observation']
+                new_terminal = np.concatenate(
+                    (stack_frames(self.frames, self.frame_index[indices[i], 1:]), old_terminal), axis=-1)
+                infos[i]['terminal_observation'] = new_terminal
+            else:
+                warnings.warn(
+                    "VecFrameStack wrapping a VecEnv without terminal_observation info")
+        self._clear(indices[done_envs])
+        self._push(indices, observations)
+        return self._stacks(indices), rewards, dones, infos
+
+    def reset(self, i=None):
         """
-        Reset all environments
+        Reset the environments i (all by default), only their frames are cleared
+
+        :return: the stacked observations of all the environments
         """
-        obs = self.venv.reset()
-        self.stackedobs[...] = 0
-        self.stackedobs[..., -obs.shape[-1]:] = obs
-        return self.stackedobs
+        obs = self.venv.reset(i)
+        indices = np.asarray(list(self._get_indices(i)), dtype=np.int64)
+        self._clear(indices)
+        self._push(indices, obs[indices])
+        return self._stacks(np.arange(self.num_envs))
 
     def close(self):
         self.venv.close()
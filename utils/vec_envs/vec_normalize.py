@@ -120,30 +120,32 @@ class VecNormalize(VecEnvWrapper):
         else:
             return obs
 
-    def step_wait(self):
+    def step_wait(self, indices=None):
         """
         Apply sequence of actions to sequence of environments
         actions -> (observations, rewards, news)
 
         where 'news' is a boolean vector indicating whether each element is new.
         """
-        obs, rews, news, infos = self.venv.step_wait()
+        obs, rews, news, infos = self.venv.step_wait(indices)
         self.old_obs = obs
         self.old_rews = rews
 
         self.normalize_obs(obs)
 
+        indices = list(self._get_indices(indices))
         if self.training:
-            self._update_reward(rews)
+            self._update_reward(rews, indices)
         rews = self.normalize_reward(rews)
 
-        self.ret[news] = 0
+        self.ret[np.asarray(indices)[news]] = 0
         return obs, rews, news, infos
 
-    def _update_reward(self, reward: np.ndarray) -> None:
+    def _update_reward(self, reward: np.ndarray, indices=None) -> None:
         """Update reward normalization statistics."""
-        self.ret = self.ret * self.gamma + reward
-        self.ret_rms.update(self.ret)
+        indices = list(self._get_indices(indices))
+        self.ret[indices] = self.ret[indices] * self.gamma + reward
+        self.ret_rms.update(self.ret[indices])
 
     def normalize_reward(self, reward: np.ndarray) -> np.ndarray:
         """